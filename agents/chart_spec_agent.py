@@ -0,0 +1,36 @@
+from google.adk.agents import LlmAgent
+from google.genai import types
+from dotenv import load_dotenv
+from constants import *
+from pydantic_models import ChartSpec
+from instructions.chart_spec_agent_instructions import *
+import warnings
+from callbacks import trace_model_call_start, trace_model_call_end
+from callbacks import serve_model_from_backend, observe_model_response
+
+load_dotenv(override=True)
+
+warnings.filterwarnings("ignore")
+
+#Chart Spec Agent: a declarative chart drawn by the UI, no code execution
+chart_spec_agent = LlmAgent(
+    name='chart_spec_agent',
+    model=CHART_SPEC_AGENT_MODEL,
+    description="Describes a chart over the BigQuery SQL output as a declarative spec",
+    # Relies solely on state via placeholders
+    include_contents='none',
+    global_instruction=GLOBAL_INSTRUCTION,
+    static_instruction=types.Content(role='system', parts=[types.Part(text=CHART_SPEC_AGENT_STATIC_INSTRUCTION)]),
+    instruction=CHART_SPEC_AGENT_DYNAMIC_INSTRUCTION,
+    generate_content_config=types.GenerateContentConfig(
+        temperature=0,
+        top_p=0.5,
+        max_output_tokens=1000,
+        seed=1,
+        candidate_count=None
+    ),
+    output_schema=ChartSpec,
+    before_model_callback=[trace_model_call_start, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
+    output_key='latest_chart_spec'
+)
@@ -6,7 +6,8 @@ from constants import *
 from instructions.python_critic_agent_instructions import *
 from google.genai import types
 import warnings
-from callbacks import get_sequence_outcome
+from callbacks import get_sequence_outcome, trace_model_call_start, trace_model_call_end
+from callbacks import serve_model_from_backend, observe_model_response
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -37,5 +38,7 @@ python_critic_agent = LlmAgent(
           thinking_budget=-1
           )
     ),
+    before_model_callback=[trace_model_call_start, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
     after_agent_callback=get_sequence_outcome
 )
\ No newline at end of file
@@ -6,9 +6,11 @@ from google.genai import types
 from dotenv import load_dotenv
 from constants import *
 from google.genai import types
-from callbacks import get_sequence_outcome, store_image_artifact
+from callbacks import get_sequence_outcome, store_image_artifact, attach_sql_result
 import warnings
 from callbacks import python_refiner_agent_callback
+from callbacks import trace_model_call_start, trace_model_call_end, trace_tool_call_start, trace_tool_call_end
+from callbacks import serve_model_from_backend, observe_model_response, serve_tool_from_backend, observe_tool_response
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -43,7 +45,10 @@ python_refiner_agent = LlmAgent(
           )
     ),
     before_agent_callback=python_refiner_agent_callback,
-    after_tool_callback=store_image_artifact,
+    before_model_callback=[trace_model_call_start, attach_sql_result, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
+    before_tool_callback=[trace_tool_call_start, serve_tool_from_backend],
+    after_tool_callback=[trace_tool_call_end, observe_tool_response, store_image_artifact],
     after_agent_callback=get_sequence_outcome,
     output_key='latest_python_code_output_reasoning'
 )
\ No newline at end of file
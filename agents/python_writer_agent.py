@@ -7,7 +7,9 @@ from google.genai import types
 from google.adk.planners import BuiltInPlanner
 from instructions.python_writer_agent_instructions import *
 import warnings
-from callbacks import store_image_artifact
+from callbacks import store_image_artifact, compact_conversation_history, encode_sql_result_for_python, attach_sql_result
+from callbacks import trace_model_call_start, trace_model_call_end, trace_tool_call_start, trace_tool_call_end
+from callbacks import serve_model_from_backend, observe_model_response, serve_tool_from_backend, observe_tool_response
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -39,6 +41,10 @@ python_writer_agent = LlmAgent(
           )
     ),
     include_contents='default',
+    before_agent_callback=encode_sql_result_for_python,
+    before_model_callback=[trace_model_call_start, compact_conversation_history, attach_sql_result, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
+    before_tool_callback=[trace_tool_call_start, serve_tool_from_backend],
     output_key='latest_python_code_output_reasoning',
-    after_tool_callback=store_image_artifact
+    after_tool_callback=[trace_tool_call_end, observe_tool_response, store_image_artifact]
 )
\ No newline at end of file
@@ -5,7 +5,8 @@ from dotenv import load_dotenv
 from instructions.sql_critic_agent_instructions import *
 from constants import *
 from google.genai import types
-from callbacks import get_sequence_outcome
+from callbacks import get_sequence_outcome, trace_model_call_start, trace_model_call_end
+from callbacks import serve_model_from_backend, observe_model_response
 import warnings
 import warnings
 from dotenv import load_dotenv
@@ -37,5 +38,7 @@ sql_critic_agent = LlmAgent(
           thinking_budget=-1
           )
     ),
+    before_model_callback=[trace_model_call_start, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
     after_agent_callback=get_sequence_outcome
 )
@@ -6,6 +6,7 @@ from google.adk.tools.bigquery.config import WriteMode
 from google.adk.planners import BuiltInPlanner
 import google.auth
 from google.genai import types
+from utils.agent_utils import get_bigquery_credentials
 from dotenv import load_dotenv
 from instructions.sql_refiner_agent_instructions import *
 from constants import *
@@ -13,6 +14,8 @@ from google.genai import types
 import warnings
 from dotenv import load_dotenv
 from callbacks import sql_refiner_agent_callback, get_sequence_outcome
+from callbacks import trace_model_call_start, trace_model_call_end, trace_tool_call_start, trace_tool_call_end, guard_sql_query
+from callbacks import serve_model_from_backend, observe_model_response, serve_tool_from_backend, observe_tool_response, note_sql_guard_rewrites
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -26,9 +29,8 @@ tool_config = BigQueryToolConfig(write_mode=WriteMode.PROTECTED)
 # Define a credentials config - in this example we are using application default
 # credentials
 # https://cloud.google.com/docs/authentication/provide-credentials-adc
-application_default_credentials, _ = google.auth.default()
 credentials_config = BigQueryCredentialsConfig(
-    credentials=application_default_credentials
+    credentials=get_bigquery_credentials()
 )
 
 # Instantiate a BigQuery toolset
@@ -65,6 +67,10 @@ sql_refiner_agent = LlmAgent(
           thinking_budget=-1
           )
     ),
+    before_model_callback=[trace_model_call_start, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
+    before_tool_callback=[trace_tool_call_start, guard_sql_query, serve_tool_from_backend],
+    after_tool_callback=[trace_tool_call_end, observe_tool_response, note_sql_guard_rewrites],
     after_agent_callback=get_sequence_outcome,
     output_key='latest_sql_output_reasoning' # Overwrites state['latest_sql_output_reasoning'] with the refined version
 )
@@ -7,9 +7,13 @@ from instructions.sql_writer_agent_instructions import SQL_WRITER_AGENT_DYNAMIC_
 from google.adk.planners import BuiltInPlanner
 import google.auth
 from google.genai import types
+from utils.agent_utils import get_bigquery_credentials
 from constants import *
 from google.genai import types
 import warnings
+from callbacks import compact_conversation_history, trace_model_call_start, trace_model_call_end
+from callbacks import trace_tool_call_start, trace_tool_call_end, resolve_kpi_filters, answer_from_rollup_cube, guard_sql_query
+from callbacks import serve_model_from_backend, observe_model_response, serve_tool_from_backend, observe_tool_response, note_sql_guard_rewrites
 from dotenv import load_dotenv
 from vertexai import init as vertex_init
 from google.cloud.aiplatform import initializer as aiplatform_init
@@ -28,9 +32,8 @@ tool_config = BigQueryToolConfig(write_mode=WriteMode.PROTECTED,
 # Define a credentials config - in this example we are using application default
 # credentials
 # https://cloud.google.com/docs/authentication/provide-credentials-adc
-application_default_credentials, _ = google.auth.default()
 credentials_config = BigQueryCredentialsConfig(
-    credentials=application_default_credentials
+    credentials=get_bigquery_credentials()
 )
 
 # Instantiate a BigQuery toolset
@@ -66,5 +69,10 @@ sql_writer_agent = LlmAgent(
           )
     ),
     include_contents='default',
+    before_agent_callback=[resolve_kpi_filters, answer_from_rollup_cube],
+    before_model_callback=[trace_model_call_start, compact_conversation_history, serve_model_from_backend],
+    after_model_callback=[observe_model_response, trace_model_call_end],
+    before_tool_callback=[trace_tool_call_start, guard_sql_query, serve_tool_from_backend],
+    after_tool_callback=[trace_tool_call_end, observe_tool_response, note_sql_guard_rewrites],
     output_key='latest_sql_output_reasoning'
 )
\ No newline at end of file
@@ -4,7 +4,9 @@ from constants import *
 from google.genai import types
 from google.adk.planners import BuiltInPlanner
 from pydantic import BaseModel, Field
-from callbacks import store_results_in_context
+from callbacks import store_results_in_context, store_turn_digest, compact_conversation_history
+from callbacks import trace_model_call_start, trace_model_call_end
+from callbacks import serve_model_from_backend, observe_model_response
 from google import genai
 from utils.helper import json_to_dict
 # from agents import cache 
@@ -50,6 +52,9 @@ starter_agent = LlmAgent(
     ),
   output_schema=StarterAgentResponse,
   include_contents='default',
+  before_agent_callback=store_turn_digest,
+  before_model_callback=[trace_model_call_start, compact_conversation_history, serve_model_from_backend],
+  after_model_callback=[observe_model_response, trace_model_call_end],
   after_agent_callback=store_results_in_context,
   output_key='starter_agent_response',
 )
@@ -1,18 +1,22 @@
 import streamlit as st
 import asyncio
 import uuid
+import os
 from pathlib import Path
 from google.adk.sessions import InMemorySessionService
 from google.adk.artifacts import InMemoryArtifactService
 from utils import EVENT_LOG_ACCUMULATOR
 from utils.helper import json_to_dict
 from constants import *
-from utils.logger import get_logger
-from sequences.sql_sequence import sql_agent_sequence
-from sequences.python_sequence import python_agent_sequence
-from sequences.starter_sequence import starter_agent_sequence
+from utils.logger import get_logger, dropped_records
+from sequences.turn_sequence import initial_session_state, run_turn
 import pandas as pd
-from utils.helper import save_img
+from utils.tracing import get_tracer
+from utils.metering import get_meter
+from utils.bigquery_jobs import get_job_manager
+from utils.result_store import get_result_store
+from utils.chart_spec import chart_data, vega_lite
+from utils.profiling import get_profiler
 from google import genai
 
 logger = get_logger(__name__)
@@ -276,85 +280,18 @@ async def process_query(user_query: str, session_id: str):
         #Define Artifact service
         artifact_service = st.session_state.artifact_service
 
-        # Define defs schema to be passed as initial_state
-        defs_schema = json_to_dict(DEFS_SCHEMA_PATH)
-
-        data_schema = json_to_dict(DATA_SCHEMA_PATH)
-
-        initial_state_formatted = {
-            'projects': "uk-dta-gsmanalytics-poc",
-            'datasets': "metricmind",
-            'tables': "GSM_KPI_DATA_TEST_V5, GSM_KPI_DEFS_TEST_V5",
-            # 'schema_structure': defs_schema,
-            # 'schema_context': data_schema
-        }
-
-        # Create or get existing session
+        # Create session on the first query
         if st.session_state.agent_session is None:
             session = await session_service.create_session(
                 app_name=app_name,
                 user_id=user_id,
                 session_id=session_id,
-                state=initial_state_formatted
+                state=initial_session_state()
             )
             logger.info(f"Created new session: {session.id}")
-        else:
-            session = await session_service.get_session(
-                app_name=app_name,
-                user_id=user_id,
-                session_id=session_id
-            )
-        
-        # Call Starter Agent Sequence
-        await starter_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
-        
-        # Refresh session to get updated state
-        session = await session_service.get_session(
-            app_name=app_name,
-            user_id=user_id,
-            session_id=session_id
-        )
-
-        # Decide if SQL sequence is required
-        if session.state.get('sql_required'):
-            # Call SQL Sequence
-            await sql_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
-            
-            # Update session
-            session = await session_service.get_session(
-                app_name=app_name,
-                user_id=user_id,
-                session_id=session_id
-            )
 
-        # Decide if Python sequence is required
-        if session.state.get('python_required'):
-            
-            # Note: If python_required is True, sql_required is ALWAYS True
-            if session.state.get('latest_sql_sequence_outcome') == 'SUCCESS':
-                
-                # Call Python Sequence
-                await python_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
-                
-                # Update session
-                session = await session_service.get_session(
-                    app_name=app_name,
-                    user_id=user_id,
-                    session_id=session_id
-                )
-                
-                # Save image artifact from Python sequence
-                img_bytes = session.state.get('latest_img_bytes')                
-                save_img(img_bytes)                
-            else:
-                logger.error('SQL sequence failed')
-
-        #update again?
-        session = await session_service.get_session(
-                app_name=app_name,
-                user_id=user_id,
-                session_id=session_id
-            )
+        # Run Starter, SQL and Python sequences as one traced turn
+        session = await run_turn(app_name, user_id, session_service, artifact_service, session_id, user_query, save_image=True)
 
         #Store session for future use
         st.session_state.agent_session = session
@@ -445,11 +382,12 @@ def display_agent_response(session, is_initial_query=False):
         sql_outcome = state.get('latest_sql_sequence_outcome')
         
         if sql_outcome == 'SUCCESS':
-            sql_response = state.get('latest_sql_response', '')
+            # rows live in the result store; state only holds the handle
+            handle = state.get('latest_sql_result')
             
             # If this is the initial query, use special formatting
-            if is_initial_query and sql_response:
-                display_initial_kpi_data(sql_response)
+            if is_initial_query and handle:
+                display_initial_kpi_data(get_result_store().rows(handle))
             else:
                 # Regular SQL display for non-initial queries
                 st.subheader("SQL Analysis")
@@ -459,10 +397,30 @@ def display_agent_response(session, is_initial_query=False):
                     with st.expander("**SQL Analysis**", expanded=True):
                         st.markdown(sql_output_reasoning, unsafe_allow_html=True)
 
-                if sql_response:
+                if handle:
                     st.markdown('**SQL Response:**')
-                    df = pd.DataFrame(sql_response)
-                    st.dataframe(df, width='stretch')
+                    # the stored Arrow-backed frame, rather than a new DataFrame on every rerun
+                    df = get_result_store().frame(handle)
+                    if df is None:
+                        st.warning("This result is no longer held in memory; ask the question again to see its rows.")
+                    else:
+                        st.dataframe(df, width='stretch')
+                    downsampling_note = state.get('latest_sql_downsampling_note')
+                    if downsampling_note:
+                        st.info(downsampling_note)
+                    profile = state.get('latest_sql_profile')
+                    if profile:
+                        with st.expander("**Result Profile**", expanded=False):
+                            display_result_profile(profile)
+                    parquet = get_result_store().parquet_bytes(handle)
+                    if parquet:
+                        st.download_button(
+                            'Download Parquet',
+                            data=parquet,
+                            file_name=f"{handle}.parquet",
+                            mime='application/octet-stream',
+                            key=f"parquet_{handle}",
+                        )
         else:
             # Display error for failed SQL
             st.subheader("SQL Analysis")
@@ -483,17 +441,26 @@ def display_agent_response(session, is_initial_query=False):
                 with st.expander("**Visualization Analysis**", expanded=False):
                     st.markdown(python_response, unsafe_allow_html=True)
             
-            # Display the most recently saved image
-            img_dir = Path("images")
-            if img_dir.exists():
-                png_files = list(img_dir.glob("img_*.png"))
-                if png_files:
-                    latest_img = max(png_files, key=lambda f: f.stat().st_mtime)
-                    st.image(str(latest_img), caption=f"Generated Visualization ({latest_img.name})", width='content')
-                else:
-                    st.warning("Visualization was generated but no image files found in the directory.")
+            # Draw a declarative chart spec natively from the stored result
+            frame = get_result_store().frame(state.get('latest_sql_result'))
+            if state.get('latest_chart_mode') == 'spec' and frame is not None:
+                spec = state.get('latest_chart_spec')
+                data = chart_data(spec, frame)
+                st.vega_lite_chart(data, vega_lite(spec, data), use_container_width=True)
+                with st.expander("**Chart Spec**", expanded=False):
+                    st.json(spec)
             else:
-                st.warning("Visualization directory not found.")
+                # Display the most recently saved image
+                img_dir = Path("images")
+                if img_dir.exists():
+                    png_files = list(img_dir.glob("img_*.png"))
+                    if png_files:
+                        latest_img = max(png_files, key=lambda f: f.stat().st_mtime)
+                        st.image(str(latest_img), caption=f"Generated Visualization ({latest_img.name})", width='content')
+                    else:
+                        st.warning("Visualization was generated but no image files found in the directory.")
+                else:
+                    st.warning("Visualization directory not found.")
 
         else:
             # Display only Python response (error case)
@@ -501,6 +468,91 @@ def display_agent_response(session, is_initial_query=False):
             st.markdown("**Visualization Status:**")
             st.warning(python_response)
 
+def display_result_profile(profile):
+    """Display per-column statistics, date coverage and trends of a SQL result."""
+    date = profile.get('date')
+    cols = st.columns(3)
+    cols[0].metric("Rows", profile['rows'])
+    if date:
+        cols[1].metric(f"{date['period'].title()}s covered", f"{date['periods'] - date['missing_periods']}/{date['periods']}")
+        cols[2].metric("Date range", f"{date['from']} → {date['to']}")
+        if date['missing']:
+            st.caption(f"Missing {date['period']}s: {', '.join(date['missing'])}")
+    st.dataframe(pd.DataFrame.from_dict(profile['columns'], orient='index'), width='stretch')
+    trends = profile.get('trends') or {}
+    if trends:
+        st.markdown('**Trends** (least-squares slope of the mean per date)')
+        st.dataframe(pd.DataFrame.from_dict(trends, orient='index'), width='stretch')
+    st.caption(f"Profiled in {profile.get('elapsed_ms', 0):.1f} ms")
+
+def display_trace_waterfall(trace):
+    """Display one turn trace as a waterfall of nested spans."""
+    spans = sorted(trace['spans'], key=lambda span: span['offset_ms'])
+    parents = {span['span_id']: span['parent_id'] for span in spans}
+
+    rows = []
+    for idx, span in enumerate(spans):
+        depth, parent_id = 0, span['parent_id']
+        while parent_id is not None:
+            depth += 1
+            parent_id = parents.get(parent_id)
+        rows.append({
+            'span': f"{idx:03d} {'  ' * depth}{span['name']}",
+            'kind': span['kind'],
+            'start_ms': round(span['offset_ms'], 1),
+            'end_ms': round(span['offset_ms'] + (span['duration_ms'] or 0), 1),
+            'duration_ms': round(span['duration_ms'] or 0, 1),
+            'status': span['status'],
+        })
+
+    st.text(f"Turn {trace['turn']} took {trace['duration_ms']:.0f} ms across {len(spans)} spans")
+    st.vega_lite_chart(
+        {
+            'data': {'values': rows},
+            'mark': 'bar',
+            'encoding': {
+                'y': {'field': 'span', 'type': 'nominal', 'sort': None, 'title': None},
+                'x': {'field': 'start_ms', 'type': 'quantitative', 'title': 'ms since turn start'},
+                'x2': {'field': 'end_ms'},
+                'color': {'field': 'kind', 'type': 'nominal'},
+                'tooltip': [{'field': k} for k in ('span', 'duration_ms', 'status')],
+            },
+            'height': max(len(rows) * 14, 100),
+        },
+        use_container_width=True
+    )
+    st.dataframe(pd.DataFrame(rows), width='stretch', hide_index=True)
+
+def display_profiling_controls(session_id: str):
+    """Switch turn profiling on for this session and link its saved profiles."""
+    profiler = get_profiler()
+
+    every_turn = st.checkbox("Profile every turn", value=profiler.session_enabled(session_id))
+    if every_turn != profiler.session_enabled(session_id):
+        if every_turn:
+            profiler.enable_session(session_id)
+        else:
+            profiler.disable_session(session_id)
+
+    if st.button("Profile next turn"):
+        profiler.profile_next_turn(session_id)
+        st.text("The next question will be profiled")
+
+    profiles = profiler.recent_profiles(session_id)
+    if not profiles:
+        st.text("No profiles recorded for this session")
+    for idx, profile in enumerate(profiles):
+        st.text(f"Turn {profile['turn']} - {profile['mode']}, {profile['duration_ms']:.0f} ms")
+        for kind, path in profile['paths'].items():
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    st.download_button(
+                        label=f"{kind}: {os.path.basename(path)}",
+                        data=f.read(),
+                        file_name=os.path.basename(path),
+                        key=f"profile_{idx}_{kind}"
+                    )
+
 def display_debug_info(session):
     """Display debug information in the sidebar."""
     if session is None or not hasattr(session, 'state'):
@@ -513,7 +565,19 @@ def display_debug_info(session):
     
     #COMPLETE FLOW
     with st.expander("Event Log",expanded=False):
-        st.json(EVENT_LOG_ACCUMULATOR)
+        st.json(list(EVENT_LOG_ACCUMULATOR))
+
+    # Per-turn waterfall of the latest trace
+    with st.expander("Turn Trace", expanded=False):
+        trace = get_tracer().latest_trace(session.id)
+        if trace:
+            display_trace_waterfall(trace)
+        else:
+            st.text("No trace recorded for this session")
+        
+    # Profiles of this session's turns
+    with st.expander("Profiling", expanded=False):
+        display_profiling_controls(session.id)
         
     # Starter Agent Response
     with st.expander("Starter Agent Response", expanded=False):
@@ -537,6 +601,12 @@ def display_debug_info(session):
         
         st.text("Latest BQ Execution Status:")
         st.code(state.get('latest_bq_execution_status', 'N/A'), language=None)
+
+        st.text("Latest SQL Guard:")
+        if state.get('latest_sql_guard'):
+            st.json(state['latest_sql_guard'])
+        else:
+            st.code('N/A', language=None)
     
     # Python Code Details
     with st.expander("Python Code Details", expanded=False):
@@ -552,6 +622,14 @@ def display_debug_info(session):
         st.text("Latest Code Execution Outcome:")
         st.code(state.get('latest_python_code_execution_outcome', 'N/A'), language=None)
     
+    # History Compaction
+    with st.expander("History Compaction", expanded=False):
+        compaction = state.get('history_compaction', {})
+        if compaction:
+            st.json(compaction)
+        else:
+            st.text("No history compaction recorded")
+
     # Image Bytes Info
     with st.expander("Image Info", expanded=False):
         img_bytes = state.get('latest_img_bytes')
@@ -563,54 +641,72 @@ def display_debug_info(session):
     
     # Metrics
     with st.expander("Metrics", expanded=False):
-        # col1, col2, col3 = st.columns(3)
         col1, col2 = st.columns(2)
 
         with col1:
-            # st.metric(
-            #     label="BQ API Failures",
-            #     value=state.get('app:bq_api_failure_count', 0)
-            # )
             st.metric(
                 label="Total Tokens",
                 value=state.get('app:total_token_count', 0)
             )
-            # st.metric(
-            #     label="Prompt Tokens",
-            #     value=state.get('app:prompt_token_count', 0)
-            # )
+            st.metric(
+                label="Prompt Tokens",
+                value=state.get('app:prompt_token_count', 0)
+            )
+            st.metric(
+                label="Thoughts Tokens",
+                value=state.get('app:thoughts_token_count', 0)
+            )
         
         with col2:
             st.metric(
             label="Cached Content Tokens",
             value=state.get('app:cached_content_token_count', 0)
             )
-            # st.metric(
-            #     label="Tool Use Prompt Tokens",
-            #     value=state.get('app:tool_use_prompt_token_count', 0)
-            # )
-            # st.metric(
-            #     label="Thoughts Tokens",
-            #     value=state.get('app:thoughts_token_count', 0)
-            # )
-            # st.metric(
-            #     label="Candidates Tokens",
-            #     value=state.get('app:candidates_token_count', 0)
-            # )
-    
-    # with col3:
-    #     st.metric(
-    #         label="Cached Content Tokens",
-    #         value=state.get('app:cached_content_token_count', 0)
-    #     )
-    #     st.metric(
-    #         label="Cache Invocations",
-    #         value=state.get('app:cache_invocations_used', 0)
-    #     )
-    #     st.metric(
-    #         label="Cached Contents Count",
-    #         value=state.get('app:cached_contents_count', 0)
-    #     )
+            st.metric(
+                label="Candidates Tokens",
+                value=state.get('app:candidates_token_count', 0)
+            )
+            st.metric(
+                label="Estimated Cost (USD)",
+                value=f"{state.get('app:estimated_cost_usd', 0.0):.4f}"
+            )
+
+        #per-agent usage of the latest turn
+        turn_usage = state.get('turn_token_usage') or {}
+        if turn_usage.get('agents'):
+            st.text(f"Turn {turn_usage.get('turn')} usage by agent:")
+            st.dataframe(
+                pd.DataFrame.from_dict(turn_usage['agents'], orient='index'),
+                width='stretch'
+            )
+
+        #BigQuery jobs run by the SQL agents
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric(
+                label="BigQuery GB Billed",
+                value=f"{state.get('app:bq_bytes_billed', 0) / 1024 ** 3:.2f}"
+            )
+        with col2:
+            st.metric(
+                label="BigQuery Slot Seconds",
+                value=f"{state.get('app:bq_slot_ms', 0) / 1000:.1f}"
+            )
+        turn_jobs = state.get('turn_bq_jobs') or {}
+        if turn_jobs.get('jobs'):
+            st.text(f"Turn {turn_jobs.get('turn')} BigQuery jobs:")
+            st.dataframe(pd.DataFrame(turn_jobs['jobs']), width='stretch')
+
+        st.text("BigQuery jobs (submitted, cancelled, bytes avoided):")
+        st.json(get_job_manager().stats(), expanded=False)
+
+        st.text("Most expensive queries per KPI:")
+        st.json(get_meter().worst_query_report(), expanded=False)
+
+        st.text("Process-wide usage:")
+        st.json(get_meter().summary(), expanded=False)
+
+        st.text(f"Dropped log records: {dropped_records()}")
 
 def display_kpi_reference():
     """Display KPI reference dropdown with KPI names and definitions."""
@@ -640,59 +736,23 @@ def display_kpi_reference():
                 }
             )
 
-def get_initial_kpi_query() -> str:
-    """Generate the initial query to fetch KPI metadata."""
-    return """Please execute the following SQL query:
-
-WITH DistinctKpiDimInt AS (
-SELECT DISTINCT
-    t.KPI_ID,
-    d.NAME AS dim_name,
-    d.VALUE AS dim_value,
-    i.NAME AS int_name
-  FROM
-    `uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DATA_TEST_V5` AS t,
-    UNNEST(t.DIM) AS d,
-    UNNEST(t.INT) AS i
-),
-KpiDimensionsWithExamples AS (
-  SELECT
-    KPI_ID,
-    dim_name,
-    ARRAY_AGG(DISTINCT dim_value ORDER BY dim_value LIMIT 10) AS example_values
-  FROM DistinctKpiDimInt
-  WHERE dim_name IS NOT NULL AND dim_value IS NOT NULL
-  GROUP BY KPI_ID, dim_name
-),
-AggregatedDimensions AS (
-  SELECT
-    KPI_ID,
-    ARRAY_AGG(STRUCT(dim_name, example_values) ORDER BY dim_name) AS dimensions_with_examples
-  FROM KpiDimensionsWithExamples
-  GROUP BY KPI_ID
-),
-AggregatedMeasures AS (
-  SELECT
-    KPI_ID,
-  
-    ARRAY_AGG(DISTINCT int_name IGNORE NULLS ORDER BY int_name) AS measures
-  FROM DistinctKpiDimInt
-  WHERE int_name IS NOT NULL
-  GROUP BY KPI_ID
-)
-SELECT
-  T1.KPI_ID,
-  s.KPI_NAME,
-  s.KPI_DESCRIPTION,
-  T2.dimensions_with_examples,
-  T3.measures
-FROM (SELECT DISTINCT KPI_ID FROM DistinctKpiDimInt) AS T1
-left join `uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DEFS_TEST_V5` S  ON s.KPI_ID=t1.KPI_ID
-LEFT JOIN AggregatedDimensions AS T2 ON T1.KPI_ID = T2.KPI_ID
-LEFT JOIN AggregatedMeasures AS T3 ON T1.KPI_ID = T3.KPI_ID
-ORDER BY T1.KPI_ID, KPI_NAME
-
-"""
+def get_initial_kpi_rows() -> list:
+    """KPI overview rows (KPI_ID, dimensions_with_examples, measures) from the prebuilt schema context."""
+    schema_context = json_to_dict(SCHEMA_CONTEXT_PATH)
+    rows = []
+    for kpi_id, kpi_info in schema_context.get('kpis', {}).items():
+        rows.append({
+            'KPI_ID': kpi_id,
+            'dimensions_with_examples': [
+                {'dim_name': dim_name, 'example_values': dim_info.get('distinct_values_sample', [])[:10]}
+                for dim_name, dim_info in sorted(kpi_info.get('dimensions', {}).items())
+            ],
+            'measures': sorted(
+                indicator['name'] for indicator in kpi_info.get('indicators_int', []) + kpi_info.get('indicators_float', [])
+                if indicator.get('name')
+            ),
+        })
+    return rows
 
 def main():
     """Main Streamlit application."""
@@ -731,6 +791,7 @@ def main():
         st.text(f"Session ID: {st.session_state.session_id}")
         
         if st.button("Create New Session"):
+            get_result_store().release(st.session_state.session_id)
             st.session_state.messages = []
             st.session_state.session_id = str(uuid.uuid4())
             st.session_state.agent_session = None
@@ -746,58 +807,18 @@ def main():
         else:
             st.info("Start a conversation to see debug information")
     
-    # Auto-run initial KPI query on first session load
+    # Show the KPI overview on first session load, straight from the offline-built schema context
     if not st.session_state.initial_query_processed and len(st.session_state.messages) == 0:
-        initial_query = get_initial_kpi_query()
-        initial_display_message = "I'm currently loading data definitions in, I'll give you a view of what's available and the dimensions you can split them by."
-        
-        # Add initial query to messages (store actual query but display custom message)
-        st.session_state.messages.append({
-            "role": "user", 
-            "content": initial_query,
-            "display_content": initial_display_message
-        })
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.markdown(initial_display_message)
-        
-        # Display assistant response with spinner
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing your query..."):
-                try:
-                    # Process the query
-                    session = asyncio.run(process_query(initial_query, st.session_state.session_id))
-                    
-                    if session is None:
-                        raise ValueError("Session is None after processing")
-                    
-                    # Display response for initial query
-                    display_agent_response(session, is_initial_query=True)
-                    
-                    # Save to message history
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": "Response generated",
-                        "session": session,
-                        "is_initial_query": True
-                    })
-                    
-                    # Mark initial query as processed
-                    st.session_state.initial_query_processed = True
-                    
-                except Exception as e:
-                    error_msg = f"An error occurred: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": error_msg
-                    })
-                    logger.error(f"Error processing initial query: {e}", exc_info=True)
-        
-        # Force page to update after initial query
-        st.rerun()
-    
+        try:
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": "Here's what's available and the dimensions you can split it by.",
+                "kpi_rows": get_initial_kpi_rows()
+            })
+        except Exception as e:
+            logger.error(f"Error loading schema context for the KPI overview: {e}", exc_info=True)
+        st.session_state.initial_query_processed = True
+
     # Display chat messages (excluding the initial auto-run on first load)
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -807,7 +828,10 @@ def main():
                 st.markdown(display_text)
             else:
                 # For assistant, display structured response
-                if "session" in message:
+                if "kpi_rows" in message:
+                    st.markdown(message["content"])
+                    display_initial_kpi_data(message["kpi_rows"])
+                elif "session" in message:
                     is_initial = message.get("is_initial_query", False)
                     display_agent_response(message["session"], is_initial_query=is_initial)
                 else:
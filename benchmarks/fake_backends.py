@@ -0,0 +1,181 @@
+import asyncio
+import json
+import random
+from datetime import date, timedelta
+from typing import Any, Optional
+from google.genai import types
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from constants import OUTCOME_OK_PHRASE, CHARS_PER_TOKEN
+from utils.backends import Backend
+from utils.cassette import LatencyModel
+from utils.history import estimate_tokens
+
+#words in a question that make the fake starter agent ask for a chart
+CHART_WORDS = ('plot', 'chart', 'graph', 'visual', 'trend')
+#questions starting like this are answered without SQL
+NO_SQL_PREFIXES = ('hi', 'hello', 'thanks', 'what does', 'what is the definition')
+
+FAKE_SQL = (
+    "SELECT KPI_DATE, DIM1, SUM(VALUE) AS VALUE "
+    "FROM `uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DATA_TEST_V5` "
+    "WHERE KPI_ID = 20002001 GROUP BY KPI_DATE, DIM1 ORDER BY KPI_DATE"
+)
+FAKE_PYTHON = "import matplotlib.pyplot as plt\nplt.plot([1, 2, 3])\nplt.savefig('chart.png')"
+
+
+class FakeBackendError(RuntimeError):
+    """simulated backend failure (e.g. a Gemini 503)"""
+
+
+class FakeModelBackend(Backend):
+    """answers every agent's model call with a canned, schema-valid response
+
+    replies per agent role: the starter returns StarterAgentResponse JSON, the
+    chart spec agent a ChartSpec, writers/refiners call execute_sql or return
+    executed code, critics approve unless critic_reject_rate says otherwise.
+    """
+
+    offline = True
+
+    def __init__(
+            self,
+            latency: str = 'lognormal:800,0.5',
+            failure_rate: float = 0.0,
+            critic_reject_rate: float = 0.0,
+            output_tokens: int = 150,
+            seed: int = 1,
+        ):
+        self.latency = LatencyModel(latency, seed)
+        self.failure_rate = failure_rate
+        self.critic_reject_rate = critic_reject_rate
+        self.output_tokens = output_tokens
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    @staticmethod
+    def _question(llm_request: LlmRequest) -> str:
+        for content in reversed(llm_request.contents):
+            if content.role == 'user' and content.parts and content.parts[0].text \
+                    and not content.parts[0].text.startswith('For context:'):
+                return content.parts[0].text
+        return ''
+
+    def _parts(self, agent_name: str, llm_request: LlmRequest) -> list[types.Part]:
+        last = llm_request.contents[-1] if llm_request.contents else None
+        answered_tool = last is not None and any(p.function_response for p in last.parts or [])
+
+        if agent_name == 'starter_agent':
+            question = self._question(llm_request).lower()
+            python_required = any(word in question for word in CHART_WORDS)
+            sql_required = python_required or not question.startswith(NO_SQL_PREFIXES)
+            return [types.Part(text=json.dumps({
+                'greeting': 'Sure, let me look into that.',
+                'user_intent': question[:200],
+                'sql_required': sql_required,
+                'python_required': python_required,
+            }))]
+
+        if 'critic' in agent_name:
+            if self._rng.random() < self.critic_reject_rate:
+                return [types.Part(text='The query does not filter on the requested dimension.')]
+            return [types.Part(text=OUTCOME_OK_PHRASE)]
+
+        if agent_name.startswith('sql_'):
+            if answered_tool:
+                return [types.Part(text='The query ran successfully.')]
+            return [types.Part(function_call=types.FunctionCall(
+                name='execute_sql',
+                args={'project_id': 'uk-dta-gsmanalytics-poc', 'query': FAKE_SQL},
+            ))]
+
+        if agent_name == 'chart_spec_agent':
+            return [types.Part(text=json.dumps({
+                'chart_type': 'line', 'x': 'KPI_DATE', 'y': 'VALUE', 'series': 'DIM1',
+                'aggregation': 'sum', 'title': 'VALUE by KPI_DATE', 'reasoning': 'A line chart shows the trend.',
+            }))]
+
+        if agent_name.startswith('python_'):
+            return [
+                types.Part(executable_code=types.ExecutableCode(language=types.Language.PYTHON, code=FAKE_PYTHON)),
+                types.Part(code_execution_result=types.CodeExecutionResult(
+                    outcome=types.Outcome.OUTCOME_OK, output='chart saved'
+                )),
+                types.Part(text='Here is the chart.'),
+            ]
+
+        return [types.Part(text='OK')]
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        self.calls += 1
+        delay_ms = self.latency.delay_ms(0.0)
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+        if self._rng.random() < self.failure_rate:
+            self.failures += 1
+            raise FakeBackendError(f"Simulated model failure for {agent_name}")
+
+        parts = self._parts(agent_name, llm_request)
+        prompt_tokens = estimate_tokens(llm_request.contents) + 2000 // CHARS_PER_TOKEN
+        return LlmResponse(
+            content=types.Content(role='model', parts=parts),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=self.output_tokens,
+                total_token_count=prompt_tokens + self.output_tokens,
+            ),
+        )
+
+
+class FakeBigQueryBackend(Backend):
+    """answers execute_sql with synthetic KPI rows"""
+
+    offline = True
+
+    def __init__(
+            self,
+            latency: str = 'lognormal:1500,0.6',
+            failure_rate: float = 0.0,
+            rows: int = 50,
+            seed: int = 1,
+        ):
+        self.latency = LatencyModel(latency, seed)
+        self.failure_rate = failure_rate
+        self.rows = rows
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def _rows(self) -> list[dict[str, Any]]:
+        start = date(2025, 1, 1)
+        return [
+            {
+                'KPI_DATE': (start + timedelta(days=i // 3)).isoformat(),
+                'DIM1': ('Sky Glass', 'Sky Stream', 'Sky Q')[i % 3],
+                'VALUE': self._rng.randint(100, 10000),
+            }
+            for i in range(self.rows)
+        ]
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if tool_name != 'execute_sql':
+            return None
+        self.calls += 1
+        delay_ms = self.latency.delay_ms(0.0)
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+        if self._rng.random() < self.failure_rate:
+            self.failures += 1
+            return {'status': 'ERROR', 'error_details': 'Simulated BigQuery failure'}
+        #shaped like the BigQuery executor's statistics, so the metering path runs offline too
+        job_stats = {
+            'job_id': f"fake_job_{self.calls}",
+            'bytes_processed': self._rng.randint(10, 500) * 1024 ** 2,
+            'bytes_billed': 0,
+            'slot_ms': self._rng.randint(100, 5000),
+            'cache_hit': False,
+            'wall_ms': delay_ms,
+        }
+        job_stats['bytes_billed'] = job_stats['bytes_processed']
+        return {'status': 'SUCCESS', 'rows': self._rows(), 'job_stats': job_stats}
@@ -0,0 +1,506 @@
+import argparse
+import asyncio
+import json
+import math
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Optional
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+
+from constants import APP_NAME, USER_ID
+from sequences.turn_sequence import initial_session_state, run_turn
+from utils.backends import find_backend, get_backend, set_backend, is_offline
+from utils.cassette import Cassette
+from utils.local_mirror import LocalMirror, LocalMirrorBackend
+from utils.result_cache import ResultCache
+from utils.bigquery_jobs import get_job_manager
+from utils.rollup_cube import get_rollup_cube
+from utils import sql_guard
+from utils.result_store import get_result_store
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+#agents whose runs count as one critic/refiner iteration each, when they made a model call
+ITERATION_AGENTS = {
+    "sql_critic": "sql_critic_agent",
+    "sql_refiner": "sql_refiner_agent",
+    "python_critic": "python_critic_agent",
+    "python_refiner": "python_refiner_agent",
+}
+
+#regression check defaults for --compare
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA_MS = 50.0
+
+
+# ---- suite loading ----
+
+def load_suite(path: str) -> dict[str, Any]:
+    """load a golden suite: {"name": ..., "questions": [{"id", "question", "expected_rows", ...}]}
+
+    optional per question keys:
+      setup: earlier questions asked in the same session before the golden one
+      expected_rows: rows execute_sql must return, null to only measure
+      columns: compare only these columns
+      ignore_column_names: compare each row's values only, for answers whose column aliases vary
+      ordered: rows must come back in the same order (default false)
+      float_tolerance: absolute tolerance for numeric values (default 1e-6)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        suite = json.load(f)
+
+    ids = set()
+    for question in suite.get("questions", []):
+        if "id" not in question or "question" not in question:
+            raise ValueError(f"Every golden question needs an 'id' and a 'question': {question}")
+        if question["id"] in ids:
+            raise ValueError(f"Duplicate golden question id: {question['id']}")
+        ids.add(question["id"])
+
+    if not ids:
+        raise ValueError(f"No questions in golden suite {path}")
+    suite.setdefault("name", path)
+    return suite
+
+
+# ---- correctness ----
+
+def _normalise_value(value: Any, tolerance: float) -> Any:
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        if tolerance <= 0:
+            return float(value)
+        #snap to the tolerance grid so near-equal values compare equal
+        return round(float(value) / tolerance) * tolerance
+    if isinstance(value, str):
+        try:
+            return _normalise_value(float(value), tolerance)
+        except ValueError:
+            return value.strip()
+    return str(value)
+
+
+def _normalise_rows(rows: list[dict[str, Any]], columns: Optional[list[str]], tolerance: float,
+                    ignore_names: bool = False) -> list[tuple]:
+    normalised = []
+    for row in rows:
+        keys = columns or sorted(row.keys())
+        if ignore_names:
+            normalised.append(tuple(sorted((_normalise_value(row.get(key), tolerance) for key in keys), key=repr)))
+        else:
+            normalised.append(tuple((key.upper(), _normalise_value(row.get(key), tolerance)) for key in keys))
+    return normalised
+
+
+def check_rows(actual: Optional[list[dict[str, Any]]], question: dict[str, Any]) -> dict[str, Any]:
+    """compare execute_sql rows with the question's expected rows"""
+    expected = question.get("expected_rows")
+    if expected is None:
+        return {"status": "UNCHECKED"}
+    if actual is None:
+        return {"status": "FAIL", "reason": "no rows returned"}
+
+    tolerance = question.get("float_tolerance", 1e-6)
+    columns = question.get("columns")
+    ignore_names = question.get("ignore_column_names", False)
+    actual_rows = _normalise_rows(actual, columns, tolerance, ignore_names)
+    expected_rows = _normalise_rows(expected, columns, tolerance, ignore_names)
+    if not question.get("ordered", False):
+        actual_rows = sorted(actual_rows, key=repr)
+        expected_rows = sorted(expected_rows, key=repr)
+
+    if actual_rows == expected_rows:
+        return {"status": "PASS"}
+
+    missing = [r for r in expected_rows if r not in actual_rows]
+    unexpected = [r for r in actual_rows if r not in expected_rows]
+    return {
+        "status": "FAIL",
+        "reason": f"expected {len(expected_rows)} rows, got {len(actual_rows)}",
+        "missing_rows": [list(r) if ignore_names else dict(r) for r in missing[:5]],
+        "unexpected_rows": [list(r) if ignore_names else dict(r) for r in unexpected[:5]],
+    }
+
+
+# ---- metrics ----
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """linear-interpolated percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _stage_durations(trace: Optional[dict[str, Any]]) -> dict[str, list[float]]:
+    """span durations in ms by span name for one turn trace"""
+    durations: dict[str, list[float]] = defaultdict(list)
+    if trace is None:
+        return durations
+    for span in trace["spans"]:
+        if span.get("duration_ms") is not None:
+            durations[span["name"]].append(span["duration_ms"])
+    return durations
+
+
+def _iterations(trace: Optional[dict[str, Any]]) -> dict[str, int]:
+    """runs of each iteration agent that made a model call
+
+    an agent span without a model span under it was skipped by its before_agent
+    callback (e.g. the SQL refiner once the critic approved) and is not counted.
+    """
+    counts = {key: 0 for key in ITERATION_AGENTS}
+    if trace is None:
+        return counts
+    parents = {span["span_id"]: span["parent_id"] for span in trace["spans"]}
+    names = {span["span_id"]: span["name"] for span in trace["spans"]}
+    called = set()
+    for span in trace["spans"]:
+        if not span["name"].startswith("model:"):
+            continue
+        #the agent span this model call ran under
+        parent_id = span["parent_id"]
+        while parent_id is not None and not names.get(parent_id, "").startswith("agent:"):
+            parent_id = parents.get(parent_id)
+        if parent_id is not None and names[parent_id] == f"agent:{span['name'][len('model:'):]}":
+            called.add(parent_id)
+    for key, agent in ITERATION_AGENTS.items():
+        counts[key] = sum(1 for span_id in called if names[span_id] == f"agent:{agent}")
+    return counts
+
+
+def _bigquery_bytes(trace: Optional[dict[str, Any]]) -> Optional[int]:
+    """bytes processed by execute_sql calls, when the tool span reports them"""
+    if trace is None:
+        return None
+    reported = [
+        span["attributes"]["total_bytes_processed"]
+        for span in trace["spans"]
+        if span["name"] == "tool:execute_sql" and span["attributes"].get("total_bytes_processed") is not None
+    ]
+    return sum(reported) if reported else None
+
+
+def _local_sql_calls(trace: Optional[dict[str, Any]]) -> int:
+    """execute_sql calls answered from the local mirror"""
+    if trace is None:
+        return 0
+    return sum(
+        1 for span in trace["spans"]
+        if span["name"] == "tool:execute_sql" and span["attributes"].get("served_by") == "local_mirror"
+    )
+
+
+def _result_cache_hits(trace: Optional[dict[str, Any]]) -> dict[str, int]:
+    """execute_sql calls answered (fully or with a delta query) from the result cache"""
+    hits = {"full": 0, "delta": 0}
+    for span in (trace or {}).get("spans", []):
+        outcome = span["attributes"].get("result_cache")
+        if span["name"] == "tool:execute_sql" and outcome in hits:
+            hits[outcome] += 1
+    return hits
+
+
+def _cube_hit(trace: Optional[dict[str, Any]]) -> bool:
+    """the SQL agents were skipped because the rollup cube answered"""
+    if trace is None:
+        return False
+    return any(span["attributes"].get("cube_hit") for span in trace["spans"] if span["name"] == "answer_from_rollup_cube")
+
+
+def _dry_run_bytes(sql: Optional[str]) -> Optional[int]:
+    """bytes the final query would scan, estimated with a BigQuery dry run"""
+    if not sql or is_offline('tools'):
+        return None
+    try:
+        return sql_guard.dry_run_bytes(sql, None)
+    except Exception as e:
+        logger.warning(f"BigQuery dry run failed: {e}")
+        return None
+
+
+def current_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# ---- runner ----
+
+async def run_question(question: dict[str, Any], dry_run_bytes: bool) -> dict[str, Any]:
+    """ask one golden question in a fresh session and measure the final turn"""
+    session_service = InMemorySessionService()
+    artifact_service = InMemoryArtifactService()
+    session_id = str(uuid.uuid4())
+    await session_service.create_session(
+        app_name=APP_NAME, user_id=USER_ID, session_id=session_id, state=initial_session_state()
+    )
+
+    result: dict[str, Any] = {"id": question["id"], "question": question["question"], "session_id": session_id}
+    try:
+        for setup_query in question.get("setup", []):
+            await run_turn(APP_NAME, USER_ID, session_service, artifact_service, session_id, setup_query)
+
+        started = time.perf_counter()
+        session = await run_turn(APP_NAME, USER_ID, session_service, artifact_service, session_id, question["question"])
+        result["wall_ms"] = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        logger.error(f"Golden question {question['id']} failed: {e}")
+        get_result_store().release(session_id)
+        result.update({"status": "ERROR", "error": f"{type(e).__name__}: {e}"})
+        return result
+
+    state = session.state
+    trace = get_tracer().latest_trace(session_id)
+    durations = _stage_durations(trace)
+    bq_bytes = _bigquery_bytes(trace)
+    if bq_bytes is None and dry_run_bytes:
+        bq_bytes = _dry_run_bytes(state.get("latest_sql_output"))
+
+    handle = state.get("latest_sql_result")
+    rows = get_result_store().rows(handle)
+    get_result_store().release(session_id)
+    if handle is not None and rows is None:
+        result.update({"status": "ERROR", "error": f"SQL result {handle} is no longer in the result store"})
+        return result
+    result.update(check_rows(rows, question))
+    result.update({
+        "sql_outcome": state.get("latest_sql_sequence_outcome"),
+        "python_outcome": state.get("latest_python_sequence_outcome"),
+        "sql": state.get("latest_sql_output"),
+        "row_count": len(rows or []),
+        "stage_ms": {name: sum(values) for name, values in durations.items()},
+        "span_ms": dict(durations),
+        "iterations": _iterations(trace),
+        "tokens_by_agent": (state.get("turn_token_usage") or {}).get("agents", {}),
+        "bigquery_bytes": bq_bytes,
+        "local_sql_calls": _local_sql_calls(trace),
+        "result_cache_hits": _result_cache_hits(trace),
+        "rollup_cube_hit": _cube_hit(trace),
+    })
+    return result
+
+
+def summarise(results: list[dict[str, Any]], elapsed_s: float) -> dict[str, Any]:
+    """aggregate per-question results into the suite summary"""
+    stage_samples: dict[str, list[float]] = defaultdict(list)
+    call_samples: dict[str, list[float]] = defaultdict(list)
+    tokens: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    iterations: dict[str, list[int]] = defaultdict(list)
+    status_counts: dict[str, int] = defaultdict(int)
+    bq_bytes = 0
+
+    for result in results:
+        status_counts[result["status"]] += 1
+        if result["status"] == "ERROR":
+            continue
+        for name, total in result["stage_ms"].items():
+            stage_samples[name].append(total)
+        for name, values in result["span_ms"].items():
+            call_samples[name].extend(values)
+        for agent, usage in result["tokens_by_agent"].items():
+            for field, value in usage.items():
+                tokens[agent][field] += value
+        for key, count in result["iterations"].items():
+            iterations[key].append(count)
+        bq_bytes += result["bigquery_bytes"] or 0
+
+    def _stats(samples: dict[str, list[float]]) -> dict[str, dict[str, Any]]:
+        return {
+            name: {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values)}
+            for name, values in sorted(samples.items())
+        }
+
+    completed = len(results) - status_counts.get("ERROR", 0)
+    return {
+        "questions": len(results),
+        "status_counts": dict(status_counts),
+        "elapsed_s": elapsed_s,
+        "questions_per_minute": 60 * len(results) / elapsed_s if elapsed_s else None,
+        #stage totals per turn (e.g. all critic calls of a turn summed) and per individual call
+        "stage_latency_ms": _stats(stage_samples),
+        "call_latency_ms": _stats(call_samples),
+        "tokens_by_agent": {agent: dict(usage) for agent, usage in tokens.items()},
+        "tokens_per_question": (
+            sum(u.get("total_token_count", 0) for u in tokens.values()) / completed if completed else None
+        ),
+        "iterations_mean": {key: sum(v) / len(v) for key, v in iterations.items() if v},
+        "bigquery_bytes": bq_bytes,
+    }
+
+
+async def run_suite(suite: dict[str, Any], repeat: int, dry_run_bytes: bool) -> dict[str, Any]:
+    results = []
+    started = time.perf_counter()
+    for iteration in range(repeat):
+        for question in suite["questions"]:
+            logger.info(f"Golden question {question['id']} (run {iteration + 1}/{repeat})")
+            result = await run_question(question, dry_run_bytes)
+            result["run"] = iteration + 1
+            results.append(result)
+            print(f"[{result['status']:>9}] {question['id']} {result.get('wall_ms', 0):8.0f} ms")
+    elapsed_s = time.perf_counter() - started
+
+    summary = summarise(results, elapsed_s)
+    backend = find_backend(LocalMirrorBackend)
+    if backend is not None:
+        stats = backend.stats()
+        latencies = stats.pop("latencies_ms")
+        summary["local_mirror"] = {
+            **stats,
+            "age_hours": backend.mirror.age_hours(),
+            "query_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": max(latencies)}
+            if latencies else None,
+        }
+
+    jobs = get_job_manager().stats()
+    if jobs.get("submitted"):
+        summary["bigquery_jobs"] = jobs
+
+    result_cache = find_backend(ResultCache)
+    if result_cache is not None:
+        summary["result_cache"] = result_cache.stats()
+
+    cube = get_rollup_cube()
+    if cube is not None:
+        sql_questions = [r for r in results if r["status"] != "ERROR" and r.get("sql_outcome")]
+        hits = sum(1 for r in sql_questions if r["rollup_cube_hit"])
+        summary["rollup_cube"] = {
+            "hits": hits,
+            "hit_rate": hits / len(sql_questions) if sql_questions else None,
+            "misses": cube.stats()["misses"],
+            **cube.freshness(),
+        }
+
+    return {
+        "suite": suite["name"],
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": current_git_commit(),
+        "backend": "offline" if is_offline() else "live",
+        "repeat": repeat,
+        "summary": summary,
+        "results": results,
+    }
+
+
+# ---- compare ----
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float, min_delta_ms: float) -> list[str]:
+    """regressions of current against baseline; prints a stage latency table"""
+    regressions = []
+    base_stages = baseline["summary"]["stage_latency_ms"]
+    curr_stages = current["summary"]["stage_latency_ms"]
+
+    print(f"{'stage':<40}{'p50 base':>10}{'p50 now':>10}{'p95 base':>10}{'p95 now':>10}")
+    for name in sorted(set(base_stages) | set(curr_stages)):
+        base, curr = base_stages.get(name), curr_stages.get(name)
+        if base is None or curr is None:
+            print(f"{name:<40}{'only in ' + ('current' if base is None else 'baseline'):>40}")
+            continue
+        print(f"{name:<40}{base['p50']:>10.0f}{curr['p50']:>10.0f}{base['p95']:>10.0f}{curr['p95']:>10.0f}")
+        for pct in ("p50", "p95"):
+            delta = curr[pct] - base[pct]
+            if delta > min_delta_ms and delta > base[pct] * threshold:
+                regressions.append(f"{name} {pct} {base[pct]:.0f} -> {curr[pct]:.0f} ms")
+
+    base_tokens = baseline["summary"].get("tokens_per_question")
+    curr_tokens = current["summary"].get("tokens_per_question")
+    if base_tokens and curr_tokens and curr_tokens > base_tokens * (1 + threshold):
+        regressions.append(f"tokens per question {base_tokens:.0f} -> {curr_tokens:.0f}")
+
+    base_status = {r["id"]: r["status"] for r in baseline["results"]}
+    for result in current["results"]:
+        if base_status.get(result["id"]) == "PASS" and result["status"] != "PASS":
+            regressions.append(f"{result['id']} PASS -> {result['status']}")
+
+    return sorted(set(regressions))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run golden questions through the agent sequences and report latency, tokens and correctness."
+    )
+    parser.add_argument("--suite", default="benchmarks/golden_questions.json", help="Golden suite JSON file")
+    parser.add_argument("--out", default="benchmark_results.json", help="Output results JSON path")
+    parser.add_argument("--repeat", type=int, default=1, help="Run the whole suite this many times")
+    parser.add_argument(
+        "--dry-run-bytes",
+        action="store_true",
+        help="Estimate BigQuery bytes with a dry run of the final SQL when the tool does not report them",
+    )
+    parser.add_argument("--cassette", default=None, help="Cassette file to record into or replay from")
+    parser.add_argument("--cassette-mode", choices=["record", "replay"], default="replay")
+    parser.add_argument(
+        "--cassette-latency",
+        default="recorded",
+        help="Replay latency: none | recorded | scale:<f> | fixed:<ms> | lognormal:<median_ms>,<sigma>",
+    )
+    parser.add_argument(
+        "--local-mirror",
+        default=None,
+        metavar="DIR",
+        help="Answer execute_sql from this local mirror where possible (see sync_local_mirror.py)",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        default=None,
+        help="Compare two results files instead of running; exits 1 on regression",
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="Relative regression threshold")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS, help="Ignore latency deltas below this")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
+
+    if args.cassette:
+        set_backend(Cassette(args.cassette, args.cassette_mode, args.cassette_latency))
+    if args.local_mirror:
+        set_backend(LocalMirrorBackend(LocalMirror(args.local_mirror), get_backend()))
+
+    suite = load_suite(args.suite)
+    report = asyncio.run(run_suite(suite, args.repeat, args.dry_run_bytes))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    summary = report["summary"]
+    print(f"{summary['status_counts']} in {summary['elapsed_s']:.1f}s, results saved to {args.out}")
+    if "rollup_cube" in summary:
+        cube = summary["rollup_cube"]
+        print(f"rollup cube: {cube['hits']} hits ({cube['hit_rate']}), misses {cube['misses']}, "
+              f"data through {cube['latest_date']}, {cube['age_hours']:.1f}h old")
+    if "local_mirror" in summary:
+        mirror = summary["local_mirror"]
+        print(f"local mirror: {mirror['hits']} hits, fallbacks {mirror['fallbacks']}, query ms {mirror['query_ms']}")
+    if "result_cache" in summary:
+        cache = summary["result_cache"]
+        print(f"result cache: {cache.get('hits_full', 0)} full / {cache.get('hits_delta', 0)} delta hits "
+              f"({cache['hit_rate']}), {cache['rows_reused']} rows reused, {cache['rows_fetched']} fetched")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Optional
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+
+from constants import APP_NAME, USER_ID
+from sequences.turn_sequence import initial_session_state, run_turn
+from benchmarks.fake_backends import FakeModelBackend, FakeBigQueryBackend
+from benchmarks.golden import percentile, current_git_commit
+from utils.backends import CompositeBackend, set_backend
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import resource
+except ImportError:  #not available on Windows
+    resource = None
+
+DEFAULT_QUESTIONS = [
+    "How many TV sales did we have last week?",
+    "Show TV sales for the last 4 weeks broken down by TV Product",
+    "Plot the daily trend of broadband orders over the last 30 days",
+    "What does the Cost to Serve KPI measure?",
+    "And how does that compare with the same day last week?",
+]
+
+#a level is past the knee once its p95 exceeds this multiple of the first level's p95
+KNEE_LATENCY_FACTOR = 2.0
+#or once adding users raises throughput by less than this fraction of linear scaling
+KNEE_MIN_SCALING = 0.5
+
+
+# ---- process measurements ----
+
+def current_rss_bytes() -> Optional[int]:
+    """resident set size right now (Linux), None elsewhere"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class LoopLagMonitor:
+    """samples how late the event loop wakes a sleeping task"""
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.samples_ms: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.samples_ms.append(max(0.0, (time.perf_counter() - started - self.interval_s) * 1000))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict[str, Optional[float]]:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return {
+            'p50': percentile(self.samples_ms, 50),
+            'p95': percentile(self.samples_ms, 95),
+            'max': max(self.samples_ms) if self.samples_ms else None,
+        }
+
+
+# ---- load generation ----
+
+async def simulated_user(
+        session_service: InMemorySessionService,
+        artifact_service: InMemoryArtifactService,
+        questions: list[str],
+        turns: int,
+        think_time_s: float,
+        rng: random.Random,
+    ) -> list[dict[str, Any]]:
+    """one user with their own session asking turns questions back to back"""
+    session_id = str(uuid.uuid4())
+    await session_service.create_session(
+        app_name=APP_NAME, user_id=USER_ID, session_id=session_id, state=initial_session_state()
+    )
+
+    results = []
+    for _ in range(turns):
+        question = rng.choice(questions)
+        started = time.perf_counter()
+        try:
+            await run_turn(APP_NAME, USER_ID, session_service, artifact_service, session_id, question)
+            status = 'OK'
+        except Exception as e:
+            logger.warning(f"Simulated turn failed: {type(e).__name__}: {e}")
+            status = type(e).__name__
+        results.append({'latency_ms': (time.perf_counter() - started) * 1000, 'status': status})
+        if think_time_s:
+            await asyncio.sleep(rng.expovariate(1 / think_time_s))
+    return results
+
+
+def _session_sizes(session_service: InMemorySessionService) -> list[int]:
+    """serialised size of every session held by the service"""
+    sizes = []
+    for by_user in session_service.sessions.get(APP_NAME, {}).values():
+        for session in by_user.values():
+            sizes.append(len(session.model_dump_json()))
+    return sizes
+
+
+async def run_level(users: int, args: argparse.Namespace, questions: list[str]) -> dict[str, Any]:
+    """drive users concurrent sessions and measure one concurrency level"""
+    #one service for all users, as in one app process
+    session_service = InMemorySessionService()
+    artifact_service = InMemoryArtifactService()
+    rng = random.Random(args.seed + users)
+
+    gc.collect()
+    rss_before = current_rss_bytes()
+    monitor = LoopLagMonitor()
+    monitor.start()
+
+    started = time.perf_counter()
+    per_user = await asyncio.gather(*(
+        simulated_user(session_service, artifact_service, questions, args.turns, args.think_time, random.Random(rng.random()))
+        for _ in range(users)
+    ))
+    elapsed_s = time.perf_counter() - started
+    loop_lag = await monitor.stop()
+
+    gc.collect()
+    rss_after = current_rss_bytes()
+    sizes = _session_sizes(session_service)
+
+    turns = [turn for user in per_user for turn in user]
+    ok = [t['latency_ms'] for t in turns if t['status'] == 'OK']
+    level = {
+        'users': users,
+        'turns': len(turns),
+        'errors': len(turns) - len(ok),
+        'elapsed_s': elapsed_s,
+        'throughput_turns_per_s': len(ok) / elapsed_s if elapsed_s else None,
+        'latency_ms': {
+            'p50': percentile(ok, 50),
+            'p95': percentile(ok, 95),
+            'p99': percentile(ok, 99),
+            'max': max(ok) if ok else None,
+        },
+        'event_loop_lag_ms': loop_lag,
+        'peak_rss_mb': (peak_rss_bytes() or 0) / 2**20,
+        'rss_growth_mb': (rss_after - rss_before) / 2**20 if rss_before and rss_after else None,
+        #RSS retained per live session, and the serialised session itself
+        'rss_per_session_kb': (rss_after - rss_before) / users / 1024 if rss_before and rss_after else None,
+        'session_json_kb': {
+            'mean': sum(sizes) / len(sizes) / 1024 if sizes else None,
+            'max': max(sizes) / 1024 if sizes else None,
+        },
+    }
+    print(
+        f"users={users:>4}  tput={level['throughput_turns_per_s'] or 0:7.2f}/s  "
+        f"p50={level['latency_ms']['p50'] or 0:8.0f}ms  p95={level['latency_ms']['p95'] or 0:8.0f}ms  "
+        f"lag_p95={loop_lag['p95'] or 0:6.1f}ms  errors={level['errors']}  peak_rss={level['peak_rss_mb']:.0f}MB"
+    )
+    return level
+
+
+def find_knee(levels: list[dict[str, Any]]) -> Optional[int]:
+    """highest concurrency before latency blows up or throughput stops scaling"""
+    if not levels or levels[0]['latency_ms']['p95'] is None:
+        return None
+    base = levels[0]
+    knee = base['users']
+    for prev, level in zip(levels, levels[1:]):
+        p95 = level['latency_ms']['p95']
+        if p95 is None or p95 > base['latency_ms']['p95'] * KNEE_LATENCY_FACTOR:
+            break
+        #throughput gained vs what linear scaling from the previous level would give
+        expected_gain = prev['throughput_turns_per_s'] * (level['users'] / prev['users'] - 1)
+        actual_gain = level['throughput_turns_per_s'] - prev['throughput_turns_per_s']
+        if expected_gain > 0 and actual_gain < expected_gain * KNEE_MIN_SCALING:
+            break
+        knee = level['users']
+    return knee
+
+
+async def run_sweep(args: argparse.Namespace, questions: list[str]) -> dict[str, Any]:
+    levels = []
+    for users in args.concurrency:
+        levels.append(await run_level(users, args, questions))
+    return {
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': current_git_commit(),
+        'config': {
+            'concurrency': args.concurrency,
+            'turns_per_user': args.turns,
+            'think_time_s': args.think_time,
+            'model_latency': args.model_latency,
+            'model_failure_rate': args.model_failure_rate,
+            'critic_reject_rate': args.critic_reject_rate,
+            'bq_latency': args.bq_latency,
+            'bq_failure_rate': args.bq_failure_rate,
+            'bq_rows': args.bq_rows,
+            'live_bigquery': args.live_bigquery,
+        },
+        'levels': levels,
+        'knee_users': find_knee(levels),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Drive concurrent simulated users through the agent pipeline with fake backends."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[1, 2, 4, 8, 16, 32],
+        help="Comma separated concurrent user counts to sweep",
+    )
+    parser.add_argument("--turns", type=int, default=3, help="Questions asked by each simulated user")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a user waits between questions")
+    parser.add_argument("--questions-file", default=None, help="Text file with one question per line")
+    parser.add_argument("--model-latency", default="lognormal:800,0.5", help="Fake Gemini latency spec")
+    parser.add_argument("--model-failure-rate", type=float, default=0.0, help="Fraction of model calls that fail")
+    parser.add_argument("--critic-reject-rate", type=float, default=0.0, help="Fraction of critic calls that reject")
+    parser.add_argument("--bq-latency", default="lognormal:1500,0.6", help="Fake BigQuery latency spec")
+    parser.add_argument("--bq-failure-rate", type=float, default=0.0, help="Fraction of execute_sql calls that fail")
+    parser.add_argument("--bq-rows", type=int, default=50, help="Rows returned by each fake execute_sql")
+    parser.add_argument("--live-bigquery", action="store_true", help="Fake only the model, run SQL against BigQuery")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="load_test_results.json", help="Output results JSON path")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions_file:
+        with open(args.questions_file, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    set_backend(CompositeBackend(
+        model=FakeModelBackend(args.model_latency, args.model_failure_rate, args.critic_reject_rate, seed=args.seed),
+        tools=None if args.live_bigquery else FakeBigQueryBackend(
+            args.bq_latency, args.bq_failure_rate, args.bq_rows, seed=args.seed
+        ),
+    ))
+
+    report = asyncio.run(run_sweep(args, questions))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Knee at {report['knee_users']} concurrent users, results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+"""Microbenchmarks for the pure-Python bookkeeping run on every event or turn.
+
+Run from the repo root with `python -m benchmarks.microbench`. Targets are
+imported lazily from --root, so this harness can measure another checkout:
+--compare-commits runs it against git worktrees of two commits.
+"""
+
+import argparse
+import asyncio
+import atexit
+import base64
+import inspect
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Optional
+
+#one loop for every async benchmark, created before any target is imported
+_loop = asyncio.new_event_loop()
+
+#production-sized fixtures
+RESULT_ROWS = 500
+IMAGE_SIDE_PX = 1400
+SESSION_TURNS = 50
+KPI_COUNT = 18
+KPI_INDEX_VALUES = 5000
+MIRROR_DAYS = 90
+MIRROR_ROWS_PER_DAY = 500
+
+#a regression is flagged when ops/sec drops by more than this fraction
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+# ---- fixtures ----
+
+def make_rows(n: int = RESULT_ROWS, seed: int = 1) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    start = date(2025, 1, 1)
+    return [
+        {
+            'KPI_DATE': (start + timedelta(days=i // 5)).isoformat(),
+            'KPI_ID': 20002001,
+            'DIM1': ('Sky Glass', 'Sky Stream', 'Sky Q', 'Sky Signature', 'Netflix')[i % 5],
+            'DIM2': f'Region {i % 12}',
+            'DIM3': None,
+            'VALUE': rng.randint(0, 100000),
+        }
+        for i in range(n)
+    ]
+
+
+def make_image_base64(side_px: int = IMAGE_SIDE_PX, seed: int = 1) -> str:
+    """noise PNG that barely compresses, a few MB once base64 encoded"""
+    from PIL import Image
+    rng = random.Random(seed)
+    image = Image.frombytes('RGB', (side_px, side_px), rng.randbytes(side_px * side_px * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def sql_result_state(rows: list[dict[str, Any]]) -> dict[str, Any]:
+    """state keys a SQL result leaves: its result store handle, summary and profile, or the rows at commits before the store"""
+    try:
+        from utils.result_store import result_state
+    except ImportError:
+        return {'latest_sql_response': rows}
+    return result_state(rows)
+
+
+def make_session_state(turns: int = SESSION_TURNS, image_base64: str = '', rows: Optional[list] = None) -> dict[str, Any]:
+    """state of a session after `turns` questions"""
+    rows = rows if rows is not None else make_rows()
+    sql = (
+        "SELECT KPI_DATE, DIM1, SUM(VALUE) AS VALUE FROM `uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DATA_TEST_V5` "
+        "WHERE KPI_ID = 20002001 AND KPI_DATE BETWEEN '2025-01-01' AND '2025-03-31' GROUP BY 1, 2"
+    )
+    return {
+        'projects': "uk-dta-gsmanalytics-poc",
+        'datasets': "metricmind",
+        'tables': "GSM_KPI_DATA_TEST_V5, GSM_KPI_DEFS_TEST_V5",
+        'greeting': 'Sure, here are the TV sales.',
+        'user_intent': {'user_intent': 'TV sales by product', 'sql_required': True, 'python_required': True},
+        'sql_required': True,
+        'python_required': True,
+        'latest_user_query': f'question {turns}',
+        'latest_sql_output': sql,
+        'latest_sql_output_reasoning': 'The query filters on TV Sales. ' * 20,
+        'latest_sql_criticism': 'OUTCOME OK',
+        **sql_result_state(rows),
+        'latest_bq_execution_status': 'SUCCESS',
+        'latest_sql_sequence_outcome': 'SUCCESS',
+        'latest_python_code_output': 'import matplotlib.pyplot as plt\n' * 40,
+        'latest_python_code_execution_outcome': 'Outcome.OUTCOME_OK',
+        'latest_python_sequence_outcome': 'SUCCESS',
+        'latest_img_bytes': f'![chart](data:image/png;base64,{image_base64})',
+        'conversation_digest': [
+            {'question': f'question {i}', 'intent': 'TV sales', 'kpis': ['20002001'],
+             'filters': ["KPI_DATE BETWEEN '2025-01-01' AND '2025-03-31'"], 'sql': sql, 'outcome': 'SQL SUCCESS'}
+            for i in range(max(0, turns - 10), turns)
+        ],
+        'conversation_summaries': {f'question {i}': 'TV sales summary ' * 5 for i in range(turns // 2)},
+        'history_compaction': {
+            agent: {'before_tokens': 40000, 'after_tokens': 9000, 'folded_turns': turns - 2}
+            for agent in ('starter_agent', 'sql_writer_agent', 'python_writer_agent')
+        },
+        'turn_token_usage': {'turn': turns, 'agents': {
+            agent: {'total_token_count': 5000, 'prompt_token_count': 4500, 'cost_usd': 0.001}
+            for agent in ('starter_agent', 'sql_writer_agent', 'sql_critic_agent', 'python_writer_agent')
+        }},
+        **{f'app:{name}': turns * 5000 for name in (
+            'total_token_count', 'prompt_token_count', 'candidates_token_count',
+            'thoughts_token_count', 'tool_use_prompt_token_count', 'cached_content_token_count',
+        )},
+    }
+
+
+def make_kpi_payload(n: int = KPI_COUNT) -> list[dict[str, Any]]:
+    """rows of the initial KPI overview query"""
+    return [
+        {
+            'KPI_ID': kpi_id,
+            'dimensions_with_examples': [
+                {'dim_name': f'dimension {d}', 'example_values': [f'value {v}' for v in range(25)]}
+                for d in range(10)
+            ],
+            'measures': [f'measure {m}' for m in range(8)],
+        }
+        for kpi_id in range(10000, 10000 + n)
+    ]
+
+
+def make_local_mirror(days: int = MIRROR_DAYS, rows_per_day: int = MIRROR_ROWS_PER_DAY, seed: int = 1):
+    """temporary local mirror holding one KPI's last `days` partitions"""
+    from utils.local_mirror import LocalMirror, wide_frame
+
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp(prefix='microbench_mirror_')
+    atexit.register(shutil.rmtree, root, True)
+    mirror = LocalMirror(root)
+    today = date.today()
+    rows = [
+        {
+            'KPI_DATE': today - timedelta(days=day),
+            'DIM': [
+                {'NAME': 'Technology', 'VALUE': ('FTTP', 'FTTC', 'SOGEA')[i % 3]},
+                {'NAME': 'Operator', 'VALUE': f'Operator {i % 7}'},
+                {'NAME': 'Country', 'VALUE': ('UK', 'IE')[i % 2]},
+            ],
+            'INT': [
+                {'NAME': 'Packet Loss', 'VALUE': rng.randint(0, 100)},
+                {'NAME': 'Total Packets', 'VALUE': rng.randint(100, 10000)},
+            ],
+        }
+        for day in range(days) for i in range(rows_per_day)
+    ]
+    frame = wide_frame(30030, rows)
+    for month, part in frame.groupby(frame['KPI_DATE'].dt.strftime('%Y-%m')):
+        mirror._write_month(30030, month, part, None)
+    mirror._write_manifest({
+        'table': mirror.table_id,
+        'synced_at': datetime.now().astimezone().isoformat(timespec='seconds'),
+        'latest_date': today.isoformat(),
+        'synced_through': (today - timedelta(days=7)).isoformat(),
+    })
+    return mirror
+
+
+# ---- benchmarks ----
+# each returns (setup, call): setup() builds fresh context per round outside
+# the timed region, call(ctx) is timed and may be a coroutine function
+
+def bench_process_agent_response_rows():
+    from google.adk.events import Event
+    from google.adk.sessions import InMemorySessionService
+    from google.genai import types
+    from utils.agent_utils import process_agent_response
+
+    state = make_session_state()
+    event = Event(author='sql_writer_agent', content=types.Content(role='user', parts=[
+        types.Part(function_response=types.FunctionResponse(
+            name='execute_sql', response={'status': 'SUCCESS', 'rows': make_rows()}
+        ))
+    ]))
+
+    def setup():
+        service = InMemorySessionService()
+        _loop.run_until_complete(
+            service.create_session(app_name='bench', user_id='bench', session_id='s', state=state)
+        )
+        return service
+
+    async def call(service):
+        await process_agent_response(event, 'bench', 'bench', 's', service, None, {})
+
+    return setup, call
+
+
+def bench_process_agent_response_usage():
+    from google.adk.events import Event
+    from google.adk.sessions import InMemorySessionService
+    from google.genai import types
+    from utils.agent_utils import process_agent_response
+
+    state = make_session_state()
+    event = Event(
+        author='sql_critic_agent',
+        content=types.Content(role='model', parts=[types.Part(text='OUTCOME OK')]),
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=4000, candidates_token_count=20, total_token_count=4020
+        ),
+    )
+
+    def setup():
+        service = InMemorySessionService()
+        _loop.run_until_complete(
+            service.create_session(app_name='bench', user_id='bench', session_id='s', state=state)
+        )
+        return service
+
+    async def call(service):
+        await process_agent_response(event, 'bench', 'bench', 's', service, None, {})
+
+    return setup, call
+
+
+def bench_save_img():
+    from utils.helper import save_img
+
+    img = f'![chart](data:image/png;base64,{make_image_base64()})'
+    #save_img writes into images/ under the working directory
+    workdir = tempfile.mkdtemp(prefix='microbench_images_')
+
+    def setup():
+        #save_img numbers files by listing images/, start each round empty
+        os.chdir(workdir)
+        shutil.rmtree('images', ignore_errors=True)
+        return img
+
+    return setup, save_img
+
+
+def bench_store_image_artifact():
+    from callbacks import store_image_artifact
+
+    class _ArtifactSink:
+        """stands in for ToolContext, keeping only what the callback touches"""
+        async def save_artifact(self, filename, artifact):
+            return 0
+
+    response = {'inline_data': f'![chart](data:image/png;base64,{make_image_base64()})'}
+
+    async def call(sink):
+        await store_image_artifact(None, {}, sink, response)
+
+    return _ArtifactSink, call
+
+
+def bench_safe_value():
+    from state_check import _safe_value
+
+    state = make_session_state(image_base64=make_image_base64())
+    return (lambda: state), (lambda s: _safe_value(s, 2000))
+
+
+def bench_state_tracker():
+    from google.adk.events import Event, EventActions
+    from state_check import StateTracker
+
+    prev = make_session_state(image_base64=make_image_base64())
+    curr = dict(prev)
+    delta = {
+        **sql_result_state(make_rows(seed=2)),
+        'latest_user_query': 'next question',
+        'app:total_token_count': prev['app:total_token_count'] + 5000,
+        'turn_token_usage': prev['turn_token_usage'],
+        'conversation_digest': prev['conversation_digest'],
+    }
+    curr.update(delta)
+    #a turn's worth of system events, each writing part of the delta
+    events = [Event(author='system', actions=EventActions(state_delta={key: value})) for key, value in delta.items()]
+
+    def setup():
+        return StateTracker(prev)
+
+    def call(tracker):
+        tracker.events_seen = 0
+        tracker.update(curr, events)
+
+    return setup, call
+
+
+def bench_kpi_index_resolve():
+    from utils.kpi_index import KpiValueIndex
+    from constants import KPI_INDEX_SOURCES
+
+    index = KpiValueIndex.from_sources(KPI_INDEX_SOURCES)
+    #pad the real values out to a few thousand, as a fuller schema context would
+    rng = random.Random(0)
+    words = sorted(index._vocabulary)
+    for i in range(KPI_INDEX_VALUES - len(index.entries)):
+        index.add_value(f"9{i % KPI_COUNT:04d}", f"Dimension {i % 7}", ' '.join(rng.sample(words, 3)))
+    index.build()
+    question = "customer count by technology for ultrafst customers on sky full fibre 500 in the UK with speed 100"
+    return (lambda: index), (lambda idx: idx.resolve(question))
+
+
+def bench_local_mirror_query(cold: bool = False):
+    from constants import DATA_TABLE_ID
+
+    mirror = make_local_mirror()
+    #shape of the SQL agents' per-day breakdown pattern
+    sql = f"""
+        WITH SUBSET AS (
+          SELECT * FROM `{DATA_TABLE_ID}`
+          WHERE KPI_ID = 30030 AND KPI_DATE BETWEEN CURRENT_DATE() - 30 AND CURRENT_DATE()
+          AND EXISTS (SELECT 1 FROM UNNEST(DIM) AS D WHERE D.NAME = 'Country' AND D.VALUE = 'UK')
+        )
+        SELECT KPI_DATE,
+          (SELECT VALUE FROM UNNEST(DIM) WHERE NAME = 'Technology') AS TECHNOLOGY,
+          SUM((SELECT VALUE FROM UNNEST(INT) WHERE NAME = 'Packet Loss')) /
+          SUM((SELECT VALUE FROM UNNEST(INT) WHERE NAME = 'Total Packets')) * 100 AS PACKET_LOSS_RATE
+        FROM SUBSET
+        GROUP BY ALL
+        ORDER BY 1, 2
+    """
+
+    def call(m):
+        if cold:
+            #drop the in-memory KPI rows so every call reads the parquet files
+            m._frames.clear()
+        return m.query(sql)
+
+    return (lambda: mirror), call
+
+
+def bench_rollup_cube_answer():
+    from datetime import timezone
+    from utils.rollup_cube import RollupCube, records_from_frame
+
+    mirror = make_local_mirror()
+    kpi = {'kpi_name': 'Packet Loss', 'indicators_int': [
+        {'name': 'Packet Loss', 'aggregation': 'SUM'}, {'name': 'Total Packets', 'aggregation': 'SUM'}]}
+    cube = RollupCube.from_records(
+        records_from_frame(mirror.load([30030])), {'30030': kpi},
+        built_at=datetime.now(timezone.utc).isoformat(), latest_date=date.today().isoformat(),
+    )
+    question = "weekly packet loss by technology for the last 12 weeks"
+    resolution = {'kpis': [{'kpi_id': '30030'}], 'filters': []}
+    return (lambda: cube), (lambda c: c.answer(question, resolution))
+
+
+def bench_display_initial_kpi_data():
+    from app import display_initial_kpi_data
+
+    payload = make_kpi_payload()
+    return (lambda: payload), display_initial_kpi_data
+
+
+BENCHMARKS: dict[str, Callable] = {
+    'process_agent_response[500 rows]': bench_process_agent_response_rows,
+    'process_agent_response[usage]': bench_process_agent_response_usage,
+    'save_img': bench_save_img,
+    'store_image_artifact': bench_store_image_artifact,
+    'state_check._safe_value': bench_safe_value,
+    'state_check.StateTracker.update': bench_state_tracker,
+    'kpi_index.resolve': bench_kpi_index_resolve,
+    'local_mirror.query[90 days]': bench_local_mirror_query,
+    'local_mirror.query[90 days, cold]': lambda: bench_local_mirror_query(cold=True),
+    'rollup_cube.answer': bench_rollup_cube_answer,
+    'display_initial_kpi_data': bench_display_initial_kpi_data,
+}
+
+
+# ---- harness ----
+
+def _timer(call: Callable) -> Callable[[Any, int], float]:
+    """seconds to run call(ctx) n times"""
+    if inspect.iscoroutinefunction(call):
+        async def many(ctx, n):
+            for _ in range(n):
+                await call(ctx)
+
+        def run(ctx, n):
+            started = time.perf_counter()
+            _loop.run_until_complete(many(ctx, n))
+            return time.perf_counter() - started
+        return run
+
+    def run(ctx, n):
+        started = time.perf_counter()
+        for _ in range(n):
+            call(ctx)
+        return time.perf_counter() - started
+    return run
+
+
+def measure(name: str, factory: Callable, rounds: int, min_round_s: float) -> dict[str, Any]:
+    cwd = os.getcwd()
+    try:
+        return _measure(name, factory, rounds, min_round_s)
+    finally:
+        os.chdir(cwd)
+
+
+def _measure(name: str, factory: Callable, rounds: int, min_round_s: float) -> dict[str, Any]:
+    try:
+        setup, call = factory()
+    except ImportError as e:
+        return {'name': name, 'status': 'SKIPPED', 'reason': f'{type(e).__name__}: {e}'}
+    except Exception as e:
+        #e.g. a target that does not exist or import cleanly at an older commit
+        return {'name': name, 'status': 'ERROR', 'reason': f'{type(e).__name__}: {e}'}
+
+    run = _timer(call)
+
+    #warm up, then size rounds like timeit.autorange
+    number = 1
+    while True:
+        elapsed = run(setup(), number)
+        if elapsed >= min_round_s or number >= 10000:
+            break
+        number *= 2 if elapsed * 2 >= min_round_s else 10
+
+    per_call_s = [run(setup(), number) / number for _ in range(rounds)]
+
+    #allocations of a single call
+    ctx = setup()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    run(ctx, 1)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median_s = statistics.median(per_call_s)
+    return {
+        'name': name,
+        'status': 'OK',
+        'calls_per_round': number,
+        'rounds': rounds,
+        'ops_per_sec': 1 / median_s,
+        'median_us': median_s * 1e6,
+        'stdev_us': statistics.stdev(per_call_s) * 1e6 if rounds > 1 else 0.0,
+        'alloc_peak_kb': (peak - before) / 1024,
+        'alloc_retained_kb': (after - before) / 1024,
+    }
+
+
+def run_suite(selected: list[str], rounds: int, min_round_s: float) -> dict[str, Any]:
+    results = []
+    for name in selected:
+        result = measure(name, BENCHMARKS[name], rounds, min_round_s)
+        results.append(result)
+        if result['status'] == 'OK':
+            print(f"{name:<36}{result['ops_per_sec']:>12.1f} ops/s{result['median_us']:>12.1f} us"
+                  f"{result['alloc_peak_kb']:>12.1f} KB peak")
+        else:
+            print(f"{name:<36} {result['status'].lower()} ({result['reason']})")
+    return {'run_at': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0], 'results': results}
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[str]:
+    """print ops/sec and allocation changes, return benchmarks that got slower than threshold"""
+    base = {r['name']: r for r in baseline['results'] if r['status'] == 'OK'}
+    regressions = []
+    print(f"{'benchmark':<36}{'ops/s base':>12}{'ops/s now':>12}{'change':>9}{'KB base':>10}{'KB now':>10}")
+    for result in current['results']:
+        if result['status'] != 'OK' or result['name'] not in base:
+            continue
+        old = base[result['name']]
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        print(f"{result['name']:<36}{old['ops_per_sec']:>12.1f}{result['ops_per_sec']:>12.1f}{change:>+9.1%}"
+              f"{old['alloc_peak_kb']:>10.0f}{result['alloc_peak_kb']:>10.0f}")
+        if change < -threshold:
+            regressions.append(f"{result['name']} {change:+.1%} ops/s")
+    return regressions
+
+
+def run_at_commit(commit: str, args: argparse.Namespace, out_path: str) -> dict[str, Any]:
+    """run this harness against a git worktree checked out at commit"""
+    worktree = tempfile.mkdtemp(prefix=f'microbench_{commit[:12]}_')
+    subprocess.run(['git', 'worktree', 'add', '--detach', worktree, commit], check=True, capture_output=True)
+    try:
+        cmd = [
+            sys.executable, os.path.abspath(__file__), '--root', worktree, '--out', out_path,
+            '--rounds', str(args.rounds), '--min-round-s', str(args.min_round_s),
+        ]
+        if args.only:
+            cmd += ['--only', *args.only]
+        print(f"== {commit}")
+        subprocess.run(cmd, check=True, cwd=worktree)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree], check=False, capture_output=True)
+    with open(out_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks for per-event and per-turn bookkeeping.")
+    parser.add_argument('--root', default=None, help='Repo checkout to import benchmark targets from')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None, help='Run only these')
+    parser.add_argument('--rounds', type=int, default=7, help='Timed rounds per benchmark')
+    parser.add_argument('--min-round-s', type=float, default=0.2, help='Minimum duration of one timed round')
+    parser.add_argument('--out', default='microbench_results.json', help='Output results JSON path')
+    parser.add_argument('--tracing', action='store_true', help='Keep span tracing on while measuring')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two results files')
+    parser.add_argument('--compare-commits', nargs=2, metavar=('BASE', 'HEAD'), help='Benchmark and compare two commits')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare or args.compare_commits:
+        if args.compare:
+            paths = args.compare
+            reports = []
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    reports.append(json.load(f))
+        else:
+            out_dir = tempfile.mkdtemp(prefix='microbench_')
+            reports = [
+                run_at_commit(commit, args, os.path.join(out_dir, f'{i}.json'))
+                for i, commit in enumerate(args.compare_commits)
+            ]
+        regressions = compare(*reports, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
+
+    #a root span per call would otherwise export a trace file line per call
+    if not args.tracing:
+        os.environ['METRIC_MIND_TRACING'] = 'false'
+    out = os.path.abspath(args.out)
+    root = os.path.abspath(args.root or os.getcwd())
+    sys.path.insert(0, root)
+    os.chdir(root)
+
+    report = run_suite(args.only or list(BENCHMARKS), args.rounds, args.min_round_s)
+    report['root'] = root
+
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Build the rollup cube the SQL writer answers simple KPI questions from.
+
+Run offline, e.g. nightly after build_schema_context.py: `python build_rollup_cube.py`.
+Daily SUM/COUNT aggregates per KPI, indicator and single dimension value are
+read from BigQuery, or from the local mirror with --from-mirror, and rolled up
+into weeks and months. Each run only rereads the KPI_DATE partitions the
+previous build had not settled; the last SCHEMA_MUTABLE_DAYS are always reread.
+Pass --full to rebuild from scratch.
+"""
+
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+import pandas as pd
+
+from constants import (
+    ROLLUP_CUBE_PATH, SCHEMA_CONTEXT_PATH, DATA_TABLE_ID, BIGQUERY_LOCATION, SCHEMA_MUTABLE_DAYS,
+)
+from utils.helper import json_to_dict
+from utils.local_mirror import LocalMirror
+from utils.logger import get_logger
+from utils.rollup_cube import RECORD_COLUMNS, TOTAL, RollupCube, records_from_frame
+
+logger = get_logger(__name__)
+
+
+# ---- sources ----
+
+def scan_bigquery(client, after: Optional[date]) -> pd.DataFrame:
+    """daily totals and per dimension value aggregates, in one pass each over the partitions after `after`"""
+    from google.cloud import bigquery
+
+    where, params = "", []
+    if after is not None:
+        #partition filter, so only the unsettled partitions are billed
+        where = "WHERE KPI_DATE > @after"
+        params.append(bigquery.ScalarQueryParameter('after', 'DATE', after))
+    queries = [
+        f"""SELECT KPI_ID, KPI_DATE, '{TOTAL}' AS DIMENSION, CAST(NULL AS STRING) AS VALUE, I.NAME AS INDICATOR,
+                   SUM(I.VALUE) AS TOTAL, COUNT(I.VALUE) AS N
+            FROM `{DATA_TABLE_ID}`, UNNEST(INT) AS I {where}
+            GROUP BY ALL""",
+        f"""SELECT KPI_ID, KPI_DATE, D.NAME AS DIMENSION, CAST(D.VALUE AS STRING) AS VALUE, I.NAME AS INDICATOR,
+                   SUM(I.VALUE) AS TOTAL, COUNT(I.VALUE) AS N
+            FROM `{DATA_TABLE_ID}`, UNNEST(DIM) AS D, UNNEST(INT) AS I {where}
+            GROUP BY ALL""",
+    ]
+    frames = []
+    for query in queries:
+        job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params))
+        frames.append(job.to_dataframe())
+    records = pd.concat(frames, ignore_index=True)
+    records['KPI_DATE'] = pd.to_datetime(records['KPI_DATE'])
+    return records[RECORD_COLUMNS]
+
+
+def scan_mirror(mirror: LocalMirror, after: Optional[date]) -> pd.DataFrame:
+    """the same aggregates computed from the local mirror"""
+    parts = []
+    for entry in sorted(os.listdir(mirror.root)):
+        if not entry.startswith('kpi_id='):
+            continue
+        frame = mirror.load([int(entry.split('=', 1)[1])])
+        if after is not None:
+            frame = frame[frame['KPI_DATE'] > pd.Timestamp(after)]
+        parts.append(records_from_frame(frame))
+    if not parts:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the KPI x dimension x date rollup cube.")
+    parser.add_argument('--out', default=ROLLUP_CUBE_PATH, help='Cube file to write')
+    parser.add_argument('--schema-context', default=SCHEMA_CONTEXT_PATH, help='Indicator aggregation types')
+    parser.add_argument('--from-mirror', default=None, metavar='DIR', help='Aggregate this local mirror instead of BigQuery')
+    parser.add_argument('--full', action='store_true', help='Ignore the existing cube and reread every partition')
+    parser.add_argument('--mutable-days', type=int, default=SCHEMA_MUTABLE_DAYS,
+                        help='Trailing KPI_DATE partitions reread on every build')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    previous = None if args.full or not os.path.exists(args.out) else RollupCube.load(args.out)
+    after = date.fromisoformat(previous.meta['settled_through']) if previous is not None else None
+
+    if args.from_mirror:
+        mirror = LocalMirror(args.from_mirror)
+        if mirror.manifest() is None:
+            raise SystemExit(f"No local mirror at {args.from_mirror}, run sync_local_mirror.py first")
+        records = scan_mirror(mirror, after)
+        source = f"mirror:{args.from_mirror}"
+    else:
+        from google.cloud import bigquery
+        records = scan_bigquery(bigquery.Client(location=BIGQUERY_LOCATION), after)
+        source = 'bigquery'
+
+    if previous is not None:
+        kept = previous.records()
+        kept = kept[kept['KPI_DATE'] <= pd.Timestamp(after)]
+        records = pd.concat([kept, records], ignore_index=True)
+    if records.empty:
+        raise SystemExit("No KPI rows to aggregate")
+
+    latest = pd.Timestamp(records['KPI_DATE'].max()).date()
+    schema_context = json_to_dict(args.schema_context)
+    cube = RollupCube.from_records(
+        records,
+        {str(kpi_id): kpi for kpi_id, kpi in schema_context.get('kpis', {}).items()},
+        table=DATA_TABLE_ID,
+        source=source,
+        built_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        latest_date=latest.isoformat(),
+        settled_through=(latest - timedelta(days=args.mutable_days)).isoformat(),
+    )
+    cube.save(args.out)
+    print(f"Wrote {len(cube.meta['kpis'])} KPIs, {len(cube.slices)} slices to {args.out}, data through {latest} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Regenerate schema_context.json from the KPI data and defs tables.
+
+Run offline, e.g. nightly: `python build_schema_context.py`. Each run scans
+the KPI_DATE partitions the previous run had not settled, folding them into
+per-KPI sketches (HyperLogLog distinct counts, SpaceSaving top values) saved
+in SCHEMA_SKETCHES_PATH. The last SCHEMA_MUTABLE_DAYS partitions are never
+settled and are rescanned on every refresh; pass --full to rebuild from scratch.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
+
+from constants import (
+    SCHEMA_CONTEXT_PATH, DATA_TABLE_ID, DEFS_TABLE_ID, BIGQUERY_LOCATION, SCHEMA_SKETCHES_PATH,
+    SCHEMA_MUTABLE_DAYS, SCHEMA_SAMPLE_VALUES, SCHEMA_HLL_PRECISION, SCHEMA_TOP_K_CAPACITY,
+)
+from utils.logger import get_logger
+from utils.sketches import HyperLogLog, SpaceSaving
+
+logger = get_logger(__name__)
+
+SKETCHES_VERSION = 1
+
+
+class DimensionProfile:
+    """distinct count and most frequent values of one KPI dimension"""
+
+    def __init__(self, hll: Optional[HyperLogLog] = None, top: Optional[SpaceSaving] = None):
+        self.hll = hll or HyperLogLog(SCHEMA_HLL_PRECISION)
+        self.top = top or SpaceSaving(SCHEMA_TOP_K_CAPACITY)
+
+    def add(self, value: str) -> None:
+        #values already counted were already hashed; most rows repeat a heavy hitter
+        if value not in self.top.counts:
+            self.hll.add(value)
+        self.top.add(value)
+
+    def merge(self, other: 'DimensionProfile') -> None:
+        self.hll.merge(other.hll)
+        self.top.merge(other.top)
+
+    def distinct_count(self) -> int:
+        #nothing was ever evicted, so the counters hold every value seen
+        if len(self.top.counts) < self.top.capacity:
+            return len(self.top.counts)
+        return self.hll.count()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'hll': self.hll.to_dict(), 'top': self.top.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'DimensionProfile':
+        return cls(HyperLogLog.from_dict(data['hll']), SpaceSaving.from_dict(data['top']))
+
+
+class KpiProfile:
+    """everything learnt about one KPI from its DIM and INT arrays"""
+
+    def __init__(self):
+        self.rows = 0
+        self.dimensions: dict[str, DimensionProfile] = {}
+        #indicator name -> [min, max]
+        self.indicators: dict[str, list[float]] = {}
+
+    def add_row(self, dims: Iterable[dict[str, Any]], ints: Iterable[dict[str, Any]]) -> None:
+        self.rows += 1
+        for dim in dims or []:
+            if dim.get('NAME') is None or dim.get('VALUE') is None:
+                continue
+            profile = self.dimensions.get(dim['NAME'])
+            if profile is None:
+                profile = self.dimensions[dim['NAME']] = DimensionProfile()
+            profile.add(str(dim['VALUE']))
+        for indicator in ints or []:
+            if indicator.get('NAME') is None or indicator.get('VALUE') is None:
+                continue
+            self._observe(indicator['NAME'], indicator['VALUE'], indicator['VALUE'])
+
+    def _observe(self, name: str, low: float, high: float) -> None:
+        bounds = self.indicators.get(name)
+        if bounds is None:
+            self.indicators[name] = [low, high]
+        else:
+            bounds[0] = min(bounds[0], low)
+            bounds[1] = max(bounds[1], high)
+
+    def merge(self, other: 'KpiProfile') -> None:
+        self.rows += other.rows
+        for name, profile in other.dimensions.items():
+            if name in self.dimensions:
+                self.dimensions[name].merge(profile)
+            else:
+                self.dimensions[name] = DimensionProfile(
+                    HyperLogLog(profile.hll.precision, bytearray(profile.hll.registers)),
+                    SpaceSaving(profile.top.capacity, profile.top.counts),
+                )
+        for name, (low, high) in other.indicators.items():
+            self._observe(name, low, high)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'dimensions': {name: profile.to_dict() for name, profile in self.dimensions.items()},
+            'indicators': self.indicators,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'KpiProfile':
+        profile = cls()
+        profile.rows = data['rows']
+        profile.dimensions = {name: DimensionProfile.from_dict(d) for name, d in data['dimensions'].items()}
+        profile.indicators = {name: list(bounds) for name, bounds in data['indicators'].items()}
+        return profile
+
+
+# ---- sketch store ----
+
+def empty_sketches() -> dict[str, Any]:
+    return {'version': SKETCHES_VERSION, 'settled_through': None, 'latest_date': None, 'base': {}, 'partitions': {}}
+
+
+def load_sketches(path: str) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return empty_sketches()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        stored = json.load(f)
+    if stored.get('version') != SKETCHES_VERSION:
+        logger.warning(f"Ignoring sketches in {path} from version {stored.get('version')}, rebuilding")
+        return empty_sketches()
+    return {
+        'version': SKETCHES_VERSION,
+        'settled_through': stored['settled_through'],
+        'latest_date': stored['latest_date'],
+        'base': {kpi_id: KpiProfile.from_dict(p) for kpi_id, p in stored['base'].items()},
+        #unsettled partitions are rescanned on every refresh, so they are never stored
+        'partitions': {},
+    }
+
+
+def save_sketches(sketches: dict[str, Any], path: str) -> None:
+    stored = {
+        'version': SKETCHES_VERSION,
+        'settled_through': sketches['settled_through'],
+        'latest_date': sketches['latest_date'],
+        'base': {kpi_id: p.to_dict() for kpi_id, p in sketches['base'].items()},
+    }
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(stored, f)
+    os.replace(tmp_path, path)
+
+
+def profile_rows(rows: Iterable[dict[str, Any]], sketches: dict[str, Any], cutoff: Optional[date]) -> int:
+    """fold scanned rows into the settled base (KPI_DATE <= cutoff) or their own partition"""
+    n_rows = 0
+    for row in rows:
+        kpi_id = str(row['KPI_ID'])
+        day = row['KPI_DATE']
+        if cutoff is not None and day <= cutoff:
+            target = sketches['base']
+        else:
+            target = sketches['partitions'].setdefault(day.isoformat(), {})
+        profile = target.get(kpi_id)
+        if profile is None:
+            profile = target[kpi_id] = KpiProfile()
+        profile.add_row(row['DIM'], row['INT'])
+        n_rows += 1
+    return n_rows
+
+
+# ---- BigQuery ----
+
+def latest_kpi_date(client) -> Optional[date]:
+    rows = list(client.query(f"SELECT MAX(KPI_DATE) AS LATEST FROM `{DATA_TABLE_ID}`").result())
+    return rows[0]['LATEST'] if rows else None
+
+
+def scan_data(client, after: Optional[date]) -> Iterable[dict[str, Any]]:
+    """one pass over every KPI's DIM and INT arrays in partitions after `after`"""
+    from google.cloud import bigquery
+
+    query = f"SELECT KPI_ID, KPI_DATE, DIM, INT FROM `{DATA_TABLE_ID}`"
+    params = []
+    if after is not None:
+        #partition filter, so only the new partitions are billed
+        query += " WHERE KPI_DATE > @after"
+        params.append(bigquery.ScalarQueryParameter('after', 'DATE', after))
+    job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params))
+    for row in job.result(page_size=50000):
+        yield row
+
+
+def load_defs(client) -> dict[str, dict[str, Any]]:
+    query = f"SELECT KPI_ID, KPI_NAME, KPI_DESCRIPTION, DIM, INT, FLOAT FROM `{DEFS_TABLE_ID}` ORDER BY KPI_ID"
+    return {str(row['KPI_ID']): dict(row.items()) for row in client.query(query).result()}
+
+
+# ---- schema context ----
+
+def _indicators(definitions: list[dict[str, Any]], prefix: str, observed: dict[str, list[float]]) -> list[dict[str, Any]]:
+    indicators = []
+    for position, indicator in enumerate(definitions or [], start=1):
+        entry = {
+            'name': indicator.get('NAME'),
+            'aggregation': indicator.get('AGG') or 'SUM',
+            'physical_column': f"{prefix}{position:02d}",
+        }
+        if indicator.get('NAME') in observed:
+            entry['observed_min'], entry['observed_max'] = observed[indicator['NAME']]
+        indicators.append(entry)
+    return indicators
+
+
+def build_schema_context(defs: dict[str, dict[str, Any]], sketches: dict[str, Any],
+                         sample_size: int = SCHEMA_SAMPLE_VALUES) -> dict[str, Any]:
+    """schema_context.json content: defs merged with what the sketches learnt from the data"""
+    kpis = {}
+    for kpi_id in sorted(set(defs) | set(sketches['base']) | {k for p in sketches['partitions'].values() for k in p}):
+        profile = KpiProfile()
+        if kpi_id in sketches['base']:
+            profile.merge(sketches['base'][kpi_id])
+        for partition in sketches['partitions'].values():
+            if kpi_id in partition:
+                profile.merge(partition[kpi_id])
+
+        definition = defs.get(kpi_id, {})
+        dimension_names = [d.get('NAME') for d in definition.get('DIM') or []]
+        #dimensions only seen in the data are appended after the defined ones
+        dimension_names += sorted(set(profile.dimensions) - set(dimension_names))
+
+        dimensions = {}
+        for position, name in enumerate(dimension_names, start=1):
+            dimension = profile.dimensions.get(name)
+            top_values = [value for value, _ in dimension.top.top(sample_size)] if dimension else []
+            dimensions[name] = {
+                'physical_column': f"DIM{position}" if position <= len(definition.get('DIM') or []) else None,
+                'distinct_values_sample': sorted(top_values),
+                'distinct_count': dimension.distinct_count() if dimension else 0,
+            }
+
+        kpis[kpi_id] = {
+            'kpi_id': int(kpi_id) if kpi_id.isdigit() else kpi_id,
+            'kpi_name': definition.get('KPI_NAME') or '',
+            'kpi_description': definition.get('KPI_DESCRIPTION') or '',
+            'dimensions': dimensions,
+            'indicators_int': _indicators(definition.get('INT'), 'INT', profile.indicators),
+            'indicators_float': _indicators(definition.get('FLOAT'), 'FLOAT', {}),
+            'row_count': profile.rows,
+        }
+
+    return {
+        'kpis': kpis,
+        'build': {
+            'built_at': datetime.now().isoformat(timespec='seconds'),
+            'data_through': sketches['latest_date'],
+            'settled_through': sketches['settled_through'],
+            'distinct_counts': 'exact below the top-k capacity, HyperLogLog estimates above it',
+        },
+    }
+
+
+def refresh(client, sketches: dict[str, Any], mutable_days: int) -> dict[str, Any]:
+    """scan the partitions after the settled ones and move partitions older than mutable_days into the base"""
+    latest = latest_kpi_date(client)
+    if latest is None:
+        logger.warning(f"{DATA_TABLE_ID} has no rows")
+        return sketches
+
+    settled = date.fromisoformat(sketches['settled_through']) if sketches['settled_through'] else None
+    cutoff = latest - timedelta(days=mutable_days)
+    if settled is not None and cutoff < settled:
+        cutoff = settled
+
+    #every unsettled partition is rescanned, restated or not
+    sketches['partitions'] = {}
+    started = time.perf_counter()
+    n_rows = profile_rows(scan_data(client, settled), sketches, cutoff)
+    logger.info(f"Scanned {n_rows} rows after {settled or 'the first partition'} "
+                f"in {time.perf_counter() - started:.1f}s, settled through {cutoff}")
+
+    sketches['settled_through'] = cutoff.isoformat()
+    sketches['latest_date'] = latest.isoformat()
+    return sketches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Regenerate schema_context.json from the KPI data and defs tables.")
+    parser.add_argument('--out', default=SCHEMA_CONTEXT_PATH, help='Schema context to write')
+    parser.add_argument('--sketches', default=SCHEMA_SKETCHES_PATH, help='Sketch store kept between refreshes')
+    parser.add_argument('--full', action='store_true', help='Ignore stored sketches and rescan every partition')
+    parser.add_argument('--mutable-days', type=int, default=SCHEMA_MUTABLE_DAYS,
+                        help='Trailing KPI_DATE partitions rescanned on every refresh')
+    parser.add_argument('--sample-size', type=int, default=SCHEMA_SAMPLE_VALUES, help='Values kept per dimension')
+    args = parser.parse_args()
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client(location=BIGQUERY_LOCATION)
+    sketches = empty_sketches() if args.full else load_sketches(args.sketches)
+
+    sketches = refresh(client, sketches, args.mutable_days)
+    save_sketches(sketches, args.sketches)
+
+    schema_context = build_schema_context(load_defs(client), sketches, args.sample_size)
+    tmp_path = f"{args.out}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(schema_context, f, indent=2, default=str)
+    os.replace(tmp_path, args.out)
+    print(f"Wrote {len(schema_context['kpis'])} KPIs to {args.out}, data through {sketches['latest_date']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,15 @@ from typing import Dict, Any
 from google.adk.tools.tool_context import ToolContext
 from constants import *
 from pydantic_models import StarterAgentResponse
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from utils.history import build_turn_digest, compact_contents, estimate_tokens, strip_sql_rows
+from utils.tracing import get_tracer, traced
+from utils.backends import get_backend, is_offline
+from utils.kpi_index import get_kpi_index, format_resolution
+from utils.rollup_cube import CubeMiss, get_rollup_cube
+from utils.sql_guard import describe_rewrites, guard_query
+from utils.result_store import get_result_store, result_state
 import base64
 import re
 import io
@@ -14,6 +23,7 @@ import json
 
 logger = get_logger(__name__)
 
+@traced(kind='callback')
 def sql_refiner_agent_callback(callback_context: CallbackContext) -> Optional[types.Content]:
 
   agent_name = callback_context.agent_name
@@ -27,6 +37,7 @@ def sql_refiner_agent_callback(callback_context: CallbackContext) -> Optional[ty
 
   return None # Return None to allow the LlmAgent's normal execution
 
+@traced(kind='callback')
 def python_refiner_agent_callback(callback_context: CallbackContext) -> Optional[types.Content]:
 
   agent_name = callback_context.agent_name
@@ -39,6 +50,7 @@ def python_refiner_agent_callback(callback_context: CallbackContext) -> Optional
         )
   return None # Return None to allow the LlmAgent's normal execution
 
+@traced(kind='callback')
 def store_results_in_context(callback_context: CallbackContext) -> None:
   """save JSON output into state"""
 
@@ -57,6 +69,7 @@ def store_results_in_context(callback_context: CallbackContext) -> None:
   callback_context.state['sql_required'] = True if callback_context.state['python_required'] else parsed_response.sql_required
 
 
+@traced(kind='callback')
 def get_sequence_outcome(callback_context: CallbackContext) -> None:
   """get the sequence outcome of SQL/Python Agent"""
   
@@ -78,6 +91,7 @@ def get_sequence_outcome(callback_context: CallbackContext) -> None:
   return None
 
 
+@traced(kind='callback')
 async def store_image_artifact(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict) -> None:
     try:
         # The response contains a Markdown image tag — extract base64 string
@@ -87,7 +101,8 @@ async def store_image_artifact(tool: BaseTool, args: Dict[str, Any], tool_contex
             raise ValueError("No valid base64 image string found in response")
 
         image_base64 = match.group(1)
-        image_bytes = base64.b64decode(image_base64)
+        with get_tracer().span('decode_image', 'image', base64_length=len(image_base64)):
+            image_bytes = base64.b64decode(image_base64)
 
         filename = "image.png"
         image_artifact = types.Part.from_bytes(
@@ -104,5 +119,281 @@ async def store_image_artifact(tool: BaseTool, args: Dict[str, Any], tool_contex
     except Exception as e:
         logger.error(f"Error saving image artifact: {e}")
 
-  
 
+@traced(kind='callback')
+def store_turn_digest(callback_context: CallbackContext) -> None:
+  """fold the previous turn's outcome into the conversation digest before a new turn starts"""
+
+  user_content = callback_context.user_content
+  question = ''.join(part.text for part in (user_content.parts if user_content else []) or [] if part.text)
+  previous_question = callback_context.state.get('latest_user_query')
+
+  #the starter agent runs first on every turn, so state still holds the previous turn here
+  if previous_question and previous_question != question:
+    digests = list(callback_context.state.get('conversation_digest', []))
+    digests.append(build_turn_digest(callback_context.state, previous_question))
+    callback_context.state['conversation_digest'] = digests[-HISTORY_MAX_SUMMARY_TURNS:]
+
+  callback_context.state['latest_user_query'] = question
+  return None
+
+
+@traced(kind='callback')
+def resolve_kpi_filters(callback_context: CallbackContext) -> None:
+  """resolve KPI names and dimension values named in the question locally, before the SQL writer runs"""
+
+  user_content = callback_context.user_content
+  question = ''.join(part.text for part in (user_content.parts if user_content else []) or [] if part.text)
+
+  try:
+    resolution = get_kpi_index().resolve(question)
+  except Exception as e:
+    #the SQL writer can still work from the schema context alone
+    logger.error(f"Error resolving KPI filters: {e}")
+    return None
+
+  #a multi-KPI sub-query only filters on its own KPI
+  sub_query_kpi = callback_context.state.get('sub_query_kpi')
+  if sub_query_kpi:
+    resolution['kpis'] = [sub_query_kpi]
+    resolution['filters'] = [
+      {**resolved, 'matches': [m for m in resolved['matches'] if m['kpi_id'] == sub_query_kpi['kpi_id']]}
+      for resolved in resolution['filters']
+    ]
+    resolution['filters'] = [resolved for resolved in resolution['filters'] if resolved['matches']]
+
+  callback_context.state['resolved_kpis'] = resolution['kpis']
+  callback_context.state['resolved_filters'] = resolution['filters']
+  callback_context.state['resolved_filters_prompt'] = format_resolution(resolution)
+
+  span = get_tracer().current_span()
+  if span is not None:
+    span.set_attribute('resolved_filters', len(resolution['filters']))
+    span.set_attribute('resolve_ms', resolution['elapsed_ms'])
+  return None
+
+
+@traced(kind='callback')
+def answer_from_rollup_cube(callback_context: CallbackContext) -> Optional[types.Content]:
+  """answer 'KPI by dimension over a date range' questions from the rollup cube, skipping the SQL agents"""
+
+  try:
+    cube = get_rollup_cube()
+  except Exception as e:
+    logger.error(f"Error loading rollup cube: {e}")
+    return None
+  if cube is None:
+    return None
+
+  user_content = callback_context.user_content
+  question = ''.join(part.text for part in (user_content.parts if user_content else []) or [] if part.text)
+  resolution = {
+    'kpis': callback_context.state.get('resolved_kpis') or [],
+    'filters': callback_context.state.get('resolved_filters') or [],
+  }
+
+  span = get_tracer().current_span()
+  try:
+    answer = cube.answer(question, resolution)
+  except CubeMiss as e:
+    if span is not None:
+      span.set_attribute('cube_miss', str(e))
+    return None
+  except Exception as e:
+    logger.error(f"Error answering from rollup cube: {e}")
+    return None
+
+  filters = '; '.join(f"{dimension} in {', '.join(values)}" for dimension, values in answer['filters'].items())
+  reasoning = (
+    f"**Insights**: {answer['kpi_name']} from {answer['start']} to {answer['end']}"
+    f"{' by ' + answer['dimension'] if answer['dimension'] else ''}"
+    f"{', ' + answer['grain'] + ' by ' + answer['grain'] if answer['grain'] else ''}"
+    f"{' where ' + filters if filters else ''}: {len(answer['rows'])} rows from the precomputed rollup cube "
+    f"(data through {cube.meta['latest_date']}).\n"
+    f"**Recommendations**: Break the KPI down by another dimension or narrow the date range for more detail."
+  )
+
+  #the same state a successful SQL writer and critic would leave
+  callback_context.state['latest_sql_output'] = answer['sql']
+  callback_context.state.update(result_state(answer['rows']))
+  callback_context.state['latest_sql_downsampling'] = None
+  callback_context.state['latest_sql_downsampling_note'] = ''
+  callback_context.state['latest_bq_execution_status'] = 'SUCCESS'
+  callback_context.state['latest_sql_criticism'] = OUTCOME_OK_PHRASE
+  callback_context.state['latest_sql_sequence_outcome'] = 'SUCCESS'
+  callback_context.state['latest_sql_output_reasoning'] = reasoning
+
+  logger.info(f"Answered from the rollup cube in {answer['elapsed_ms']:.1f} ms: {len(answer['rows'])} rows")
+  if span is not None:
+    span.set_attribute('cube_hit', True)
+    span.set_attribute('cube_rows', len(answer['rows']))
+    span.set_attribute('cube_ms', answer['elapsed_ms'])
+  return types.Content(role='model', parts=[types.Part(text=reasoning)])
+
+
+@traced(kind='callback')
+async def compact_conversation_history(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+  """keep the last turns verbatim and fold older ones into a structured summary"""
+
+  before_tokens = estimate_tokens(llm_request.contents)
+  summaries = dict(callback_context.state.get('conversation_summaries', {}))
+
+  compacted, folded_turns = await compact_contents(
+    llm_request.contents,
+    callback_context.state.get('conversation_digest', []),
+    summaries
+  )
+  llm_request.contents = compacted
+
+  if summaries != callback_context.state.get('conversation_summaries', {}):
+    callback_context.state['conversation_summaries'] = summaries
+
+  #record prompt size before/after compaction per agent
+  stats = dict(callback_context.state.get('history_compaction', {}))
+  stats[callback_context.agent_name] = {
+    'before_tokens': before_tokens,
+    'after_tokens': estimate_tokens(compacted),
+    'folded_turns': folded_turns,
+  }
+  callback_context.state['history_compaction'] = stats
+
+  return None # continue with the (compacted) model request
+
+
+def encode_sql_result_for_python(callback_context: CallbackContext) -> Optional[types.Content]:
+  """put a compact encoding of the latest SQL result (column summaries, rows or a sample) in state for the Python instructions"""
+  encoded = get_result_store().to_prompt(callback_context.state.get('latest_sql_result'))
+  callback_context.state['latest_sql_result_prompt'] = encoded or 'No SQL result is available.'
+  return None
+
+
+def attach_sql_result(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+  """send the latest SQL result to the code executor as a CSV file, and drop raw rows from the contents"""
+  removed = strip_sql_rows(llm_request.contents)
+  csv = get_result_store().to_csv(callback_context.state.get('latest_sql_result'))
+  user_contents = [content for content in llm_request.contents if content.role == 'user']
+  if csv and user_contents:
+    user_contents[-1].parts.append(types.Part.from_bytes(data=csv.encode('utf-8'), mime_type='text/csv'))
+
+  get_tracer().annotate_pending(
+    ('model', callback_context.invocation_id, callback_context.agent_name),
+    sql_rows_chars_removed=removed,
+    sql_result_csv_bytes=len(csv) if csv else 0
+  )
+  return None
+
+
+def trace_model_call_start(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+  """open a model call span, paired with trace_model_call_end"""
+  get_tracer().start_pending(
+    ('model', callback_context.invocation_id, callback_context.agent_name),
+    f"model:{callback_context.agent_name}",
+    'model',
+    model=llm_request.model
+  )
+  return None
+
+
+def trace_model_call_end(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+  """close the model call span opened by trace_model_call_start"""
+  usage = llm_response.usage_metadata
+  get_tracer().end_pending(
+    ('model', callback_context.invocation_id, callback_context.agent_name),
+    'ERROR' if llm_response.error_code else 'OK',
+    prompt_token_count=usage.prompt_token_count if usage else None,
+    candidates_token_count=usage.candidates_token_count if usage else None
+  )
+  return None
+
+
+def trace_tool_call_start(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict]:
+  """open a tool call span, paired with trace_tool_call_end"""
+  get_tracer().start_pending(('tool', tool_context.function_call_id), f"tool:{tool.name}", 'tool')
+  return None
+
+
+def trace_tool_call_end(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict) -> Optional[Dict]:
+  """close the tool call span opened by trace_tool_call_start"""
+  status = tool_response.get('status', 'OK') if isinstance(tool_response, dict) else 'OK'
+  get_tracer().end_pending(('tool', tool_context.function_call_id), status)
+  return None
+
+
+async def serve_model_from_backend(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+  """let an installed backend (e.g. a replay cassette) answer instead of Gemini"""
+  backend = get_backend()
+  if backend is None:
+    return None
+
+  call_key = ('model', callback_context.invocation_id, callback_context.agent_name)
+  response = await backend.serve_model(callback_context.agent_name, llm_request, call_key)
+  if response is not None:
+    #after_model callbacks are skipped for served responses, so close the model span here
+    get_tracer().end_pending(call_key, served_by=type(backend).__name__)
+  return response
+
+
+def observe_model_response(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+  """hand a live Gemini response to the installed backend (e.g. to record it)"""
+  backend = get_backend()
+  if backend is not None:
+    backend.observe_model(('model', callback_context.invocation_id, callback_context.agent_name), llm_response)
+  return None
+
+
+async def guard_sql_query(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict]:
+  """rewrite the SQL writer's query for partition pruning, and reject it when the dry run is over the bytes budget"""
+  if tool.name != 'execute_sql' or args.get('dry_run') or not SQL_GUARD_ENABLED:
+    return None
+
+  record = await guard_query(args.get('query') or '', args.get('project_id'), dry_run=not is_offline('tools'))
+  if record['rewrites']:
+    #the rewritten query is what runs, so downstream agents and the UI see that one
+    args['query'] = record['query']
+    tool_context.state['latest_sql_output'] = record['query']
+  tool_context.state['latest_sql_guard'] = {
+    **{key: value for key, value in record.items() if key != 'query'},
+    'function_call_id': tool_context.function_call_id,
+  }
+  tool_context.state['latest_sql_guard_note'] = describe_rewrites(record['rewrites'])
+
+  totals = dict(tool_context.state.get('app:sql_guard_totals') or {'rewritten': 0, 'rejected': 0, 'bytes_saved': 0})
+  totals['rewritten'] += bool(record['rewrites'])
+  totals['rejected'] += bool(record['rejected'])
+  totals['bytes_saved'] += record['bytes_saved'] or 0
+  tool_context.state['app:sql_guard_totals'] = totals
+
+  get_tracer().annotate_pending(
+    ('tool', tool_context.function_call_id),
+    sql_rewrites=len(record['rewrites']),
+    bytes_estimate=record['bytes_processed'],
+    bytes_saved=record['bytes_saved'],
+  )
+  if record['rejected']:
+    logger.warning(f"SQL guard rejected query: {record['rejected']}")
+    return {'status': 'ERROR', 'error_details': record['rejected']}
+  return None
+
+
+def note_sql_guard_rewrites(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict) -> Optional[Dict]:
+  """tell the SQL agent in the tool response how the guard rewrote the query it asked for"""
+  guard = tool_context.state.get('latest_sql_guard') or {}
+  if tool.name != 'execute_sql' or not guard.get('rewrites') or guard.get('function_call_id') != tool_context.function_call_id:
+    return None
+  return {**tool_response, 'sql_guard_note': tool_context.state.get('latest_sql_guard_note')}
+
+
+async def serve_tool_from_backend(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict]:
+  """let an installed backend answer a tool call instead of BigQuery"""
+  backend = get_backend()
+  if backend is None:
+    return None
+  return await backend.serve_tool(tool.name, args, ('tool', tool_context.function_call_id))
+
+
+def observe_tool_response(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict) -> Optional[Dict]:
+  """hand a live tool response to the installed backend (e.g. to record it)"""
+  backend = get_backend()
+  if backend is not None:
+    backend.observe_tool(('tool', tool_context.function_call_id), tool_response)
+  return None
@@ -1,6 +1,10 @@
+import os
+
 #GENERAL
 APP_NAME = 'agents'
 USER_ID = 'default_user'
+#agent call responses kept for the UI's event log, oldest dropped first
+EVENT_LOG_MAX_ENTRIES = 50
 
 #MODELS
 STARTER_AGENT_MODEL = 'gemini-2.5-flash-lite'
@@ -10,6 +14,7 @@ SQL_REFINER_AGENT_MODEL = 'gemini-2.5-flash-lite'
 PYTHON_WRITER_AGENT_MODEL = 'gemini-2.5-flash-lite'
 PYTHON_CRITIC_AGENT_MODEL = 'gemini-2.5-flash-lite'
 PYTHON_REFINER_AGENT_MODEL = 'gemini-2.5-flash-lite'
+CHART_SPEC_AGENT_MODEL = 'gemini-2.5-flash-lite'
 
 #AGENT CALLBACK PHRASE
 OUTCOME_OK_PHRASE = "OUTCOME OK"
@@ -22,6 +27,17 @@ DEFS_SCHEMA_PATH = 'v5//defs_table_v5.json'
 
 #SCHEMA CONTEXT
 SCHEMA_CONTEXT_PATH = 'schema_context.json'
+#built offline by build_schema_context.py from these tables
+DATA_TABLE_ID = 'uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DATA_TEST_V5'
+DEFS_TABLE_ID = 'uk-dta-gsmanalytics-poc.metricmind.GSM_KPI_DEFS_TEST_V5'
+BIGQUERY_LOCATION = 'EU'
+#per-KPI sketches kept between builds so a refresh only scans new KPI_DATE partitions
+SCHEMA_SKETCHES_PATH = 'schema_sketches.json.gz'
+#partitions this close to the latest KPI_DATE may still be restated, so every refresh rescans them
+SCHEMA_MUTABLE_DAYS = 7
+SCHEMA_SAMPLE_VALUES = 20
+SCHEMA_HLL_PRECISION = 11
+SCHEMA_TOP_K_CAPACITY = 200
 
 #GLOBAL INSTRUCTIONS
 GLOBAL_INSTRUCTION = "You are part of a Data Analytics Conversational Analytics Architecture."
@@ -29,7 +45,163 @@ GLOBAL_INSTRUCTION = "You are part of a Data Analytics Conversational Analytics
 #MAX_RETRIES
 MAX_RETRIES = 3
 
+#HISTORY COMPACTION
+#number of most recent turns passed verbatim to include_contents='default' agents
+HISTORY_KEEP_TURNS = 2
+#older turns beyond this many are dropped from the folded summary entirely
+HISTORY_MAX_SUMMARY_TURNS = 10
+#cheap model used only when a folded turn cannot be summarised from state
+HISTORY_SUMMARY_MODEL = 'gemini-2.5-flash-lite'
+HISTORY_SUMMARY_MODEL_ENABLED = True
+HISTORY_SUMMARY_MAX_CHARS = 600
+#rough chars-per-token ratio used for prompt size estimates
+CHARS_PER_TOKEN = 4
+
+#TRACING
+#set METRIC_MIND_TRACING=false to turn span collection off
+TRACING_ENABLED = os.getenv('METRIC_MIND_TRACING', 'true').lower() == 'true'
+TRACES_DIR = 'traces'
+TRACES_KEPT_IN_MEMORY = 50
+
+#METERING
+#USD per 1M tokens -- https://ai.google.dev/gemini-api/docs/pricing
+MODEL_PRICING = {
+    'gemini-2.5-flash-lite': {'input': 0.10, 'cached_input': 0.025, 'output': 0.40},
+    'gemini-2.5-flash': {'input': 0.30, 'cached_input': 0.075, 'output': 2.50},
+    'gemini-2.5-pro': {'input': 1.25, 'cached_input': 0.31, 'output': 10.00},
+}
+#stop critic/refiner loops once a turn has used more tokens than this (None = no budget)
+TURN_TOKEN_BUDGET = None
+
+#RECORD/REPLAY CASSETTES
+#off: live calls, record: capture Gemini/execute_sql responses, replay: serve them offline
+CASSETTE_MODE = os.getenv('METRIC_MIND_CASSETTE_MODE', 'off').lower()
+CASSETTE_PATH = os.getenv('METRIC_MIND_CASSETTE', 'cassettes/default.jsonl.gz')
+#none | recorded | scale:<factor> | fixed:<ms> | lognormal:<median_ms>,<sigma>
+CASSETTE_LATENCY = os.getenv('METRIC_MIND_CASSETTE_LATENCY', 'recorded')
+CASSETTE_SEED = 1
+#raise on replay misses instead of falling through to the live backend
+CASSETTE_STRICT = True
+
+#PROFILING
+#off | deterministic (cProfile) | sampling (stack sampler, flamegraph-ready)
+PROFILE_MODE = os.getenv('METRIC_MIND_PROFILE', 'off').lower()
+#fraction of turns profiled when PROFILE_MODE is on; sessions/turns can also be switched on at runtime
+PROFILE_SAMPLE_RATE = float(os.getenv('METRIC_MIND_PROFILE_SAMPLE_RATE', '0'))
+#also diff tracemalloc snapshots around profiled turns
+PROFILE_TRACEMALLOC = os.getenv('METRIC_MIND_PROFILE_TRACEMALLOC', 'false').lower() == 'true'
+PROFILE_SAMPLING_INTERVAL_MS = 5
+PROFILES_DIR = os.path.join('logs', 'profiles')
+PROFILES_KEPT_IN_MEMORY = 50
+
+#LOGGING
+LOG_LEVEL = os.getenv('METRIC_MIND_LOG_LEVEL', 'INFO').upper()
+#records waiting for the background writer; beyond this INFO/DEBUG records are dropped
+LOG_QUEUE_SIZE = 10000
+#longer messages and non-string payloads are logged as a preview plus a reference to the full payload
+LOG_MAX_MESSAGE_CHARS = 2000
+#log files roll over daily and whenever they reach this size
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 20
+#stored payloads longer than this keep only their head; payload files roll over at LOG_MAX_BYTES too
+LOG_MAX_PAYLOAD_CHARS = 1024 * 1024
+
+#KPI VALUE INDEX
+#dimension values are resolved locally from these files before the SQL writer runs
+KPI_INDEX_SOURCES = [SCHEMA_CONTEXT_PATH, DATA_SCHEMA_PATH]
+#minimum trigram similarity for a misspelt word to be corrected to a known value word
+KPI_INDEX_FUZZY_THRESHOLD = 0.5
+#(KPI_ID, dimension, value) tuples kept per matched phrase
+KPI_INDEX_MAX_MATCHES_PER_PHRASE = 10
+
+#LOCAL MIRROR
+#parquet copy of the KPI data table, kept in sync by sync_local_mirror.py; execute_sql is
+#answered from it when enabled and the query is one local_sql can run, otherwise BigQuery
+LOCAL_MIRROR_ENABLED = os.getenv('METRIC_MIND_LOCAL_MIRROR', 'false').lower() == 'true'
+LOCAL_MIRROR_DIR = os.getenv('METRIC_MIND_LOCAL_MIRROR_DIR', 'mirror')
+#older mirrors are bypassed until the next sync
+LOCAL_MIRROR_MAX_AGE_HOURS = 26
+#KPIs whose rows stay loaded in memory between queries
+LOCAL_MIRROR_CACHED_KPIS = 32
+#same cap as the BigQuery toolset's max_query_result_rows
+LOCAL_MIRROR_MAX_ROWS = 500
+
+#ROLLUP CUBE
+#per KPI x dimension x day/week/month aggregates built by build_rollup_cube.py; questions
+#they answer skip the SQL agents. A missing file disables the fast path
+ROLLUP_CUBE_PATH = os.getenv('METRIC_MIND_ROLLUP_CUBE', 'rollup_cube.npz')
+#older cubes are bypassed until the next build
+ROLLUP_CUBE_MAX_AGE_HOURS = 26
+#larger answers are left to the SQL agents, as execute_sql would truncate them
+ROLLUP_CUBE_MAX_ROWS = 500
+
+#RESULT CACHE
+#time-series execute_sql results kept by query and KPI_DATE coverage; a repeated query only
+#reads the partitions the stored result lacks or that may have been restated since
+RESULT_CACHE_ENABLED = os.getenv('METRIC_MIND_RESULT_CACHE', 'true').lower() == 'true'
+RESULT_CACHE_DIR = os.getenv('METRIC_MIND_RESULT_CACHE_DIR', 'result_cache')
+RESULT_CACHE_MAX_ENTRIES = 500
+#same cap as the BigQuery toolset's max_query_result_rows; larger results are not cached
+RESULT_CACHE_MAX_ROWS = 500
+
+#SQL GUARD
+#rewrites execute_sql queries before they reach BigQuery: a KPI_DATE window when the query
+#has none, unused arrays dropped from SELECT *, a LIMIT on row dumps, and a dry-run bytes budget
+SQL_GUARD_ENABLED = os.getenv('METRIC_MIND_SQL_GUARD', 'true').lower() == 'true'
+#trailing days read by queries that name no KPI_DATE range
+SQL_GUARD_DEFAULT_DAYS = 90
+#rows returned by exploratory dumps: no aggregation, and SELECT * or no KPI_ID filter
+SQL_GUARD_EXPLORATORY_LIMIT = 100
+#queries estimated to process more are rejected back to the SQL writer
+SQL_GUARD_MAX_BYTES = int(os.getenv('METRIC_MIND_SQL_MAX_BYTES', str(10 * 1024 ** 3)))
+
+#BIGQUERY JOBS
+#execute_sql SELECTs run by our own executor, which keeps each job's statistics (bytes
+#processed and billed, slot time, cache hit, wall time); other statements go to the ADK tool
+BIGQUERY_EXECUTOR_ENABLED = os.getenv('METRIC_MIND_BIGQUERY_EXECUTOR', 'true').lower() == 'true'
+#same cap as the BigQuery toolset's max_query_result_rows
+BIGQUERY_MAX_RESULT_ROWS = 500
+#queries kept per KPI in the metering report of the most expensive ones
+BIGQUERY_WORST_QUERIES = 5
+#execute_sql jobs still running after this long are cancelled and reported as errors
+BIGQUERY_QUERY_DEADLINE_S = float(os.getenv('METRIC_MIND_BIGQUERY_DEADLINE_S', '120'))
+#job status polls start this often and back off to at most every BIGQUERY_POLL_MAX_S
+BIGQUERY_POLL_INITIAL_S = 0.2
+BIGQUERY_POLL_MAX_S = 2.0
+
+#MULTI-KPI SUB-QUERIES
+#questions naming several KPIs run one SQL sequence per KPI concurrently, merged on KPI_DATE
+MULTI_KPI_ENABLED = os.getenv('METRIC_MIND_MULTI_KPI', 'true').lower() == 'true'
+#questions naming more KPIs than this go through a single SQL sequence
+MULTI_KPI_MAX_SUB_QUERIES = 4
 
+#DOWNSAMPLING
+#execute_sql results over BIGQUERY_MAX_RESULT_ROWS are re-aggregated server side (from the job's
+#result table) to a coarser KPI_DATE grain, or top values plus 'Other', instead of being truncated.
+#Only results whose numeric columns are named after indicators with a known aggregation qualify
+DOWNSAMPLE_ENABLED = os.getenv('METRIC_MIND_DOWNSAMPLE', 'true').lower() == 'true'
+#coarser grains tried in order
+DOWNSAMPLE_GRAINS = ('ISOWEEK', 'MONTH', 'QUARTER', 'YEAR')
+#grain kept when the remaining rows come from a dimension with too many values
+DOWNSAMPLE_TOP_N_GRAIN = 'MONTH'
 
+#RESULT STORE
+#SQL results are converted once into Arrow tables kept in memory and referenced from state by handle
+#(latest_sql_result) until their session is released; this many of the most recent tables are kept per session
+RESULT_STORE_MAX_TABLES = 64
+#parquet exports of stored results
+RESULTS_DIR = os.path.join('logs', 'results')
+#tokens of a SQL result (column summaries plus rows or a sample of them) put in the Python agents'
+#instructions; the full result reaches their code executor as an attached CSV file
+PYTHON_PROMPT_DATA_TOKENS = 1500
 
+#RESULT PROFILE
+#missing date periods listed (after the count) in a SQL result's profile
+RESULT_PROFILE_MAX_GAPS = 5
 
+#CHART SPEC
+#charts are first requested as a declarative spec over the SQL result, validated locally and drawn
+#by the UI; the Python code-execution sequence only runs when the spec cannot express the chart
+CHART_SPEC_ENABLED = os.getenv('METRIC_MIND_CHART_SPEC', 'true').lower() == 'true'
+#series (distinct values of the series column) or pie slices beyond which a chart is rejected
+CHART_SPEC_MAX_SERIES = 12
@@ -79,6 +79,12 @@ PYTHON_CRITIC_AGENT_DYNAMIC_INSTRUCTION = f"""
   {{latest_python_code_execution_outcome?}}
   ```
 
+  **Profile of the Data Being Plotted**
+  Facts computed from the SQL result (ranges, nulls, date gaps, trends); check the chart against them.
+  ```text
+  {{latest_sql_profile_prompt?}}
+  ```
+
   ## Task
   Review the provided Python code for:
   1. **Logical correctness:** Does the code answer the user's question and create the intended visualization correctly?
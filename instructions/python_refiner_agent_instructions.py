@@ -51,6 +51,12 @@ PYTHON_REFINER_AGENT_DYNAMIC_INSTRUCTION = """
         {latest_python_code_criticism?}
         ```
 
+        **Data**
+        The SQL result is attached as a CSV file; load it with `pandas.read_csv` (find its name with `os.listdir('.')`).
+        ```text
+        {latest_sql_result_prompt?}
+        ```
+
         ## Task
         1. **Analyze the critique** and identify what needs fixing or improving.
         2. **Refine the code** so that:
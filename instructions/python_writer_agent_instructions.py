@@ -41,6 +41,20 @@ PYTHON_WRITER_AGENT_DYNAMIC_INSTRUCTION = """
    {latest_sql_output?}
    ```
 
+   ## Data
+   The query's result is attached as a CSV file. Load it with `pandas.read_csv` (find its name with
+   `os.listdir('.')`) and never copy values from this prompt into the code. Its columns and rows (or a sample of them):
+
+   ```text
+   {latest_sql_result_prompt?}
+   ```
+
+   Profile of the result (date coverage gaps and trends):
+
+   ```text
+   {latest_sql_profile_prompt?}
+   ```
+
    ### Execution Steps:
 
    1. **Analyze the Question**
@@ -117,6 +117,15 @@ SQL_CRITIC_AGENT_DYNAMIC_INSTRUCTION = f"""## Query Under Review
 ### Query Construction Reasoning
 {{latest_sql_output_reasoning?}}
 
+### Result Profile
+Computed locally from the rows the query returned: row count, nulls, ranges, date coverage gaps and trends.
+Use these facts to judge whether the result answers the question (e.g. empty or all-NULL columns, missing dates).
+{{latest_sql_profile_prompt?}}
+
+### Query Rewrites
+How the SQL guard changed the query before it ran, if at all. Check the result still answers the question within these limits.
+{{latest_sql_guard_note?}}
+
 ## Available Schema for Validation
 
 ### BigQuery Resources
@@ -145,6 +145,17 @@ SQL_REFINER_AGENT_DYNAMIC_INSTRUCTION = """## Query Refinement Context
 ### Critique and Suggestions
 {latest_sql_criticism?}
 
+### Query Rewrites
+How the SQL guard changed the current query before it ran, if at all:
+{latest_sql_guard_note?}
+
+### Row Limit
+How the current query's result was re-aggregated or truncated to fit the row limit, if at all:
+{latest_sql_downsampling_note?}
+
+### Resolved Filters
+{resolved_filters_prompt?}
+
 ## Your Task
 
 1. **Analyze** the critique and identify all issues mentioned
@@ -191,4 +191,14 @@ Reference the **data table** for metric values.
 - **Tables**: {tables}
 
 Use fully-qualified table references. Verify all tables and fields before executing queries.
+
+### Resolved Filters
+KPIs and dimension values from the user's question, matched against the known values.
+Use these exact KPI_IDs, dimension names and values in filters instead of guessing spellings:
+{resolved_filters_prompt?}
+
+### Row Limit
+Results over the row limit are re-aggregated to a coarser grain when every measure column is aliased with its
+indicator name (e.g. `AS Customer_Orders`), otherwise truncated. What happened to the last result, if anything:
+{latest_sql_downsampling_note?}
 """
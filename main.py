@@ -1,12 +1,18 @@
 import uuid
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Optional
 from google.adk.sessions import InMemorySessionService
-from utils.helper import json_to_dict
+from google.adk.artifacts import InMemoryArtifactService
 from constants import *
 from utils.logger import get_logger
-from utils.helper import save_img
-from sequences.sql_sequence import sql_agent_sequence
-from sequences.python_sequence import python_agent_sequence
-from sequences.starter_sequence import starter_agent_sequence
+from utils.backends import get_backend, set_backend, RateLimitedBackend
+from utils.rate_limit import TokenBucket
+from utils.result_store import get_result_store
+from sequences.turn_sequence import initial_session_state, run_turn
 import asyncio
 
 logger = get_logger(__name__)
@@ -25,76 +31,197 @@ async def main_async(user_query=None, session_id=None):
     session_service = InMemorySessionService()
 
     #Define Artifact Service
-    # artifact_service = InMemoryArtifactService()
-
-    #Define data schema to be passed as initial_state
-    initial_state = json_to_dict(DATA_SCHEMA_PATH)
-    initial_state_formatted = {
-      'projects': initial_state.get('project_id'),
-      'datasets': initial_state.get('dataset_id'),
-      'tables': initial_state.get('tables')
-    }
+    artifact_service = InMemoryArtifactService()
 
     #Create Session
     session = await session_service.create_session(
               app_name=app_name,
               user_id=user_id,
               session_id=session_id,
-              state=initial_state_formatted,
+              state=initial_session_state(),
           )
-    
+
     logger.info(f"Created new session: {session.id}")
 
-    #Call Starter Agent Sequence 
-    await starter_agent_sequence(app_name,user_id,session_service,session_id,user_query)
+    #Run Starter, SQL and Python sequences as one traced turn
+    session = await run_turn(app_name, user_id, session_service, artifact_service, session_id, user_query, save_image=True)
 
-    #decide if SQL sequence is required
-    if session.state.get('sql_required'):       
-      #Call SQL Sequence
-      await sql_agent_sequence(app_name,user_id,session_service,session_id,user_query)
+    print(f"SQL sequence: {session.state.get('latest_sql_sequence_outcome')}, "
+          f"Python sequence: {session.state.get('latest_python_sequence_outcome')}")
 
-      #update session
-      session = await session_service.get_session(
-        app_name=app_name,user_id=user_id,session_id=session_id
-      )
+    return session
 
-    if session.state.get('python_required'):
-      #if SQL sequence was successful, run Python sequence  
-      if session.state.get('latest_sql_criticism') == OUTCOME_OK_PHRASE and \
-        session.state.get('latest_bq_execution_status').upper() == 'SUCCESS':     
+  except Exception as e:
+    logger.error(f"Error in main_async: {e}")
 
-          #declare SQL sequence outcome successful
-          session.state['sql_sequence_outcome'] = 'SUCCESS'
 
-          #Call Python Sequence
-          await python_agent_sequence(app_name,user_id,session_service,session_id,user_query)
+def load_batch_questions(path: str) -> list[dict[str, Any]]:
+  """questions from a .jsonl file ({"id", "question"} per line) or a text file (one per line)"""
+  questions = []
+  with open(path, 'r', encoding='utf-8') as f:
+    for line_no, line in enumerate(f, start=1):
+      line = line.strip()
+      if not line:
+        continue
+      if path.endswith('.jsonl'):
+        record = json.loads(line)
+        questions.append({'id': str(record.get('id', line_no)), 'question': record['question']})
+      else:
+        questions.append({'id': str(line_no), 'question': line})
+
+  ids = [q['id'] for q in questions]
+  if len(ids) != len(set(ids)):
+    raise ValueError(f"Duplicate question ids in {path}")
+  return questions
+
+
+def load_completed_ids(out_path: str) -> set[str]:
+  """ids already answered successfully in an earlier run of the batch"""
+  completed = set()
+  if not os.path.exists(out_path):
+    return completed
+  with open(out_path, 'r', encoding='utf-8') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        #a run killed mid-write leaves a partial last line
+        continue
+      if record.get('status') == 'SUCCESS':
+        completed.add(record['id'])
+      else:
+        completed.discard(record['id'])
+  return completed
+
+
+def batch_result(question: dict[str, Any], state: dict[str, Any], wall_ms: float, max_rows: int) -> dict[str, Any]:
+  """one JSONL record for an answered question"""
+  handle = state.get('latest_sql_result')
+  rows = get_result_store().rows(handle)
+  #no handle is an empty result; a handle the store no longer has is a lost one, not an empty one
+  lost = handle is not None and rows is None
+  rows = rows or []
+  usage = (state.get('turn_token_usage') or {}).get('agents', {})
+
+  failed = (state.get('sql_required') and state.get('latest_sql_sequence_outcome') != 'SUCCESS') or \
+           (state.get('python_required') and state.get('latest_python_sequence_outcome') != 'SUCCESS')
+
+  record = {
+    'id': question['id'],
+    'question': question['question'],
+    'status': 'ERROR' if lost else 'FAILURE' if failed else 'SUCCESS',
+    'finished_at': datetime.now().isoformat(timespec='seconds'),
+    'wall_ms': wall_ms,
+    'greeting': state.get('greeting'),
+    'sql_outcome': state.get('latest_sql_sequence_outcome'),
+    'python_outcome': state.get('latest_python_sequence_outcome'),
+    'sql': state.get('latest_sql_output') if state.get('sql_required') else None,
+    'row_count': len(rows),
+    'rows': rows[:max_rows],
+    'rows_truncated': len(rows) > max_rows,
+    'total_token_count': sum(a.get('total_token_count', 0) for a in usage.values()),
+    'estimated_cost_usd': sum(a.get('cost_usd', 0.0) for a in usage.values()),
+  }
+  if lost:
+    record['error'] = f"SQL result {handle} is no longer in the result store"
+  return record
+
+
+async def run_batch(args: argparse.Namespace) -> dict[str, int]:
+  """answer every question in its own session with at most args.concurrency in flight"""
+  questions = load_batch_questions(args.batch)
+  completed = load_completed_ids(args.out) if args.resume else set()
+  pending = [q for q in questions if q['id'] not in completed]
+  logger.info(f"Batch: {len(questions)} questions, {len(completed)} already done, {len(pending)} to run")
+
+  #shared limiters sit in front of every model/BigQuery call of every session
+  if args.model_rpm or args.bq_qpm:
+    set_backend(RateLimitedBackend(
+      inner=get_backend(),
+      model_limiter=TokenBucket.per_minute(args.model_rpm) if args.model_rpm else None,
+      tool_limiter=TokenBucket.per_minute(args.bq_qpm) if args.bq_qpm else None,
+    ))
+
+  session_service = InMemorySessionService()
+  artifact_service = InMemoryArtifactService()
+  queue: asyncio.Queue = asyncio.Queue()
+  for question in pending:
+    queue.put_nowait(question)
+
+  counts = {'SUCCESS': 0, 'FAILURE': 0, 'ERROR': 0}
+  write_lock = asyncio.Lock()
+  out_file = open(args.out, 'a' if args.resume else 'w', encoding='utf-8')
+
+  async def write(record: dict[str, Any]) -> None:
+    async with write_lock:
+      out_file.write(json.dumps(record, default=str) + '\n')
+      out_file.flush()
+      counts[record['status']] += 1
+      done = sum(counts.values())
+      print(f"[{done}/{len(pending)}] {record['id']}: {record['status']}")
+
+  async def worker() -> None:
+    while True:
+      try:
+        question = queue.get_nowait()
+      except asyncio.QueueEmpty:
+        return
+
+      session_id = str(uuid.uuid4())
+      started = time.perf_counter()
+      try:
+        await session_service.create_session(
+          app_name=APP_NAME, user_id=USER_ID, session_id=session_id, state=initial_session_state()
+        )
+        session = await asyncio.wait_for(
+          run_turn(APP_NAME, USER_ID, session_service, artifact_service, session_id, question['question']),
+          timeout=args.timeout,
+        )
+        record = batch_result(question, session.state, (time.perf_counter() - started) * 1000, args.max_rows)
+      except Exception as e:
+        logger.error(f"Batch question {question['id']} failed: {e}", exc_info=True)
+        record = {
+          'id': question['id'],
+          'question': question['question'],
+          'status': 'ERROR',
+          'finished_at': datetime.now().isoformat(timespec='seconds'),
+          'wall_ms': (time.perf_counter() - started) * 1000,
+          'error': f"{type(e).__name__}: {e}",
+        }
+      finally:
+        #sessions are independent, free each one as soon as it is written
+        await session_service.delete_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+        get_result_store().release(session_id)
+
+      await write(record)
 
-          #update session
-          session = await session_service.get_session(
-            app_name=app_name,user_id=user_id,session_id=session_id
-          )
+  try:
+    await asyncio.gather(*(worker() for _ in range(min(args.concurrency, len(pending)) or 1)))
+  finally:
+    out_file.close()
+  return counts
 
-          #save image artifact from Python sequence
-          img_bytes = session.state.get('latest_img_bytes')
-          result = save_img(img_bytes)
 
-          print('Python Sequence completed successfully')
-          session.state['python_sequence_outcome'] = result
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Ask one question, or run a batch of questions in independent sessions.")
+  parser.add_argument('--query', default=None, help='Single question to answer')
+  parser.add_argument('--batch', default=None, help='Questions file: .jsonl with {"id", "question"} or one question per line')
+  parser.add_argument('--out', default='batch_results.jsonl', help='JSONL output, one record per question')
+  parser.add_argument('--concurrency', type=int, default=4, help='Questions in flight at once')
+  parser.add_argument('--model-rpm', type=float, default=None, help='Shared limit on Gemini calls per minute')
+  parser.add_argument('--bq-qpm', type=float, default=None, help='Shared limit on BigQuery queries per minute')
+  parser.add_argument('--timeout', type=float, default=600, help='Seconds before a question is abandoned')
+  parser.add_argument('--max-rows', type=int, default=1000, help='Rows kept per result record')
+  parser.add_argument('--resume', action='store_true', help='Skip questions already answered successfully in --out')
+  args = parser.parse_args()
 
-          # print('----- Final Outputs -----')
-          # print(session.state.get('latest_sql_output'),end='\n\n')
-          # print(session.state.get('latest_sql_response'),end='\n\n')
-          # print(session.state.get('latest_python_code_output'),end='\n\n')
-          # print(session.state.get('app:total_token_count'),end='\n\n')
+  if args.batch is None:
+    asyncio.run(main_async(args.query))
+    return
 
-      else:
-        print('SQL Sequence failed')
-        session.state['sql_sequence_outcome'] = 'FAILURE'
+  counts = asyncio.run(run_batch(args))
+  print(f"Batch finished: {counts}, results in {args.out}")
 
-      return session
-    
-  except Exception as e:
-    logger.error(f"Error in main_async: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
\ No newline at end of file
+    main()
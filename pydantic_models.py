@@ -1,4 +1,5 @@
 # models.py
+from typing import Literal, Optional
 from pydantic import BaseModel, Field
 
 class StarterAgentResponse(BaseModel):
@@ -15,4 +16,25 @@ class StarterAgentResponse(BaseModel):
     )
     python_required: bool = Field(
         description="True if the query requires writing and executing Python code for visualizations or data processing"
-    )
\ No newline at end of file
+    )
+
+class ChartSpec(BaseModel):
+    """Declarative chart over the latest SQL result, rendered natively by the UI."""
+
+    chart_type: Literal['line', 'bar', 'area', 'scatter', 'pie', 'unsupported'] = Field(
+        description="Mark to draw, or 'unsupported' when the chart cannot be expressed with these fields"
+    )
+    x: Optional[str] = Field(
+        default=None, description="Result column on the x axis (the category column for pie charts)"
+    )
+    y: Optional[str] = Field(
+        default=None, description="Numeric result column on the y axis (the slice size for pie charts)"
+    )
+    series: Optional[str] = Field(
+        default=None, description="Result column splitting the data into coloured series, if any"
+    )
+    aggregation: Literal['sum', 'mean', 'min', 'max', 'count', 'none'] = Field(
+        default='none', description="How y is aggregated over rows sharing the same x and series"
+    )
+    title: str = Field(description="Chart title")
+    reasoning: str = Field(description="One or two sentences on why this chart answers the question")
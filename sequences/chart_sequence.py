@@ -0,0 +1,72 @@
+import time
+from constants import *
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.artifacts import InMemoryArtifactService
+from agents.chart_spec_agent import chart_spec_agent
+from utils.agent_utils import call_agent_async
+from utils.chart_spec import validate_spec
+from utils.logger import get_logger
+from utils.result_store import get_result_store
+from utils.tracing import get_tracer, traced
+
+logger = get_logger(__name__)
+
+
+@traced(kind='sequence')
+async def chart_spec_sequence(
+    app_name: str,
+    user_id: str,
+    session_service: InMemorySessionService,
+    artifact_service: InMemoryArtifactService,
+    session_id: str,
+    user_query: str) -> bool:
+  """Ask for a declarative chart spec and validate it against the latest SQL result
+
+  Returns False when the agent finds the chart inexpressible or the spec does
+  not validate, so the caller can fall back to the Python code-execution sequence.
+  """
+
+  chart_spec_agent_runner = Runner(
+    agent=chart_spec_agent,
+    app_name=app_name,
+    session_service=session_service,
+    artifact_service=artifact_service
+  )
+
+  chart_spec_response = await call_agent_async(
+    runner=chart_spec_agent_runner,
+    app_name=app_name,
+    user_id=user_id,
+    session_id=session_id,
+    user_query=user_query,
+    session_service=session_service,
+    artifact_service=artifact_service
+  )
+  logger.info(chart_spec_response)
+
+  session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+  spec = session.state.get('latest_chart_spec')
+  errors = validate_spec(spec, get_result_store().frame(session.state.get('latest_sql_result')))
+  span = get_tracer().current_span()
+  if span is not None:
+    span.set_attribute('chart_mode', 'code' if errors else 'spec')
+
+  if errors:
+    logger.info(f"Chart spec not usable, falling back to code execution: {errors}")
+    state_changes = {'latest_chart_mode': 'code', 'latest_chart_spec_errors': errors}
+  else:
+    #the same state a successful Python sequence would leave, minus the code and image
+    state_changes = {
+      'latest_chart_mode': 'spec',
+      'latest_chart_spec_errors': [],
+      'latest_python_sequence_outcome': 'SUCCESS',
+      'latest_python_code_output_reasoning': spec.get('reasoning', ''),
+      'latest_python_code_output': None,
+      'latest_img_bytes': None,
+    }
+  await session_service.append_event(
+    session, Event(author='system', actions=EventActions(state_delta=state_changes), timestamp=time.time())
+  )
+  return not errors
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from typing import Any
+from constants import *
+from google.adk.events import Event, EventActions
+from google.adk.sessions import InMemorySessionService
+from google.adk.artifacts import InMemoryArtifactService
+from sequences.sql_sequence import sql_agent_sequence
+from utils.logger import get_logger
+from utils.tracing import traced
+from utils.metering import get_meter
+from utils.turn_context import current_turn
+from utils.sub_queries import merge_on_kpi_date, sub_question
+from utils.result_store import get_result_store, result_state
+
+logger = get_logger(__name__)
+
+
+def sub_session_state(state: dict[str, Any], kpi: dict[str, Any]) -> dict[str, Any]:
+  """parent state without the previous turn's results, app/user scoped or temp keys"""
+  state = {
+    key: value for key, value in state.items()
+    if not key.startswith(('latest_', 'app:', 'user:', 'temp:', 'turn_'))
+  }
+  state['sub_query_kpi'] = kpi
+  return state
+
+
+async def _run_sub_query(
+    app_name: str,
+    user_id: str,
+    session_service: InMemorySessionService,
+    artifact_service: InMemoryArtifactService,
+    session_id: str,
+    user_query: str,
+    kpi: dict[str, Any]) -> dict[str, Any]:
+  """one KPI's SQL sequence in its own session; returns its outcome, SQL and rows"""
+
+  parent = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+  sub_session_id = f"{session_id}:kpi:{kpi['kpi_id']}"
+  await session_service.create_session(
+    app_name=app_name, user_id=user_id, session_id=sub_session_id, state=sub_session_state(parent.state, kpi)
+  )
+  #tokens the sub-session spends count towards the parent turn's budget
+  get_meter().attach_sub_session(sub_session_id, session_id)
+  started = time.perf_counter()
+  try:
+    await sql_agent_sequence(app_name, user_id, session_service, artifact_service, sub_session_id, sub_question(user_query, kpi))
+    state = (await session_service.get_session(app_name=app_name, user_id=user_id, session_id=sub_session_id)).state
+    rows = get_result_store().rows(state.get('latest_sql_result'))
+    outcome = state.get('latest_sql_sequence_outcome')
+    if state.get('latest_sql_result') is not None and rows is None:
+      logger.warning(f"Result of sub-query for KPI_ID {kpi['kpi_id']} is no longer in the result store")
+      outcome = 'ERROR'
+    return {
+      'kpi': kpi,
+      'outcome': outcome,
+      'sql': state.get('latest_sql_output'),
+      'reasoning': state.get('latest_sql_output_reasoning'),
+      'rows': rows or [],
+      'downsampling_note': state.get('latest_sql_downsampling_note') or '',
+      'wall_ms': (time.perf_counter() - started) * 1000,
+    }
+  finally:
+    get_meter().detach_sub_session(sub_session_id)
+    await session_service.delete_session(app_name=app_name, user_id=user_id, session_id=sub_session_id)
+
+
+@traced(kind='sequence')
+async def multi_kpi_sql_sequence(
+    app_name: str,
+    user_id: str,
+    session_service: InMemorySessionService,
+    artifact_service: InMemoryArtifactService,
+    session_id: str,
+    user_query: str,
+    kpis: list[dict[str, Any]]) -> bool:
+  """Run one SQL sequence per KPI concurrently and merge their rows on KPI_DATE
+
+  Returns False, leaving the session untouched, when any sub-query fails or
+  the results cannot be merged, so the caller can fall back to one SQL sequence.
+  """
+
+  results = await asyncio.gather(*(
+    _run_sub_query(app_name, user_id, session_service, artifact_service, session_id, user_query, kpi)
+    for kpi in kpis
+  ))
+  summary = [
+    {'kpi_id': r['kpi']['kpi_id'], 'kpi_name': r['kpi']['kpi_name'], 'outcome': r['outcome'],
+     'rows': len(r['rows']), 'wall_ms': round(r['wall_ms'], 1)}
+    for r in results
+  ]
+  logger.info(f"Multi-KPI sub-queries: {summary}")
+
+  if any(r['outcome'] != 'SUCCESS' for r in results):
+    return False
+  try:
+    rows = merge_on_kpi_date([(r['kpi'], r['rows']) for r in results])
+  except ValueError as e:
+    logger.warning(f"Could not merge multi-KPI sub-queries: {e}")
+    return False
+
+  #the same state a successful single SQL sequence would leave
+  state_changes = {
+    'latest_sql_output': '\n\n'.join(f"-- {r['kpi']['kpi_name']} (KPI_ID {r['kpi']['kpi_id']})\n{r['sql']}" for r in results),
+    **result_state(rows),
+    'latest_sql_downsampling': None,
+    'latest_sql_downsampling_note': '\n'.join(
+      f"{r['kpi']['kpi_name']}: {r['downsampling_note']}" for r in results if r['downsampling_note']
+    ),
+    'latest_bq_execution_status': 'SUCCESS',
+    'latest_sql_criticism': OUTCOME_OK_PHRASE,
+    'latest_sql_sequence_outcome': 'SUCCESS',
+    'latest_sql_output_reasoning': '\n\n'.join(f"### {r['kpi']['kpi_name']}\n{r['reasoning'] or ''}" for r in results),
+    'sub_queries': summary,
+    #the parent turn's breakdown, sub-sessions included
+    'turn_token_usage': {'turn': current_turn(), 'agents': get_meter().turn_usage(session_id)},
+  }
+  session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+  await session_service.append_event(
+    session, Event(author='system', actions=EventActions(state_delta=state_changes), timestamp=time.time())
+  )
+  return True
@@ -7,9 +7,12 @@ from agents.python_writer_agent import python_writer_agent
 from agents.python_critic_agent import python_critic_agent
 from agents.python_refiner_agent import python_refiner_agent
 from utils.logger import get_logger
+from utils.tracing import traced
+from utils.metering import get_meter
 
 logger = get_logger(__name__)
 
+@traced(kind='sequence')
 async def python_agent_sequence(
     app_name: str,
     user_id: str,
@@ -67,6 +70,11 @@ async def python_agent_sequence(
       if session.state.get('latest_python_code_criticism') == OUTCOME_OK_PHRASE and \
          session.state.get('latest_python_code_execution_outcome') == OUTCOME_OK_PHRASE:
         break 
+
+      #stop refining once the turn's token budget is spent
+      if get_meter().budget_exceeded(session_id):
+        logger.warning(f"Turn token budget exceeded, stopping Python refine loop after {retries} retries")
+        break
       
       #Call Python Critic Agent
       python_critic_response = await call_agent_async(
@@ -7,9 +7,12 @@ from agents.sql_writer_agent import sql_writer_agent
 from agents.sql_critic_agent import sql_critic_agent
 from agents.sql_refiner_agent import sql_refiner_agent
 from utils.logger import get_logger
+from utils.tracing import traced
+from utils.metering import get_meter
 
 logger = get_logger(__name__)
 
+@traced(kind='sequence')
 async def sql_agent_sequence(
     app_name: str,
     user_id: str,
@@ -68,6 +71,11 @@ async def sql_agent_sequence(
     if session.state.get('latest_sql_criticism') == OUTCOME_OK_PHRASE and \
       session.state.get('latest_bq_execution_status').upper() == 'SUCCESS':
        break
+
+    #stop refining once the turn's token budget is spent
+    if get_meter().budget_exceeded(session_id):
+      logger.warning(f"Turn token budget exceeded, stopping SQL refine loop after {retries} retries")
+      break
     
     #call SQL Critic Agent
     sql_critic_response = await call_agent_async(
@@ -95,4 +103,4 @@ async def sql_agent_sequence(
 
     logger.info(sql_refiner_response)
 
-    retries += 1
\ No newline at end of file
+    retries += 1
@@ -5,9 +5,11 @@ from google.adk.artifacts import InMemoryArtifactService
 from utils.agent_utils import call_agent_async
 from agents.starter_agent import starter_agent
 from utils.logger import get_logger
+from utils.tracing import traced
 
 logger = get_logger(__name__)
 
+@traced(kind='sequence')
 async def starter_agent_sequence(
     app_name: str,
     user_id: str,
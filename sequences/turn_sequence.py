@@ -0,0 +1,75 @@
+from typing import Any
+from constants import *
+from google.adk.sessions import InMemorySessionService, Session
+from google.adk.artifacts import InMemoryArtifactService
+from sequences.starter_sequence import starter_agent_sequence
+from sequences.sql_sequence import sql_agent_sequence
+from sequences.multi_kpi_sequence import multi_kpi_sql_sequence
+from sequences.python_sequence import python_agent_sequence
+from sequences.chart_sequence import chart_spec_sequence
+from utils.helper import save_img
+from utils.sub_queries import plan_sub_queries
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+from utils.profiling import get_profiler
+from utils.turn_context import current_turn
+
+logger = get_logger(__name__)
+
+
+def initial_session_state() -> dict[str, Any]:
+  """State every new agent session starts from"""
+  return {
+      'projects': "uk-dta-gsmanalytics-poc",
+      'datasets': "metricmind",
+      'tables': "GSM_KPI_DATA_TEST_V5, GSM_KPI_DEFS_TEST_V5",
+  }
+
+
+async def run_turn(
+    app_name: str,
+    user_id: str,
+    session_service: InMemorySessionService,
+    artifact_service: InMemoryArtifactService,
+    session_id: str,
+    user_query: str,
+    save_image: bool = False) -> Session:
+  """Run one user query through the Starter, SQL and Python sequences as a traced turn"""
+
+  #the profiler hook is a shared null context unless this turn was selected for profiling
+  with get_tracer().turn(session_id, query=user_query[:200]), get_profiler().turn(session_id, current_turn()):
+
+    #Call Starter Agent Sequence
+    await starter_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
+
+    session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    #Decide if SQL sequence is required
+    if session.state.get('sql_required'):
+      #questions naming several KPIs get one SQL sequence per KPI, run concurrently
+      starter_response = session.state.get('starter_agent_response') or {}
+      kpis = plan_sub_queries(user_query, starter_response.get('user_intent')) if MULTI_KPI_ENABLED else []
+      merged = kpis and await multi_kpi_sql_sequence(
+        app_name, user_id, session_service, artifact_service, session_id, user_query, kpis
+      )
+      if not merged:
+        await sql_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
+      session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    #Note: If python_required is True, sql_required is ALWAYS True
+    if session.state.get('python_required'):
+      if session.state.get('latest_sql_sequence_outcome') == 'SUCCESS':
+        #a declarative chart spec drawn by the UI, generated code only for charts it cannot express
+        charted = CHART_SPEC_ENABLED and await chart_spec_sequence(
+          app_name, user_id, session_service, artifact_service, session_id, user_query
+        )
+        if not charted:
+          await python_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, user_query)
+        session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+        if save_image and not charted:
+          save_img(session.state.get('latest_img_bytes'))
+      else:
+        logger.error('SQL sequence failed')
+
+    return session
@@ -1,18 +1,18 @@
 import argparse
 import asyncio
+import hashlib
 import json
 import uuid
-from copy import deepcopy
-from typing import Any
+from typing import Any, Optional, TextIO
 
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.sessions import InMemorySessionService
 
 from constants import APP_NAME, DATA_SCHEMA_PATH, DEFS_SCHEMA_PATH, USER_ID
-from sequences.python_sequence import python_agent_sequence
-from sequences.sql_sequence import sql_agent_sequence
-from sequences.starter_sequence import starter_agent_sequence
+from sequences.turn_sequence import initial_session_state, run_turn
 from utils.helper import json_to_dict
+from utils.backends import set_backend
+from utils.cassette import Cassette
 
 #hold all token keys here for tracking usage count 
 TOKEN_KEYS = [
@@ -25,7 +25,7 @@ TOKEN_KEYS = [
 ]
 
 #internal func to decide return types
-def _safe_value(value: Any, max_text_len: int) -> Any:
+def _safe_value(value: Any, max_text_len: int, max_list_len: int = 50) -> Any:
     if isinstance(value, bytes):
         return {
             "_type": "bytes",
@@ -40,40 +40,85 @@ def _safe_value(value: Any, max_text_len: int) -> Any:
             }
         return value
     if isinstance(value, list):
-        return [_safe_value(v, max_text_len) for v in value]
+        if len(value) > max_list_len:
+            return {
+                "_type": "list",
+                "length": len(value),
+                "preview": [_safe_value(v, max_text_len, max_list_len) for v in value[:max_list_len]],
+            }
+        return [_safe_value(v, max_text_len, max_list_len) for v in value]
     if isinstance(value, dict):
-        return {k: _safe_value(v, max_text_len) for k, v in value.items()}
+        return {k: _safe_value(v, max_text_len, max_list_len) for k, v in value.items()}
     return value
 
 #use this helper to display snapshot state 
-def _snapshot_state(state: dict[str, Any], max_text_len: int) -> dict[str, Any]:
-    return _safe_value(state, max_text_len)
-
-#track changes in state keys 
-def _state_diff(prev_state: dict[str, Any], curr_state: dict[str, Any]) -> dict[str, Any]:
-    prev_keys = set(prev_state.keys()) 
-    curr_keys = set(curr_state.keys())
-
-    #what's added/remvoed/changed since last QnA
-    added = sorted(curr_keys - prev_keys)
-    removed = sorted(prev_keys - curr_keys)
-
-    changed = []
-    for key in sorted(prev_keys & curr_keys):
-        if prev_state[key] != curr_state[key]:
-            changed.append(key) #if values for the key don't match, add to what's changed
- 
-    #format to return keys 
-    return {
-        "added_keys": added,
-        "removed_keys": removed,
-        "changed_keys": changed,
-        "counts": {
-            "added": len(added),
-            "removed": len(removed),
-            "changed": len(changed),
-        },
-    }
+def _snapshot_state(state: dict[str, Any], max_text_len: int, max_list_len: int = 50) -> dict[str, Any]:
+    return _safe_value(state, max_text_len, max_list_len)
+
+#content hash of one state value; strings/bytes are hashed without serialising
+def _fingerprint(value: Any) -> str:
+    if isinstance(value, bytes):
+        data = value
+    elif isinstance(value, str):
+        data = value.encode("utf-8", "surrogatepass")
+    else:
+        data = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class StateTracker:
+    """per-key version counters and content hashes, updated from the events' state deltas
+
+    only keys written by new events are re-hashed, so a turn costs the size of
+    what it wrote rather than a deep copy and comparison of the whole state
+    """
+
+    def __init__(self, initial_state: dict[str, Any]):
+        self.hashes = {key: _fingerprint(value) for key, value in initial_state.items()}
+        self.versions = {key: 0 for key in initial_state}
+        self.events_seen = 0
+
+    #track changes in state keys 
+    def update(self, state: dict[str, Any], events: list[Any]) -> dict[str, Any]:
+        written: set[str] = set()
+        for event in events[self.events_seen:]:
+            actions = getattr(event, "actions", None)
+            if actions is not None and actions.state_delta:
+                written.update(actions.state_delta)
+        self.events_seen = len(events)
+
+        #what's added/remvoed/changed since last QnA
+        added, changed = [], []
+        for key in sorted(written):
+            if key not in state:
+                continue  #temp: keys are never persisted
+            digest = _fingerprint(state[key])
+            if key not in self.hashes:
+                added.append(key)
+            elif digest != self.hashes[key]:
+                changed.append(key) #rewritten with a different value
+            else:
+                continue
+            self.hashes[key] = digest
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+        removed = sorted(key for key in self.hashes if key not in state)
+        for key in removed:
+            del self.hashes[key]
+            del self.versions[key]
+
+        #format to return keys 
+        return {
+            "added_keys": added,
+            "removed_keys": removed,
+            "changed_keys": changed,
+            "counts": {
+                "added": len(added),
+                "removed": len(removed),
+                "changed": len(changed),
+            },
+            "versions": {key: self.versions[key] for key in added + changed},
+        }
 
 #token metric helper
 def _token_metrics(state: dict[str, Any]) -> dict[str, Any]:
@@ -93,9 +138,11 @@ def _token_delta(prev: dict[str, Any], curr: dict[str, Any]) -> dict[str, Any]:
     return delta
 
 
-def _event_summary(events: list[Any]) -> dict[str, Any]:
-    by_author: dict[str, int] = {}
-    with_content_by_author: dict[str, int] = {}
+def _event_summary(events: list[Any], previous: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """counts over events, added on top of the previous summary when given"""
+    previous = previous or {}
+    by_author: dict[str, int] = dict(previous.get("events_by_author", {}))
+    with_content_by_author: dict[str, int] = dict(previous.get("events_with_content_by_author", {}))
 
     for event in events:
         author = getattr(event, "author", "unknown")
@@ -106,7 +153,7 @@ def _event_summary(events: list[Any]) -> dict[str, Any]:
             with_content_by_author[author] = with_content_by_author.get(author, 0) + 1
 
     return {
-        "total_events": len(events),
+        "total_events": previous.get("total_events", 0) + len(events),
         "events_by_author": by_author,
         "events_with_content_by_author": with_content_by_author,
     }
@@ -121,36 +168,13 @@ def _agent_state_view(state: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-async def _build_initial_state() -> dict[str, Any]:
-    return {
-        "projects": "uk-dta-gsmanalytics-poc",
-        "datasets": "metricmind",
-        "tables": "GSM_KPI_DATA_TEST_V5, GSM_KPI_DEFS_TEST_V5"
-    }
-
-
-async def _run_single_query(
-    *,
-    app_name: str,
-    user_id: str,
-    session_id: str,
-    query: str,
-    session_service: InMemorySessionService,
-    artifact_service: InMemoryArtifactService,
-) -> None:
-    await starter_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, query)
-
-    session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-
-    if session.state.get("sql_required"):
-        await sql_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, query)
-        session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-
-    if session.state.get("python_required") and session.state.get("latest_sql_sequence_outcome") == "SUCCESS":
-        await python_agent_sequence(app_name, user_id, session_service, artifact_service, session_id, query)
+#one JSON object per line, flushed so a crashed run keeps every finished turn
+def _write_record(out: TextIO, record: dict[str, Any]) -> None:
+    out.write(json.dumps(record, default=str) + "\n")
+    out.flush()
 
 #MAIN RUNNER
-async def _run(args: argparse.Namespace) -> dict[str, Any]:
+async def _run(args: argparse.Namespace, out: TextIO) -> dict[str, Any]:
     #INITIATE STUFF HERE
     app_name = APP_NAME
     user_id = USER_ID
@@ -159,7 +183,7 @@ async def _run(args: argparse.Namespace) -> dict[str, Any]:
     session_service = InMemorySessionService()
     artifact_service = InMemoryArtifactService()
 
-    initial_state = await _build_initial_state()
+    initial_state = initial_session_state()
     
     #create a session first
     await session_service.create_session(
@@ -169,36 +193,42 @@ async def _run(args: argparse.Namespace) -> dict[str, Any]:
         state=initial_state,
     )
 
-    #initialize whats held for dumping into report 
-    query_reports: list[dict[str, Any]] = []
-    prev_state: dict[str, Any] = deepcopy(initial_state)
-    prev_tokens = _token_metrics(prev_state)
+    _write_record(out, {
+        "type": "run",
+        "session_id": session_id,
+        "query_count": len(args.queries),
+        "notes": {
+            "same_session_used_for_all_queries": True,
+            "include_contents_default_agents": ["starter_agent", "sql_writer_agent", "python_writer_agent"],
+            "include_contents_none_agents": ["sql_critic_agent", "sql_refiner_agent", "python_critic_agent", "python_refiner_agent"],
+        },
+    })
+
+    #initialize whats held between turns: key hashes/versions and small counters only
+    tracker = StateTracker(initial_state)
+    prev_tokens = _token_metrics(initial_state)
     prev_event_count = 0
+    event_counts: dict[str, Any] = {"events_by_author": {}, "events_with_content_by_author": {}}
 
     #run query by query 
     for idx, query in enumerate(args.queries, start=1):
-        await _run_single_query(
-            app_name=app_name,
-            user_id=user_id,
-            session_id=session_id,
-            query=query,
-            session_service=session_service,
-            artifact_service=artifact_service,
-        )
-
-        #fetch state info
+        await run_turn(app_name, user_id, session_service, artifact_service, session_id, query)
+
+        #fetch state info (the service already hands back a copy)
         session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-        curr_state = deepcopy(session.state) #replace shallow with deepcopy!!!
+        curr_state = session.state
         curr_tokens = _token_metrics(curr_state)
 
         event_count = len(session.events)
+        event_counts = _event_summary(session.events[prev_event_count:], event_counts)
 
         #custom turn-based report 
         report = {
+            "type": "turn",
             "turn": idx,
             "query": query,
             "state_key_count": len(curr_state),
-            "state_diff_from_previous_turn": _state_diff(prev_state, curr_state),
+            "state_diff_from_previous_turn": tracker.update(curr_state, session.events),
             "token_metrics": {
                 "current": curr_tokens,
                 "delta_from_previous_turn": _token_delta(prev_tokens, curr_tokens),
@@ -206,38 +236,31 @@ async def _run(args: argparse.Namespace) -> dict[str, Any]:
             "events": {
                 "total_events": event_count,
                 "delta_events_from_previous_turn": event_count - prev_event_count,
-                "summary": _event_summary(session.events),
+                "summary": event_counts,
             },
-            "agent_state_view": _snapshot_state(_agent_state_view(curr_state), args.max_text_len),
-            "full_state_snapshot": _snapshot_state(curr_state, args.max_text_len),
+            "agent_state_view": _snapshot_state(_agent_state_view(curr_state), args.max_text_len, args.max_list_len),
         }
 
-        #append to final query report
-        query_reports.append(report)
+        #full snapshots are sampled, and always taken for the last turn when enabled
+        if args.snapshot_every and (idx % args.snapshot_every == 0 or idx == len(args.queries)):
+            report["full_state_snapshot"] = _snapshot_state(curr_state, args.max_text_len, args.max_list_len)
+
+        #stream the turn out instead of holding every report in memory
+        _write_record(out, report)
 
         #modify state at end of turn 
-        prev_state = curr_state
         prev_tokens = curr_tokens
         prev_event_count = event_count
 
-    #fetch final state
-    final_session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-
     #return a summary of events, tokens etc
-    return {
-        "session_id": session_id,
-        "query_count": len(args.queries),
-        "notes": {
-            "same_session_used_for_all_queries": True,
-            "include_contents_default_agents": ["starter_agent", "sql_writer_agent", "python_writer_agent"],
-            "include_contents_none_agents": ["sql_critic_agent", "sql_refiner_agent", "python_critic_agent", "python_refiner_agent"],
-        },
-        "per_query": query_reports,
-        "final": {
-            "event_count": len(final_session.events),
-            "token_metrics": _token_metrics(final_session.state),
-        },
+    final = {
+        "type": "final",
+        "event_count": prev_event_count,
+        "token_metrics": prev_tokens,
+        "state_key_versions": tracker.versions,
     }
+    _write_record(out, final)
+    return final
 
 #fetch all queries post processing
 def _load_queries(args: argparse.Namespace) -> list[str]:
@@ -275,8 +298,8 @@ def main() -> None:
     )
     parser.add_argument(
         "--out",
-        default="session_state_growth_dump.json",
-        help="Output JSON path",
+        default="session_state_growth_dump.jsonl",
+        help="Output JSONL path, one record per turn written as each turn finishes",
     )
     parser.add_argument(
         "--max-text-len",
@@ -284,17 +307,46 @@ def main() -> None:
         default=2000,
         help="Maximum stored text length per value in snapshots (longer strings are summarized)",
     )
+    parser.add_argument(
+        "--max-list-len",
+        type=int,
+        default=50,
+        help="Maximum stored items per list in snapshots (longer lists are summarized)",
+    )
+    parser.add_argument(
+        "--snapshot-every",
+        type=int,
+        default=0,
+        help="Include a full state snapshot every N turns and on the last turn (0 disables)",
+    )
+
+    parser.add_argument(
+        "--cassette",
+        default=None,
+        help="Optional cassette file to record Gemini/BigQuery calls into or replay them from",
+    )
+    parser.add_argument(
+        "--cassette-mode",
+        choices=["record", "replay"],
+        default="replay",
+        help="Record live calls into --cassette or replay them offline",
+    )
+    parser.add_argument(
+        "--cassette-latency",
+        default="recorded",
+        help="Replay latency: none | recorded | scale:<f> | fixed:<ms> | lognormal:<median_ms>,<sigma>",
+    )
 
     #parse then load arguments
     args = parser.parse_args()
     args.queries = _load_queries(args)
-    
-    #run it through the event loop
-    report = asyncio.run(_run(args))
 
-    # dump report as JSON to debug
+    if args.cassette:
+        set_backend(Cassette(args.cassette, args.cassette_mode, args.cassette_latency))
+    
+    #run it through the event loop, streaming each turn's report to JSONL
     with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(report, f, indent=2, default=str)
+        asyncio.run(_run(args, f))
 
     print(f"Saved session report to {args.out}")
 
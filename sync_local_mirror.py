@@ -0,0 +1,34 @@
+"""Sync the local parquet mirror of the KPI data table.
+
+Run offline, e.g. nightly after build_schema_context.py: `python sync_local_mirror.py`.
+Each run copies the KPI_DATE partitions the previous sync had not settled; the
+last SCHEMA_MUTABLE_DAYS partitions are always recopied, as they may still be
+restated. Pass --full to recopy everything. Set METRIC_MIND_LOCAL_MIRROR=true
+to answer execute_sql from the mirror.
+"""
+
+import argparse
+
+from constants import LOCAL_MIRROR_DIR, DATA_TABLE_ID, BIGQUERY_LOCATION, SCHEMA_MUTABLE_DAYS
+from utils.local_mirror import LocalMirror
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sync the local parquet mirror of the KPI data table.")
+    parser.add_argument('--dir', default=LOCAL_MIRROR_DIR, help='Mirror directory')
+    parser.add_argument('--table', default=DATA_TABLE_ID, help='KPI data table to mirror')
+    parser.add_argument('--full', action='store_true', help='Recopy every partition')
+    parser.add_argument('--mutable-days', type=int, default=SCHEMA_MUTABLE_DAYS,
+                        help='Trailing KPI_DATE partitions recopied on every sync')
+    args = parser.parse_args()
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client(location=BIGQUERY_LOCATION)
+    result = LocalMirror(args.dir, args.table).sync(client, full=args.full, mutable_days=args.mutable_days)
+    print(f"Synced {result['rows']} rows into {args.dir}, data through {result['latest_date']} "
+          f"({result['files_written']} files written, {result['files_removed']} removed)")
+
+
+if __name__ == "__main__":
+    main()
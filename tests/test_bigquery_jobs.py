@@ -0,0 +1,86 @@
+"""JobManager cancels BigQuery jobs nobody waits for any more"""
+import asyncio
+import pytest
+from utils.bigquery_jobs import JobManager, QueryCancelled, QueryDeadlineExceeded, get_job_manager
+from utils.turn_context import current_session_id, turn_scope
+
+
+class FakeJob:
+    def __init__(self):
+        self.cancelled = False
+        self.estimated_bytes_processed = 1000
+        self.total_bytes_processed = 100
+
+    def done(self) -> bool:
+        return self.cancelled
+
+
+class FakeClient:
+    """a BigQuery client whose jobs run until they are cancelled"""
+
+    def __init__(self):
+        self.jobs: dict[str, FakeJob] = {}
+
+    def query(self, sql: str, job_id: str) -> FakeJob:
+        self.jobs[job_id] = FakeJob()
+        return self.jobs[job_id]
+
+    def cancel_job(self, job_id: str) -> FakeJob:
+        self.jobs[job_id].cancelled = True
+        return self.jobs[job_id]
+
+
+def manager() -> JobManager:
+    return JobManager(deadline_s=5, poll_initial_s=0.01, poll_max_s=0.01)
+
+
+def test_deadline_cancels_the_job():
+    jobs, client = manager(), FakeClient()
+    with pytest.raises(QueryDeadlineExceeded):
+        asyncio.run(jobs.run(client, 'SELECT 1', deadline_s=0.05))
+    assert [job.cancelled for job in client.jobs.values()] == [True]
+    assert jobs.counts['cancelled_deadline'] == 1
+    assert jobs.counts['bytes_avoided'] == 900
+    assert jobs.outstanding() == 0
+
+
+def test_cancelled_task_cancels_the_job():
+    jobs, client = manager(), FakeClient()
+
+    async def abandon():
+        task = asyncio.create_task(jobs.run(client, 'SELECT 1'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(abandon())
+    assert [job.cancelled for job in client.jobs.values()] == [True]
+    assert jobs.counts['cancelled_abandoned'] == 1
+
+
+def test_turn_end_cancels_jobs_the_turn_left_running(monkeypatch):
+    jobs, client = get_job_manager(), FakeClient()
+    monkeypatch.setattr(jobs, 'poll_initial_s', 0.01)
+    monkeypatch.setattr(jobs, 'poll_max_s', 0.01)
+    before, finished = jobs.counts['cancelled_abandoned'], jobs.counts['finished']
+
+    async def turn():
+        with turn_scope('session-1'):
+            #submitted the way BigQueryExecutor does, on behalf of the turn's session
+            task = asyncio.create_task(jobs.run(client, 'SELECT 1', owner=current_session_id()))
+            await asyncio.sleep(0.05)
+            #another session's turn ending leaves the job alone
+            with turn_scope('session-2'):
+                pass
+            assert not any(job.cancelled for job in client.jobs.values())
+        #leaving the turn ran the job manager's turn-end hook
+        return await task
+
+    #the cancelled job reports done() but is not handed back as a result
+    with pytest.raises(QueryCancelled):
+        asyncio.run(turn())
+    assert [job.cancelled for job in client.jobs.values()] == [True]
+    assert jobs.counts['cancelled_abandoned'] == before + 1
+    assert jobs.counts['finished'] == finished
+    assert jobs.outstanding() == 0
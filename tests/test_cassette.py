@@ -0,0 +1,69 @@
+"""cassette record and replay of Gemini and execute_sql calls"""
+import asyncio
+import pytest
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+from utils.cassette import Cassette, CassetteMissError, LatencyModel, sql_fingerprint
+
+
+def request(question: str) -> LlmRequest:
+    return LlmRequest(model='gemini-2.5-flash', contents=[types.Content(role='user', parts=[types.Part(text=question)])])
+
+
+def answer(value: str) -> LlmResponse:
+    return LlmResponse(content=types.Content(role='model', parts=[types.Part(text=value)]))
+
+
+def record(path: str) -> None:
+    cassette = Cassette(path, mode='record', latency='none')
+    assert asyncio.run(cassette.serve_model('sql_writer_agent', request('daily sales'), 'm1')) is None
+    cassette.observe_model('m1', answer('SELECT 1'))
+    for call, rows in (('t1', [{'N': 1}]), ('t2', [{'N': 2}])):
+        assert asyncio.run(cassette.serve_tool('execute_sql', {'query': 'SELECT  COUNT(*) AS N\nFROM t'}, call)) is None
+        cassette.observe_tool(call, {'status': 'SUCCESS', 'rows': rows})
+
+
+def test_replay_serves_recorded_responses_in_order(tmp_path):
+    path = str(tmp_path / 'calls.jsonl.gz')
+    record(path)
+
+    cassette = Cassette(path, mode='replay', latency='none', strict=True)
+    assert cassette.offline
+    response = asyncio.run(cassette.serve_model('sql_writer_agent', request('daily sales'), 'm1'))
+    assert response.content.parts[0].text == 'SELECT 1'
+    #whitespace layout does not change a query's fingerprint; repeats replay in recorded order
+    first = asyncio.run(cassette.serve_tool('execute_sql', {'query': 'SELECT COUNT(*) AS N FROM t'}, 't1'))
+    second = asyncio.run(cassette.serve_tool('execute_sql', {'query': 'SELECT COUNT(*) AS N FROM t'}, 't2'))
+    assert (first['rows'], second['rows']) == ([{'N': 1}], [{'N': 2}])
+    assert cassette.hits == 3 and cassette.misses == 0
+
+
+def test_strict_replay_raises_on_an_unrecorded_request(tmp_path):
+    path = str(tmp_path / 'calls.jsonl.gz')
+    record(path)
+    with pytest.raises(CassetteMissError):
+        asyncio.run(Cassette(path, mode='replay', strict=True).serve_model('sql_writer_agent', request('monthly sales'), 'm'))
+
+
+def test_lenient_replay_leaves_a_miss_to_the_live_call(tmp_path):
+    path = str(tmp_path / 'calls.jsonl.gz')
+    record(path)
+    cassette = Cassette(path, mode='replay', strict=False)
+    assert asyncio.run(cassette.serve_tool('execute_sql', {'query': 'SELECT 2'}, 't')) is None
+    assert cassette.misses == 1
+
+
+def test_model_fingerprint_depends_on_the_agent(tmp_path):
+    path = str(tmp_path / 'calls.jsonl.gz')
+    record(path)
+    cassette = Cassette(path, mode='replay', strict=False)
+    assert asyncio.run(cassette.serve_model('sql_critic_agent', request('daily sales'), 'm')) is None
+
+
+def test_latency_models():
+    assert LatencyModel('none').delay_ms(120) == 0
+    assert LatencyModel('scale:0.5').delay_ms(120) == 60
+    assert LatencyModel('fixed:30').delay_ms(120) == 30
+    assert LatencyModel('lognormal:100,0.5', seed=1).delay_ms(0) == LatencyModel('lognormal:100,0.5', seed=1).delay_ms(0)
+    assert sql_fingerprint('SELECT 1') == sql_fingerprint(' SELECT\n1 ')
@@ -0,0 +1,53 @@
+"""chart spec validation and the data drawn from a valid spec"""
+import pandas as pd
+from utils.chart_spec import chart_data, validate_spec, vega_lite
+
+FRAME = pd.DataFrame({
+    'KPI_DATE': ['2025-01-01', '2025-01-01', '2025-01-02', '2025-01-02'],
+    'PRODUCT': ['Sky Glass', 'Sky Q', 'Sky Glass', 'Sky Q'],
+    'VALUE': [10, 20, 30, 40],
+})
+
+
+def spec(**fields) -> dict:
+    return {'chart_type': 'line', 'x': 'KPI_DATE', 'y': 'VALUE', 'title': 'Sales', 'reasoning': '', **fields}
+
+
+def test_series_chart_is_valid():
+    assert validate_spec(spec(series='PRODUCT'), FRAME) == []
+
+
+def test_repeated_x_without_series_or_aggregation_is_rejected():
+    errors = validate_spec(spec(), FRAME)
+    assert len(errors) == 1 and 'repeat' in errors[0]
+
+
+def test_repeated_x_with_an_aggregation_is_valid():
+    assert validate_spec(spec(aggregation='sum'), FRAME) == []
+    data = chart_data(spec(aggregation='sum'), FRAME)
+    assert data['VALUE'].tolist() == [30, 70]
+
+
+def test_unknown_and_non_numeric_columns_are_rejected():
+    assert 'not a result column' in validate_spec(spec(x='DAY'), FRAME)[0]
+    assert 'not numeric' in validate_spec(spec(y='PRODUCT', series=None, x='KPI_DATE', aggregation='sum'), FRAME)[0]
+
+
+def test_count_aggregation_counts_rows():
+    data = chart_data(spec(y='PRODUCT', aggregation='count', chart_type='bar', x='KPI_DATE'), FRAME)
+    assert data['PRODUCT'].tolist() == [2, 2]
+
+
+def test_pie_takes_no_series():
+    assert any('Pie' in e for e in validate_spec(spec(chart_type='pie', x='PRODUCT', series='KPI_DATE', aggregation='sum'), FRAME))
+
+
+def test_vega_lite_uses_a_temporal_axis_for_dates():
+    data = chart_data(spec(series='PRODUCT'), FRAME)
+    chart = vega_lite(spec(series='PRODUCT'), data)
+    assert chart['encoding']['x']['type'] == 'temporal'
+    assert chart['encoding']['color']['field'] == 'PRODUCT'
+
+
+def test_empty_result_is_rejected():
+    assert validate_spec(spec(), FRAME.iloc[0:0]) == ['No SQL result to chart.']
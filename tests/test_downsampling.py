@@ -0,0 +1,71 @@
+"""downsampling oversized results: which columns re-aggregate, the plan and its query"""
+import json
+from utils import downsampling
+from utils.downsampling import ResultColumns, describe, downsample_sql, indicator_aggregations, plan, result_note
+
+SCHEMA = {'kpis': {
+    '1': {'indicators_int': [{'name': 'Sales', 'aggregation': 'SUM'}, {'name': 'Orders', 'aggregation': 'COUNT'}],
+          'indicators_float': [{'name': 'Avg Price', 'aggregation': 'AVG'}]},
+    '2': {'indicators_int': [{'name': 'Sales', 'aggregation': 'MAX'}, {'name': 'Speed', 'aggregation': None}]},
+}}
+
+
+def aggregations(tmp_path, monkeypatch, kpi_ids):
+    path = tmp_path / 'schema_context.json'
+    path.write_text(json.dumps(SCHEMA))
+    monkeypatch.setattr(downsampling, '_schema_kpis', None)
+    return indicator_aggregations(kpi_ids, str(path))
+
+
+def test_indicator_aggregations_by_name(tmp_path, monkeypatch):
+    assert aggregations(tmp_path, monkeypatch, [1]) == {'SALES': 'SUM', 'ORDERS': 'SUM', 'AVG_PRICE': 'AVG'}
+    #Sales aggregates differently across the two KPIs, Speed has no aggregation
+    assert aggregations(tmp_path, monkeypatch, [1, 2]) == {'ORDERS': 'SUM', 'AVG_PRICE': 'AVG'}
+
+
+def test_columns_from_schema():
+    schema = [('KPI_DATE', 'DATE', 'NULLABLE'), ('CHANNEL', 'STRING', 'NULLABLE'), ('KPI_ID', 'INTEGER', 'NULLABLE'),
+              ('SALES', 'INTEGER', 'NULLABLE'), ('avg price', 'FLOAT', 'NULLABLE')]
+    columns = ResultColumns.from_schema(schema, {'SALES': 'SUM', 'AVG_PRICE': 'AVG'})
+    assert (columns.date, columns.dimensions, columns.measures) == \
+        ('KPI_DATE', ['CHANNEL', 'KPI_ID'], {'SALES': 'SUM', 'avg price': 'AVG'})
+
+
+def test_measure_not_named_after_an_indicator_is_not_downsampled():
+    assert ResultColumns.from_schema([('KPI_DATE', 'DATE', 'NULLABLE'), ('N', 'INTEGER', 'NULLABLE')], {'SALES': 'SUM'}) is None
+
+
+def test_plan_takes_the_finest_grain_that_fits():
+    columns = ResultColumns('KPI_DATE', [], {'SALES': 'SUM'})
+    estimates = {'ISOWEEK': 1500, 'MONTH': 400, 'QUARTER': 130, 'YEAR': 40}
+    assert plan(columns, estimates, 10000, 1000) == {'grain': 'MONTH', 'top_column': None, 'top_n': None, 'rows': 400}
+    sql = downsample_sql('p.d.result', columns, plan(columns, estimates, 10000, 1000))
+    assert sql == ("WITH R AS (SELECT * FROM `p.d.result`)\n"
+                   "SELECT DATE_TRUNC(`KPI_DATE`, MONTH) AS `KPI_DATE`, SUM(`SALES`) AS `SALES`\n"
+                   "FROM R\nGROUP BY ALL\nORDER BY 1")
+
+
+def test_plan_keeps_the_top_values_of_the_widest_dimension():
+    columns = ResultColumns('KPI_DATE', ['CHANNEL', 'PRODUCT'], {'SALES': 'SUM'})
+    estimates = {'ISOWEEK': 50000, 'MONTH': 12000, 'QUARTER': 4000, 'YEAR': 1200, 'D0': 3, 'D1': 400}
+    downsample = plan(columns, estimates, 200000, 1000)
+    #12000 monthly rows over 400 products is 30 rows a product: 32 products and 'Other' fit
+    assert downsample == {'grain': 'MONTH', 'top_column': 'PRODUCT', 'top_n': 32, 'rows': 990}
+    sql = downsample_sql('p.d.result', columns, downsample)
+    assert "ORDER BY SUM(`SALES`) DESC LIMIT 32" in sql and "'Other') AS `PRODUCT`" in sql
+    assert 'top 32 PRODUCT values kept' in describe(downsample, columns, 200000, 1000)
+
+
+def test_no_plan_when_nothing_fits():
+    #without a date grain or dimensions nothing can regroup
+    assert plan(ResultColumns(None, [], {'SALES': 'SUM'}), {}, 5000, 1000) is None
+    #a single month of a single product already exceeds max_rows
+    columns = ResultColumns('KPI_DATE', ['PRODUCT'], {'SALES': 'SUM'})
+    estimates = {'ISOWEEK': 90000, 'MONTH': 20000, 'QUARTER': 8000, 'YEAR': 3000, 'D0': 10}
+    assert plan(columns, estimates, 200000, 1000) is None
+
+
+def test_result_note():
+    assert result_note({'status': 'SUCCESS', 'rows': []}) == ''
+    assert 'truncated' in result_note({'result_is_likely_truncated': True})
+    assert result_note({'downsampled': {'note': 'regrouped'}}) == 'regrouped'
@@ -0,0 +1,72 @@
+"""conversation history compaction: older turns folded into digests or model summaries"""
+import asyncio
+from types import SimpleNamespace
+from google.genai import types
+from utils import history
+from utils.history import compact_contents, strip_sql_rows
+from utils.metering import Meter
+
+
+def text(role: str, value: str) -> types.Content:
+    return types.Content(role=role, parts=[types.Part(text=value)])
+
+
+def conversation(questions: list[str]) -> list[types.Content]:
+    contents = []
+    for question in questions:
+        #every agent of a sequence sees the same question, so it repeats within one turn
+        contents += [text('user', question), text('model', f"answer to {question}"), text('user', question)]
+    return contents
+
+
+def test_recent_turns_are_kept_and_older_ones_use_their_digest():
+    contents = conversation(['q1', 'q2', 'q3'])
+    digests = [{'question': 'q1', 'kpis': ['10010'], 'filters': ["KPI_DATE >= '2025-01-01'"], 'outcome': 'SQL SUCCESS'}]
+    compacted, folded = asyncio.run(compact_contents(contents, digests, {}, keep_turns=2))
+    assert folded == 1
+    assert compacted[1:] == contents[3:]
+    summary = compacted[0].parts[0].text
+    assert summary.startswith('For context:') and 'kpis: 10010' in summary and 'outcome: SQL SUCCESS' in summary
+
+
+def test_short_conversation_is_untouched():
+    contents = conversation(['q1', 'q2'])
+    assert asyncio.run(compact_contents(contents, [], {}, keep_turns=2)) == (contents, 0)
+
+
+class FakeModels:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        usage = SimpleNamespace(prompt_token_count=120, candidates_token_count=30, total_token_count=150)
+        return SimpleNamespace(text='asked q1, answered it', usage_metadata=usage, model_version=model)
+
+
+def test_turn_without_digest_is_summarised_once_and_metered(monkeypatch):
+    models, meter = FakeModels(), Meter()
+    monkeypatch.setattr(history, '_summary_client', SimpleNamespace(aio=SimpleNamespace(models=models)))
+    monkeypatch.setattr(history, 'is_offline', lambda side=None: False)
+    monkeypatch.setattr(history, 'HISTORY_SUMMARY_MODEL_ENABLED', True)
+    monkeypatch.setattr(history, 'get_meter', lambda: meter)
+
+    summaries = {}
+    for _ in range(2):
+        compacted, _ = asyncio.run(compact_contents(conversation(['q1', 'q2', 'q3']), [], summaries, keep_turns=2))
+    assert 'summary: asked q1, answered it' in compacted[0].parts[0].text
+    assert models.calls == 1
+    assert meter.by_agent['history_summary']['total_token_count'] == 150
+    assert meter.by_agent['history_summary']['cost_usd'] > 0
+
+
+def test_offline_summary_falls_back_to_the_last_answer(monkeypatch):
+    monkeypatch.setattr(history, 'is_offline', lambda side=None: True)
+    compacted, _ = asyncio.run(compact_contents(conversation(['q1', 'q2', 'q3']), [], {}, keep_turns=2))
+    assert 'summary: answer to q1' in compacted[0].parts[0].text
+
+
+def test_sql_rows_are_stripped_from_replayed_results():
+    part = text('user', "[sql_writer_agent] `execute_sql` tool returned result: {'status': 'SUCCESS', 'rows': [{'A': 1}]}")
+    strip_sql_rows([part])
+    assert part.parts[0].text.endswith("{'status': 'SUCCESS', 'rows': 'rows omitted, see the SQL result in the instructions and the attached CSV file'}")
@@ -0,0 +1,50 @@
+"""resolving KPI names and dimension values named in a question"""
+from utils.kpi_index import KpiValueIndex, format_resolution
+
+SCHEMA = {'kpis': {
+    '10010': {'kpi_name': '1. Broadband Orders', 'dimensions': {
+        'Product': {'physical_column': 'DIM1', 'distinct_values_sample': ['Sky Full Fibre 500 FTTP', 'Sky Broadband Essential']},
+        'Speed Tier': {'physical_column': 'DIM2', 'distinct_values_sample': ['100']},
+    }},
+    '20002001': {'kpi_name': 'TV Sales', 'dimensions': {
+        'Product': {'physical_column': 'DIM1', 'distinct_values_sample': ['Sky Glass', 'Sky Q']},
+    }},
+}}
+
+
+def index() -> KpiValueIndex:
+    index = KpiValueIndex()
+    index.add_schema_context(SCHEMA)
+    return index
+
+
+def values(resolution: dict) -> list[tuple[str, str, str]]:
+    return [(f['match'], m['kpi_id'], m['value']) for f in resolution['filters'] for m in f['matches']]
+
+
+def test_kpi_name_without_its_number_and_exact_value():
+    resolution = index().resolve('broadband orders for sky broadband essential last month')
+    assert [k['kpi_id'] for k in resolution['kpis']] == ['10010']
+    assert values(resolution) == [('exact', '10010', 'Sky Broadband Essential')]
+
+
+def test_misspelt_value_is_corrected():
+    resolution = index().resolve('tv sales of sky glas')
+    assert values(resolution) == [('fuzzy', '20002001', 'Sky Glass')]
+
+
+def test_value_without_its_suffix_resolves_by_prefix():
+    resolution = index().resolve('orders of sky full fibre 500')
+    assert values(resolution) == [('prefix', '10010', 'Sky Full Fibre 500 FTTP')]
+
+
+def test_numeric_value_needs_its_dimension_named():
+    assert values(index().resolve('broadband orders over 100 days')) == []
+    assert values(index().resolve('broadband orders in speed tier 100')) == [('exact', '10010', '100')]
+
+
+def test_kpi_id_mention_and_format():
+    resolution = index().resolve('KPI_ID 20002001 for sky q')
+    assert [k['kpi_id'] for k in resolution['kpis']] == ['20002001']
+    assert "D.NAME = 'Product' AND D.VALUE = 'Sky Q' (KPI_ID 20002001)" in format_resolution(resolution)
+    assert format_resolution({'kpis': [], 'filters': []}).startswith('None resolved')
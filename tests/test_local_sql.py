@@ -0,0 +1,90 @@
+"""local_sql results against what BigQuery returns for the same query and rows"""
+import pandas as pd
+import pytest
+from utils.local_mirror import wide_frame
+from utils.local_sql import UnsupportedQuery, execute
+
+TABLE = 'project.dataset.KPI_DATA'
+
+ROWS = [
+    {'KPI_DATE': '2025-01-01', 'DIM': [{'NAME': 'Channel', 'VALUE': 'Online'}],
+     'INT': [{'NAME': 'Sales', 'VALUE': 10}, {'NAME': 'Returns', 'VALUE': 1}]},
+    {'KPI_DATE': '2025-01-02', 'DIM': [{'NAME': 'Channel', 'VALUE': 'Retail'}],
+     'INT': [{'NAME': 'Sales', 'VALUE': 20}]},
+    {'KPI_DATE': '2025-01-03', 'DIM': [],
+     'INT': [{'NAME': 'Returns', 'VALUE': 3}]},
+]
+
+
+def run(sql: str) -> list[dict]:
+    frame = wide_frame(1, ROWS)
+    return execute(sql, lambda kpi_ids: frame[frame['KPI_ID'].isin(kpi_ids)], TABLE, today=pd.Timestamp('2025-02-01'))
+
+
+def test_unnest_join_drops_rows_without_the_element():
+    #BigQuery: 2 (the 2025-01-03 row has no Sales element to join)
+    sql = f"SELECT COUNT(*) AS N FROM `{TABLE}`, UNNEST(INT) AS I WHERE KPI_ID = 1 AND I.NAME = 'Sales'"
+    assert run(sql) == [{'N': 2}]
+
+
+def test_unnest_join_values():
+    sql = (f"SELECT KPI_DATE, I.VALUE FROM `{TABLE}`, UNNEST(INT) AS I "
+           "WHERE KPI_ID = 1 AND I.NAME = 'Returns' ORDER BY KPI_DATE")
+    assert run(sql) == [{'KPI_DATE': '2025-01-01', 'VALUE': 1}, {'KPI_DATE': '2025-01-03', 'VALUE': 3}]
+
+
+def test_unnest_join_on_an_unmirrored_element_is_left_to_bigquery():
+    sql = f"SELECT COUNT(*) AS N FROM `{TABLE}`, UNNEST(INT) AS I WHERE KPI_ID = 1 AND I.NAME = 'Refunds'"
+    with pytest.raises(UnsupportedQuery):
+        run(sql)
+
+
+def test_not_of_a_null_comparison_is_null():
+    #BigQuery: only 2025-01-02; the row without a Channel compares NULL and NOT NULL is NULL
+    sql = (f"SELECT KPI_DATE FROM `{TABLE}` WHERE KPI_ID = 1 "
+           "AND NOT (SELECT VALUE FROM UNNEST(DIM) WHERE NAME = 'Channel') = 'Online'")
+    assert run(sql) == [{'KPI_DATE': '2025-01-02'}]
+
+
+def test_not_in_with_a_null_entry_matches_nothing():
+    #BigQuery: no rows; 'Retail' NOT IN ('Online', NULL) is NULL
+    sql = (f"SELECT KPI_DATE FROM `{TABLE}` WHERE KPI_ID = 1 "
+           "AND NOT (SELECT VALUE FROM UNNEST(DIM) WHERE NAME = 'Channel') IN ('Online', NULL)")
+    assert run(sql) == []
+
+
+def test_not_exists_is_true_when_the_element_is_missing():
+    #BigQuery: 2025-01-02 and 2025-01-03; EXISTS is FALSE, never NULL
+    sql = (f"SELECT KPI_DATE FROM `{TABLE}` WHERE KPI_ID = 1 AND NOT EXISTS "
+           "(SELECT 1 FROM UNNEST(DIM) AS D WHERE D.NAME = 'Channel' AND D.VALUE = 'Online') ORDER BY KPI_DATE")
+    assert run(sql) == [{'KPI_DATE': '2025-01-02'}, {'KPI_DATE': '2025-01-03'}]
+
+
+def test_date_of_a_column():
+    sql = (f"SELECT DATE(KPI_DATE) AS DAY FROM `{TABLE}` "
+           "WHERE KPI_ID = 1 AND DATE(KPI_DATE) >= '2025-01-02' ORDER BY DAY")
+    assert run(sql) == [{'DAY': '2025-01-02'}, {'DAY': '2025-01-03'}]
+
+
+@pytest.mark.parametrize('interval, earlier, later', [
+    ('1 DAY', '2024-12-31', '2025-01-02'),
+    ('2 WEEK', '2024-12-18', '2025-01-15'),
+    ('1 MONTH', '2024-12-01', '2025-02-01'),
+    ('1 QUARTER', '2024-10-01', '2025-04-01'),
+    ('1 YEAR', '2024-01-01', '2026-01-01'),
+])
+def test_date_sub_and_date_add_by_each_interval(interval, earlier, later):
+    sql = (f"SELECT DATE_SUB(KPI_DATE, INTERVAL {interval}) AS EARLIER, DATE_ADD(KPI_DATE, INTERVAL {interval}) AS LATER "
+           f"FROM `{TABLE}` WHERE KPI_ID = 1 AND KPI_DATE = '2025-01-01'")
+    assert run(sql) == [{'EARLIER': earlier, 'LATER': later}]
+
+
+def test_date_sub_clamps_to_the_end_of_a_shorter_month():
+    sql = f"SELECT DATE_SUB(DATE '2025-05-31', INTERVAL 1 QUARTER) AS D FROM `{TABLE}` WHERE KPI_ID = 1 LIMIT 1"
+    assert run(sql) == [{'D': '2025-02-28'}]
+
+
+def test_date_sub_by_isoweek_is_left_to_bigquery():
+    sql = f"SELECT DATE_SUB(KPI_DATE, INTERVAL 1 ISOWEEK) AS D FROM `{TABLE}` WHERE KPI_ID = 1"
+    with pytest.raises(UnsupportedQuery):
+        run(sql)
@@ -0,0 +1,34 @@
+"""logging off the caller's thread: what a record carries across the queue"""
+import json
+import logging
+import queue
+from utils import logger as L
+
+
+def prepared(msg, *args) -> logging.LogRecord:
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, args or None, None)
+    return L.ContextQueueHandler(queue.Queue()).prepare(record)
+
+
+def test_object_payload_is_captured_when_logged(tmp_path, monkeypatch):
+    state = {'rows': [1, 2]}
+    record = prepared(state)
+    state['rows'].append(3)
+
+    monkeypatch.setattr(L, 'LOGS_DIR', str(tmp_path))
+    line = json.loads(L.JsonLinesFileHandler().format(record))
+    path, ref = line['payload_ref'].split('#')
+    stored = json.loads((tmp_path / path).read_text())
+    assert stored == {'ref': ref, 'payload': {'rows': [1, 2]}}
+    assert line['msg'] == "{'rows': [1, 2]}"
+
+
+def test_long_message_keeps_a_preview_and_the_full_text_as_payload():
+    record = prepared('x' * (L.LOG_MAX_MESSAGE_CHARS + 10))
+    assert record.msg.endswith(f"... [{L.LOG_MAX_MESSAGE_CHARS + 10} chars]")
+    assert json.loads(record.payload) == 'x' * (L.LOG_MAX_MESSAGE_CHARS + 10)
+
+
+def test_short_message_has_no_payload():
+    record = prepared('rows: %d', 3)
+    assert record.msg == 'rows: 3' and record.payload is None
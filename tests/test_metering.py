@@ -0,0 +1,59 @@
+"""token metering: per-turn breakdowns, budgets and cost estimates"""
+from types import SimpleNamespace
+from constants import BIGQUERY_WORST_QUERIES, CHART_SPEC_AGENT_MODEL, MODEL_PRICING
+from utils.metering import Meter, estimate_cost
+from utils.turn_context import turn_scope
+
+
+def usage(total: int, prompt: int = 0, output: int = 0) -> SimpleNamespace:
+    return SimpleNamespace(prompt_token_count=prompt, candidates_token_count=output, total_token_count=total)
+
+
+def test_sub_session_usage_counts_towards_the_parent_turn_budget():
+    meter = Meter()
+    with turn_scope('parent'):
+        meter.record('starter_agent', usage(300))
+        meter.attach_sub_session('parent:kpi:1', 'parent')
+        meter.record('sql_writer_agent', usage(800), session_id='parent:kpi:1')
+        assert meter.turn_tokens('parent') == 1100
+        assert meter.budget_exceeded('parent:kpi:1', budget=1000)
+        assert not meter.budget_exceeded('parent:kpi:1', budget=2000)
+        meter.detach_sub_session('parent:kpi:1')
+        assert set(meter.turn_usage('parent')) == {'starter_agent', 'sql_writer_agent'}
+
+
+def test_cost_is_priced_by_the_agent_model():
+    meter = Meter()
+    record = meter.record('chart_spec_agent', usage(1_000_000, prompt=1_000_000), model_version='served-model-suffix')
+    assert record.model == CHART_SPEC_AGENT_MODEL
+    assert record.cost_usd == MODEL_PRICING[CHART_SPEC_AGENT_MODEL]['input']
+    assert meter.record('unknown_agent', usage(10), model_version='not-priced').cost_usd == 0
+
+
+def test_cached_and_thinking_tokens_are_priced_apart():
+    cost = estimate_cost('gemini-2.5-flash', prompt=1_000_000, cached=400_000, output=100_000)
+    assert abs(cost - (0.6 * 0.30 + 0.4 * 0.075 + 0.1 * 2.50)) < 1e-12
+
+
+def test_turn_breakdown_closes_into_the_turn_histogram():
+    meter = Meter()
+    with turn_scope('session-1') as turn:
+        meter.record('sql_writer_agent', usage(300))
+        meter.record('sql_writer_agent', usage(200))
+        meter.record('sql_critic_agent', usage(100))
+        assert meter.turn_usage()['sql_writer_agent']['calls'] == 2
+        assert meter.turn_tokens() == 600
+        assert not meter.budget_exceeded(budget=None)
+    meter.end_turn('session-1', turn)
+    assert meter.turn_usage('session-1', turn) == {}
+    assert meter.turn_histogram.to_dict() == {'count': 1, 'mean': 600, 'buckets': {'<=1024': 1}}
+    assert meter.summary()['by_agent']['sql_writer_agent']['total_token_count'] == 500
+
+
+def test_worst_queries_are_kept_per_kpi():
+    meter = Meter()
+    for billed in (10, 30, 20):
+        meter.record_query('sql_writer_agent', {'bytes_billed': billed, 'job_id': f'job_{billed}'}, [7], 'SELECT 1')
+    worst = meter.worst_query_report()['7']
+    assert [q['bytes_billed'] for q in worst] == sorted((10, 30, 20), reverse=True)[:BIGQUERY_WORST_QUERIES]
+    assert meter.summary()['bigquery_jobs']['jobs'] == 3
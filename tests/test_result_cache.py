@@ -0,0 +1,84 @@
+"""result cache: which queries it keys and stores, and delta refreshes of a moved range"""
+import asyncio
+import pandas as pd
+from utils.backends import Backend
+from utils.local_mirror import wide_frame
+from utils.local_sql import execute
+from utils.result_cache import ResultCache, query_key
+
+TABLE = 'project.dataset.KPI_DATA'
+
+ROWS = [
+    {'KPI_DATE': f'2025-01-0{day}', 'DIM': [], 'INT': [{'NAME': 'Sales', 'VALUE': day * 10}]}
+    for day in (1, 2, 3)
+]
+
+SELECT = (f"SELECT KPI_DATE, (SELECT VALUE FROM UNNEST(INT) WHERE NAME = 'Sales') AS SALES "
+          f"FROM `{TABLE}` WHERE KPI_ID = 1 AND ")
+
+
+class LocalBigQuery(Backend):
+    """answers execute_sql from ROWS and records the queries it ran"""
+
+    def __init__(self):
+        self.queries = []
+
+    async def serve_tool(self, tool_name, args, call_key):
+        self.queries.append(args['query'])
+        frame = wide_frame(1, ROWS)
+        rows = execute(args['query'], lambda kpi_ids: frame[frame['KPI_ID'].isin(kpi_ids)], TABLE)
+        return {'status': 'SUCCESS', 'rows': rows}
+
+
+def cache(tmp_path) -> tuple[ResultCache, LocalBigQuery]:
+    inner = LocalBigQuery()
+    return ResultCache(inner, root=str(tmp_path), table_id=TABLE), inner
+
+
+def serve(result_cache: ResultCache, sql: str, call: int) -> dict:
+    return asyncio.run(result_cache.serve_tool('execute_sql', {'query': sql}, call))
+
+
+def test_moved_range_reuses_stored_rows_and_fetches_the_rest(tmp_path):
+    result_cache, inner = cache(tmp_path)
+    first = serve(result_cache, SELECT + "KPI_DATE BETWEEN '2025-01-01' AND '2025-01-02' ORDER BY KPI_DATE", 1)
+    second = serve(result_cache, SELECT + "KPI_DATE BETWEEN '2025-01-01' AND '2025-01-03' ORDER BY KPI_DATE", 2)
+    assert [row['SALES'] for row in first['rows']] == [10, 20]
+    assert [row['SALES'] for row in second['rows']] == [10, 20, 30]
+    assert 'NOT BETWEEN' in inner.queries[-1]
+    assert result_cache.stats()['rows_reused'] == 2 and result_cache.stats()['rows_fetched'] == 1
+
+
+def test_ge_le_range_is_cached(tmp_path):
+    result_cache, _ = cache(tmp_path)
+    assert result_cache._plan(SELECT + "KPI_DATE >= '2025-01-01' AND KPI_DATE <= '2025-01-02'") is not None
+
+
+def test_in_equals_and_not_equals_are_not_cached(tmp_path):
+    result_cache, inner = cache(tmp_path)
+    for condition in ("KPI_DATE IN ('2025-01-01', '2025-01-03')", "KPI_DATE = '2025-01-02'",
+                      "KPI_DATE >= '2025-01-01' AND KPI_DATE != '2025-01-02'"):
+        assert result_cache._plan(SELECT + condition) is None
+    #an IN list recorded as its min-max range would answer with the date in between
+    serve(result_cache, SELECT + "KPI_DATE IN ('2025-01-01', '2025-01-03')", 1)
+    response = serve(result_cache, SELECT + "KPI_DATE IN ('2025-01-01', '2025-01-03')", 2)
+    assert [row['SALES'] for row in response['rows']] == [10, 30]
+    assert len(inner.queries) == 2 and result_cache.stats()['bypassed'] == 5
+
+
+def test_key_masks_only_the_range_bounds():
+    assert query_key(SELECT + "KPI_DATE BETWEEN '2025-01-01' AND '2025-01-02'") \
+        == query_key(SELECT + "KPI_DATE BETWEEN '2025-02-01' AND '2025-02-02'")
+    assert query_key(SELECT + "KPI_DATE >= '2025-01-01' AND KPI_DATE != '2025-01-02'") \
+        != query_key(SELECT + "KPI_DATE >= '2025-01-01' AND KPI_DATE != '2025-01-03'")
+
+
+def test_kpi_date_under_or_is_not_cached(tmp_path):
+    result_cache, _ = cache(tmp_path)
+    sql = SELECT + "KPI_DATE BETWEEN '2025-01-01' AND '2025-01-03' AND (KPI_DATE >= '2025-01-02' OR KPI_ID = 2)"
+    assert result_cache._plan(sql) is None
+
+
+def test_limit_is_not_cached(tmp_path):
+    result_cache, _ = cache(tmp_path)
+    assert result_cache._plan(SELECT + "KPI_DATE >= '2025-01-01' LIMIT 2") is None
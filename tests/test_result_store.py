@@ -0,0 +1,57 @@
+"""result store: handles, per-session ownership and the encodings read from a stored table"""
+from utils.result_store import ResultStore, to_table
+from utils.turn_context import turn_scope
+
+ROWS = [{'KPI_DATE': f'2025-01-{day:02d}', 'SALES': day * 10} for day in range(1, 31)]
+
+
+def test_rows_round_trip_through_the_handle():
+    store = ResultStore()
+    handle = store.put(ROWS, owner='session-1')
+    assert store.rows(handle) == ROWS
+    assert store.summary(handle) == {'result': handle, 'row_count': 30, 'columns': {'KPI_DATE': 'string', 'SALES': 'int64'}}
+    assert store.frame(handle) is store.frame(handle)
+
+
+def test_no_rows_store_nothing():
+    store = ResultStore()
+    assert store.put([], owner='session-1') is None and len(store) == 0
+
+
+def test_mixed_json_types_are_kept_as_strings():
+    table = to_table([{'VALUE': 1}, {'VALUE': 'n/a'}])
+    assert table.column('VALUE').to_pylist() == ['1', 'n/a']
+
+
+def test_results_belong_to_the_session_of_the_current_turn():
+    store = ResultStore()
+    with turn_scope('session-1'):
+        handle = store.put(ROWS)
+    assert store.release('session-2') == 0 and store.rows(handle) == ROWS
+    assert store.release('session-1') == 1 and store.rows(handle) is None
+
+
+def test_one_session_does_not_evict_another():
+    store = ResultStore(max_tables=2)
+    kept = store.put(ROWS, owner='session-1')
+    handles = [store.put(ROWS, owner='session-2') for _ in range(3)]
+    assert store.table(kept) is not None
+    assert store.table(handles[0]) is None and all(store.table(h) is not None for h in handles[1:])
+
+
+def test_prompt_samples_rows_within_the_token_budget():
+    store = ResultStore()
+    handle = store.put(ROWS, owner='session-1')
+    full = store.to_prompt(handle, token_budget=1000)
+    sampled = store.to_prompt(handle, token_budget=80)
+    assert 'All rows (CSV)' in full and full.split('All rows (CSV):')[1].count('2025-01-') == 30
+    assert 'evenly spaced rows' in sampled and '2025-01-01' in sampled and '2025-01-30' in sampled
+
+
+def test_exports(tmp_path):
+    store = ResultStore(export_dir=str(tmp_path))
+    handle = store.put(ROWS[:2], owner='session-1')
+    assert store.to_csv(handle) == '"KPI_DATE","SALES"\n"2025-01-01",10\n"2025-01-02",20\n'
+    assert store.to_markdown(handle, max_rows=1) == '| KPI_DATE | SALES |\n|---|---|\n| 2025-01-01 | 10 |'
+    assert store.to_parquet(handle).startswith(str(tmp_path))
+    assert store.parquet_bytes('res_unknown') is None
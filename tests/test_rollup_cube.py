@@ -0,0 +1,78 @@
+"""rollup cube answers against the same rows queried with local_sql"""
+from datetime import date, datetime, timezone
+import pytest
+from utils.local_mirror import wide_frame
+from utils.local_sql import execute
+from utils.rollup_cube import CubeMiss, RollupCube, parse_date_range, records_from_frame
+
+TABLE = 'project.dataset.KPI_DATA'
+TODAY = date(2025, 1, 20)
+#Channel alternates Online/Retail, and is missing on the 7th
+ROWS = [
+    {'KPI_DATE': f'2025-01-{day:02d}',
+     'DIM': [] if day == 7 else [{'NAME': 'Channel', 'VALUE': 'Online' if day % 2 else 'Retail'}],
+     'INT': [{'NAME': 'Sales', 'VALUE': day}]}
+    for day in range(1, 15)
+]
+KPIS = {'1': {'kpi_name': 'TV Sales', 'indicators_int': [{'name': 'Sales', 'aggregation': 'SUM'}]}}
+RESOLUTION = {'kpis': [{'kpi_id': '1', 'kpi_name': 'TV Sales', 'phrase': 'tv sales'}], 'filters': []}
+
+
+def cube() -> RollupCube:
+    records = records_from_frame(wide_frame(1, ROWS))
+    return RollupCube.from_records(records, KPIS, built_at=datetime.now(timezone.utc).isoformat(),
+                                   latest_date='2025-01-14', table=TABLE)
+
+
+def local_sql(sql: str) -> list[dict]:
+    frame = wide_frame(1, ROWS)
+    return execute(sql, lambda kpi_ids: frame[frame['KPI_ID'].isin(kpi_ids)], TABLE, today=TODAY)
+
+
+@pytest.mark.parametrize('question', [
+    'tv sales between 2025-01-01 and 2025-01-14',
+    'daily tv sales between 2025-01-03 and 2025-01-09',
+    'weekly tv sales between 2025-01-06 and 2025-01-12',
+    'tv sales by channel between 2025-01-01 and 2025-01-14',
+])
+def test_answer_matches_its_sql(question):
+    answer = cube().answer(question, RESOLUTION, today=TODAY)
+    assert answer['rows'] == local_sql(answer['sql'])
+
+
+def test_breakdown_keeps_rows_without_the_dimension():
+    rows = cube().answer('tv sales by channel between 2025-01-01 and 2025-01-14', RESOLUTION, today=TODAY)['rows']
+    assert rows == [{'CHANNEL': None, 'SALES': 7}, {'CHANNEL': 'Online', 'SALES': 42}, {'CHANNEL': 'Retail', 'SALES': 56}]
+
+
+def test_filter_on_a_dimension_value():
+    resolution = {**RESOLUTION, 'filters': [{'phrase': 'online', 'match': 'exact', 'matches': [
+        {'kpi_id': '1', 'kpi_name': 'TV Sales', 'dimension': 'Channel', 'physical_column': None, 'value': 'Online'}]}]}
+    answer = cube().answer('online tv sales between 2025-01-01 and 2025-01-14', resolution, today=TODAY)
+    assert answer['rows'] == [{'SALES': 42}] == local_sql(answer['sql'])
+
+
+@pytest.mark.parametrize('question, reason', [
+    ('average tv sales between 2025-01-01 and 2025-01-14', 'not a sum or count'),
+    ('tv sales between 2025-01-01 and 2025-01-19', 'range ends after cube data'),
+    ('tv sales', 'no single date range'),
+])
+def test_misses_are_counted_by_reason(question, reason):
+    rollup = cube()
+    with pytest.raises(CubeMiss, match=reason):
+        rollup.answer(question, RESOLUTION, today=TODAY)
+    assert rollup.misses == {reason: 1} and rollup.hits == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    cube().save(path)
+    question = 'daily tv sales by channel between 2025-01-01 and 2025-01-14'
+    assert RollupCube.load(path).answer(question, RESOLUTION, today=TODAY)['rows'] \
+        == cube().answer(question, RESOLUTION, today=TODAY)['rows']
+
+
+def test_relative_date_ranges():
+    assert parse_date_range('sales last 7 days', TODAY) == (date(2025, 1, 13), date(2025, 1, 19))
+    assert parse_date_range('sales last month', TODAY) == (date(2024, 12, 1), date(2024, 12, 31))
+    assert parse_date_range('sales last week vs this month', TODAY) is None
@@ -0,0 +1,65 @@
+"""SQL guard rewrites and the dry runs behind its bytes budget"""
+import asyncio
+from constants import DATA_TABLE_ID
+from utils import sql_guard
+from utils.sql_guard import describe_rewrites, guard_query, rewrite
+
+TABLE = 'project.dataset.KPI_DATA'
+SERIES = (f"SELECT KPI_DATE, (SELECT VALUE FROM UNNEST(INT) WHERE NAME = 'Sales') AS SALES\n"
+          f"FROM `{TABLE}`\nWHERE KPI_ID = 1 AND KPI_DATE >= '2024-01-01'\nORDER BY KPI_DATE")
+
+
+def test_per_kpi_daily_series_runs_as_written():
+    assert rewrite(SERIES, TABLE) == (SERIES, [])
+
+
+def test_select_star_gets_a_limit():
+    sql, rewrites = rewrite(f"SELECT * FROM `{TABLE}` WHERE KPI_ID = 1 AND KPI_DATE = '2025-01-01'", TABLE)
+    assert sql.endswith('\nLIMIT 100') and rewrites == ['LIMIT 100 on a row dump']
+
+
+def test_dump_without_a_kpi_id_filter_gets_a_limit():
+    sql, rewrites = rewrite(f"SELECT KPI_ID, KPI_DATE FROM `{TABLE}` WHERE KPI_DATE >= '2025-01-01' LIMIT 5000", TABLE)
+    assert sql.endswith('LIMIT 100') and rewrites == ['LIMIT 5000 capped to 100']
+
+
+def test_aggregation_is_never_limited():
+    sql = f"SELECT KPI_ID, COUNT(*) AS N FROM `{TABLE}` WHERE KPI_DATE >= '2025-01-01' GROUP BY KPI_ID"
+    assert rewrite(sql, TABLE) == (sql, [])
+
+
+def test_missing_kpi_date_gets_a_window_that_survives_a_trailing_comment():
+    sql, rewrites = rewrite(f"SELECT KPI_DATE FROM `{TABLE}` WHERE KPI_ID = 1 -- daily\nORDER BY KPI_DATE", TABLE)
+    assert "KPI_DATE >= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY) AND (KPI_ID = 1 -- daily\n)" in sql
+    assert rewrites == ['KPI_DATE window: last 90 days']
+    assert 'window' in describe_rewrites(rewrites)
+
+
+def test_nested_select_star_drops_unused_arrays():
+    sql, rewrites = rewrite(
+        f"SELECT KPI_DATE, (SELECT VALUE FROM UNNEST(INT) WHERE NAME = 'Sales') AS SALES "
+        f"FROM (SELECT * FROM `{TABLE}` WHERE KPI_ID = 1 AND KPI_DATE >= '2025-01-01')", TABLE)
+    assert 'SELECT * EXCEPT (DIM, FLOAT)' in sql and rewrites == ['SELECT * without DIM, FLOAT']
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.clients = 0
+
+    def client(self, project_id):
+        self.clients += 1
+        return FakeClient()
+
+
+class FakeClient:
+    def query(self, sql, job_config=None):
+        assert job_config.dry_run
+        return type('Job', (), {'total_bytes_processed': 2000 if 'LIMIT' in sql else 3000})()
+
+
+def test_dry_runs_use_the_executor_client(monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(sql_guard, 'find_backend', lambda cls: executor)
+    record = asyncio.run(guard_query(f"SELECT * FROM `{DATA_TABLE_ID}` WHERE KPI_ID = 1 AND KPI_DATE = '2025-01-01'", 'project'))
+    assert executor.clients == 2
+    assert record['bytes_processed'] == 2000 and record['bytes_saved'] == 1000 and record['rejected'] is None
@@ -0,0 +1,41 @@
+"""merging per-KPI sub-query results on KPI_DATE"""
+import pytest
+from utils.sub_queries import merge_on_kpi_date
+
+SALES = {'kpi_id': 1, 'kpi_name': '1. TV Sales'}
+ORDERS = {'kpi_id': 2, 'kpi_name': '2. Broadband Orders'}
+
+
+def test_outer_join_on_kpi_date_prefixes_colliding_columns():
+    merged = merge_on_kpi_date([
+        (SALES, [{'KPI_DATE': '2025-01-01', 'VALUE': 10}, {'KPI_DATE': '2025-01-02', 'VALUE': 20}]),
+        (ORDERS, [{'KPI_DATE': '2025-01-02', 'VALUE': 5}]),
+    ])
+    assert merged == [
+        {'KPI_DATE': '2025-01-01', 'TV_SALES_VALUE': 10.0, 'BROADBAND_ORDERS_VALUE': None},
+        {'KPI_DATE': '2025-01-02', 'TV_SALES_VALUE': 20.0, 'BROADBAND_ORDERS_VALUE': 5.0},
+    ]
+
+
+def test_shared_text_columns_are_merge_keys():
+    merged = merge_on_kpi_date([
+        (SALES, [{'KPI_DATE': '2025-01-01', 'CHANNEL': 'Online', 'SALES': 10},
+                 {'KPI_DATE': '2025-01-01', 'CHANNEL': 'Retail', 'SALES': 20}]),
+        (ORDERS, [{'KPI_DATE': '2025-01-01', 'CHANNEL': 'Online', 'ORDERS': 5}]),
+    ])
+    assert [(row['CHANNEL'], row['SALES'], row['ORDERS']) for row in merged] == [('Online', 10, 5), ('Retail', 20, None)]
+
+
+def test_extra_dimension_on_one_side_is_not_merged():
+    #a per-channel KPI joined on KPI_DATE alone would repeat the other KPI's value per channel
+    with pytest.raises(ValueError, match='repeated rows'):
+        merge_on_kpi_date([
+            (SALES, [{'KPI_DATE': '2025-01-01', 'CHANNEL': 'Online', 'SALES': 10},
+                     {'KPI_DATE': '2025-01-01', 'CHANNEL': 'Retail', 'SALES': 20}]),
+            (ORDERS, [{'KPI_DATE': '2025-01-01', 'ORDERS': 5}]),
+        ])
+
+
+def test_result_without_kpi_date_is_rejected():
+    with pytest.raises(ValueError, match='no KPI_DATE'):
+        merge_on_kpi_date([(SALES, [{'VALUE': 1}]), (ORDERS, [{'KPI_DATE': '2025-01-01', 'VALUE': 2}])])
@@ -1,6 +1,8 @@
+from collections import deque
 from dotenv import load_dotenv
 
 load_dotenv(override=True)  # take environment variables from .env file
 
 #accumulate events for upstream UI showcase
-EVENT_LOG_ACCUMULATOR = []
\ No newline at end of file
+from constants import EVENT_LOG_MAX_ENTRIES
+EVENT_LOG_ACCUMULATOR = deque(maxlen=EVENT_LOG_MAX_ENTRIES)
\ No newline at end of file
@@ -4,7 +4,30 @@ from google.adk.sessions import InMemorySessionService
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.runners import Runner
 import time
+import google.auth
+import google.auth.exceptions
+from google.auth.credentials import AnonymousCredentials, Credentials
 from utils import EVENT_LOG_ACCUMULATOR 
+from utils.tracing import get_tracer
+from utils.metering import get_meter, TOKEN_FIELDS
+from utils.turn_context import current_turn
+from utils.backends import is_offline
+from utils.bigquery_jobs import kpi_ids_in
+from utils.result_store import get_result_store, result_state
+from utils.downsampling import result_note
+
+def get_bigquery_credentials() -> Credentials:
+    """application default credentials, or anonymous ones when BigQuery is served offline"""
+    if is_offline('tools'):
+        return AnonymousCredentials()
+    # https://cloud.google.com/docs/authentication/provide-credentials-adc
+    try:
+        application_default_credentials, _ = google.auth.default()
+    except google.auth.exceptions.DefaultCredentialsError as e:
+        #a backend installed after import (e.g. by a CLI flag) may still serve every query
+        print(f"No application default credentials, BigQuery calls will fail unless served offline: {e}")
+        return AnonymousCredentials()
+    return application_default_credentials
 
 async def process_agent_response(
         event: Event, 
@@ -20,11 +43,12 @@ async def process_agent_response(
     state_changes = {}
     try:
         #update session
-        current_session = await session_service.get_session(
-            app_name=app_name,
-            user_id=user_id,
-            session_id=session_id
-        )
+        with get_tracer().span('get_session', 'state_io'):
+            current_session = await session_service.get_session(
+                app_name=app_name,
+                user_id=user_id,
+                session_id=session_id
+            )
         
         # ---- 1. Final Text Response ----
         if event.content and event.content.parts:
@@ -71,11 +95,35 @@ async def process_agent_response(
             for response in responses:
                 tool_name = response.name
                 result_dict = response.response or {}
+                # convert (and profile) the rows once; state and the event log keep the handle instead of a copy of them
+                state_changes.update(result_state(result_dict.get("rows")))
+                handle = state_changes['latest_sql_result']
+                if handle:
+                    result_dict = {**result_dict, "rows": get_result_store().summary(handle)}
                 final_response[f"[tool_response]_{tool_name}"] = result_dict
-                state_changes['latest_sql_response'] = result_dict.get("rows")
                 
                 state_changes['latest_bq_execution_status'] = result_dict.get("status")
-                
+
+                # flag results the executor re-aggregated (or truncated) to fit the row cap
+                state_changes['latest_sql_downsampling'] = result_dict.get("downsampled")
+                state_changes['latest_sql_downsampling_note'] = result_note(result_dict)
+
+                # keep the BigQuery job's statistics when our executor ran it
+                stats = result_dict.get("job_stats")
+                state_changes['latest_bq_job_stats'] = stats
+                if stats:
+                    query = current_session.state.get("latest_sql_output") or ""
+                    get_meter().record_query(event.author, stats, kpi_ids_in(query), query, session_id=session_id)
+                    for name in ('bytes_processed', 'bytes_billed', 'slot_ms'):
+                        state_changes[f'app:bq_{name}'] = current_session.state.get(f'app:bq_{name}', 0) + (stats.get(name) or 0)
+                    turn_jobs = current_session.state.get('turn_bq_jobs') or {}
+                    if turn_jobs.get('turn') != current_turn():
+                        turn_jobs = {'turn': current_turn(), 'jobs': []}
+                    state_changes['turn_bq_jobs'] = {
+                        'turn': turn_jobs['turn'],
+                        'jobs': turn_jobs['jobs'] + [{**stats, 'agent': event.author, 'kpi_ids': kpi_ids_in(query)}],
+                    }
+
                 # track BQ API failures
                 if result_dict.get("status") == "ERROR":
                     state_changes["app:bq_api_failure_count"] = (
@@ -84,45 +132,32 @@ async def process_agent_response(
 
         # ---- 4. Usage Metadata ----
         if event.usage_metadata:
-            ############ update general cache stats ############
-            
-            # #Number of contents stored in this cache (ONE_TIME CALL SINCE IMMUTABLE)
-            # if not state_changes.get("app:cached_contents_count"):
-            #     state_changes["app:cached_contents_count"] = event.cache_metadata.cached_contents_count
-
-            ##Number of tokens in the cached part in the input (the cached content). (ONE_TIME CALL SINCE IMMUTABLE)
-            state_changes['app:cached_content_token_count'] = event.usage_metadata.cached_content_token_count
-
-            # #Number of invocations this cache has been used for
-            # state_changes['app:cache_invocations_used'] = state_changes.get('app:cache_invocations_used',0) + event.cache_metadata.invocations_used
-
-            ############ update token usage stats ############
-            
-            #Number of tokens in the response(s).
-            n_tokens = event.usage_metadata.candidates_token_count
-            state_changes['app:candidates_token_count'] = state_changes.get('app:candidates_token_count',0) + n_tokens if n_tokens else 0
-            
-            #Number of tokens in the request. When `cached_content` is set, this is still the total effective prompt size meaning this includes the number of tokens in the cached content.
-            prompt_token_count = event.usage_metadata.prompt_token_count
-            state_changes['app:prompt_token_count'] = state_changes.get('app:prompt_token_count',0) + prompt_token_count if prompt_token_count else 0
-
-            #Number of tokens present in thoughts output.
-            thoughts_token_count = event.usage_metadata.thoughts_token_count
-            state_changes['app:thoughts_token_count'] = state_changes.get('app:thoughts_token_count',0) + thoughts_token_count if thoughts_token_count else 0
-            
-            #Number of tokens present in tool-use prompt(s).
-            tool_use_prompt_token_count = event.usage_metadata.tool_use_prompt_token_count
-            state_changes['app:tool_use_prompt_token_count'] = state_changes.get('app:tool_use_prompt_token_count',0) + tool_use_prompt_token_count if tool_use_prompt_token_count else 0
-
-            #total tokens used
-            total_tokens_used = event.usage_metadata.total_token_count or 0
-            final_response["total_token_count"] = final_response.get("total_token_count", 0) + total_tokens_used
-            state_changes["app:total_token_count"] = (
-                current_session.state.get("app:total_token_count", 0) + total_tokens_used
+            #record per agent/turn in the meter (also aggregates across sessions)
+            record = get_meter().record(
+                agent=event.author,
+                usage=event.usage_metadata,
+                model_version=getattr(event, "model_version", None),
+                session_id=session_id
             )
-        
-        #Accumulate logs for UI upstream
-        EVENT_LOG_ACCUMULATOR.append(final_response)
+
+            #accumulate every counter on top of the session's running totals
+            for name, value in record.token_counts().items():
+                state_changes[f'app:{name}'] = current_session.state.get(f'app:{name}', 0) + value
+            state_changes['app:estimated_cost_usd'] = current_session.state.get('app:estimated_cost_usd', 0.0) + record.cost_usd
+
+            #per-agent breakdown of the current turn
+            turn_usage = current_session.state.get('turn_token_usage') or {}
+            if turn_usage.get('turn') != current_turn():
+                turn_usage = {'turn': current_turn(), 'agents': {}}
+            agents = dict(turn_usage['agents'])
+            agent_usage = dict(agents.get(event.author) or {name: 0 for name in TOKEN_FIELDS})
+            for name, value in record.token_counts().items():
+                agent_usage[name] = agent_usage.get(name, 0) + value
+            agent_usage['cost_usd'] = agent_usage.get('cost_usd', 0.0) + record.cost_usd
+            agents[event.author] = agent_usage
+            state_changes['turn_token_usage'] = {'turn': turn_usage['turn'], 'agents': agents}
+
+            final_response["total_token_count"] = final_response.get("total_token_count", 0) + record.total_token_count
 
         # --- 5. Apply State Changes ---
         if state_changes:
@@ -133,7 +168,8 @@ async def process_agent_response(
                 timestamp=time.time(),
             )
 
-            await session_service.append_event(current_session, system_event)
+            with get_tracer().span('append_event', 'state_io', keys=len(state_changes)):
+                await session_service.append_event(current_session, system_event)
 
     except Exception as e:
         print(f"Error in process_agent_response: {e}")
@@ -160,12 +196,16 @@ async def call_agent_async(
     #set user_query into final_response
     final_response['user_query'] = user_query
     
-    try:
-        async for event in runner.run_async(
-            user_id=user_id, session_id=session_id, new_message=content
-        ):
-            await process_agent_response(event, app_name, user_id, session_id, session_service, artifact_service, final_response)
-    except Exception as e:
-        print(f"Error during agent call: {e}")
-    
+    with get_tracer().span(f"agent:{runner.agent.name}", 'agent') as agent_span:
+        try:
+            async for event in runner.run_async(
+                user_id=user_id, session_id=session_id, new_message=content
+            ):
+                await process_agent_response(event, app_name, user_id, session_id, session_service, artifact_service, final_response)
+        except Exception as e:
+            agent_span.set_attribute('error', str(e))
+            print(f"Error during agent call: {e}")
+
+    #Accumulate logs for UI upstream, once per agent call
+    EVENT_LOG_ACCUMULATOR.append(final_response)
     return final_response
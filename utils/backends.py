@@ -0,0 +1,133 @@
+from typing import Any, Optional
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+
+class Backend:
+    """stands in for Gemini and/or BigQuery inside the agent callbacks
+
+    serve_* return None to let the real call go ahead; observe_* see what the
+    real call produced, matched by the call_key passed to serve_*. The default
+    implementation is a pass-through.
+    """
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        return None
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        pass
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        return None
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        pass
+
+
+class CompositeBackend(Backend):
+    """routes model calls to one backend and tool calls to another (None means live)
+
+    offline only when both sides are; model_offline and tools_offline tell
+    them apart, e.g. a fake model in front of live BigQuery.
+    """
+
+    def __init__(self, model: Optional[Backend] = None, tools: Optional[Backend] = None):
+        self.model = model
+        self.tools = tools
+        self.model_offline = model is not None and getattr(model, 'offline', False)
+        self.tools_offline = tools is not None and getattr(tools, 'offline', False)
+        self.offline = self.model_offline and self.tools_offline
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        return None if self.model is None else await self.model.serve_model(agent_name, llm_request, call_key)
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        if self.model is not None:
+            self.model.observe_model(call_key, llm_response)
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        return None if self.tools is None else await self.tools.serve_tool(tool_name, args, call_key)
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        if self.tools is not None:
+            self.tools.observe_tool(call_key, tool_response)
+
+
+class RateLimitedBackend(Backend):
+    """waits on shared rate limiters before each model/tool call, then defers to inner"""
+
+    def __init__(self, inner: Optional[Backend] = None, model_limiter=None, tool_limiter=None):
+        self.inner = inner
+        self.model_limiter = model_limiter
+        self.tool_limiter = tool_limiter
+        self.offline = inner is not None and getattr(inner, 'offline', False)
+        self.model_offline = inner is not None and getattr(inner, 'model_offline', self.offline)
+        self.tools_offline = inner is not None and getattr(inner, 'tools_offline', self.offline)
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        if self.model_limiter is not None:
+            await self.model_limiter.acquire()
+        return None if self.inner is None else await self.inner.serve_model(agent_name, llm_request, call_key)
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        if self.inner is not None:
+            self.inner.observe_model(call_key, llm_response)
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if self.tool_limiter is not None and tool_name == 'execute_sql':
+            await self.tool_limiter.acquire()
+        return None if self.inner is None else await self.inner.serve_tool(tool_name, args, call_key)
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        if self.inner is not None:
+            self.inner.observe_tool(call_key, tool_response)
+
+
+_backend: Optional[Backend] = None
+
+
+def set_backend(backend: Optional[Backend]) -> None:
+    """install a backend for every agent in this process (None restores live calls)"""
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> Optional[Backend]:
+    """the installed backend, creating the configured cassette or BigQuery executor, local mirror and result cache on first use"""
+    global _backend
+    if _backend is None:
+        from constants import CASSETTE_MODE, LOCAL_MIRROR_ENABLED, RESULT_CACHE_ENABLED, BIGQUERY_EXECUTOR_ENABLED
+        if CASSETTE_MODE != 'off':
+            from utils.cassette import Cassette
+            _backend = Cassette.from_config()
+        elif BIGQUERY_EXECUTOR_ENABLED:
+            from utils.bigquery_jobs import BigQueryExecutor
+            _backend = BigQueryExecutor()
+        if LOCAL_MIRROR_ENABLED:
+            from utils.local_mirror import LocalMirror, LocalMirrorBackend
+            _backend = LocalMirrorBackend(LocalMirror(), _backend)
+        if RESULT_CACHE_ENABLED and CASSETTE_MODE == 'off':
+            #recorded runs must replay the exact tool responses, so the cache stays out of them
+            from utils.result_cache import ResultCache
+            _backend = ResultCache(_backend)
+    return _backend
+
+
+def find_backend(cls: type) -> Optional[Backend]:
+    """the first backend of this type in the installed chain"""
+    backend = get_backend()
+    while backend is not None and not isinstance(backend, cls):
+        backend = getattr(backend, 'inner', None) or getattr(backend, 'tools', None)
+    return backend
+
+
+def is_offline(side: Optional[str] = None) -> bool:
+    """True when model and BigQuery calls are served without live backends
+
+    side 'model' or 'tools' asks about Gemini or BigQuery calls alone.
+    """
+    backend = get_backend()
+    if backend is None:
+        return False
+    offline = getattr(backend, 'offline', False)
+    return getattr(backend, f"{side}_offline", offline) if side else offline
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Optional
+from constants import (
+    BIGQUERY_LOCATION, BIGQUERY_MAX_RESULT_ROWS, BIGQUERY_QUERY_DEADLINE_S, BIGQUERY_POLL_INITIAL_S, BIGQUERY_POLL_MAX_S,
+    DOWNSAMPLE_ENABLED,
+)
+from utils.backends import Backend
+from utils.downsampling import ResultColumns, describe, downsample_sql, estimate_sql, indicator_aggregations, plan
+from utils.local_sql import TOKEN_PATTERN
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+from utils.turn_context import current_session_id, register_turn_end_hook
+
+logger = get_logger(__name__)
+
+#statements left to the ADK tool, which enforces the toolset's write mode
+WRITE_WORDS = {'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'CREATE', 'DROP', 'ALTER', 'TRUNCATE', 'EXPORT', 'LOAD',
+               'CALL', 'DECLARE', 'SET', 'BEGIN', 'EXECUTE', 'GRANT', 'REVOKE'}
+
+KPI_ID_FILTER = re.compile(r"\bKPI_ID\s*(?:=\s*(\d+)|IN\s*\(([\d,\s]+)\))", re.IGNORECASE)
+
+
+def is_read_only(sql: str) -> bool:
+    """a single SELECT (or WITH ... SELECT) statement"""
+    words = [match.group().upper() for match in TOKEN_PATTERN.finditer(sql) if match.lastgroup == 'ident']
+    return bool(words) and words[0] in ('SELECT', 'WITH') and not WRITE_WORDS.intersection(words)
+
+
+def kpi_ids_in(sql: str) -> list[int]:
+    """KPI_IDs a query filters on, for grouping job statistics by KPI"""
+    ids = set()
+    for single, listed in KPI_ID_FILTER.findall(sql):
+        ids.update(int(value) for value in (single or listed).replace(',', ' ').split())
+    return sorted(ids)
+
+
+def job_stats(job, wall_ms: float) -> dict[str, Any]:
+    """what a finished (or failed) query job cost"""
+    return {
+        'job_id': job.job_id,
+        'bytes_processed': job.total_bytes_processed,
+        'bytes_billed': job.total_bytes_billed,
+        'slot_ms': job.slot_millis,
+        'cache_hit': job.cache_hit,
+        'wall_ms': round(wall_ms, 1),
+    }
+
+
+def _tool_value(value: Any) -> Any:
+    """as the ADK execute_sql tool returns it: JSON values as they are, anything else as a string"""
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        value = str(value)
+    return value
+
+
+class QueryCancelled(Exception):
+    """the job was cancelled while the caller waited on it, e.g. because its turn ended"""
+
+
+class QueryDeadlineExceeded(QueryCancelled):
+    pass
+
+
+class JobManager:
+    """submits query jobs and polls them with backoff, cancelling the ones nobody waits for any more
+
+    a job is cancelled when it outlives its deadline, when the task waiting on
+    it is cancelled (the turn timed out or was abandoned), or when the turn that
+    submitted it ends (cancel_session runs as a turn-end hook); run() then
+    raises rather than returning the job. Jobs carry ids generated here, so
+    they can be cancelled by id.
+    """
+
+    def __init__(self, deadline_s: float = BIGQUERY_QUERY_DEADLINE_S, poll_initial_s: float = BIGQUERY_POLL_INITIAL_S,
+                 poll_max_s: float = BIGQUERY_POLL_MAX_S):
+        self.deadline_s = deadline_s
+        self.poll_initial_s = poll_initial_s
+        self.poll_max_s = poll_max_s
+        #job id -> (client, owning session id)
+        self._outstanding: dict[str, tuple[Any, Optional[str]]] = {}
+        #ids of jobs cancelled while run() was waiting on them; done() is True for those too
+        self._cancelled: set[str] = set()
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = defaultdict(int)
+
+    async def run(self, client, sql: str, owner: Optional[str] = None, deadline_s: Optional[float] = None):
+        """the finished job; raises QueryDeadlineExceeded after cancelling a job that ran too long,
+        QueryCancelled when it was cancelled from elsewhere (its turn ended)"""
+        job_id = f"metric_mind_{uuid.uuid4().hex}"
+        with self._lock:
+            self._outstanding[job_id] = (client, owner)
+        self.counts['submitted'] += 1
+        deadline = time.monotonic() + (deadline_s or self.deadline_s)
+        try:
+            job = await asyncio.to_thread(client.query, sql, job_id=job_id)
+            delay = self.poll_initial_s
+            #done() reloads the job's status from BigQuery while it is running
+            while not await asyncio.to_thread(job.done):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.cancel(job_id, 'deadline')
+                    raise QueryDeadlineExceeded(
+                        f"Query did not finish within {deadline_s or self.deadline_s:g}s and was cancelled. "
+                        f"Narrow the KPI_DATE range or the KPI_IDs."
+                    )
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, self.poll_max_s)
+            if job_id in self._cancelled:
+                raise QueryCancelled(f"Query job {job_id} was cancelled before it finished.")
+            self.counts['finished'] += 1
+            return job
+        except asyncio.CancelledError:
+            self.cancel(job_id, 'abandoned')
+            raise
+        finally:
+            with self._lock:
+                self._outstanding.pop(job_id, None)
+                self._cancelled.discard(job_id)
+
+    def cancel(self, job_id: str, reason: str) -> None:
+        """cancel a running job and count the bytes it would still have processed"""
+        with self._lock:
+            client, _ = self._outstanding.pop(job_id, (None, None))
+            if client is not None:
+                #marked before the request, so a poll seeing done() never mistakes it for a finished job
+                self._cancelled.add(job_id)
+        if client is None:
+            return
+        try:
+            job = client.cancel_job(job_id)
+        except Exception as e:
+            #e.g. cancelled before BigQuery saw the submission
+            logger.warning(f"Could not cancel BigQuery job {job_id}: {e}")
+            with self._lock:
+                self._cancelled.discard(job_id)
+            return
+        self.counts[f'cancelled_{reason}'] += 1
+        avoided = max((getattr(job, 'estimated_bytes_processed', None) or 0) - (job.total_bytes_processed or 0), 0)
+        self.counts['bytes_avoided'] += avoided
+        logger.info(f"Cancelled BigQuery job {job_id} ({reason}), about {avoided} bytes not processed")
+
+    def cancel_session(self, session_id: Optional[str], turn: Optional[int] = None, reason: str = 'abandoned') -> int:
+        """cancel every outstanding job owned by session_id, the turn's session and not a sub-session"""
+        with self._lock:
+            job_ids = [job_id for job_id, (_, owner) in self._outstanding.items() if owner == session_id]
+        for job_id in job_ids:
+            self.cancel(job_id, reason)
+        return len(job_ids)
+
+    def outstanding(self) -> int:
+        return len(self._outstanding)
+
+    def stats(self) -> dict[str, Any]:
+        return {**dict(self.counts), 'outstanding': self.outstanding()}
+
+
+_job_manager = JobManager()
+
+
+def get_job_manager() -> JobManager:
+    return _job_manager
+
+
+#nothing started within a turn should outlive it
+register_turn_end_hook(_job_manager.cancel_session)
+
+
+class BigQueryExecutor(Backend):
+    """runs execute_sql SELECTs itself, so the response carries the job's statistics
+
+    responses match the ADK tool's (rows, status, result_is_likely_truncated)
+    plus a job_stats entry, and a downsampled entry when a result over the row
+    cap was re-aggregated instead of truncated. Dry runs and anything but a
+    plain SELECT fall through to the ADK tool.
+    """
+
+    def __init__(self, max_rows: int = BIGQUERY_MAX_RESULT_ROWS, location: str = BIGQUERY_LOCATION,
+                 jobs: Optional[JobManager] = None):
+        self.max_rows = max_rows
+        self.location = location
+        self.jobs = jobs or get_job_manager()
+        self._clients: dict[Optional[str], Any] = {}
+        self._lock = threading.Lock()
+
+    def client(self, project_id: Optional[str]):
+        """one client per project, shared across calls and threads"""
+        with self._lock:
+            if project_id not in self._clients:
+                from google.cloud import bigquery
+                from utils.agent_utils import get_bigquery_credentials
+
+                self._clients[project_id] = bigquery.Client(
+                    project=project_id, location=self.location, credentials=get_bigquery_credentials()
+                )
+            return self._clients[project_id]
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if tool_name != 'execute_sql' or args.get('dry_run') or not is_read_only(args.get('query') or ''):
+            return None
+        response = await self.run(args['query'], args.get('project_id'))
+        stats = response.get('job_stats')
+        if stats:
+            get_tracer().annotate_pending(
+                call_key,
+                job_id=stats['job_id'],
+                total_bytes_processed=stats['bytes_processed'],
+                total_bytes_billed=stats['bytes_billed'],
+                slot_ms=stats['slot_ms'],
+                cache_hit=stats['cache_hit'],
+                downsampled=bool(response.get('downsampled')),
+            )
+        return response
+
+    def _rows(self, job) -> tuple[list[dict[str, Any]], int, list[tuple[str, str, str]]]:
+        """the first max_rows rows, the result's full row count and its (name, type, mode) schema"""
+        iterator = job.result(max_results=self.max_rows)
+        rows = [{key: _tool_value(value) for key, value in row.items()} for row in iterator]
+        schema = [(field.name, field.field_type, field.mode) for field in iterator.schema or []]
+        return rows, iterator.total_rows or len(rows), schema
+
+    async def _downsample(self, client, job, sql: str, schema: list[tuple[str, str, str]], total_rows: int) -> Optional[dict]:
+        """re-aggregate an oversized result from the job's result table, None when it cannot be brought under the cap"""
+        columns = ResultColumns.from_schema(schema, indicator_aggregations(kpi_ids_in(sql)))
+        if columns is None or job.destination is None:
+            return None
+        destination = job.destination
+        table = f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+        try:
+            estimate_job = await self.jobs.run(client, estimate_sql(table, columns), owner=current_session_id())
+            estimates = dict(next(iter(await asyncio.to_thread(estimate_job.result))).items())
+            downsample = plan(columns, estimates, total_rows, self.max_rows)
+            if downsample is None:
+                return None
+            downsample_job = await self.jobs.run(client, downsample_sql(table, columns, downsample), owner=current_session_id())
+            rows, _, _ = await asyncio.to_thread(self._rows, downsample_job)
+        except Exception as e:
+            logger.warning(f"Could not downsample {total_rows} row result of job {job.job_id}: {e}")
+            return None
+        return {
+            'rows': rows,
+            'downsampled': {
+                **downsample,
+                'original_rows': total_rows,
+                'job_id': downsample_job.job_id,
+                'note': describe(downsample, columns, total_rows, self.max_rows),
+            },
+        }
+
+    async def run(self, sql: str, project_id: Optional[str]) -> dict:
+        """run a query through the job manager, on behalf of the current session"""
+        started = time.perf_counter()
+        job = None
+        try:
+            client = await asyncio.to_thread(self.client, project_id)
+            job = await self.jobs.run(client, sql, owner=current_session_id())
+            rows, total_rows, schema = await asyncio.to_thread(self._rows, job)
+        except Exception as e:
+            response = {'status': 'ERROR', 'error_details': str(e)}
+            if job is not None:
+                response['job_stats'] = job_stats(job, (time.perf_counter() - started) * 1000)
+            return response
+
+        response = {'status': 'SUCCESS', 'rows': rows}
+        #rather than truncating, aggregate what does not fit into coarser rows
+        downsampled = None
+        if total_rows > self.max_rows and DOWNSAMPLE_ENABLED:
+            downsampled = await self._downsample(client, job, sql, schema, total_rows)
+        if downsampled is not None:
+            response.update(downsampled)
+            logger.info(f"Downsampled {total_rows} rows to {len(downsampled['rows'])}: {downsampled['downsampled']['note']}")
+        elif len(rows) == self.max_rows:
+            response['result_is_likely_truncated'] = True
+        response['job_stats'] = job_stats(job, (time.perf_counter() - started) * 1000)
+        logger.info(f"BigQuery job {job.job_id}: {job.total_bytes_processed} bytes, {job.slot_millis} slot ms, "
+                    f"cache hit {job.cache_hit}")
+        return response
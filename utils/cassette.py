@@ -0,0 +1,186 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Any, Optional
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from constants import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY, CASSETTE_SEED, CASSETTE_STRICT
+from utils.backends import Backend
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class CassetteMissError(KeyError):
+    """raised in strict replay when a request was never recorded"""
+
+
+def fingerprint(kind: str, payload: Any) -> str:
+    """stable hash of a request, independent of dict ordering"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{kind}|{canonical}".encode('utf-8')).hexdigest()[:32]
+
+
+def model_request_fingerprint(agent_name: str, llm_request: LlmRequest) -> str:
+    """fingerprint over what the model actually sees: model, instructions, contents and tools"""
+    config = llm_request.config
+    system_instruction = config.system_instruction if config else None
+    if hasattr(system_instruction, 'model_dump'):
+        system_instruction = system_instruction.model_dump(mode='json', exclude_none=True)
+    return fingerprint('model', {
+        'agent': agent_name,
+        'model': llm_request.model,
+        'system_instruction': system_instruction,
+        'contents': [c.model_dump(mode='json', exclude_none=True) for c in llm_request.contents],
+        'tools': sorted(llm_request.tools_dict.keys()),
+    })
+
+
+def sql_fingerprint(query: str) -> str:
+    """fingerprint of a SQL query, ignoring whitespace layout"""
+    return fingerprint('sql', ' '.join((query or '').split()))
+
+
+class LatencyModel:
+    """synthetic latency for replayed calls
+
+    specs: 'none', 'recorded', 'scale:<factor>', 'fixed:<ms>',
+    'lognormal:<median_ms>,<sigma>'
+    """
+
+    def __init__(self, spec: str = 'recorded', seed: int = CASSETTE_SEED):
+        self.spec = spec
+        name, _, params = spec.partition(':')
+        self.name = name
+        self.params = [float(p) for p in params.split(',')] if params else []
+        self._rng = random.Random(seed)
+
+    def delay_ms(self, recorded_ms: float) -> float:
+        if self.name == 'none':
+            return 0.0
+        if self.name == 'recorded':
+            return recorded_ms
+        if self.name == 'scale':
+            return recorded_ms * self.params[0]
+        if self.name == 'fixed':
+            return self.params[0]
+        if self.name == 'lognormal':
+            median_ms, sigma = self.params
+            return self._rng.lognormvariate(math.log(median_ms), sigma)
+        raise ValueError(f"Unknown latency spec: {self.spec}")
+
+
+class Cassette(Backend):
+    """records Gemini and execute_sql responses keyed by request fingerprint and replays them
+
+    the file is gzip-compressed JSONL, one record per call, appended as calls
+    complete so a crashed recording keeps everything captured so far
+    """
+
+    def __init__(self, path: str, mode: str = 'replay', latency: str = 'recorded', strict: bool = CASSETTE_STRICT):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency = LatencyModel(latency)
+        self.strict = strict
+        self.offline = mode == 'replay'
+        #fingerprint -> recorded calls in order; repeats of a request replay in order
+        self._records: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self._cursor: dict[str, int] = defaultdict(int)
+        #call_key -> (kind, fingerprint, start time) for calls being recorded
+        self._in_flight: dict[Any, tuple[str, str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def from_config(cls) -> 'Cassette':
+        return cls(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_LATENCY)
+
+    def _load(self) -> None:
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records[record['key']].append(record)
+        logger.info(f"Loaded {sum(len(v) for v in self._records.values())} cassette records from {self.path}")
+
+    def _append(self, record: dict[str, Any]) -> None:
+        self._records[record['key']].append(record)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        #each append adds a gzip member; gzip.open reads them back as one stream
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    async def _next(self, kind: str, key: str) -> Optional[dict[str, Any]]:
+        records = self._records.get(key)
+        if not records:
+            self.misses += 1
+            if self.strict:
+                raise CassetteMissError(f"No recorded {kind} response for fingerprint {key} in {self.path}")
+            logger.warning(f"Cassette miss for {kind} fingerprint {key}, calling live backend")
+            return None
+        idx = self._cursor[key]
+        self._cursor[key] = idx + 1
+        record = records[min(idx, len(records) - 1)]
+        self.hits += 1
+        delay_ms = self.latency.delay_ms(record.get('latency_ms', 0.0))
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+        return record
+
+    # ---- model calls ----
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        key = model_request_fingerprint(agent_name, llm_request)
+        if self.mode == 'record':
+            self._in_flight[call_key] = ('model', key, time.perf_counter())
+            return None
+        record = await self._next('model', key)
+        if record is None:
+            return None
+        return LlmResponse.model_validate_json(json.dumps(record['response']))
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        started = self._in_flight.pop(call_key, None)
+        if started is None:
+            return
+        kind, key, start = started
+        self._append({
+            'kind': kind,
+            'key': key,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+            'response': json.loads(llm_response.model_dump_json(exclude_none=True)),
+        })
+
+    # ---- execute_sql calls ----
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if tool_name != 'execute_sql':
+            return None
+        key = sql_fingerprint(args.get('query'))
+        if self.mode == 'record':
+            self._in_flight[call_key] = ('sql', key, time.perf_counter())
+            return None
+        record = await self._next('sql', key)
+        return None if record is None else record['response']
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        started = self._in_flight.pop(call_key, None)
+        if started is None:
+            return
+        kind, key, start = started
+        self._append({
+            'kind': kind,
+            'key': key,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+            'response': tool_response,
+        })
@@ -0,0 +1,93 @@
+from typing import Any, Optional
+import pandas as pd
+from pydantic import ValidationError
+from constants import CHART_SPEC_MAX_SERIES
+from pydantic_models import ChartSpec
+
+MARKS = {'line': 'line', 'bar': 'bar', 'area': 'area', 'scatter': 'point', 'pie': 'arc'}
+
+
+def _is_date(frame: pd.DataFrame, column: str) -> bool:
+    if pd.api.types.is_datetime64_any_dtype(frame[column]):
+        return True
+    return 'DATE' in column.upper() and pd.to_datetime(frame[column].astype(str), errors='coerce', format='ISO8601').notna().mean() >= 0.9
+
+
+def validate_spec(spec: Optional[dict[str, Any]], frame: Optional[pd.DataFrame]) -> list[str]:
+    """problems that stop the spec being drawn from the result; [] when it can be rendered"""
+    if frame is None or frame.empty:
+        return ['No SQL result to chart.']
+    if not spec:
+        return ['No chart spec was returned.']
+    try:
+        spec = ChartSpec.model_validate(spec)
+    except ValidationError as e:
+        return [f"Invalid chart spec: {e.errors()[0]['msg']}"]
+    if spec.chart_type == 'unsupported':
+        return ['The chart cannot be expressed as a spec.']
+
+    errors = []
+    for field in ('x', 'y', 'series'):
+        column = getattr(spec, field)
+        if field != 'series' and not column:
+            errors.append(f"'{field}' is required.")
+        elif column and column not in frame.columns:
+            errors.append(f"'{field}' names {column}, which is not a result column ({', '.join(frame.columns)}).")
+    if errors:
+        return errors
+
+    if spec.y in (spec.x, spec.series):
+        errors.append(f"'y' column {spec.y} is also the x or series column.")
+    elif spec.aggregation != 'count' and not pd.api.types.is_numeric_dtype(frame[spec.y]):
+        errors.append(f"'y' column {spec.y} is not numeric; use a numeric column or aggregation 'count'.")
+    if spec.chart_type == 'pie' and spec.series:
+        errors.append("Pie charts take no series; the slices are the x values.")
+    split = spec.x if spec.chart_type == 'pie' else spec.series
+    if split and frame[split].nunique() > CHART_SPEC_MAX_SERIES:
+        errors.append(f"{split} has {frame[split].nunique()} values, more than the {CHART_SPEC_MAX_SERIES} a chart can show.")
+    if spec.aggregation == 'none' and spec.chart_type != 'scatter' and not errors:
+        #unaggregated repeats of an x (and series) value would be drawn as one zigzagging line or overlapping marks
+        keys = [column for column in (spec.x, spec.series) if column]
+        repeated = int(frame.duplicated(keys).sum())
+        if repeated:
+            errors.append(
+                f"{repeated} rows repeat an x{' and series' if spec.series else ''} value; set series to the column "
+                f"that tells them apart, or choose an aggregation."
+            )
+    return errors
+
+
+def chart_data(spec: dict[str, Any], frame: pd.DataFrame) -> pd.DataFrame:
+    """the columns the chart draws, aggregated as the spec says and sorted along x"""
+    keys = [column for column in (spec['x'], spec.get('series')) if column]
+    data = frame[list(dict.fromkeys(keys + [spec['y']]))].copy()
+    if _is_date(data, spec['x']):
+        data[spec['x']] = pd.to_datetime(data[spec['x']].astype(str), errors='coerce', format='ISO8601')
+    if spec.get('aggregation') == 'count':
+        data = data.groupby(keys, as_index=False, dropna=False).size().rename(columns={'size': spec['y']})
+    elif spec.get('aggregation', 'none') != 'none':
+        data = data.groupby(keys, as_index=False, dropna=False)[spec['y']].agg(spec['aggregation'])
+    return data.sort_values(spec['x']).reset_index(drop=True)
+
+
+def vega_lite(spec: dict[str, Any], data: pd.DataFrame) -> dict[str, Any]:
+    """Vega-Lite specification drawing chart_data(spec, ...) as data"""
+    y = {'field': spec['y'], 'type': 'quantitative'}
+    tooltip = [{'field': column} for column in data.columns]
+    if spec['chart_type'] == 'pie':
+        encoding = {'theta': y, 'color': {'field': spec['x'], 'type': 'nominal'}, 'tooltip': tooltip}
+    else:
+        if _is_date(data, spec['x']):
+            x_type = 'temporal'
+        elif pd.api.types.is_numeric_dtype(data[spec['x']]) and spec['chart_type'] != 'bar':
+            x_type = 'quantitative'
+        else:
+            x_type = 'nominal'
+        encoding = {'x': {'field': spec['x'], 'type': x_type, 'sort': None}, 'y': y, 'tooltip': tooltip}
+        if spec.get('series'):
+            encoding['color'] = {'field': spec['series'], 'type': 'nominal'}
+    return {
+        'title': spec.get('title'),
+        'mark': {'type': MARKS[spec['chart_type']], 'tooltip': True},
+        'encoding': encoding,
+    }
@@ -0,0 +1,174 @@
+import json
+import math
+import re
+from typing import Any, Optional
+from constants import DOWNSAMPLE_GRAINS, DOWNSAMPLE_TOP_N_GRAIN, SCHEMA_CONTEXT_PATH
+
+DATE_TYPES = {'DATE', 'DATETIME', 'TIMESTAMP'}
+NUMERIC_TYPES = {'INTEGER', 'INT64', 'FLOAT', 'FLOAT64', 'NUMERIC', 'BIGNUMERIC'}
+DIMENSION_TYPES = {'STRING', 'BOOLEAN', 'BOOL'}
+OTHER = 'Other'
+#indicator aggregation in the schema context -> how its already aggregated values combine
+REAGGREGATE = {'SUM': 'SUM', 'COUNT': 'SUM', 'AVG': 'AVG', 'MIN': 'MIN', 'MAX': 'MAX'}
+
+_schema_kpis: Optional[dict[str, Any]] = None
+
+
+def _name_key(name: str) -> str:
+    return re.sub(r'[^A-Z0-9]+', '_', name.upper()).strip('_')
+
+
+def indicator_aggregations(kpi_ids: list[int], path: str = SCHEMA_CONTEXT_PATH) -> dict[str, str]:
+    """re-aggregation of these KPIs' indicators by normalised name, from indicators_int/indicators_float
+
+    names whose aggregation is unknown, or differs between the KPIs, are left out.
+    """
+    global _schema_kpis
+    if _schema_kpis is None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                _schema_kpis = json.load(f).get('kpis', {})
+        except (OSError, ValueError):
+            _schema_kpis = {}
+    found: dict[str, set[Optional[str]]] = {}
+    for kpi_id in kpi_ids:
+        kpi = _schema_kpis.get(str(kpi_id), {})
+        for indicator in kpi.get('indicators_int', []) + kpi.get('indicators_float', []):
+            aggregation = REAGGREGATE.get((indicator.get('aggregation') or '').upper())
+            found.setdefault(_name_key(indicator['name']), set()).add(aggregation)
+    return {name: aggregations.pop() for name, aggregations in found.items() if len(aggregations) == 1 and None not in aggregations}
+
+
+class ResultColumns:
+    """a query result's columns split into the date, dimensions and measures to re-aggregate"""
+
+    def __init__(self, date: Optional[str], dimensions: list[str], measures: dict[str, str], date_type: str = 'DATE'):
+        self.date = date
+        self.date_type = date_type
+        self.dimensions = dimensions
+        #measure -> SUM, AVG, MIN or MAX
+        self.measures = measures
+
+    @classmethod
+    def from_schema(cls, schema: list[tuple[str, str, str]], aggregations: dict[str, str]) -> Optional['ResultColumns']:
+        """from (name, type, mode) fields and indicator_aggregations(); None when a column cannot be re-aggregated
+
+        a measure is re-aggregated only when it is named after an indicator whose aggregation is known.
+        """
+        date, date_type, dimensions, measures = None, 'DATE', [], {}
+        for name, field_type, mode in schema:
+            field_type = field_type.upper()
+            if mode == 'REPEATED':
+                return None
+            if field_type in DATE_TYPES and (date is None or name.upper() == 'KPI_DATE'):
+                if date is not None:
+                    dimensions.append(date)
+                date, date_type = name, field_type
+            elif field_type in NUMERIC_TYPES and not name.upper().endswith('ID'):
+                if _name_key(name) not in aggregations:
+                    return None
+                measures[name] = aggregations[_name_key(name)]
+            elif field_type in DIMENSION_TYPES | NUMERIC_TYPES | DATE_TYPES:
+                dimensions.append(name)
+            else:
+                return None
+        return cls(date, dimensions, measures, date_type) if measures else None
+
+
+def _period(columns: ResultColumns, grain: str) -> str:
+    column = f"`{columns.date}`" if columns.date_type == 'DATE' else f"DATE(`{columns.date}`)"
+    return f"DATE_TRUNC({column}, {grain})"
+
+
+def estimate_sql(table: str, columns: ResultColumns) -> str:
+    """one row: distinct output rows at each coarser grain, and distinct values of each dimension"""
+    dims = ''.join(f", `{d}`" for d in columns.dimensions)
+    counts = []
+    if columns.date is not None:
+        for grain in DOWNSAMPLE_GRAINS:
+            counts.append(f"COUNT(DISTINCT TO_JSON_STRING(STRUCT({_period(columns, grain)} AS P{dims}))) AS {grain}")
+    for position, dimension in enumerate(columns.dimensions):
+        counts.append(f"COUNT(DISTINCT `{dimension}`) AS D{position}")
+    return f"SELECT {', '.join(counts)} FROM `{table}`"
+
+
+def plan(columns: ResultColumns, estimates: dict[str, int], total_rows: int, max_rows: int) -> Optional[dict[str, Any]]:
+    """the finest grain that fits max_rows, else the top values of the widest dimension plus 'Other'
+
+    None when neither brings the result under max_rows.
+    """
+    if columns.date is not None:
+        for grain in DOWNSAMPLE_GRAINS:
+            if estimates[grain] <= max_rows:
+                return {'grain': grain, 'top_column': None, 'top_n': None, 'rows': estimates[grain]}
+    if not columns.dimensions:
+        return None
+
+    grain = DOWNSAMPLE_TOP_N_GRAIN if columns.date is not None else None
+    rows = estimates[grain] if grain else total_rows
+    position = max(range(len(columns.dimensions)), key=lambda p: estimates[f"D{p}"])
+    values = estimates[f"D{position}"]
+    #rows each value of the dimension contributes, on average
+    per_value = rows / max(values, 1)
+    top_n = math.floor(max_rows / per_value) - 1
+    if top_n < 1 or top_n >= values:
+        return None
+    return {
+        'grain': grain,
+        'top_column': columns.dimensions[position],
+        'top_n': top_n,
+        'rows': math.ceil(per_value * (top_n + 1)),
+    }
+
+
+def _measure(column: str, aggregation: str) -> str:
+    return f"{aggregation}(`{column}`) AS `{column}`"
+
+
+def downsample_sql(table: str, columns: ResultColumns, downsample: dict[str, Any]) -> str:
+    """re-aggregate a result table as planned"""
+    top = downsample['top_column']
+    items, ctes = [], [f"R AS (SELECT * FROM `{table}`)"]
+    if columns.date is not None:
+        items.append(f"{_period(columns, downsample['grain'])} AS `{columns.date}`")
+    for dimension in columns.dimensions:
+        if dimension == top:
+            items.append(f"IF(CAST(`{top}` AS STRING) IN (SELECT V FROM TOP_VALUES), CAST(`{top}` AS STRING), '{OTHER}') AS `{top}`")
+        else:
+            items.append(f"`{dimension}`")
+    if top is not None:
+        ctes.append(
+            f"TOP_VALUES AS (SELECT CAST(`{top}` AS STRING) AS V FROM R GROUP BY 1 "
+            f"ORDER BY SUM(`{next(iter(columns.measures))}`) DESC LIMIT {downsample['top_n']})"
+        )
+    items += [_measure(m, aggregation) for m, aggregation in columns.measures.items()]
+    keys = len(items) - len(columns.measures)
+    order = f"\nORDER BY {', '.join(str(i) for i in range(1, keys + 1))}" if keys else ""
+    group = "\nGROUP BY ALL" if keys else ""
+    return f"WITH {', '.join(ctes)}\nSELECT {', '.join(items)}\nFROM R{group}{order}"
+
+
+def result_note(response: dict[str, Any]) -> str:
+    """what the SQL agents and the answer should know about an execute_sql result's row limit; '' when it fit"""
+    if response.get('downsampled'):
+        return response['downsampled']['note']
+    if response.get('result_is_likely_truncated'):
+        return (
+            "The result hit the row limit and was truncated, so later rows are missing. Aggregate to a coarser "
+            "KPI_DATE grain, filter further, or alias measures with their indicator names so it can be re-aggregated."
+        )
+    return ''
+
+
+def describe(downsample: dict[str, Any], columns: ResultColumns, total_rows: int, max_rows: int) -> str:
+    """what was done to the result, for the SQL writer's reasoning"""
+    parts = []
+    if downsample['grain']:
+        parts.append(f"{columns.date} truncated to {downsample['grain']}")
+    if downsample['top_column']:
+        parts.append(f"top {downsample['top_n']} {downsample['top_column']} values kept, the rest grouped as '{OTHER}'")
+    measures = ', '.join(f"{aggregation}({m})" for m, aggregation in columns.measures.items())
+    return (
+        f"The query returned {total_rows} rows, over the {max_rows} row limit, so the result was re-aggregated: "
+        f"{'; '.join(parts)} ({measures}). Mention this in the insights."
+    )
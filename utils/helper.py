@@ -5,6 +5,7 @@ from utils.logger import get_logger
 import io
 import re
 from PIL import Image
+from utils.tracing import traced
 
 logger = get_logger(__name__)
 
@@ -20,6 +21,7 @@ def json_to_dict(path: str) -> dict:
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found: {path}")
 
+@traced(kind='image')
 def save_img(img_bytes: str) -> None:
     """Save base64 image string (possibly wrapped in Markdown/data URL) to a uniquely named PNG file."""
     if not img_bytes:
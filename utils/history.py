@@ -0,0 +1,268 @@
+import re
+from typing import Any, Optional
+from google.genai import types
+from constants import *
+from utils.logger import get_logger
+from utils.backends import is_offline
+from utils.metering import get_meter
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+#name the summary model's calls are metered and traced under
+HISTORY_SUMMARY_AGENT = 'history_summary'
+
+#prefix ADK puts on events authored by other agents when replaying history
+OTHER_AGENT_CONTEXT_PREFIX = 'For context:'
+
+KPI_ID_PATTERN = re.compile(r"\bKPI_ID\s*(?:=\s*(\d+)|IN\s*\(([^)]*)\))", re.IGNORECASE)
+DIM_FILTER_PATTERN = re.compile(
+    r"\bNAME\s*=\s*'([^']+)'\s+AND\s+\w*\.?VALUE\s*(?:=\s*'([^']*)'|IN\s*\(([^)]*)\))",
+    re.IGNORECASE
+)
+KPI_DATE_PATTERN = re.compile(
+    r"\bKPI_DATE\s*(BETWEEN\s+.+?\s+AND\s+[^\n]+|[<>=]{1,2}\s*[^\n]+)",
+    re.IGNORECASE
+)
+
+SQL_RESULT_CONTEXT = re.compile(r"^(\[[^\]]+\] `execute_sql` tool returned result: )(\{.*'rows': .*\})$", re.DOTALL)
+SQL_RESULT_STATUS = re.compile(r"'status': '(\w+)'")
+SQL_ROWS_OMITTED = 'rows omitted, see the SQL result in the instructions and the attached CSV file'
+
+_summary_client = None
+
+
+def estimate_tokens(contents: list[types.Content]) -> int:
+    """cheap prompt size estimate from the text carried by contents"""
+    n_chars = 0
+    for content in contents or []:
+        for part in content.parts or []:
+            if part.text:
+                n_chars += len(part.text)
+            elif part.function_call:
+                n_chars += len(str(part.function_call.args))
+            elif part.function_response:
+                n_chars += len(str(part.function_response.response))
+            elif part.executable_code:
+                n_chars += len(part.executable_code.code or '')
+            elif part.code_execution_result:
+                n_chars += len(part.code_execution_result.output or '')
+    return n_chars // CHARS_PER_TOKEN
+
+
+def strip_sql_rows(contents: list[types.Content]) -> int:
+    """replace the rows of execute_sql responses in contents with a short note, in place
+
+    covers both the agent's own function responses and other agents' responses
+    replayed as 'For context:' text. Returns the number of characters removed.
+    """
+    removed = 0
+    for content in contents or []:
+        for part in content.parts or []:
+            if part.text:
+                match = SQL_RESULT_CONTEXT.match(part.text)
+                if match:
+                    status = SQL_RESULT_STATUS.search(match.group(2))
+                    text = f"{match.group(1)}{{'status': '{status.group(1) if status else 'UNKNOWN'}', 'rows': '{SQL_ROWS_OMITTED}'}}"
+                    removed += len(part.text) - len(text)
+                    part.text = text
+            elif part.function_response and part.function_response.name == 'execute_sql':
+                response = part.function_response.response or {}
+                if isinstance(response.get('rows'), list):
+                    before = len(str(response))
+                    part.function_response.response = {**response, 'rows': SQL_ROWS_OMITTED}
+                    removed += before - len(str(part.function_response.response))
+    return removed
+
+
+def _user_text(content: types.Content) -> Optional[str]:
+    """text of a genuine user message, None for tool responses or other agents' context"""
+    if content.role != 'user' or not content.parts:
+        return None
+    first = content.parts[0]
+    if not first.text or first.text.startswith(OTHER_AGENT_CONTEXT_PREFIX):
+        return None
+    return ''.join(part.text for part in content.parts if part.text)
+
+
+def split_turns(contents: list[types.Content]) -> tuple[list[types.Content], list[dict[str, Any]]]:
+    """split contents into a preamble and turns, one turn per distinct user question
+
+    every agent in a sequence is invoked with the same user query, so consecutive
+    identical user messages belong to the same turn
+    """
+    preamble: list[types.Content] = []
+    turns: list[dict[str, Any]] = []
+
+    for content in contents:
+        text = _user_text(content)
+        if text is not None and (not turns or turns[-1]['question'] != text):
+            turns.append({'question': text, 'contents': [content]})
+        elif turns:
+            turns[-1]['contents'].append(content)
+        else:
+            preamble.append(content)
+
+    return preamble, turns
+
+
+def extract_kpis(sql: Optional[str]) -> list[str]:
+    """KPI_IDs referenced by a generated query"""
+    if not sql:
+        return []
+    kpis = []
+    for single, many in KPI_ID_PATTERN.findall(sql):
+        values = [single] if single else re.findall(r"\d+", many)
+        for value in values:
+            if value not in kpis:
+                kpis.append(value)
+    return kpis
+
+
+def extract_filters(sql: Optional[str]) -> list[str]:
+    """dimension and date filters applied by a generated query"""
+    if not sql:
+        return []
+    filters = []
+    for name, value, values in DIM_FILTER_PATTERN.findall(sql):
+        filters.append(f"{name} = {value}" if not values else f"{name} IN ({values.strip()})")
+    for date_filter in KPI_DATE_PATTERN.findall(sql):
+        filters.append(f"KPI_DATE {date_filter.strip()}")
+    return filters
+
+
+def build_turn_digest(state: dict[str, Any], question: str) -> dict[str, Any]:
+    """deterministic summary of the turn that produced the current state"""
+    sql = state.get('latest_sql_output') if state.get('sql_required') else None
+    user_intent = state.get('user_intent')
+    intent = getattr(user_intent, 'user_intent', None) or (
+        user_intent.get('user_intent') if isinstance(user_intent, dict) else None
+    )
+
+    outcome = 'ANSWERED_WITHOUT_DATA'
+    if state.get('sql_required'):
+        outcome = f"SQL {state.get('latest_sql_sequence_outcome', 'UNKNOWN')}"
+    if state.get('python_required'):
+        outcome += f", PYTHON {state.get('latest_python_sequence_outcome', 'UNKNOWN')}"
+
+    return {
+        'question': question,
+        'intent': intent,
+        'kpis': extract_kpis(sql),
+        'filters': extract_filters(sql),
+        'sql': sql if isinstance(sql, str) else None,
+        'outcome': outcome,
+    }
+
+
+def render_digest(digest: dict[str, Any]) -> str:
+    """render one turn digest as compact text"""
+    lines = [f"- Q: {digest['question'][:HISTORY_SUMMARY_MAX_CHARS]}"]
+    if digest.get('intent'):
+        lines.append(f"  intent: {digest['intent']}")
+    if digest.get('kpis'):
+        lines.append(f"  kpis: {', '.join(digest['kpis'])}")
+    if digest.get('filters'):
+        lines.append(f"  filters: {'; '.join(digest['filters'])}")
+    if digest.get('sql'):
+        sql = ' '.join(digest['sql'].split())
+        lines.append(f"  final sql: {sql[:HISTORY_SUMMARY_MAX_CHARS]}")
+    if digest.get('summary'):
+        lines.append(f"  summary: {digest['summary']}")
+    if digest.get('outcome'):
+        lines.append(f"  outcome: {digest['outcome']}")
+    return '\n'.join(lines)
+
+
+def _fallback_summary(turn: dict[str, Any]) -> str:
+    """last model text of a turn, truncated"""
+    for content in reversed(turn['contents']):
+        if content.role == 'model':
+            text = ''.join(part.text for part in content.parts or [] if part.text and not part.thought)
+            if text:
+                return ' '.join(text.split())[:HISTORY_SUMMARY_MAX_CHARS]
+    return 'no answer recorded'
+
+
+async def summarise_turn_with_model(turn: dict[str, Any]) -> str:
+    """summarise a turn with the cheap model when no state digest exists for it"""
+    global _summary_client
+
+    #offline runs (cassette replay, fake backends) never call the live summary model
+    if not HISTORY_SUMMARY_MODEL_ENABLED or is_offline('model'):
+        return _fallback_summary(turn)
+
+    transcript = []
+    for content in turn['contents']:
+        for part in content.parts or []:
+            if part.text and not part.thought:
+                transcript.append(f"{content.role}: {part.text[:2000]}")
+    try:
+        if _summary_client is None:
+            from google import genai
+            _summary_client = genai.Client()
+
+        #called outside the agents, so it is traced and metered here rather than by their callbacks
+        with get_tracer().span(f"model:{HISTORY_SUMMARY_AGENT}", 'model', model=HISTORY_SUMMARY_MODEL) as span:
+            response = await _summary_client.aio.models.generate_content(
+                model=HISTORY_SUMMARY_MODEL,
+                contents='\n'.join(transcript),
+                config=types.GenerateContentConfig(
+                    system_instruction=(
+                        "Summarise this analytics conversation turn in at most three short lines: "
+                        "KPIs and filters used, the final answer, and whether it succeeded."
+                    ),
+                    temperature=0,
+                    max_output_tokens=200,
+                ),
+            )
+            usage = response.usage_metadata
+            if usage:
+                get_meter().record(HISTORY_SUMMARY_AGENT, usage, model_version=getattr(response, 'model_version', None))
+                span.set_attribute('prompt_token_count', usage.prompt_token_count)
+                span.set_attribute('candidates_token_count', usage.candidates_token_count)
+        return (response.text or '').strip()[:HISTORY_SUMMARY_MAX_CHARS] or _fallback_summary(turn)
+    except Exception as e:
+        logger.error(f"History summary model failed, using truncated text: {e}")
+        return _fallback_summary(turn)
+
+
+async def compact_contents(
+        contents: list[types.Content],
+        digests: list[dict[str, Any]],
+        summaries: dict[str, str],
+        keep_turns: int = HISTORY_KEEP_TURNS,
+    ) -> tuple[list[types.Content], int]:
+    """keep the last keep_turns turns verbatim and fold older ones into one summary content
+
+    summaries caches model-written summaries by question and is updated in place.
+    Returns the compacted contents and the number of folded turns.
+    """
+    preamble, turns = split_turns(contents)
+    if len(turns) <= keep_turns:
+        return contents, 0
+
+    folded, kept = turns[:-keep_turns], turns[-keep_turns:]
+    digest_by_question = {d['question']: d for d in digests}
+
+    lines = []
+    for turn in folded[-HISTORY_MAX_SUMMARY_TURNS:]:
+        digest = digest_by_question.get(turn['question'])
+        if digest is None:
+            if turn['question'] not in summaries:
+                summaries[turn['question']] = await summarise_turn_with_model(turn)
+            digest = {'question': turn['question'], 'summary': summaries[turn['question']]}
+        lines.append(render_digest(digest))
+
+    summary_content = types.Content(
+        role='user',
+        parts=[types.Part(text=(
+            f"{OTHER_AGENT_CONTEXT_PREFIX}\nSummary of {len(folded)} earlier turn(s) in this conversation:\n"
+            + '\n'.join(lines)
+        ))]
+    )
+
+    compacted = preamble + [summary_content]
+    for turn in kept:
+        compacted.extend(turn['contents'])
+    return compacted, len(folded)
@@ -0,0 +1,325 @@
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+from constants import KPI_INDEX_SOURCES, KPI_INDEX_FUZZY_THRESHOLD, KPI_INDEX_MAX_MATCHES_PER_PHRASE
+from utils.helper import json_to_dict
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#words kept together: '2.4ghz', 'fttp', '1.15j.2639.r'
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")
+KPI_ID_MENTION_PATTERN = re.compile(r"\bkpi(?:_id)?\s*(?:=|:|#)?\s*(\d{4,})", re.IGNORECASE)
+
+#never resolved on their own, and never fuzzy-corrected
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'for', 'from', 'how', 'in', 'is', 'it', 'me', 'my',
+    'of', 'on', 'or', 'per', 'show', 'the', 'to', 'vs', 'was', 'what', 'which', 'with', 'all',
+    'last', 'this', 'that', 'day', 'days', 'week', 'weeks', 'month', 'months', 'year', 'years',
+    'total', 'count', 'number', 'give', 'over', 'between', 'trend', 'compare', 'average',
+})
+
+#corrections remembered across questions; the vocabulary is small, so is this
+_MAX_CACHED_CORRECTIONS = 10000
+
+
+def normalize(text: str) -> list[str]:
+    """lowercase word tokens, '&' read as 'and'"""
+    return TOKEN_PATTERN.findall(text.lower().replace('&', ' and '))
+
+
+def _trigrams(token: str) -> set[str]:
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class ValueEntry:
+    kpi_id: str
+    kpi_name: str
+    dimension: str
+    physical_column: Optional[str]
+    value: str
+
+
+class _TrieNode:
+    __slots__ = ('children', 'entries', 'only')
+
+    def __init__(self):
+        self.children: dict[str, '_TrieNode'] = {}
+        self.entries: list[int] = []
+        #the single normalized value below this node, None when there are several
+        self.only: Optional[str] = None
+
+
+class KpiValueIndex:
+    """in-memory index of KPI names and dimension values for resolving a question locally
+
+    values are stored in a word-level prefix trie, so the longest known value
+    starting at each word of the question is found in one walk; misspelt words
+    are first corrected against the value vocabulary by trigram similarity.
+    """
+
+    def __init__(self):
+        self.entries: list[ValueEntry] = []
+        self.kpi_names: dict[str, str] = {}
+        self._keys: set[tuple[str, str, str]] = set()
+        self._columns: dict[tuple[str, str], str] = {}
+        self._dimension_tokens: dict[str, tuple[str, ...]] = {}
+        self._values = _TrieNode()
+        self._kpis = _TrieNode()
+        self._vocabulary: set[str] = set()
+        self._trigram_postings: dict[str, list[str]] = {}
+        self._trigram_counts: dict[str, int] = {}
+        self._corrections: dict[str, Optional[str]] = {}
+        self._built = False
+
+    # ---- building ----
+
+    def add_kpi(self, kpi_id: Any, kpi_name: str) -> None:
+        kpi_id = str(kpi_id)
+        self.kpi_names.setdefault(kpi_id, kpi_name)
+        tokens = normalize(kpi_name)
+        #'1. Broadband Orders' is asked for as 'broadband orders'
+        while tokens and tokens[0].isdigit():
+            tokens = tokens[1:]
+        if tokens:
+            self._insert(self._kpis, tokens, int(kpi_id))
+        self._built = False
+
+    def add_value(self, kpi_id: Any, dimension: str, value: str, physical_column: Optional[str] = None) -> None:
+        kpi_id = str(kpi_id)
+        tokens = normalize(value)
+        if not tokens:
+            return
+        key = (kpi_id, dimension, ' '.join(tokens))
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        if physical_column:
+            self._columns[(kpi_id, dimension)] = physical_column
+        self._dimension_tokens.setdefault(dimension, tuple(normalize(dimension)))
+
+        self.entries.append(ValueEntry(
+            kpi_id=kpi_id,
+            kpi_name=self.kpi_names.get(kpi_id, ''),
+            dimension=dimension,
+            physical_column=physical_column or self._columns.get((kpi_id, dimension)),
+            value=value.strip(),
+        ))
+        self._insert(self._values, tokens, len(self.entries) - 1)
+        self._vocabulary.update(tokens)
+        self._built = False
+
+    def _insert(self, root: _TrieNode, tokens: list[str], entry: int) -> None:
+        node = root
+        for token in tokens:
+            node = node.children.setdefault(token, _TrieNode())
+        node.entries.append(entry)
+
+    def add_schema_context(self, schema_context: dict[str, Any]) -> None:
+        """{'kpis': {id: {'kpi_name', 'dimensions': {name: {'physical_column', 'distinct_values_sample'}}}}}"""
+        for kpi_id, kpi in schema_context.get('kpis', {}).items():
+            self.add_kpi(kpi_id, kpi.get('kpi_name', ''))
+            for dimension, details in (kpi.get('dimensions') or {}).items():
+                column = details.get('physical_column')
+                if column:
+                    self._columns[(str(kpi_id), dimension)] = column
+                for value in details.get('distinct_values_sample') or []:
+                    self.add_value(kpi_id, dimension, str(value), column)
+
+    def add_data_table(self, kpis: list[dict[str, Any]]) -> None:
+        """[{'kpi_id', 'kpi_name', 'f0_': [{'name', 'kpi': [{'dim_values'}]}]}]"""
+        for kpi in kpis:
+            self.add_kpi(kpi['kpi_id'], kpi.get('kpi_name', ''))
+            for dimension in kpi.get('f0_') or []:
+                for value in dimension.get('kpi') or []:
+                    if value.get('dim_values') is not None:
+                        self.add_value(kpi['kpi_id'], dimension['name'], str(value['dim_values']))
+
+    @classmethod
+    def from_sources(cls, paths: Iterable[str]) -> 'KpiValueIndex':
+        index = cls()
+        for path in paths:
+            source = json_to_dict(path)
+            if isinstance(source, dict):
+                index.add_schema_context(source)
+            else:
+                index.add_data_table(source)
+        index.build()
+        return index
+
+    def build(self) -> None:
+        """derive the fuzzy and prefix lookups; called lazily after values change"""
+        self._trigram_postings = {}
+        self._trigram_counts = {}
+        for token in self._vocabulary:
+            if len(token) >= 3 and not token.isdigit():
+                grams = _trigrams(token)
+                self._trigram_counts[token] = len(grams)
+                for gram in grams:
+                    self._trigram_postings.setdefault(gram, []).append(token)
+        self._corrections = {}
+        self._mark_unique(self._values)
+        self._built = True
+
+    def _mark_unique(self, node: _TrieNode) -> set[str]:
+        values = {' '.join(normalize(self.entries[i].value)) for i in node.entries}
+        for child in node.children.values():
+            values |= self._mark_unique(child)
+        node.only = next(iter(values)) if len(values) == 1 else None
+        return values
+
+    # ---- resolving ----
+
+    def _correct(self, token: str) -> Optional[str]:
+        """closest vocabulary word by trigram Jaccard similarity, None when nothing is close enough"""
+        if token in self._corrections:
+            return self._corrections[token]
+
+        grams = _trigrams(token)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._trigram_postings.get(gram, ()))
+        best, best_score = None, KPI_INDEX_FUZZY_THRESHOLD
+        for candidate, n_shared in sorted(shared.items()):
+            score = n_shared / (len(grams) + self._trigram_counts[candidate] - n_shared)
+            if score >= best_score and (best is None or score > best_score):
+                best, best_score = candidate, score
+
+        if len(self._corrections) >= _MAX_CACHED_CORRECTIONS:
+            self._corrections.clear()
+        self._corrections[token] = best
+        return best
+
+    def _longest_match(self, root: _TrieNode, tokens: list[str], start: int) -> tuple[int, Optional[_TrieNode], bool]:
+        """end of the longest known phrase starting at start, its node and whether it was completed from a prefix"""
+        node, end, matched = root, start, None
+        i = start
+        while i < len(tokens) and tokens[i] in node.children:
+            node = node.children[tokens[i]]
+            i += 1
+            if node.entries:
+                end, matched = i, node
+        if matched is None and i - start >= 2 and node.only is not None:
+            #'sky full fibre 500 fttp' names one value even without its suffix
+            return i, node, True
+        return end, matched, False
+
+    def _weak(self, tokens: list[str]) -> bool:
+        """values that read like ordinary words or numbers unless their dimension is named"""
+        if len(tokens) == 1 and tokens[0] in STOPWORDS:
+            return True
+        return all(t.isdigit() for t in tokens) or sum(len(t) for t in tokens) == 1
+
+    def resolve(self, question: str) -> dict[str, Any]:
+        """KPIs and (KPI_ID, dimension, value) tuples named in question
+
+        returns {'kpis': [...], 'filters': [{'phrase', 'match', 'matches': [...]}], 'elapsed_ms'}
+        """
+        started = time.perf_counter()
+        if not self._built:
+            self.build()
+
+        raw = normalize(question)
+        present = set(raw)
+        tokens, corrected = [], []
+        for token in raw:
+            if token in self._vocabulary or token in STOPWORDS or token.isdigit() or len(token) < 4:
+                tokens.append(token)
+                corrected.append(False)
+                continue
+            fixed = self._correct(token)
+            tokens.append(fixed or token)
+            corrected.append(fixed is not None)
+
+        kpis = {}
+        for kpi_id in KPI_ID_MENTION_PATTERN.findall(question):
+            if kpi_id in self.kpi_names:
+                kpis[kpi_id] = {'kpi_id': kpi_id, 'kpi_name': self.kpi_names[kpi_id], 'phrase': f"KPI {kpi_id}"}
+        i = 0
+        while i < len(tokens):
+            end, node, _ = self._longest_match(self._kpis, tokens, i)
+            if node is None or end - i < 2:
+                i += 1
+                continue
+            for kpi_id in map(str, node.entries):
+                kpis.setdefault(kpi_id, {'kpi_id': kpi_id, 'kpi_name': self.kpi_names[kpi_id], 'phrase': ' '.join(raw[i:end])})
+            i = end
+
+        filters = []
+        i = 0
+        while i < len(tokens):
+            end, node, from_prefix = self._longest_match(self._values, tokens, i)
+            if node is None:
+                i += 1
+                continue
+            phrase = tokens[i:end]
+            entries = [self.entries[e] for e in self._collect(node, from_prefix)]
+            if self._weak(phrase):
+                #'100' or 'y' only count when the question names the dimension too
+                entries = [e for e in entries if set(self._dimension_tokens[e.dimension]) <= present]
+            if kpis:
+                in_kpis = [e for e in entries if e.kpi_id in kpis]
+                entries = in_kpis or entries
+            if entries:
+                filters.append({
+                    'phrase': ' '.join(raw[i:end]),
+                    'match': 'fuzzy' if any(corrected[i:end]) else 'prefix' if from_prefix else 'exact',
+                    'matches': [
+                        {'kpi_id': e.kpi_id, 'kpi_name': e.kpi_name, 'dimension': e.dimension,
+                         'physical_column': e.physical_column, 'value': e.value}
+                        for e in entries[:KPI_INDEX_MAX_MATCHES_PER_PHRASE]
+                    ],
+                })
+            i = end
+
+        return {
+            'kpis': list(kpis.values()),
+            'filters': filters,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+        }
+
+    def _collect(self, node: _TrieNode, subtree: bool) -> list[int]:
+        if not subtree:
+            return node.entries
+        found, stack = [], [node]
+        while stack:
+            current = stack.pop()
+            found.extend(current.entries)
+            stack.extend(current.children.values())
+        return found
+
+
+def format_resolution(resolution: dict[str, Any]) -> str:
+    """markdown bullets for the SQL agents' instructions"""
+    lines = []
+    for kpi in resolution['kpis']:
+        lines.append(f"- KPI \"{kpi['phrase']}\": KPI_ID = {kpi['kpi_id']} ({kpi['kpi_name']})")
+    for resolved in resolution['filters']:
+        #the same value usually exists for several KPIs, list it once
+        kpi_ids: dict[tuple[str, str], list[str]] = {}
+        for m in resolved['matches']:
+            kpi_ids.setdefault((m['dimension'], m['value']), []).append(m['kpi_id'])
+        options = '; '.join(
+            f"D.NAME = '{dimension}' AND D.VALUE = '{value}' (KPI_ID {', '.join(ids)})"
+            for (dimension, value), ids in kpi_ids.items()
+        )
+        lines.append(f"- \"{resolved['phrase']}\" ({resolved['match']} match): {options}")
+    return '\n'.join(lines) if lines else "None resolved, check the schema context for exact values."
+
+
+_index: Optional[KpiValueIndex] = None
+
+
+def get_kpi_index() -> KpiValueIndex:
+    """process-wide index, built from KPI_INDEX_SOURCES on first use"""
+    global _index
+    if _index is None:
+        started = time.perf_counter()
+        _index = KpiValueIndex.from_sources(KPI_INDEX_SOURCES)
+        logger.info(f"Built KPI value index: {len(_index.kpi_names)} KPIs, {len(_index.entries)} values "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return _index
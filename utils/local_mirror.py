@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Iterable, Optional
+import pandas as pd
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from constants import (
+    DATA_TABLE_ID, LOCAL_MIRROR_DIR, LOCAL_MIRROR_MAX_AGE_HOURS, LOCAL_MIRROR_CACHED_KPIS, LOCAL_MIRROR_MAX_ROWS,
+    SCHEMA_MUTABLE_DAYS,
+)
+from utils.backends import Backend
+from utils.local_sql import UnsupportedQuery, execute
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+MANIFEST_NAME = '_manifest.json'
+#arrays of the data table copied into the mirror
+MIRRORED_ARRAYS = ('DIM', 'INT')
+
+
+def _month(day: date) -> str:
+    return day.strftime('%Y-%m')
+
+
+def wide_frame(kpi_id: int, rows: Iterable[dict[str, Any]]) -> pd.DataFrame:
+    """data table rows -> one row per KPI row with a 'DIM:<name>' / 'INT:<name>' column per array element"""
+    records = []
+    for row in rows:
+        record = {'KPI_ID': kpi_id, 'KPI_DATE': row['KPI_DATE']}
+        for array in MIRRORED_ARRAYS:
+            for element in row[array] or []:
+                if element.get('NAME') is not None:
+                    record[f"{array}:{element['NAME']}"] = element.get('VALUE')
+        records.append(record)
+    frame = pd.DataFrame.from_records(records)
+    if frame.empty:
+        return pd.DataFrame({'KPI_ID': pd.Series(dtype='int64'), 'KPI_DATE': pd.Series(dtype='datetime64[ns]')})
+    frame['KPI_DATE'] = pd.to_datetime(frame['KPI_DATE'])
+    for column in frame.columns:
+        if column.startswith('DIM:'):
+            frame[column] = frame[column].astype(object).where(frame[column].notna(), None)
+    return frame
+
+
+class LocalMirror:
+    """the KPI data table as parquet files, one per KPI_ID and KPI_DATE month
+
+    <root>/kpi_id=<id>/<YYYY-MM>.parquet plus a manifest recording when it was
+    synced and through which KPI_DATE partitions it is settled. Queries run with
+    utils.local_sql over the wide layout built by wide_frame.
+    """
+
+    def __init__(self, root: str = LOCAL_MIRROR_DIR, table_id: str = DATA_TABLE_ID):
+        self.root = root
+        self.table_id = table_id
+        self._manifest: Optional[dict[str, Any]] = None
+        self._manifest_mtime: Optional[float] = None
+        #kpi_id -> rows, dropped whenever a sync changes the manifest
+        self._frames: OrderedDict[int, pd.DataFrame] = OrderedDict()
+
+    # ---- manifest ----
+
+    def manifest(self) -> Optional[dict[str, Any]]:
+        path = os.path.join(self.root, MANIFEST_NAME)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if mtime != self._manifest_mtime:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+            self._frames.clear()
+        return self._manifest
+
+    def age_hours(self) -> Optional[float]:
+        manifest = self.manifest()
+        if manifest is None or manifest.get('table') != self.table_id:
+            return None
+        synced_at = datetime.fromisoformat(manifest['synced_at'])
+        return (datetime.now(timezone.utc) - synced_at).total_seconds() / 3600
+
+    def is_fresh(self, max_age_hours: float = LOCAL_MIRROR_MAX_AGE_HOURS) -> bool:
+        age = self.age_hours()
+        return age is not None and age <= max_age_hours
+
+    def _write_manifest(self, manifest: dict[str, Any]) -> None:
+        path = os.path.join(self.root, MANIFEST_NAME)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    # ---- reads ----
+
+    def _kpi_dir(self, kpi_id: int) -> str:
+        return os.path.join(self.root, f"kpi_id={kpi_id}")
+
+    def _read_kpi(self, kpi_id: int) -> pd.DataFrame:
+        directory = self._kpi_dir(kpi_id)
+        try:
+            names = sorted(n for n in os.listdir(directory) if n.endswith('.parquet'))
+        except FileNotFoundError:
+            names = []
+        if not names:
+            return wide_frame(kpi_id, [])
+        return pd.concat([pd.read_parquet(os.path.join(directory, n)) for n in names], ignore_index=True)
+
+    def load(self, kpi_ids: list[int]) -> pd.DataFrame:
+        """rows of these KPIs, served from memory after the first read"""
+        self.manifest()
+        frames = []
+        for kpi_id in kpi_ids:
+            frame = self._frames.get(kpi_id)
+            if frame is None:
+                frame = self._frames[kpi_id] = self._read_kpi(kpi_id)
+                while len(self._frames) > LOCAL_MIRROR_CACHED_KPIS:
+                    self._frames.popitem(last=False)
+            else:
+                self._frames.move_to_end(kpi_id)
+            frames.append(frame)
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def query(self, sql: str) -> list[dict[str, Any]]:
+        """run BigQuery SQL locally; raises UnsupportedQuery when it has to go to BigQuery"""
+        return execute(sql, self.load, self.table_id, arrays=MIRRORED_ARRAYS)
+
+    # ---- sync ----
+
+    def _write_month(self, kpi_id: int, month: str, frame: pd.DataFrame, after: Optional[date]) -> None:
+        directory = self._kpi_dir(kpi_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{month}.parquet")
+        if after is not None and _month(after) == month and os.path.exists(path):
+            #the month straddles the settled cutoff: keep its settled days
+            kept = pd.read_parquet(path)
+            kept = kept[kept['KPI_DATE'] <= pd.Timestamp(after)]
+            frame = pd.concat([kept, frame], ignore_index=True)
+        frame = frame.sort_values('KPI_DATE', kind='stable')
+        frame.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+
+    def _drop_unwritten(self, written: set[tuple[int, str]], after: Optional[date]) -> int:
+        """months no longer in the table: everything on a full sync, past the cutoff otherwise"""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for entry in os.listdir(self.root):
+            if not entry.startswith('kpi_id='):
+                continue
+            kpi_id = int(entry.split('=', 1)[1])
+            for name in os.listdir(os.path.join(self.root, entry)):
+                month = name.removesuffix('.parquet')
+                if (kpi_id, month) in written or (after is not None and month < _month(after)):
+                    continue
+                path = os.path.join(self.root, entry, name)
+                if after is not None and month == _month(after):
+                    kept = pd.read_parquet(path)
+                    kept = kept[kept['KPI_DATE'] <= pd.Timestamp(after)]
+                    if not kept.empty:
+                        kept.to_parquet(f"{path}.tmp", index=False)
+                        os.replace(f"{path}.tmp", path)
+                        continue
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def sync(self, client, full: bool = False, mutable_days: int = SCHEMA_MUTABLE_DAYS) -> dict[str, Any]:
+        """copy KPI_DATE partitions the last sync had not settled (all of them with full=True)"""
+        from google.cloud import bigquery
+
+        manifest = None if full else self.manifest()
+        if manifest is not None and manifest.get('table') != self.table_id:
+            raise ValueError(f"Mirror at {self.root} holds {manifest.get('table')}, not {self.table_id}")
+        after = date.fromisoformat(manifest['synced_through']) if manifest and manifest.get('synced_through') else None
+
+        rows = list(client.query(f"SELECT MAX(KPI_DATE) AS LATEST FROM `{self.table_id}`").result())
+        latest = rows[0]['LATEST'] if rows else None
+        if latest is None:
+            raise ValueError(f"{self.table_id} has no rows")
+
+        query = f"SELECT KPI_ID, KPI_DATE, {', '.join(MIRRORED_ARRAYS)} FROM `{self.table_id}`"
+        params = []
+        if after is not None:
+            #partition filter, so only the unsettled partitions are billed
+            query += " WHERE KPI_DATE > @after"
+            params.append(bigquery.ScalarQueryParameter('after', 'DATE', after))
+        #ordered, so each KPI month is complete when the next one starts
+        query += " ORDER BY KPI_ID, KPI_DATE"
+        job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params))
+
+        started = time.perf_counter()
+        written: set[tuple[int, str]] = set()
+        current: Optional[tuple[int, str]] = None
+        batch: list[dict[str, Any]] = []
+        n_rows = 0
+        for row in job.result(page_size=50000):
+            key = (int(row['KPI_ID']), _month(row['KPI_DATE']))
+            if key != current and batch:
+                self._write_month(*current, wide_frame(current[0], batch), after)
+                written.add(current)
+                batch = []
+            current = key
+            batch.append(row)
+            n_rows += 1
+        if batch:
+            self._write_month(*current, wide_frame(current[0], batch), after)
+            written.add(current)
+        removed = self._drop_unwritten(written, after)
+
+        manifest = {
+            'table': self.table_id,
+            'synced_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'latest_date': latest.isoformat(),
+            #partitions after this are rescanned by the next sync
+            'synced_through': (latest - timedelta(days=mutable_days)).isoformat(),
+            'arrays': list(MIRRORED_ARRAYS),
+        }
+        os.makedirs(self.root, exist_ok=True)
+        self._write_manifest(manifest)
+        logger.info(
+            f"Local mirror synced {n_rows} rows into {len(written)} files after {after or 'the start'}, "
+            f"removed {removed} in {time.perf_counter() - started:.1f}s"
+        )
+        return {**manifest, 'rows': n_rows, 'files_written': len(written), 'files_removed': removed}
+
+
+class LocalMirrorBackend(Backend):
+    """answers execute_sql from a fresh local mirror; everything else, and any
+    query local_sql cannot run, goes to inner (or live BigQuery when inner is None)
+    """
+
+    def __init__(self, mirror: LocalMirror, inner: Optional[Backend] = None):
+        self.mirror = mirror
+        self.inner = inner
+        self.offline = inner is not None and getattr(inner, 'offline', False)
+        self.hits = 0
+        self.fallbacks: dict[str, int] = defaultdict(int)
+        self.latencies_ms: list[float] = []
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        return None if self.inner is None else await self.inner.serve_model(agent_name, llm_request, call_key)
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        if self.inner is not None:
+            self.inner.observe_model(call_key, llm_response)
+
+    def _fall_back(self, reason: str) -> None:
+        self.fallbacks[reason] += 1
+        logger.info(f"Local mirror fallback to BigQuery: {reason}")
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if tool_name == 'execute_sql' and not args.get('dry_run'):
+            age = self.mirror.age_hours()
+            if age is None or age > LOCAL_MIRROR_MAX_AGE_HOURS:
+                self._fall_back('no mirror' if age is None else 'stale')
+            else:
+                started = time.perf_counter()
+                try:
+                    rows = await asyncio.to_thread(self.mirror.query, args.get('query') or '')
+                except UnsupportedQuery as e:
+                    self._fall_back(str(e))
+                except Exception as e:
+                    logger.warning(f"Local mirror query failed, using BigQuery: {type(e).__name__}: {e}")
+                    self._fall_back(type(e).__name__)
+                else:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    self.hits += 1
+                    self.latencies_ms.append(elapsed_ms)
+                    get_tracer().annotate_pending(call_key, served_by='local_mirror', local_sql_ms=elapsed_ms)
+                    response = {'status': 'SUCCESS', 'rows': rows[:LOCAL_MIRROR_MAX_ROWS]}
+                    if len(rows) >= LOCAL_MIRROR_MAX_ROWS:
+                        response['result_is_likely_truncated'] = True
+                    return response
+        return None if self.inner is None else await self.inner.serve_tool(tool_name, args, call_key)
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        if self.inner is not None:
+            self.inner.observe_tool(call_key, tool_response)
+
+    def stats(self) -> dict[str, Any]:
+        queries = self.hits + sum(self.fallbacks.values())
+        return {
+            'hits': self.hits,
+            'fallbacks': dict(self.fallbacks),
+            'hit_rate': self.hits / queries if queries else None,
+            'latencies_ms': list(self.latencies_ms),
+        }
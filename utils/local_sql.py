@@ -0,0 +1,1185 @@
+import operator
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+import numpy as np
+import pandas as pd
+
+#columns of the KPI data table; DIM/INT/FLOAT arrays are mirrored wide as 'DIM:<name>' etc.
+ARRAY_KINDS = ('DIM', 'INT', 'FLOAT')
+KIND_OF_ARRAY = {'DIM': 'str', 'INT': 'int', 'FLOAT': 'float'}
+TABLE_COLUMNS = {'KPI_ID': 'int', 'KPI_DATE': 'date'}
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<quoted>`[^`]*`)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<number>\d+\.\d*|\.\d+|\d+)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op><=|>=|<>|!=|[=<>(),.*+\-/;])
+""", re.VERBOSE | re.DOTALL)
+
+#keywords that end an expression or clause
+CLAUSE_KEYWORDS = {'FROM', 'WHERE', 'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'AS', 'AND', 'OR', 'ON', 'BETWEEN',
+                   'IN', 'IS', 'NOT', 'LIKE', 'ASC', 'DESC', 'QUALIFY', 'WINDOW', 'UNION', 'JOIN', 'CROSS',
+                   'LEFT', 'RIGHT', 'INNER', 'FULL', 'OVER', 'NULLS', 'SELECT', 'WITH', 'EXCEPT', 'INTERSECT'}
+AGGREGATES = {'SUM', 'AVG', 'MIN', 'MAX', 'COUNT'}
+DATE_PARTS = {'DAY', 'WEEK', 'ISOWEEK', 'MONTH', 'QUARTER', 'YEAR'}
+#DATE_ADD / DATE_SUB interval of n of each part; BigQuery allows no other part there
+DATE_INTERVALS = {
+    'DAY': lambda n: pd.DateOffset(days=n),
+    'WEEK': lambda n: pd.DateOffset(weeks=n),
+    'MONTH': lambda n: pd.DateOffset(months=n),
+    'QUARTER': lambda n: pd.DateOffset(months=3 * n),
+    'YEAR': lambda n: pd.DateOffset(years=n),
+}
+#KPI_DATE conditions a result cache can treat as a date range
+RANGE_OPS = {'BETWEEN', '>=', '>', '<=', '<'}
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+#keywords ending a WHERE clause at its own nesting level
+WHERE_CLAUSE_ENDS = {'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'QUALIFY', 'WINDOW', 'UNION', 'EXCEPT', 'INTERSECT'}
+
+
+class UnsupportedQuery(Exception):
+    """the query uses SQL this engine does not translate; run it on BigQuery instead"""
+
+
+def _tokenize(sql: str) -> list[tuple[str, str]]:
+    tokens, pos = [], 0
+    while pos < len(sql):
+        match = TOKEN_PATTERN.match(sql, pos)
+        if match is None:
+            raise UnsupportedQuery(f"Unexpected character {sql[pos]!r}")
+        pos = match.end()
+        if match.lastgroup != 'space':
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+# ---- expression nodes ----
+
+class Node:
+    kind = 'unknown'
+
+    def children(self) -> list['Node']:
+        return []
+
+    def has_aggregate(self) -> bool:
+        return any(child.has_aggregate() for child in self.children())
+
+    def walk(self):
+        yield self
+        for child in self.children():
+            yield from child.walk()
+
+
+class Literal(Node):
+    def __init__(self, value: Any, kind: str):
+        self.value = value
+        self.kind = kind
+
+    def evaluate(self, env: '_Env') -> Any:
+        return self.value
+
+
+class Column(Node):
+    def __init__(self, name: str):
+        self.name = name
+        self.kind = TABLE_COLUMNS[name]
+
+    def evaluate(self, env: '_Env') -> Any:
+        return env.frame[self.name]
+
+
+class ArrayValue(Node):
+    """(SELECT VALUE FROM UNNEST(<kind>) WHERE NAME = '<name>'), or NAME LIKE '<pattern>'"""
+
+    def __init__(self, array: str, name: str, like: bool = False):
+        self.array = array
+        self.name = name
+        self.like = like
+        self.kind = KIND_OF_ARRAY[array]
+
+    def column(self, frame: pd.DataFrame) -> Optional[str]:
+        if not self.like:
+            column = f"{self.array}:{self.name}"
+            return column if column in frame.columns else None
+        pattern = _like_regex(self.name)
+        matches = [c for c in frame.columns if c.startswith(f"{self.array}:") and pattern.match(c.split(':', 1)[1])]
+        if len(matches) > 1:
+            #BigQuery raises when the scalar subquery finds several elements
+            raise UnsupportedQuery(f"NAME LIKE '{self.name}' matches {len(matches)} {self.array} entries")
+        return matches[0] if matches else None
+
+    def evaluate(self, env: '_Env') -> Any:
+        column = self.column(env.frame)
+        if column is None:
+            #no such element in the array: the subquery is NULL for every row
+            return pd.Series(None, index=env.frame.index, dtype=object if self.kind == 'str' else float)
+        return env.frame[column]
+
+
+class Aggregate(Node):
+    def __init__(self, func: str, arg: Optional[Node], distinct: bool = False):
+        self.func = func
+        self.arg = arg
+        self.distinct = distinct
+        if func == 'COUNT':
+            self.kind = 'int'
+        elif func == 'AVG':
+            self.kind = 'float'
+        else:
+            self.kind = arg.kind
+
+    def children(self) -> list[Node]:
+        return [self.arg] if self.arg is not None else []
+
+    def has_aggregate(self) -> bool:
+        return True
+
+    def evaluate(self, env: '_Env') -> Any:
+        if env.aggregates is None:
+            raise UnsupportedQuery(f"{self.func} outside an aggregating SELECT")
+        return env.aggregates[id(self)]
+
+
+_BINARY_OPS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}
+
+
+class BinaryOp(Node):
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+        if op == '/':
+            self.kind = 'float'
+        elif 'date' in (left.kind, right.kind):
+            self.kind = 'date'
+        elif left.kind == right.kind == 'int':
+            self.kind = 'int'
+        else:
+            self.kind = 'float'
+
+    def children(self) -> list[Node]:
+        return [self.left, self.right]
+
+    def evaluate(self, env: '_Env') -> Any:
+        left, right = self.left.evaluate(env), self.right.evaluate(env)
+        if self.kind == 'date':
+            #DATE +/- INT64 counts days
+            if self.left.kind == 'date' and self.right.kind == 'int' and self.op in '+-':
+                return _BINARY_OPS[self.op](left, pd.to_timedelta(right, unit='D'))
+            raise UnsupportedQuery(f"Date arithmetic {self.left.kind} {self.op} {self.right.kind}")
+        if self.op == '/':
+            divisor = right if isinstance(right, pd.Series) else pd.Series([right])
+            if (divisor == 0).any():
+                #BigQuery fails the whole query on division by zero; let it report that
+                raise UnsupportedQuery("Division by zero")
+        return _BINARY_OPS[self.op](left, right)
+
+
+class Function(Node):
+    def __init__(self, name: str, args: list[Node], part: Optional[str] = None):
+        self.name = name
+        self.args = args
+        self.part = part
+        if name in ('CURRENT_DATE', 'DATE', 'DATE_SUB', 'DATE_ADD', 'DATE_TRUNC'):
+            self.kind = 'date'
+        elif name in ('SAFE_DIVIDE', 'ROUND'):
+            self.kind = 'float'
+        elif name in ('COALESCE', 'IFNULL'):
+            self.kind = args[0].kind
+        else:
+            raise UnsupportedQuery(f"Function {name}")
+
+    def children(self) -> list[Node]:
+        return self.args
+
+    def evaluate(self, env: '_Env') -> Any:
+        if self.name == 'CURRENT_DATE':
+            return env.today
+        values = [arg.evaluate(env) for arg in self.args]
+        if self.name == 'DATE':
+            #dates are midnight Timestamps here; DATE() of a column or TIMESTAMP drops the time of day
+            if isinstance(values[0], pd.Series):
+                return pd.to_datetime(values[0]).dt.normalize()
+            return None if values[0] is None else pd.Timestamp(values[0]).normalize()
+        if self.name in ('DATE_SUB', 'DATE_ADD'):
+            if self.part not in DATE_INTERVALS:
+                raise UnsupportedQuery(f"{self.name} by INTERVAL {self.part}")
+            offset = DATE_INTERVALS[self.part](int(values[1]))
+            return values[0] - offset if self.name == 'DATE_SUB' else values[0] + offset
+        if self.name == 'DATE_TRUNC':
+            return _date_trunc(values[0], self.part)
+        if self.name == 'SAFE_DIVIDE':
+            numerator, denominator = values
+            if isinstance(denominator, pd.Series):
+                return numerator / denominator.where(denominator != 0)
+            return None if denominator == 0 else numerator / denominator
+        if self.name == 'ROUND':
+            digits = int(values[1]) if len(values) > 1 else 0
+            return values[0].round(digits) if isinstance(values[0], pd.Series) else round(values[0], digits)
+        #COALESCE / IFNULL
+        result = values[0]
+        for value in values[1:]:
+            result = result.fillna(value) if isinstance(result, pd.Series) else (value if result is None else result)
+        return result
+
+
+_COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<>': operator.ne, '<': operator.lt,
+                '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def _is_null(value: Any) -> Any:
+    return value.isna() if isinstance(value, pd.Series) else value is None or value is pd.NaT
+
+
+def _with_nulls(result: Any, nulls: Any) -> Any:
+    """a nullable boolean: NULL where nulls is true, as BigQuery's three-valued logic has it"""
+    if isinstance(result, pd.Series):
+        return result.astype('boolean').mask(nulls)
+    if isinstance(nulls, pd.Series):
+        return pd.Series(bool(result), index=nulls.index, dtype='boolean').mask(nulls)
+    return None if nulls else bool(result)
+
+
+def _kleene(value: Any) -> Any:
+    """a condition's value for pandas' three-valued &, | and ~"""
+    if isinstance(value, pd.Series):
+        return value.astype('boolean')
+    return pd.NA if value is None else value
+
+
+class Predicate(Node):
+    """comparison, BETWEEN, IN, IS NULL or LIKE; NULL operands make it NULL, which WHERE drops"""
+    kind = 'bool'
+
+    def __init__(self, op: str, operands: list[Node], negated: bool = False):
+        self.op = op
+        self.operands = operands
+        self.negated = negated
+
+    def children(self) -> list[Node]:
+        return self.operands
+
+    def _values(self, env: '_Env') -> list[Any]:
+        values = [operand.evaluate(env) for operand in self.operands]
+        kinds = {operand.kind for operand in self.operands}
+        if 'date' in kinds:
+            #string literals compared to a DATE are coerced, as BigQuery does
+            values = [pd.Timestamp(v) if isinstance(v, str) else v for v in values]
+        elif 'str' in kinds and kinds & {'int', 'float'}:
+            raise UnsupportedQuery("Comparison between STRING and a number")
+        return values
+
+    def evaluate(self, env: '_Env') -> Any:
+        values = self._values(env)
+        subject = values[0]
+        if self.op == 'IS NULL':
+            result = subject.isna() if isinstance(subject, pd.Series) else subject is None
+            return ~result if self.negated else result
+        #a NULL operand makes the predicate NULL; IN skips NULL list entries, but they turn a miss into NULL
+        operands = values[:1] + [v for v in values[1:] if isinstance(v, pd.Series)] if self.op == 'IN' else values
+        series = [value for value in operands if isinstance(value, pd.Series)]
+        if any(_is_null(value) for value in operands if not isinstance(value, pd.Series)):
+            return _with_nulls(False, pd.Series(True, index=series[0].index) if series else True)
+        nulls = series[0].isna() if series else False
+        for value in series[1:]:
+            nulls = nulls | value.isna()
+        if self.op == 'IN':
+            listed = [v for v in values[1:] if isinstance(v, pd.Series) or not _is_null(v)]
+            result = subject.isin(listed) if isinstance(subject, pd.Series) else subject in listed
+            if len(listed) < len(values) - 1:
+                nulls = nulls | ~result if isinstance(result, pd.Series) else nulls or not result
+        elif self.op == 'BETWEEN':
+            result = (subject >= values[1]) & (subject <= values[2])
+        elif self.op == 'LIKE':
+            pattern = _like_regex(values[1])
+            result = subject.astype(str).str.match(pattern) if isinstance(subject, pd.Series) else bool(pattern.match(subject))
+        else:
+            result = _COMPARISONS[self.op](subject, values[1])
+        if self.negated:
+            result = ~result if isinstance(result, pd.Series) else not result
+        return _with_nulls(result, nulls)
+
+
+class Exists(Node):
+    """EXISTS (...): TRUE or FALSE, never NULL, even when the element filter is NULL"""
+    kind = 'bool'
+
+    def __init__(self, predicate: Predicate):
+        self.predicate = predicate
+
+    def children(self) -> list[Node]:
+        return [self.predicate]
+
+    def evaluate(self, env: '_Env') -> Any:
+        result = self.predicate.evaluate(env)
+        return result.fillna(False).astype(bool) if isinstance(result, pd.Series) else bool(result)
+
+
+class BoolOp(Node):
+    kind = 'bool'
+
+    def __init__(self, op: str, operands: list[Node]):
+        self.op = op
+        self.operands = operands
+
+    def children(self) -> list[Node]:
+        return self.operands
+
+    def evaluate(self, env: '_Env') -> Any:
+        #pandas' nullable booleans follow the same three-valued logic as BigQuery: NOT NULL is NULL
+        values = [_kleene(operand.evaluate(env)) for operand in self.operands]
+        if self.op == 'NOT':
+            result = ~values[0]
+        else:
+            result = values[0]
+            for value in values[1:]:
+                result = result & value
+        return None if result is pd.NA else result
+
+
+class UnnestRef(Node):
+    """I.NAME / I.VALUE of `FROM table, UNNEST(INT) AS I`; the WHERE clause must pin I.NAME to one element
+
+    execute() keeps only the rows holding that element, so I.NAME is the pinned name on every row left.
+    """
+
+    def __init__(self, field: str, array: str):
+        self.field = field
+        self.array = array
+        self.kind = 'str' if field == 'NAME' else KIND_OF_ARRAY[array]
+
+    def evaluate(self, env: '_Env') -> Any:
+        if self.field == 'NAME':
+            return env.unnest_name
+        return ArrayValue(self.array, env.unnest_name).evaluate(env)
+
+
+def _like_regex(pattern: str) -> re.Pattern:
+    return re.compile('^' + ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern) + '$', re.DOTALL)
+
+
+def _date_trunc(values: Any, part: str) -> Any:
+    series = values if isinstance(values, pd.Series) else pd.Series([values])
+    if part == 'DAY':
+        result = series
+    elif part == 'WEEK':
+        #BigQuery weeks start on Sunday
+        result = series - pd.to_timedelta((series.dt.dayofweek + 1) % 7, unit='D')
+    elif part == 'ISOWEEK':
+        result = series - pd.to_timedelta(series.dt.dayofweek, unit='D')
+    else:
+        result = series.dt.to_period(part[0]).dt.start_time
+    return result if isinstance(values, pd.Series) else result.iloc[0]
+
+
+# ---- parser ----
+
+class SelectItem:
+    def __init__(self, expr: Node, alias: Optional[str]):
+        self.expr = expr
+        self.alias = alias
+
+
+class Query:
+    def __init__(self):
+        self.distinct = False
+        self.items: list[SelectItem] = []
+        self.star = False
+        self.source: Optional[str] = None  #'table' or a CTE name
+        self.unnest: Optional[tuple[str, str]] = None  #(array kind, alias)
+        self.where: Optional[Node] = None
+        self.group_by: Optional[list] = None  #None, ['ALL'] or items
+        self.order_by: list[tuple[Any, bool]] = []
+        self.limit: Optional[int] = None
+
+
+class _Parser:
+    """recursive-descent parser for the SELECT shapes the SQL agents write against the KPI table"""
+
+    def __init__(self, sql: str, table_id: str):
+        self.tokens = _tokenize(sql)
+        self.pos = 0
+        self.table_id = table_id
+        self.ctes: dict[str, Query] = {}
+        self.aliases: dict[str, str] = {}  #FROM aliases -> 'table' / 'unnest'
+        self.unnest_array: Optional[str] = None
+
+    # ---- token helpers ----
+
+    def peek(self, offset: int = 0) -> tuple[str, str]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ('end', '')
+
+    def at(self, *words: str, offset: int = 0) -> bool:
+        kind, value = self.peek(offset)
+        return kind in ('ident', 'op') and value.upper() in words
+
+    def accept(self, *words: str) -> bool:
+        if self.at(*words):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, *words: str) -> str:
+        kind, value = self.peek()
+        if not self.at(*words):
+            raise UnsupportedQuery(f"Expected {'/'.join(words)}, found {value or 'end of query'}")
+        self.pos += 1
+        return value.upper()
+
+    def identifier(self) -> str:
+        kind, value = self.peek()
+        if kind == 'quoted':
+            self.pos += 1
+            return value.strip('`')
+        if kind == 'ident' and value.upper() not in CLAUSE_KEYWORDS:
+            self.pos += 1
+            return value
+        raise UnsupportedQuery(f"Expected an identifier, found {value or 'end of query'}")
+
+    def string(self) -> str:
+        kind, value = self.peek()
+        if kind != 'string':
+            raise UnsupportedQuery(f"Expected a string literal, found {value or 'end of query'}")
+        self.pos += 1
+        return value[1:-1].encode('utf-8').decode('unicode_escape') if '\\' in value else value[1:-1]
+
+    # ---- statements ----
+
+    def parse(self) -> Query:
+        if self.accept('WITH'):
+            while True:
+                name = self.identifier().upper()
+                self.expect('AS')
+                self.expect('(')
+                cte = self.select()
+                self.expect(')')
+                if not cte.star or cte.source != 'table' or cte.unnest or cte.order_by or cte.limit is not None \
+                        or cte.group_by not in (None, ['ALL']):
+                    raise UnsupportedQuery(f"CTE {name} is not a filtered SELECT * of the KPI table")
+                self.ctes[name] = cte
+                if not self.accept(','):
+                    break
+            self.aliases = {}
+            self.unnest_array = None
+        query = self.select()
+        self.accept(';')
+        if self.peek()[0] != 'end':
+            raise UnsupportedQuery(f"Unexpected {self.peek()[1]} after the query")
+        return query
+
+    def _prescan_from(self) -> None:
+        """register FROM aliases before the SELECT list that uses them is parsed"""
+        start, depth = self.pos, 0
+        while self.pos < len(self.tokens):
+            if self.at('('):
+                depth += 1
+            elif self.at(')'):
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and self.at('FROM'):
+                self.pos += 1
+                self.from_clause(Query())
+                break
+            self.pos += 1
+        self.pos = start
+
+    def select(self) -> Query:
+        query = Query()
+        self.expect('SELECT')
+        self._prescan_from()
+        query.distinct = self.accept('DISTINCT')
+        if self.accept('*'):
+            query.star = True
+        else:
+            while True:
+                expr = self.expression()
+                alias = None
+                if self.accept('AS'):
+                    alias = self.identifier()
+                elif self.peek()[0] in ('ident', 'quoted') and not self.at(*CLAUSE_KEYWORDS):
+                    alias = self.identifier()
+                query.items.append(SelectItem(expr, alias))
+                if not self.accept(','):
+                    break
+                if self.at('FROM'):
+                    break  #BigQuery allows a trailing comma
+        self.expect('FROM')
+        self.from_clause(query)
+        if self.accept('WHERE'):
+            query.where = self.condition()
+        if self.accept('GROUP'):
+            self.expect('BY')
+            if self.accept('ALL'):
+                query.group_by = ['ALL']
+            else:
+                query.group_by = [self.order_key() for _ in self._comma_list()]
+        if self.at('HAVING', 'QUALIFY', 'WINDOW', 'UNION', 'EXCEPT', 'INTERSECT'):
+            raise UnsupportedQuery(self.peek()[1].upper())
+        if self.accept('ORDER'):
+            self.expect('BY')
+            for _ in self._comma_list():
+                key = self.order_key()
+                descending = self.accept('DESC')
+                if not descending:
+                    self.accept('ASC')
+                if self.accept('NULLS'):
+                    raise UnsupportedQuery("NULLS FIRST/LAST")
+                query.order_by.append((key, descending))
+        if self.accept('LIMIT'):
+            kind, value = self.peek()
+            if kind != 'number':
+                raise UnsupportedQuery("LIMIT without a number")
+            self.pos += 1
+            query.limit = int(value)
+            if self.at('OFFSET'):
+                raise UnsupportedQuery("OFFSET")
+        return query
+
+    def _comma_list(self):
+        yield
+        while self.accept(','):
+            yield
+
+    def order_key(self) -> Any:
+        """an ordinal, an output alias or an expression"""
+        kind, value = self.peek()
+        if kind == 'number':
+            self.pos += 1
+            return int(value)
+        if kind in ('ident', 'quoted') and value.upper() not in TABLE_COLUMNS and not self.at(*CLAUSE_KEYWORDS) \
+                and self.peek(1) not in (('op', '('), ('op', '.')):
+            return self.identifier().upper()
+        return self.expression()
+
+    def from_clause(self, query: Query) -> None:
+        kind, value = self.peek()
+        name = self.identifier()
+        while self.accept('.'):
+            name += '.' + self.identifier()
+        if name.upper() in self.ctes:
+            query.source = name.upper()
+        elif name == self.table_id or self.table_id.endswith('.' + name) and name.count('.') >= 1:
+            query.source = 'table'
+        else:
+            raise UnsupportedQuery(f"Table {name} is not mirrored")
+        if self.accept('AS') or self.peek()[0] == 'ident' and not self.at(*CLAUSE_KEYWORDS):
+            self.aliases[self.identifier().upper()] = 'table'
+
+        if self.accept(',') or (self.accept('CROSS') and self.expect('JOIN')):
+            self.expect('UNNEST')
+            self.expect('(')
+            array = self.identifier().upper()
+            if array not in ARRAY_KINDS:
+                raise UnsupportedQuery(f"UNNEST({array})")
+            self.expect(')')
+            self.accept('AS')
+            alias = self.identifier().upper()
+            self.aliases[alias] = 'unnest'
+            self.unnest_array = array
+            query.unnest = (array, alias)
+        if self.at('JOIN', 'LEFT', 'RIGHT', 'INNER', 'FULL', 'CROSS', ','):
+            raise UnsupportedQuery("JOIN")
+
+    # ---- expressions ----
+
+    def condition(self) -> Node:
+        node = self.conjunction()
+        if self.at('OR'):
+            raise UnsupportedQuery("OR")
+        return node
+
+    def conjunction(self) -> Node:
+        operands = [self.negation()]
+        while self.accept('AND'):
+            operands.append(self.negation())
+        return operands[0] if len(operands) == 1 else BoolOp('AND', operands)
+
+    def negation(self) -> Node:
+        if self.accept('NOT'):
+            return BoolOp('NOT', [self.negation()])
+        return self.predicate()
+
+    def predicate(self) -> Node:
+        if self.at('EXISTS'):
+            return self.exists()
+        left = self.expression()
+        negated = False
+        if self.at('NOT') and self.at('BETWEEN', 'IN', 'LIKE', offset=1):
+            self.pos += 1
+            negated = True
+        if self.accept('BETWEEN'):
+            low = self.expression()
+            self.expect('AND')
+            return Predicate('BETWEEN', [left, low, self.expression()], negated)
+        if self.accept('IN'):
+            self.expect('(')
+            if self.at('SELECT', 'UNNEST'):
+                raise UnsupportedQuery("IN subquery")
+            values = [self.expression() for _ in self._comma_list()]
+            self.expect(')')
+            return Predicate('IN', [left] + values, negated)
+        if self.accept('LIKE'):
+            return Predicate('LIKE', [left, self.expression()], negated)
+        if self.accept('IS'):
+            negated = self.accept('NOT')
+            self.expect('NULL')
+            return Predicate('IS NULL', [left], negated)
+        kind, value = self.peek()
+        if kind == 'op' and value in _COMPARISONS:
+            self.pos += 1
+            return Predicate(value, [left, self.expression()])
+        return left
+
+    def expression(self) -> Node:
+        node = self.term()
+        while self.at('+', '-'):
+            op = self.expect('+', '-')
+            node = BinaryOp(op, node, self.term())
+        return node
+
+    def term(self) -> Node:
+        node = self.unary()
+        while self.at('*', '/'):
+            op = self.expect('*', '/')
+            node = BinaryOp(op, node, self.unary())
+        return node
+
+    def unary(self) -> Node:
+        if self.accept('-'):
+            operand = self.unary()
+            if isinstance(operand, Literal):
+                return Literal(-operand.value, operand.kind)
+            return BinaryOp('-', Literal(0, 'int'), operand)
+        return self.primary()
+
+    def primary(self) -> Node:
+        kind, value = self.peek()
+        if kind == 'number':
+            self.pos += 1
+            return Literal(float(value), 'float') if '.' in value else Literal(int(value), 'int')
+        if kind == 'string':
+            return Literal(self.string(), 'str')
+        if self.accept('NULL'):
+            return Literal(None, 'null')
+        if self.at('DATE') and self.peek(1)[0] == 'string':
+            self.pos += 1
+            return Literal(pd.Timestamp(self.string()), 'date')
+        if self.accept('('):
+            if self.at('SELECT'):
+                node = self.array_subquery()
+            else:
+                node = self.condition()
+            self.expect(')')
+            return node
+        if self.at('CASE', 'CAST', 'SAFE_CAST', 'EXTRACT', 'IF', 'ARRAY', 'STRUCT'):
+            raise UnsupportedQuery(value.upper())
+        if kind in ('ident', 'quoted') and self.peek(1) == ('op', '('):
+            return self.call()
+        return self.column_ref()
+
+    def call(self) -> Node:
+        name = self.identifier().upper()
+        self.expect('(')
+        if name in AGGREGATES:
+            distinct = self.accept('DISTINCT')
+            if name == 'COUNT' and self.accept('*'):
+                arg = None
+            else:
+                arg = self.expression()
+            self.expect(')')
+            if self.at('OVER'):
+                raise UnsupportedQuery("Window function")
+            if arg is not None and arg.has_aggregate():
+                raise UnsupportedQuery("Nested aggregate")
+            return Aggregate(name, arg, distinct)
+        if name == 'CURRENT_DATE':
+            self.expect(')')
+            return Function(name, [])
+        if name in ('DATE_SUB', 'DATE_ADD'):
+            date_arg = self.expression()
+            self.expect(',')
+            self.expect('INTERVAL')
+            amount = self.expression()
+            part = self.expect(*DATE_PARTS)
+            self.expect(')')
+            return Function(name, [date_arg, amount], part)
+        if name == 'DATE_TRUNC':
+            date_arg = self.expression()
+            self.expect(',')
+            part = self.expect(*DATE_PARTS)
+            self.expect(')')
+            return Function(name, [date_arg], part)
+        args = [] if self.at(')') else [self.expression() for _ in self._comma_list()]
+        self.expect(')')
+        if name == 'DATE' and len(args) != 1:
+            raise UnsupportedQuery("DATE with more than one argument")
+        return Function(name, args)
+
+    def column_ref(self) -> Node:
+        parts = [self.identifier()]
+        while self.accept('.'):
+            parts.append(self.identifier())
+        qualifier = parts[0].upper() if len(parts) == 2 else None
+        field = parts[-1].upper()
+        if len(parts) > 2:
+            raise UnsupportedQuery(f"Column {'.'.join(parts)}")
+        if qualifier is not None and self.aliases.get(qualifier) == 'unnest' \
+                or qualifier is None and field in ('NAME', 'VALUE') and 'unnest' in self.aliases.values():
+            return UnnestRef(field, self.unnest_array)
+        if qualifier is not None and qualifier not in self.aliases and qualifier not in self.ctes:
+            raise UnsupportedQuery(f"Unknown qualifier {parts[0]}")
+        if field not in TABLE_COLUMNS:
+            raise UnsupportedQuery(f"Column {field}")
+        return Column(field)
+
+    def _unnest_source(self) -> tuple[str, str]:
+        """UNNEST(<array>) [AS alias] inside a subquery"""
+        self.expect('UNNEST')
+        self.expect('(')
+        array = self.identifier().upper()
+        if array not in ARRAY_KINDS:
+            raise UnsupportedQuery(f"UNNEST({array})")
+        self.expect(')')
+        alias = None
+        if self.accept('AS') or self.peek()[0] == 'ident' and not self.at(*CLAUSE_KEYWORDS):
+            alias = self.identifier().upper()
+        return array, alias
+
+    def _element_field(self, alias: Optional[str]) -> str:
+        parts = [self.identifier().upper()]
+        if self.accept('.'):
+            parts.append(self.identifier().upper())
+        if len(parts) == 2 and parts[0] != alias:
+            raise UnsupportedQuery(f"Correlated reference {'.'.join(parts)}")
+        if parts[-1] not in ('NAME', 'VALUE'):
+            raise UnsupportedQuery(f"Array field {parts[-1]}")
+        return parts[-1]
+
+    def _element_name(self, alias: Optional[str]) -> tuple[str, bool]:
+        """NAME = '<name>' or NAME LIKE '<pattern>'"""
+        if self._element_field(alias) != 'NAME':
+            raise UnsupportedQuery("Array element filter must start with NAME")
+        like = self.accept('LIKE')
+        if not like:
+            self.expect('=')
+        return self.string(), like
+
+    def array_subquery(self) -> Node:
+        """(SELECT VALUE FROM UNNEST(DIM) WHERE NAME = 'x')"""
+        self.expect('SELECT')
+        array_alias = None
+        if self.peek(1) == ('op', '.'):
+            array_alias = self.identifier().upper()
+            self.expect('.')
+        self.expect('VALUE')
+        self.expect('FROM')
+        array, alias = self._unnest_source()
+        if array_alias is not None and array_alias != alias:
+            raise UnsupportedQuery("Scalar subquery over another table")
+        self.expect('WHERE')
+        name, like = self._element_name(alias)
+        if self.at('AND', 'LIMIT', 'ORDER'):
+            raise UnsupportedQuery("Scalar subquery with more than a NAME filter")
+        return ArrayValue(array, name, like)
+
+    def exists(self) -> Node:
+        """EXISTS (SELECT 1 FROM UNNEST(DIM) AS D WHERE D.NAME = 'x' AND D.VALUE = 'v')"""
+        self.expect('EXISTS')
+        self.expect('(')
+        self.expect('SELECT')
+        self.primary()
+        self.expect('FROM')
+        array, alias = self._unnest_source()
+        self.expect('WHERE')
+        name, like = self._element_name(alias)
+        element = ArrayValue(array, name, like)
+        if not self.accept('AND'):
+            #the named element is present
+            self.expect(')')
+            return Exists(Predicate('IS NULL', [element], negated=True))
+        if self._element_field(alias) != 'VALUE':
+            raise UnsupportedQuery("EXISTS filter other than NAME and VALUE")
+        negated = self.accept('NOT')
+        if self.accept('IN'):
+            self.expect('(')
+            values = [self.expression() for _ in self._comma_list()]
+            self.expect(')')
+            predicate = Predicate('IN', [element] + values, negated)
+        elif self.accept('LIKE'):
+            predicate = Predicate('LIKE', [element, self.expression()], negated)
+        else:
+            kind, value = self.peek()
+            if negated or kind != 'op' or value not in _COMPARISONS:
+                raise UnsupportedQuery("EXISTS filter on VALUE")
+            self.pos += 1
+            predicate = Predicate(value, [element, self.expression()])
+        if self.at('AND', 'OR'):
+            raise UnsupportedQuery("EXISTS with more than a NAME and a VALUE filter")
+        self.expect(')')
+        return Exists(predicate)
+
+
+# ---- planning and execution ----
+
+class _Env:
+    def __init__(self, frame: pd.DataFrame, today: pd.Timestamp, unnest_name: Optional[str] = None,
+                 aggregates: Optional[dict] = None):
+        self.frame = frame
+        self.today = today
+        self.unnest_name = unnest_name
+        self.aggregates = aggregates
+
+
+def _conjuncts(node: Optional[Node]) -> list[Node]:
+    if node is None:
+        return []
+    if isinstance(node, BoolOp) and node.op == 'AND':
+        return [c for operand in node.operands for c in _conjuncts(operand)]
+    return [node]
+
+
+def _unnest_name(conditions: list[Node]) -> str:
+    """the element pinned by `I.NAME = '...'` in a `FROM table, UNNEST(...) AS I` query"""
+    names = [
+        c.operands[1].value for c in conditions
+        if isinstance(c, Predicate) and c.op == '=' and not c.negated
+        and isinstance(c.operands[0], UnnestRef) and c.operands[0].field == 'NAME'
+        and isinstance(c.operands[1], Literal)
+    ]
+    if len(names) != 1:
+        raise UnsupportedQuery("UNNEST join without exactly one NAME = '...' filter")
+    return names[0]
+
+
+def _kpi_ids(conditions: list[Node]) -> Optional[list[int]]:
+    for condition in conditions:
+        if isinstance(condition, Predicate) and not condition.negated and isinstance(condition.operands[0], Column) \
+                and condition.operands[0].name == 'KPI_ID' and all(isinstance(o, Literal) for o in condition.operands[1:]):
+            if condition.op == '=' or condition.op == 'IN':
+                return [int(o.value) for o in condition.operands[1:]]
+    return None
+
+
+def _output_names(query: Query) -> list[str]:
+    names, anonymous = [], 0
+    for item in query.items:
+        if item.alias:
+            names.append(item.alias)
+        elif isinstance(item.expr, Column):
+            names.append(item.expr.name)
+        elif isinstance(item.expr, UnnestRef):
+            names.append(item.expr.field)
+        else:
+            names.append(f"f{anonymous}_")
+            anonymous += 1
+    if len({n.upper() for n in names}) != len(names):
+        raise UnsupportedQuery("Duplicate output column names")
+    return names
+
+
+def _same(a: Any, b: Any) -> bool:
+    """structural equality of two parsed expressions"""
+    if type(a) is not type(b):
+        return False
+    if not isinstance(a, Node):
+        return a == b
+    fields = {k: v for k, v in vars(a).items() if k != 'kind'}
+    other = {k: v for k, v in vars(b).items() if k != 'kind'}
+    if fields.keys() != other.keys():
+        return False
+    for key, value in fields.items():
+        if isinstance(value, list):
+            if len(value) != len(other[key]) or not all(_same(x, y) for x, y in zip(value, other[key])):
+                return False
+        elif not _same(value, other[key]):
+            return False
+    return True
+
+
+def _to_series(value: Any, index: pd.Index) -> pd.Series:
+    return value if isinstance(value, pd.Series) else pd.Series([value] * len(index), index=index, dtype=object)
+
+
+def _aggregate(node: Aggregate, env: _Env, keys: list[str]) -> Any:
+    """one aggregate per group (a Series on the group keys), or a scalar without keys"""
+    frame = env.frame
+    if node.arg is None:
+        values = pd.Series(1, index=frame.index)
+    else:
+        values = _to_series(node.arg.evaluate(env), frame.index)
+        if node.arg.kind in ('int', 'float'):
+            values = pd.to_numeric(values, errors='coerce')
+    target = values.groupby([frame[k] for k in keys], dropna=False, sort=False) if keys else values
+
+    if node.func == 'COUNT':
+        if node.arg is None:
+            return target.size() if keys else len(values)
+        return target.nunique() if node.distinct else target.count()
+    if node.distinct:
+        raise UnsupportedQuery(f"{node.func}(DISTINCT ...)")
+    if node.func == 'SUM':
+        return target.sum(min_count=1)
+    if node.func == 'AVG':
+        return target.mean()
+    return target.min() if node.func == 'MIN' else target.max()
+
+
+def _output_value(value: Any, kind: str) -> Any:
+    if value is None or value is pd.NaT or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if kind == 'date':
+        return pd.Timestamp(value).date().isoformat()
+    if isinstance(value, (np.bool_, bool)):
+        return bool(value)
+    if kind == 'int':
+        return int(value)
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    return value
+
+
+def _item_positions(key: Any, query: Query, names: list[str]) -> list[int]:
+    """SELECT items a GROUP BY / ORDER BY key refers to: ordinal, output alias or same expression"""
+    if isinstance(key, int):
+        if not 1 <= key <= len(names):
+            raise UnsupportedQuery(f"Position {key} is out of range")
+        return [key - 1]
+    if isinstance(key, str):
+        return [i for i, name in enumerate(names) if name.upper() == key]
+    return [i for i, item in enumerate(query.items)
+            if _same(item.expr, key) or isinstance(key, Column) and names[i].upper() == key.name]
+
+
+def execute(sql: str, load_frame: Callable[[list[int]], pd.DataFrame], table_id: str,
+            today: Optional[pd.Timestamp] = None, arrays: tuple[str, ...] = ARRAY_KINDS) -> list[dict[str, Any]]:
+    """run a BigQuery SELECT against mirrored KPI rows; raises UnsupportedQuery for anything else
+
+    load_frame(kpi_ids) returns those KPIs' rows with KPI_ID, KPI_DATE and
+    one 'DIM:<name>' / 'INT:<name>' / 'FLOAT:<name>' column per element of the
+    mirrored `arrays`.
+    """
+    parser = _Parser(sql, table_id)
+    query = parser.parse()
+    if query.star:
+        raise UnsupportedQuery("SELECT * returns the raw arrays")
+
+    conditions = _conjuncts(query.where)
+    if query.source != 'table':
+        conditions = _conjuncts(parser.ctes[query.source].where) + conditions
+    for root in [item.expr for item in query.items] + conditions:
+        for node in root.walk():
+            if getattr(node, 'array', arrays[0]) not in arrays:
+                raise UnsupportedQuery(f"{node.array} is not mirrored")
+    kpi_ids = _kpi_ids(conditions)
+    if not kpi_ids:
+        raise UnsupportedQuery("No KPI_ID filter")
+    unnest_name = _unnest_name(conditions) if query.unnest is not None else None
+    today = today if today is not None else pd.Timestamp(datetime.now(timezone.utc).date())
+
+    frame = load_frame(kpi_ids)
+    if query.unnest is not None:
+        #the join keeps one row per row holding the pinned element, none for rows without it; the wide
+        #layout cannot tell an element with a NULL VALUE from a missing one, so both are dropped
+        column = f"{query.unnest[0]}:{unnest_name}"
+        if column not in frame.columns:
+            raise UnsupportedQuery(f"{query.unnest[0]} element {unnest_name} is not mirrored for these KPIs")
+        frame = frame[frame[column].notna()]
+    for condition in conditions:
+        mask = condition.evaluate(_Env(frame, today, unnest_name))
+        if isinstance(mask, pd.Series):
+            frame = frame[mask.fillna(False).astype(bool)]
+        elif not mask:
+            frame = frame.iloc[0:0]
+
+    names = _output_names(query)
+    env = _Env(frame, today, unnest_name)
+    aggregating = query.group_by is not None or any(item.expr.has_aggregate() for item in query.items)
+    if not aggregating:
+        out = pd.DataFrame({name: _to_series(item.expr.evaluate(env), frame.index)
+                            for name, item in zip(names, query.items)})
+    else:
+        key_items = [i for i, item in enumerate(query.items) if not item.expr.has_aggregate()]
+        if query.group_by not in (None, ['ALL']):
+            grouped = {i for key in query.group_by for i in _item_positions(key, query, names)}
+            if grouped != set(key_items):
+                raise UnsupportedQuery("GROUP BY does not match the non-aggregated SELECT items")
+
+        work = frame.copy()
+        key_columns = [f"__key{i}" for i in key_items]
+        for i, column in zip(key_items, key_columns):
+            work[column] = _to_series(query.items[i].expr.evaluate(env), frame.index)
+        work_env = _Env(work, today, unnest_name)
+        aggregates = {
+            id(node): _aggregate(node, work_env, key_columns)
+            for item in query.items for node in item.expr.walk() if isinstance(node, Aggregate)
+        }
+        agg_env = _Env(work, today, unnest_name, aggregates)
+
+        if key_columns:
+            groups = work.groupby(key_columns, dropna=False, sort=False).size().index
+            columns = {}
+            for position, (name, item) in enumerate(zip(names, query.items)):
+                if position in key_items:
+                    level = key_items.index(position)
+                    values = groups.get_level_values(level) if isinstance(groups, pd.MultiIndex) else groups
+                    columns[name] = np.asarray(values, dtype=object)
+                else:
+                    values = _to_series(item.expr.evaluate(agg_env), groups).reindex(groups)
+                    columns[name] = values.to_numpy(dtype=object)
+            out = pd.DataFrame(columns)
+        else:
+            out = pd.DataFrame({name: [item.expr.evaluate(agg_env)] for name, item in zip(names, query.items)})
+
+    if query.distinct:
+        out = out.drop_duplicates()
+
+    if query.order_by:
+        by, ascending = [], []
+        for key, descending in query.order_by:
+            positions = _item_positions(key, query, names)
+            if not positions:
+                raise UnsupportedQuery("ORDER BY an expression not in the SELECT list")
+            by.append(names[positions[0]])
+            ascending.append(not descending)
+        #BigQuery puts NULLs first ascending and last descending
+        out = out.sort_values(by, ascending=ascending, kind='stable', na_position='first' if ascending[0] else 'last')
+
+    if query.limit is not None:
+        out = out.head(query.limit)
+
+    kinds = [item.expr.kind for item in query.items]
+    return [
+        {name: _output_value(value, kind) for name, value, kind in zip(names, row, kinds)}
+        for row in out.itertuples(index=False, name=None)
+    ]
+
+
+# ---- query shape ----
+
+class QueryShape:
+    """what a result cache needs to know about a query, without running it"""
+
+    def __init__(self, kpi_ids: Optional[list[int]], date_bounds: tuple[Optional[date], Optional[date]],
+                 date_column: Optional[str], order_by: list[tuple[str, bool]], limit: Optional[int],
+                 bound_literals: int = 0):
+        self.kpi_ids = kpi_ids
+        #KPI_DATE range the WHERE clauses allow, None where unbounded
+        self.date_bounds = date_bounds
+        #'YYYY-MM-DD' literals among those bounds, the only literals a moving range changes
+        self.bound_literals = bound_literals
+        #output column holding KPI_DATE itself, so each row belongs to one partition
+        self.date_column = date_column
+        self.order_by = order_by
+        self.limit = limit
+
+
+def _constant(node: Node) -> bool:
+    return not any(isinstance(n, (Column, ArrayValue, Aggregate, UnnestRef)) for n in node.walk())
+
+
+def _is_date_literal(node: Node) -> bool:
+    return isinstance(node, Literal) and node.kind in ('str', 'date') \
+        and ISO_DATE.fullmatch(str(node.value)[:10] if node.kind == 'date' else node.value) is not None
+
+
+def _date_bounds(conditions: list[Node], today: pd.Timestamp) -> tuple[tuple[Optional[date], Optional[date]], int]:
+    """KPI_DATE range of the WHERE conditions and how many date literals bound it
+
+    only BETWEEN and >=, >, <=, < conditions are a range; KPI_DATE in any other
+    condition (=, IN, !=, NOT BETWEEN, OR) picks dates a range cannot stand for
+    """
+    low, high = None, None
+    literals = 0
+    env = _Env(pd.DataFrame(), today)
+
+    def bound(node: Node) -> date:
+        value = node.evaluate(env)
+        return pd.Timestamp(value).date()
+
+    for condition in conditions:
+        if not isinstance(condition, Predicate) or condition.negated or condition.op not in RANGE_OPS \
+                or not isinstance(condition.operands[0], Column) or condition.operands[0].name != 'KPI_DATE' \
+                or not all(_constant(o) for o in condition.operands[1:]):
+            if any(isinstance(n, Column) and n.name == 'KPI_DATE' for n in condition.walk()):
+                raise UnsupportedQuery("KPI_DATE is filtered by more than a BETWEEN or >=/<= range")
+            continue
+        values = [bound(o) for o in condition.operands[1:]]
+        literals += sum(_is_date_literal(o) for o in condition.operands[1:])
+        lows, highs = None, None
+        if condition.op == 'BETWEEN':
+            lows, highs = values
+        elif condition.op in ('>=', '>'):
+            lows = values[0] + timedelta(days=int(condition.op == '>'))
+        elif condition.op in ('<=', '<'):
+            highs = values[0] - timedelta(days=int(condition.op == '<'))
+        if lows is not None:
+            low = lows if low is None else max(low, lows)
+        if highs is not None:
+            high = highs if high is None else min(high, highs)
+    return (low, high), literals
+
+
+def describe(sql: str, table_id: str, today: Optional[pd.Timestamp] = None) -> QueryShape:
+    """KPI_IDs, KPI_DATE range, per-date output column and ordering of a query local_sql can parse"""
+    parser = _Parser(sql, table_id)
+    query = parser.parse()
+    if query.star:
+        raise UnsupportedQuery("SELECT * returns the raw arrays")
+    conditions = _conjuncts(query.where)
+    if query.source != 'table':
+        conditions = _conjuncts(parser.ctes[query.source].where) + conditions
+    today = today if today is not None else pd.Timestamp(datetime.now(timezone.utc).date())
+
+    names = _output_names(query)
+    date_column = next(
+        (name for name, item in zip(names, query.items) if isinstance(item.expr, Column) and item.expr.name == 'KPI_DATE'),
+        None,
+    )
+    order_by = []
+    for key, descending in query.order_by:
+        positions = _item_positions(key, query, names)
+        if not positions:
+            raise UnsupportedQuery("ORDER BY an expression not in the SELECT list")
+        order_by.append((names[positions[0]], descending))
+    date_bounds, bound_literals = _date_bounds(conditions, today)
+    return QueryShape(_kpi_ids(conditions), date_bounds, date_column, order_by, query.limit, bound_literals)
+
+
+def add_table_condition(sql: str, table_id: str, condition: str) -> str:
+    """AND a condition into the WHERE clause of the one SELECT reading the KPI table"""
+    depth, table_depth, where_at, where_end = 0, None, None, None
+    pos = 0
+    while pos < len(sql):
+        match = TOKEN_PATTERN.match(sql, pos)
+        if match is None:
+            raise UnsupportedQuery(f"Unexpected character {sql[pos]!r}")
+        pos = match.end()
+        kind, value = match.lastgroup, match.group()
+        if kind == 'space':
+            continue
+        clause_end = depth == table_depth and (
+            value == ')' or kind == 'ident' and value.upper() in WHERE_CLAUSE_ENDS
+        )
+        if where_at is not None and where_end is None and clause_end:
+            where_end = match.start()
+        if value == '(':
+            depth += 1
+        elif value == ')':
+            depth -= 1
+        elif kind == 'quoted' and value.strip('`') == table_id:
+            if table_depth is not None:
+                raise UnsupportedQuery("The KPI table is read more than once")
+            table_depth = depth
+        elif kind == 'ident' and value.upper() == 'WHERE' and depth == table_depth and where_at is None:
+            where_at = match.end()
+    if where_at is None:
+        raise UnsupportedQuery("No WHERE clause on the KPI table")
+    if where_end is None:
+        where_end = len(sql.rstrip().rstrip(';').rstrip())
+    #the ) goes on its own line, so a trailing -- comment in the clause cannot swallow it
+    return f"{sql[:where_at]} {condition} AND ({sql[where_at:where_end].strip()}\n)\n{sql[where_end:]}"
@@ -1,20 +1,213 @@
 import os
+import glob
+import json
+import uuid
+import queue
+import atexit
 import logging
+import reprlib
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from constants import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_MAX_MESSAGE_CHARS, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_MAX_PAYLOAD_CHARS
+from utils.turn_context import current_session_id, current_turn
 
 LOGS_DIR = 'logs'
 
 os.makedirs(LOGS_DIR,exist_ok=True)
 
-LOGS_FILE = os.path.join(LOGS_DIR,f'log_{datetime.now().strftime("%Y-%m-%d")}.log')
+#bounded, cheap repr for previews of payloads logged as objects
+_preview_repr = reprlib.Repr()
+_preview_repr.maxstring = 200
+_preview_repr.maxother = 200
+_preview_repr.maxlist = _preview_repr.maxdict = 10
+_preview_repr.maxlevel = 3
 
-logging.basicConfig(
-  filename=LOGS_FILE,
-  format='%(asctime)s - %(levelname)s - %(message)s',
-  level=logging.INFO
-)
+#records dropped under backpressure, and how many of those were already reported in the log
+_stats = {'dropped': 0, 'reported': 0}
+_stats_lock = threading.Lock()
+
+
+def _payload_json(payload) -> str:
+  try:
+    return json.dumps(payload, default=str)
+  except (TypeError, ValueError, RuntimeError):
+    #e.g. a dict mutated by another thread while being serialised
+    return json.dumps(repr(payload))
+
+
+def _dated(prefix: str, ext: str) -> str:
+  return os.path.join(LOGS_DIR, f'{prefix}_{datetime.now().strftime("%Y-%m-%d")}.{ext}')
+
+
+def _payload_segment(date: str, segment: int) -> str:
+  #segments are numbered rather than renamed, so payload refs keep pointing at the right file
+  suffix = f'.{segment}' if segment else ''
+  return os.path.join(LOGS_DIR, f'payloads_{date}{suffix}.jsonl')
+
+
+class ContextQueueHandler(QueueHandler):
+  """runs on the caller's thread: attaches session/turn ids, bounds the message and never blocks
+
+  payloads are serialised here, so an object its owner changes after logging
+  it is written as it was; formatting records and disk I/O are left to the
+  listener thread
+  """
+
+  def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+    record.session_id = current_session_id()
+    record.turn = current_turn()
+
+    payload = None
+    if record.args:
+      msg = record.getMessage()
+    elif isinstance(record.msg, str):
+      msg = record.msg
+    else:
+      payload = record.msg
+      msg = _preview_repr.repr(payload)
+
+    if payload is None and len(msg) > LOG_MAX_MESSAGE_CHARS:
+      payload = msg
+      msg = f"{msg[:LOG_MAX_MESSAGE_CHARS]}... [{len(payload)} chars]"
+
+    if record.exc_info:
+      #tracebacks cannot cross threads, render them now
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+
+    record.msg = msg
+    record.args = None
+    record.payload = None if payload is None else _payload_json(payload)
+    return record
+
+  def enqueue(self, record: logging.LogRecord) -> None:
+    try:
+      if record.levelno >= logging.WARNING:
+        #warnings and errors wait briefly for room rather than being dropped
+        self.queue.put(record, timeout=0.1)
+      else:
+        self.queue.put_nowait(record)
+    except queue.Full:
+      with _stats_lock:
+        _stats['dropped'] += 1
+
+
+class JsonLinesFileHandler(RotatingFileHandler):
+  """runs on the listener thread: one JSON object per record, rolled daily and by size
+
+  payloads that were truncated or logged as objects are appended to a dated
+  payload file and referenced from the record by id; payload files also roll
+  over by size, keeping LOG_BACKUP_COUNT older segments per day
+  """
+
+  def __init__(self):
+    self._date = datetime.now().strftime("%Y-%m-%d")
+    self._payload_date = None
+    self._payload_segment = 0
+    super().__init__(_dated('log', 'jsonl'), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+
+  def shouldRollover(self, record: logging.LogRecord) -> bool:
+    if datetime.now().strftime("%Y-%m-%d") != self._date:
+      return True
+    return bool(super().shouldRollover(record))
+
+  def doRollover(self) -> None:
+    today = datetime.now().strftime("%Y-%m-%d")
+    if today != self._date:
+      #new day, new file; size-based backups restart from .1
+      if self.stream:
+        self.stream.close()
+        self.stream = None
+      self._date = today
+      self.baseFilename = os.path.abspath(_dated('log', 'jsonl'))
+      return
+    super().doRollover()
+
+  def _payload_path(self, size: int) -> str:
+    """the payload file to append size bytes to, starting a new segment once the current one is full"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    if today != self._payload_date:
+      #resume after the last segment an earlier process wrote today
+      self._payload_date = today
+      segments = glob.glob(os.path.join(LOGS_DIR, f'payloads_{today}.*.jsonl'))
+      self._payload_segment = max((int(p.split('.')[-2]) for p in segments if p.split('.')[-2].isdigit()), default=0)
+    path = _payload_segment(today, self._payload_segment)
+    if os.path.exists(path) and os.path.getsize(path) > 0 and os.path.getsize(path) + size > LOG_MAX_BYTES:
+      self._payload_segment += 1
+      path = _payload_segment(today, self._payload_segment)
+      expired = _payload_segment(today, self._payload_segment - LOG_BACKUP_COUNT - 1)
+      if self._payload_segment > LOG_BACKUP_COUNT and os.path.exists(expired):
+        os.remove(expired)
+    return path
+
+  def _store_payload(self, body: str) -> str:
+    """append a payload, already serialised to JSON, and return its ref"""
+    ref = uuid.uuid4().hex[:16]
+    if len(body) > LOG_MAX_PAYLOAD_CHARS:
+      body = json.dumps({'truncated_chars': len(body), 'head': body[:LOG_MAX_PAYLOAD_CHARS]})
+    line = f'{{"ref": "{ref}", "payload": {body}}}\n'
+    path = self._payload_path(len(line))
+    with open(path, 'a', encoding='utf-8') as f:
+      f.write(line)
+    return f"{os.path.basename(path)}#{ref}"
+
+  def format(self, record: logging.LogRecord) -> str:
+    #shouldRollover formats the record too; store the payload and build the line once
+    cached = getattr(record, 'json_line', None)
+    if cached is not None:
+      return cached
+
+    entry = {
+      'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+      'level': record.levelname,
+      'logger': record.name,
+      'msg': record.msg,
+      'session_id': getattr(record, 'session_id', None),
+      'turn': getattr(record, 'turn', None),
+    }
+    if getattr(record, 'payload', None) is not None:
+      entry['payload_ref'] = self._store_payload(record.payload)
+    if record.exc_text:
+      entry['exc'] = record.exc_text
+    record.json_line = json.dumps(entry, default=str)
+    return record.json_line
+
+  def emit(self, record: logging.LogRecord) -> None:
+    with _stats_lock:
+      unreported = _stats['dropped'] - _stats['reported']
+      _stats['reported'] = _stats['dropped']
+    if unreported:
+      super().emit(logging.LogRecord(
+        'utils.logger', logging.WARNING, __file__, 0,
+        f"Dropped {unreported} log records under backpressure ({_stats['dropped']} total)", None, None
+      ))
+    super().emit(record)
+
+
+def dropped_records() -> int:
+  """log records dropped because the writer queue was full"""
+  return _stats['dropped']
+
+
+def _configure() -> None:
+  root = logging.getLogger()
+  if any(isinstance(h, ContextQueueHandler) for h in root.handlers):
+    return  #already configured in this process (e.g. a streamlit rerun)
+
+  log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+  listener = QueueListener(log_queue, JsonLinesFileHandler(), respect_handler_level=False)
+  listener.start()
+  #flush whatever is still queued on interpreter exit
+  atexit.register(listener.stop)
+
+  root.addHandler(ContextQueueHandler(log_queue))
+  root.setLevel(LOG_LEVEL)
+
+
+_configure()
 
 def get_logger(name):
   logger = logging.getLogger(name)
-  logger.setLevel(logging.INFO)
-  return logger
\ No newline at end of file
+  logger.setLevel(LOG_LEVEL)
+  return logger
@@ -0,0 +1,247 @@
+import bisect
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Optional
+from constants import *
+from utils.turn_context import current_session_id, current_turn, register_turn_end_hook
+
+#usage_metadata fields tracked, in the order they are reported
+TOKEN_FIELDS = (
+    'prompt_token_count',
+    'candidates_token_count',
+    'thoughts_token_count',
+    'tool_use_prompt_token_count',
+    'cached_content_token_count',
+    'total_token_count',
+)
+
+#model used by each agent, for events that carry no model_version
+AGENT_MODELS = {
+    'starter_agent': STARTER_AGENT_MODEL,
+    'sql_writer_agent': SQL_WRITER_AGENT_MODEL,
+    'sql_critic_agent': SQL_CRITIC_AGENT_MODEL,
+    'sql_refiner_agent': SQL_REFINER_AGENT_MODEL,
+    'python_writer_agent': PYTHON_WRITER_AGENT_MODEL,
+    'python_critic_agent': PYTHON_CRITIC_AGENT_MODEL,
+    'python_refiner_agent': PYTHON_REFINER_AGENT_MODEL,
+    'chart_spec_agent': CHART_SPEC_AGENT_MODEL,
+    'history_summary': HISTORY_SUMMARY_MODEL,
+}
+
+#upper bounds of the token histogram buckets (last bucket is open ended)
+HISTOGRAM_BOUNDS = (256, 512, 1_024, 2_048, 4_096, 8_192, 16_384, 32_768, 65_536, 131_072, 262_144)
+
+
+@dataclass(slots=True)
+class UsageRecord:
+    """token usage of one model response"""
+    session_id: Optional[str]
+    turn: Optional[int]
+    agent: str
+    model: str
+    prompt_token_count: int
+    candidates_token_count: int
+    thoughts_token_count: int
+    tool_use_prompt_token_count: int
+    cached_content_token_count: int
+    total_token_count: int
+    cost_usd: float
+    timestamp: float
+
+    def token_counts(self) -> dict[str, int]:
+        return {name: getattr(self, name) for name in TOKEN_FIELDS}
+
+
+@dataclass(slots=True)
+class QueryRecord:
+    """statistics of one BigQuery job run for execute_sql"""
+    session_id: Optional[str]
+    turn: Optional[int]
+    agent: str
+    kpi_ids: list[int]
+    job_id: Optional[str]
+    bytes_processed: int
+    bytes_billed: int
+    slot_ms: int
+    cache_hit: bool
+    wall_ms: float
+    query: str
+    timestamp: float
+
+    def to_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Histogram:
+    """fixed-bucket histogram of token counts"""
+
+    def __init__(self, bounds: tuple[int, ...] = HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.n = 0
+        self.total = 0
+
+    def observe(self, value: int) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.n += 1
+        self.total += value
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            'count': self.n,
+            'mean': self.total / self.n if self.n else 0,
+            'buckets': {label: c for label, c in zip(labels, self.counts) if c},
+        }
+
+
+def estimate_cost(model: str, prompt: int, cached: int, output: int) -> float:
+    """estimated USD cost from per-1M-token prices in MODEL_PRICING"""
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    uncached = max(prompt - cached, 0)
+    return (
+        uncached * pricing['input']
+        + cached * pricing['cached_input']
+        + output * pricing['output']
+    ) / 1_000_000
+
+
+def _empty_totals() -> dict[str, float]:
+    return {**{name: 0 for name in TOKEN_FIELDS}, 'cost_usd': 0.0, 'calls': 0}
+
+
+class Meter:
+    """records every usage_metadata event per agent and per turn, aggregated across sessions"""
+
+    def __init__(self):
+        #(session_id, turn) -> agent -> totals
+        self.turns: dict[tuple, dict[str, dict[str, float]]] = defaultdict(lambda: defaultdict(_empty_totals))
+        self.by_agent: dict[str, dict[str, float]] = defaultdict(_empty_totals)
+        self.by_model: dict[str, dict[str, float]] = defaultdict(_empty_totals)
+        self.call_histograms: dict[str, Histogram] = defaultdict(Histogram)
+        self.turn_histogram = Histogram()
+        self.query_totals: dict[str, float] = defaultdict(float)
+        #KPI_ID (or 'unknown') -> most expensive queries, by bytes billed then slot time
+        self.worst_queries: dict[str, list[QueryRecord]] = defaultdict(list)
+        #sub-session id -> session whose turn its usage belongs to
+        self.parent_sessions: dict[str, str] = {}
+
+    def _turn_key(self, session_id: Optional[str], turn: Optional[int]) -> tuple:
+        session_id = session_id or current_session_id()
+        return self.parent_sessions.get(session_id, session_id), turn if turn is not None else current_turn()
+
+    def attach_sub_session(self, sub_session_id: str, session_id: str) -> None:
+        """count a sub-session's usage in session_id's turn, for its breakdown and token budget"""
+        self.parent_sessions[sub_session_id] = session_id
+
+    def detach_sub_session(self, sub_session_id: str) -> None:
+        self.parent_sessions.pop(sub_session_id, None)
+
+    def record(self, agent: str, usage: Any, model_version: Optional[str] = None, session_id: Optional[str] = None) -> UsageRecord:
+        """record one response's usage_metadata under the current turn"""
+        counts = {name: getattr(usage, name, None) or 0 for name in TOKEN_FIELDS}
+        #price by the configured model, the served model_version may carry a suffix
+        model = AGENT_MODELS.get(agent) or model_version or 'unknown'
+        record = UsageRecord(
+            session_id=session_id or current_session_id(),
+            turn=current_turn(),
+            agent=agent,
+            model=model,
+            **counts,
+            cost_usd=estimate_cost(
+                model,
+                prompt=counts['prompt_token_count'] + counts['tool_use_prompt_token_count'],
+                cached=counts['cached_content_token_count'],
+                output=counts['candidates_token_count'] + counts['thoughts_token_count'],
+            ),
+            timestamp=time.time(),
+        )
+
+        for totals in (
+            self.turns[self._turn_key(record.session_id, record.turn)][agent],
+            self.by_agent[agent],
+            self.by_model[model],
+        ):
+            for name, value in counts.items():
+                totals[name] += value
+            totals['cost_usd'] += record.cost_usd
+            totals['calls'] += 1
+
+        self.call_histograms[agent].observe(record.total_token_count)
+        return record
+
+    def record_query(self, agent: str, stats: dict[str, Any], kpi_ids: list[int], query: str,
+                     session_id: Optional[str] = None) -> QueryRecord:
+        """record one execute_sql job's statistics under the current turn"""
+        record = QueryRecord(
+            session_id=session_id or current_session_id(),
+            turn=current_turn(),
+            agent=agent,
+            kpi_ids=kpi_ids,
+            job_id=stats.get('job_id'),
+            bytes_processed=stats.get('bytes_processed') or 0,
+            bytes_billed=stats.get('bytes_billed') or 0,
+            slot_ms=stats.get('slot_ms') or 0,
+            cache_hit=bool(stats.get('cache_hit')),
+            wall_ms=stats.get('wall_ms') or 0.0,
+            query=query,
+            timestamp=time.time(),
+        )
+        self.query_totals['jobs'] += 1
+        self.query_totals['cache_hits'] += record.cache_hit
+        for name in ('bytes_processed', 'bytes_billed', 'slot_ms', 'wall_ms'):
+            self.query_totals[name] += getattr(record, name)
+
+        for kpi_id in kpi_ids or ['unknown']:
+            worst = self.worst_queries[str(kpi_id)]
+            worst.append(record)
+            worst.sort(key=lambda r: (r.bytes_billed, r.slot_ms), reverse=True)
+            del worst[BIGQUERY_WORST_QUERIES:]
+        return record
+
+    def worst_query_report(self) -> dict[str, list[dict[str, Any]]]:
+        """the most expensive queries seen per KPI, most expensive KPI first"""
+        ranked = sorted(self.worst_queries.items(), key=lambda item: item[1][0].bytes_billed, reverse=True)
+        return {kpi_id: [r.to_dict() for r in records] for kpi_id, records in ranked}
+
+    def end_turn(self, session_id: Optional[str], turn: Optional[int]) -> None:
+        """close a turn: add its total to the per-turn histogram and free its breakdown"""
+        agents = self.turns.pop((session_id, turn), None)
+        if agents:
+            self.turn_histogram.observe(int(sum(a['total_token_count'] for a in agents.values())))
+
+    def turn_usage(self, session_id: Optional[str] = None, turn: Optional[int] = None) -> dict[str, dict[str, float]]:
+        """per-agent totals for a turn, the current one by default"""
+        key = self._turn_key(session_id, turn)
+        return {agent: dict(totals) for agent, totals in self.turns.get(key, {}).items()}
+
+    def turn_tokens(self, session_id: Optional[str] = None, turn: Optional[int] = None) -> int:
+        return int(sum(a['total_token_count'] for a in self.turn_usage(session_id, turn).values()))
+
+    def budget_exceeded(self, session_id: Optional[str] = None, budget: Optional[int] = TURN_TOKEN_BUDGET) -> bool:
+        """True once the current turn has used more tokens than budget (None disables the check)"""
+        return budget is not None and self.turn_tokens(session_id) > budget
+
+    def summary(self) -> dict[str, Any]:
+        """aggregates across all sessions seen by this process"""
+        return {
+            'by_agent': {agent: dict(totals) for agent, totals in self.by_agent.items()},
+            'by_model': {model: dict(totals) for model, totals in self.by_model.items()},
+            'call_token_histograms': {agent: h.to_dict() for agent, h in self.call_histograms.items()},
+            'turn_token_histogram': self.turn_histogram.to_dict(),
+            'bigquery_jobs': dict(self.query_totals),
+            'worst_queries_by_kpi': self.worst_query_report(),
+        }
+
+
+_meter = Meter()
+
+
+def get_meter() -> Meter:
+    return _meter
+
+
+register_turn_end_hook(_meter.end_turn)
@@ -0,0 +1,235 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Any, Iterator, Optional
+from constants import (
+    PROFILE_MODE, PROFILE_SAMPLE_RATE, PROFILE_TRACEMALLOC,
+    PROFILE_SAMPLING_INTERVAL_MS, PROFILES_DIR, PROFILES_KEPT_IN_MEMORY,
+)
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+PROFILE_MODES = ('deterministic', 'sampling')
+
+
+class StackSampler:
+    """statistical profiler: samples one thread's stack on a timer thread
+
+    output is in collapsed-stack format (one 'frame;frame;frame count' line per
+    stack), ready for flamegraph.pl or speedscope
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLING_INTERVAL_MS):
+        self.interval_s = interval_ms / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class TurnProfiler:
+    """profiles selected turns: by session, by one-off request or by sampling rate
+
+    turn() returns a shared null context unless the turn is selected, so the
+    hook costs one attribute check while profiling is switched off.
+    """
+
+    def __init__(
+            self,
+            mode: str = PROFILE_MODE,
+            sample_rate: float = PROFILE_SAMPLE_RATE,
+            with_tracemalloc: bool = PROFILE_TRACEMALLOC,
+            profiles_dir: str = PROFILES_DIR,
+        ):
+        self.mode = mode if mode in PROFILE_MODES else 'off'
+        self.sample_rate = sample_rate
+        self.with_tracemalloc = with_tracemalloc
+        self.profiles_dir = profiles_dir
+        #sessions profiled on every turn, and sessions whose next turn is profiled once
+        self._sessions: dict[str, str] = {}
+        self._next_turn: dict[str, str] = {}
+        #cProfile cannot nest, so only one deterministic profile runs at a time
+        self._deterministic_busy = False
+        #concurrent profiled turns share tracemalloc; it is stopped by the last one if we started it
+        self._tracemalloc_users = 0
+        self._started_tracemalloc = False
+        self._recent: deque = deque(maxlen=PROFILES_KEPT_IN_MEMORY)
+        self._update_active()
+
+    def _update_active(self) -> None:
+        self.active = (self.mode != 'off' and self.sample_rate > 0) or bool(self._sessions) or bool(self._next_turn)
+
+    # ---- switches ----
+
+    def enable_session(self, session_id: str, mode: str = 'deterministic') -> None:
+        """profile every turn of session_id until disabled"""
+        self._sessions[session_id] = mode
+        self._update_active()
+
+    def disable_session(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        self._next_turn.pop(session_id, None)
+        self._update_active()
+
+    def profile_next_turn(self, session_id: str, mode: str = 'deterministic') -> None:
+        """profile only the next turn of session_id"""
+        self._next_turn[session_id] = mode
+        self._update_active()
+
+    def session_enabled(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def _select(self, session_id: str) -> Optional[str]:
+        """profiling mode for this turn, None when it is not profiled"""
+        if session_id in self._next_turn:
+            mode = self._next_turn.pop(session_id)
+            self._update_active()
+            return mode
+        if session_id in self._sessions:
+            return self._sessions[session_id]
+        if self.mode != 'off' and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    # ---- profiling ----
+
+    def turn(self, session_id: str, turn: Optional[int]):
+        """context manager profiling one turn when it is selected"""
+        if not self.active:
+            return nullcontext()
+        mode = self._select(session_id)
+        if mode is None:
+            return nullcontext()
+        if mode == 'deterministic' and (self._deterministic_busy or sys.getprofile() is not None):
+            logger.warning(f"Another deterministic profile is running, sampling session {session_id} turn {turn} instead")
+            mode = 'sampling'
+        return self._profile(session_id, turn, mode)
+
+    @contextmanager
+    def _profile(self, session_id: str, turn: Optional[int], mode: str) -> Iterator[None]:
+        base = os.path.join(
+            self.profiles_dir,
+            datetime.now().strftime('%Y-%m-%d'),
+            f"{session_id}_turn{turn}_{datetime.now().strftime('%H%M%S')}",
+        )
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+
+        if self.with_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._started_tracemalloc = True
+            self._tracemalloc_users += 1
+            mem_before = tracemalloc.take_snapshot()
+
+        if mode == 'deterministic':
+            self._deterministic_busy = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler()
+            profiler.start()
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if mode == 'deterministic':
+                profiler.disable()
+                self._deterministic_busy = False
+            else:
+                profiler.stop()
+            mem_diff = None
+            if self.with_tracemalloc:
+                mem_diff = tracemalloc.take_snapshot().compare_to(mem_before, 'lineno')
+                self._tracemalloc_users -= 1
+                if self._tracemalloc_users == 0 and self._started_tracemalloc:
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+            #a failure to write a profile must never fail the user's turn
+            try:
+                self._save(session_id, turn, mode, base, profiler, mem_diff, duration_ms)
+            except Exception as e:
+                logger.error(f"Failed to save profile for session {session_id} turn {turn}: {e}")
+
+    def _save(self, session_id: str, turn: Optional[int], mode: str, base: str, profiler: Any,
+              mem_diff: Optional[list], duration_ms: float) -> None:
+        paths = {}
+        if mode == 'deterministic':
+            paths['pstats'] = f"{base}.prof"
+            profiler.dump_stats(paths['pstats'])
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+            paths['summary'] = f"{base}.txt"
+            with open(paths['summary'], 'w', encoding='utf-8') as f:
+                f.write(summary.getvalue())
+        else:
+            paths['folded'] = f"{base}.folded"
+            profiler.dump(paths['folded'])
+
+        if mem_diff is not None:
+            paths['tracemalloc'] = f"{base}.mem.txt"
+            with open(paths['tracemalloc'], 'w', encoding='utf-8') as f:
+                f.write('\n'.join(str(stat) for stat in mem_diff[:50]))
+
+        self._recent.append({
+            'session_id': session_id,
+            'turn': turn,
+            'mode': mode,
+            'duration_ms': duration_ms,
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'paths': paths,
+        })
+        #link the profile from the turn's trace and log entry
+        span = get_tracer().current_span()
+        if span is not None:
+            span.set_attribute('profile', paths)
+        logger.info(f"Profiled session {session_id} turn {turn} ({mode}, {duration_ms:.0f} ms): {paths}")
+
+    def recent_profiles(self, session_id: Optional[str] = None) -> list[dict[str, Any]]:
+        """most recent profiles first, optionally for one session"""
+        return [r for r in reversed(self._recent) if session_id is None or r['session_id'] == session_id]
+
+
+_profiler = TurnProfiler()
+
+
+def get_profiler() -> TurnProfiler:
+    return _profiler
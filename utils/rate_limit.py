@@ -0,0 +1,41 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """async token bucket shared by every task in the process
+
+    rate tokens are added per second up to capacity; acquire() waits until a
+    token is available, so bursts up to capacity go through immediately.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_s = 0.0
+
+    @classmethod
+    def per_minute(cls, per_minute: float, burst: Optional[float] = None) -> 'TokenBucket':
+        return cls(per_minute / 60, burst)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        #the lock queues waiters in arrival order so nobody starves
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                wait_s = (tokens - self._tokens) / self.rate
+                self.waited_s += wait_s
+                await asyncio.sleep(wait_s)
+                self._refill()
+            self._tokens -= tokens
@@ -0,0 +1,311 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Optional
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from constants import (
+    DATA_TABLE_ID, DEFS_TABLE_ID, SCHEMA_CONTEXT_PATH, SCHEMA_MUTABLE_DAYS, BIGQUERY_LOCATION,
+    RESULT_CACHE_DIR, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_ROWS,
+)
+from utils.backends import Backend
+from utils.local_sql import UnsupportedQuery, add_table_condition, describe
+from utils.logger import get_logger
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+#date literals bounding a KPI_DATE range: KPI_DATE BETWEEN '<low>' AND '<high>', KPI_DATE >= '<low>' etc.
+RANGE_BOUNDS = [
+    (re.compile(r"(\bKPI_DATE`?\s+BETWEEN\s+(?:DATE\s*)?)'\d{4}-\d{2}-\d{2}'(\s+AND\s+(?:DATE\s*)?)'\d{4}-\d{2}-\d{2}'",
+                re.IGNORECASE), r"\1'?'\2'?'", 2),
+    (re.compile(r"(\bKPI_DATE`?\s*(?:>=|<=|>|<)\s*(?:DATE\s*)?)'\d{4}-\d{2}-\d{2}'", re.IGNORECASE), r"\1'?'", 1),
+]
+
+
+def mask_range_bounds(sql: str) -> tuple[str, int]:
+    """the query with the date literals of its KPI_DATE range masked, and how many were masked"""
+    masked, count = ' '.join(sql.split()), 0
+    for pattern, replacement, literals in RANGE_BOUNDS:
+        masked, found = pattern.subn(replacement, masked)
+        count += found * literals
+    return masked, count
+
+
+def query_key(sql: str) -> str:
+    """the query with its KPI_DATE range bounds masked, so a range that moved on maps to the same entry"""
+    masked, _ = mask_range_bounds(sql)
+    return hashlib.sha256(masked.encode('utf-8')).hexdigest()[:32]
+
+
+def schema_version(path: str = SCHEMA_CONTEXT_PATH) -> str:
+    """hash of the KPI definitions (dimensions, indicators and their aggregations) in the schema context"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            kpis = json.load(f).get('kpis', {})
+    except (OSError, ValueError):
+        kpis = {}
+    definitions = {
+        kpi_id: {
+            'dimensions': {name: d.get('physical_column') for name, d in kpi.get('dimensions', {}).items()},
+            'indicators': [
+                (i.get('name'), i.get('aggregation'), i.get('physical_column'))
+                for i in kpi.get('indicators_int', []) + kpi.get('indicators_float', [])
+            ],
+        }
+        for kpi_id, kpi in kpis.items()
+    }
+    canonical = json.dumps([DATA_TABLE_ID, DEFS_TABLE_ID, definitions], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def _row_date(value: Any) -> date:
+    return date.fromisoformat(str(value)[:10])
+
+
+def _sort_rows(rows: list[dict[str, Any]], order_by: list[tuple[str, bool]]) -> list[dict[str, Any]]:
+    """ORDER BY with BigQuery's NULLs first ascending, last descending"""
+    for column, descending in reversed(order_by):
+        rows = sorted(rows, key=lambda row: (row.get(column) is not None, row.get(column) if row.get(column) is not None else 0),
+                      reverse=descending)
+    return rows
+
+
+def _tool_value(value: Any) -> Any:
+    """as the execute_sql tool returns it: JSON values as they are, anything else as a string"""
+    return value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+
+
+class ResultCache(Backend):
+    """stores time-series execute_sql results with the KPI_DATE range they cover
+
+    a query is cached when every output row carries its KPI_DATE (so rows of one
+    partition do not depend on another), its dates are a BETWEEN or >=/<= range
+    and it has no LIMIT; it is keyed on its text with only that range masked. A
+    repeat keeps the stored rows of settled partitions and runs a delta query,
+    the original with those partitions excluded, for the rest of its range. Partitions within
+    SCHEMA_MUTABLE_DAYS of when a result was stored may be restated and are
+    always reread. Entries are dropped when the schema version changes.
+    """
+
+    def __init__(self, inner: Optional[Backend] = None, root: str = RESULT_CACHE_DIR,
+                 mutable_days: int = SCHEMA_MUTABLE_DAYS, table_id: str = DATA_TABLE_ID):
+        self.inner = inner
+        self.root = root
+        self.mutable_days = mutable_days
+        self.table_id = table_id
+        self.offline = inner is not None and getattr(inner, 'offline', False)
+        self._entries: dict[str, Optional[dict[str, Any]]] = {}
+        self._pending: dict[Any, dict[str, Any]] = {}
+        self._version: Optional[str] = None
+        self._version_mtime: Optional[float] = None
+        self.stats_counts: dict[str, int] = defaultdict(int)
+        self.rows_reused = 0
+        self.rows_fetched = 0
+
+    # ---- model calls pass straight through ----
+
+    async def serve_model(self, agent_name: str, llm_request: LlmRequest, call_key: Any) -> Optional[LlmResponse]:
+        return None if self.inner is None else await self.inner.serve_model(agent_name, llm_request, call_key)
+
+    def observe_model(self, call_key: Any, llm_response: LlmResponse) -> None:
+        if self.inner is not None:
+            self.inner.observe_model(call_key, llm_response)
+
+    # ---- storage ----
+
+    def version(self) -> str:
+        try:
+            mtime = os.path.getmtime(SCHEMA_CONTEXT_PATH)
+        except OSError:
+            mtime = None
+        if self._version is None or mtime != self._version_mtime:
+            self._version, self._version_mtime = schema_version(), mtime
+        return self._version
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json.gz")
+
+    def _load(self, key: str) -> Optional[dict[str, Any]]:
+        if key not in self._entries:
+            try:
+                with gzip.open(self._path(key), 'rt', encoding='utf-8') as f:
+                    self._entries[key] = json.load(f)
+            except (OSError, ValueError):
+                self._entries[key] = None
+        entry = self._entries[key]
+        if entry is not None and entry['version'] != self.version():
+            #the KPI definitions changed, the stored rows may mean something else now
+            self._drop(key)
+            self.stats_counts['invalidated'] += 1
+            return None
+        return entry
+
+    def _drop(self, key: str) -> None:
+        self._entries[key] = None
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _store(self, key: str, entry: dict[str, Any]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as f:
+            json.dump(entry, f, default=str)
+        os.replace(f"{path}.tmp", path)
+        self._entries[key] = entry
+        self._evict()
+
+    def _evict(self) -> None:
+        names = [n for n in os.listdir(self.root) if n.endswith('.json.gz')]
+        if len(names) <= RESULT_CACHE_MAX_ENTRIES:
+            return
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(self.root, n)))
+        for name in names[:len(names) - RESULT_CACHE_MAX_ENTRIES]:
+            self._drop(name.removesuffix('.json.gz'))
+
+    def _entry(self, sql: str, shape, low: date, high: date, rows: list[dict[str, Any]]) -> dict[str, Any]:
+        today = date.today()
+        return {
+            'sql': sql,
+            'version': self.version(),
+            'coverage': [low.isoformat(), high.isoformat()],
+            'cached_on': today.isoformat(),
+            #rows of partitions up to here are kept on a repeat, later ones are reread
+            'settled_through': (today - timedelta(days=self.mutable_days)).isoformat(),
+            'date_column': shape.date_column,
+            'order_by': shape.order_by,
+            'rows': rows,
+        }
+
+    # ---- execute_sql ----
+
+    def _plan(self, sql: str):
+        """(key, shape, low, high) for a cacheable query, None otherwise"""
+        try:
+            shape = describe(sql, self.table_id)
+        except UnsupportedQuery as e:
+            self.stats_counts['bypassed'] += 1
+            logger.debug(f"Result cache bypassed: {e}")
+            return None
+        low, high = shape.date_bounds
+        _, literals = mask_range_bounds(sql)
+        if shape.date_column is None or shape.limit is not None or low is None or literals != shape.bound_literals:
+            #a masked literal outside the range bounds (or a bound left unmasked) would key different queries alike
+            self.stats_counts['bypassed'] += 1
+            return None
+        return query_key(sql), shape, low, min(high or date.today(), date.today())
+
+    async def _run(self, sql: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        """run a delta query through the inner backends, or on BigQuery when they leave it to the live tool"""
+        if self.inner is not None:
+            response = await self.inner.serve_tool('execute_sql', {**args, 'query': sql}, ('delta', call_key))
+            if response is not None:
+                return response
+        return await asyncio.to_thread(self._run_live, sql, args.get('project_id'))
+
+    def _run_live(self, sql: str, project_id: Optional[str]) -> dict:
+        from google.cloud import bigquery
+        from utils.agent_utils import get_bigquery_credentials
+
+        try:
+            client = bigquery.Client(project=project_id, location=BIGQUERY_LOCATION, credentials=get_bigquery_credentials())
+            rows = client.query(sql).result(max_results=RESULT_CACHE_MAX_ROWS)
+            return {'status': 'SUCCESS', 'rows': [{k: _tool_value(v) for k, v in row.items()} for row in rows]}
+        except Exception as e:
+            return {'status': 'ERROR', 'error_details': str(e)}
+
+    async def serve_tool(self, tool_name: str, args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        if tool_name != 'execute_sql' or args.get('dry_run'):
+            return None if self.inner is None else await self.inner.serve_tool(tool_name, args, call_key)
+        sql = args.get('query') or ''
+        plan = self._plan(sql)
+        if plan is None:
+            return None if self.inner is None else await self.inner.serve_tool(tool_name, args, call_key)
+        key, shape, low, high = plan
+
+        entry = self._load(key)
+        if entry is not None:
+            response = await self._refresh(entry, key, sql, shape, low, high, args, call_key)
+            if response is not None:
+                return response
+
+        self.stats_counts['misses'] += 1
+        self._pending[call_key] = {'key': key, 'sql': sql, 'shape': shape, 'low': low, 'high': high}
+        response = None if self.inner is None else await self.inner.serve_tool(tool_name, args, call_key)
+        if response is not None:
+            self.observe_tool(call_key, response)
+        return response
+
+    async def _refresh(self, entry: dict[str, Any], key: str, sql: str, shape, low: date, high: date,
+                       args: dict[str, Any], call_key: Any) -> Optional[dict]:
+        """stored rows for the settled overlap plus a delta query for the rest, None to run the full query"""
+        started = time.perf_counter()
+        cached_low, cached_high = map(date.fromisoformat, entry['coverage'])
+        settled = date.fromisoformat(entry['settled_through'])
+        if entry['cached_on'] == date.today().isoformat():
+            #stored today: nothing has been restated since
+            settled = cached_high
+        reuse_low, reuse_high = max(low, cached_low), min(high, cached_high, settled)
+        if reuse_low > reuse_high:
+            return None
+
+        column = entry['date_column']
+        kept = [row for row in entry['rows'] if reuse_low <= _row_date(row[column]) <= reuse_high]
+        delta: list[dict[str, Any]] = []
+        if (reuse_low, reuse_high) != (low, high):
+            delta_sql = add_table_condition(
+                sql, self.table_id, f"KPI_DATE NOT BETWEEN '{reuse_low.isoformat()}' AND '{reuse_high.isoformat()}'"
+            )
+            response = await self._run(delta_sql, args, call_key)
+            if response.get('status') != 'SUCCESS' or response.get('result_is_likely_truncated') or response.get('downsampled'):
+                logger.warning(f"Result cache delta query failed, running the full query: {response.get('error_details')}")
+                return None
+            delta = response.get('rows') or []
+
+        rows = _sort_rows(kept + delta, [tuple(o) for o in entry['order_by']])
+        if len(rows) >= RESULT_CACHE_MAX_ROWS:
+            return None
+        self._store(key, self._entry(sql, shape, low, high, rows))
+
+        outcome = 'delta' if delta or (reuse_low, reuse_high) != (low, high) else 'full'
+        self.stats_counts[f'hits_{outcome}'] += 1
+        self.rows_reused += len(kept)
+        self.rows_fetched += len(delta)
+        get_tracer().annotate_pending(
+            call_key, served_by='result_cache', result_cache=outcome, rows_reused=len(kept), rows_fetched=len(delta),
+        )
+        logger.info(f"Result cache {outcome} hit: {len(kept)} stored rows ({reuse_low} to {reuse_high}) "
+                    f"+ {len(delta)} new in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return {'status': 'SUCCESS', 'rows': rows}
+
+    def observe_tool(self, call_key: Any, tool_response: dict) -> None:
+        pending = self._pending.pop(call_key, None)
+        if pending is not None and isinstance(tool_response, dict) and tool_response.get('status') == 'SUCCESS' \
+                and not tool_response.get('result_is_likely_truncated') and not tool_response.get('downsampled') \
+                and len(tool_response.get('rows') or []) < RESULT_CACHE_MAX_ROWS:
+            entry = self._entry(pending['sql'], pending['shape'], pending['low'], pending['high'], tool_response.get('rows') or [])
+            try:
+                self._store(pending['key'], entry)
+                self.stats_counts['stored'] += 1
+            except OSError as e:
+                logger.warning(f"Could not store result in cache: {e}")
+        if self.inner is not None:
+            self.inner.observe_tool(call_key, tool_response)
+
+    def stats(self) -> dict[str, Any]:
+        hits = self.stats_counts['hits_full'] + self.stats_counts['hits_delta']
+        cacheable = hits + self.stats_counts['misses']
+        return {
+            **dict(self.stats_counts),
+            'hit_rate': hits / cacheable if cacheable else None,
+            'rows_reused': self.rows_reused,
+            'rows_fetched': self.rows_fetched,
+        }
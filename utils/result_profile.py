@@ -0,0 +1,135 @@
+import time
+from typing import Any, Optional
+import numpy as np
+import pandas as pd
+from constants import RESULT_PROFILE_MAX_GAPS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#(largest median spacing of distinct dates in days, period, pandas frequency, days per period)
+PERIODS = [
+    (1, 'day', 'D', 1.0),
+    (7, 'week', 'W', 7.0),
+    (31, 'month', 'M', 365.25 / 12),
+    (92, 'quarter', 'Q', 365.25 / 4),
+    (366, 'year', 'Y', 365.25),
+]
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None or pd.isna(value):
+        return None
+    return round(float(value), 4)
+
+
+def _date_column(frame: pd.DataFrame) -> Optional[tuple[str, pd.Series]]:
+    """the result's date column parsed to datetimes: KPI_DATE first, else the first column that parses"""
+    names = sorted(frame.columns, key=lambda name: name.upper() != 'KPI_DATE')
+    for name in names:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            return name, column
+        if 'DATE' in name.upper() or isinstance(column.dtype, pd.ArrowDtype) and 'date' in str(column.dtype):
+            parsed = pd.to_datetime(column.astype(str), errors='coerce', format='ISO8601')
+            if parsed.notna().mean() >= 0.9:
+                return name, parsed
+    return None
+
+
+def _period(dates: pd.Series) -> tuple[str, str, float]:
+    spacing = np.median(np.diff(np.sort(dates.unique()))) / np.timedelta64(1, 'D') if dates.nunique() > 1 else 1
+    for limit, name, freq, days in PERIODS:
+        if spacing <= limit:
+            return name, freq, days
+    return PERIODS[-1][1:]
+
+
+def _coverage(dates: pd.Series) -> dict[str, Any]:
+    """date range, inferred period and the periods in that range with no rows"""
+    dates = dates.dropna()
+    name, freq, days = _period(dates)
+    periods = dates.dt.to_period(freq).unique()
+    expected = pd.period_range(periods.min(), periods.max(), freq=freq)
+    missing = expected.difference(periods)
+    return {
+        'from': dates.min().date().isoformat(),
+        'to': dates.max().date().isoformat(),
+        'period': name,
+        'days_per_period': days,
+        'periods': len(expected),
+        'missing_periods': len(missing),
+        'missing': [str(p) for p in missing[:RESULT_PROFILE_MAX_GAPS]],
+    }
+
+
+def _trend(dates: pd.Series, values: pd.Series, days_per_period: float) -> Optional[dict[str, Any]]:
+    """least-squares slope of the per-date mean, per period and relative to the mean"""
+    per_date = pd.DataFrame({'date': dates, 'value': values}).dropna().groupby('date')['value'].mean()
+    if len(per_date) < 3:
+        return None
+    days = (per_date.index - per_date.index[0]) / pd.Timedelta(days=1)
+    slope = np.polyfit(days.to_numpy(dtype=float), per_date.to_numpy(dtype=float), 1)[0] * days_per_period
+    mean = per_date.mean()
+    return {
+        'slope_per_period': _number(slope),
+        'slope_pct_of_mean': _number(slope / mean * 100) if mean else None,
+        'first': _number(per_date.iloc[0]),
+        'last': _number(per_date.iloc[-1]),
+    }
+
+
+def profile_frame(frame: pd.DataFrame) -> dict[str, Any]:
+    """per-column nulls, cardinality and min/max/mean, date coverage gaps and trend slopes of numeric columns"""
+    started = time.perf_counter()
+    profile: dict[str, Any] = {'rows': len(frame), 'columns': {}, 'date': None, 'trends': {}}
+    if frame.empty:
+        return profile
+
+    nulls = frame.isna().sum()
+    date = _date_column(frame)
+    for name in frame.columns:
+        column = frame[name]
+        stats: dict[str, Any] = {'type': str(column.dtype).replace('[pyarrow]', ''), 'nulls': int(nulls[name])}
+        try:
+            stats['distinct'] = int(column.nunique())
+        except (TypeError, NotImplementedError):
+            #list/struct values cannot be counted
+            stats['distinct'] = None
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            stats.update(min=_number(column.min()), max=_number(column.max()), mean=_number(column.mean()))
+        profile['columns'][name] = stats
+
+    if date is not None:
+        name, dates = date
+        profile['date'] = {'column': name, **_coverage(dates)}
+        for measure, stats in profile['columns'].items():
+            if 'mean' in stats and measure != name and not measure.upper().endswith('ID'):
+                trend = _trend(dates, frame[measure], profile['date']['days_per_period'])
+                if trend is not None:
+                    profile['trends'][measure] = trend
+
+    profile['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return profile
+
+
+def render_profile(profile: Optional[dict[str, Any]]) -> str:
+    """compact text of a profile for agent instructions"""
+    if not profile:
+        return 'No SQL result profile is available.'
+    lines = [f"{profile['rows']} rows."]
+    for name, stats in profile['columns'].items():
+        line = f"- {name} ({stats['type']}): {stats['nulls']} nulls, {stats['distinct']} distinct"
+        if 'mean' in stats:
+            line += f", min {stats['min']}, max {stats['max']}, mean {stats['mean']}"
+        lines.append(line)
+    date = profile.get('date')
+    if date:
+        gaps = f", {date['missing_periods']} missing ({', '.join(date['missing'])})" if date['missing_periods'] else ', no gaps'
+        lines.append(f"Dates ({date['column']}): {date['from']} to {date['to']}, {date['periods']} {date['period']}s{gaps}.")
+    for name, trend in profile.get('trends', {}).items():
+        lines.append(
+            f"Trend of {name} (mean per date): {trend['slope_per_period']} per {date['period']}"
+            f" ({trend['slope_pct_of_mean']}% of the mean), from {trend['first']} to {trend['last']}."
+        )
+    return '\n'.join(lines)
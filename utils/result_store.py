@@ -0,0 +1,247 @@
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from constants import RESULT_STORE_MAX_TABLES, RESULTS_DIR, CHARS_PER_TOKEN, PYTHON_PROMPT_DATA_TOKENS
+from utils.logger import get_logger
+from utils.result_profile import profile_frame, render_profile
+from utils.turn_context import current_session_id
+
+logger = get_logger(__name__)
+
+
+def to_table(rows: list[dict[str, Any]]) -> pa.Table:
+    """SQL rows as an Arrow table; columns holding mixed JSON types are kept as strings"""
+    try:
+        return pa.Table.from_pylist(rows)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        names = list(dict.fromkeys(key for row in rows for key in row))
+        return pa.table({
+            name: pa.array([None if row.get(name) is None else str(row.get(name)) for row in rows], pa.string())
+            for name in names
+        })
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value).replace('|', '\\|').replace('\n', ' ')
+
+
+def _column_summary(name: str, column: pa.ChunkedArray) -> str:
+    """one line: type, nulls and range (numbers, dates) or distinct and most frequent values (text)"""
+    line = f"- {name} ({column.type}), {column.null_count} nulls"
+    try:
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+            bounds = pc.min_max(column).as_py()
+            return f"{line}, min {_cell(bounds['min'])}, max {_cell(bounds['max'])}, mean {_cell(pc.mean(column).as_py())}"
+        if pa.types.is_temporal(column.type):
+            bounds = pc.min_max(column).as_py()
+            return f"{line}, from {bounds['min']} to {bounds['max']}"
+        if pa.types.is_string(column.type) or pa.types.is_boolean(column.type):
+            counts = sorted(pc.value_counts(column).to_pylist(), key=lambda c: -c['counts'])
+            top = ', '.join(_cell(c['values']) for c in counts[:5] if c['values'] is not None)
+            return f"{line}, {len(counts)} distinct, most frequent: {top}"
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        pass
+    return line
+
+
+class ResultStore:
+    """SQL results converted once into Arrow tables and passed around by handle
+
+    session state and the event log keep the handle; the UI, prompt encoders
+    and exports read the same table, so rows are not rebuilt into new
+    DataFrames or re-serialized at every step. Each table belongs to the
+    session that stored it and stays until that session is released; past
+    max_tables of one session its least recently used tables are dropped, so
+    other sessions never push out each other's results.
+    """
+
+    def __init__(self, max_tables: int = RESULT_STORE_MAX_TABLES, export_dir: str = RESULTS_DIR):
+        self.max_tables = max_tables
+        self.export_dir = export_dir
+        self._tables: OrderedDict[str, pa.Table] = OrderedDict()
+        self._owners: dict[str, Optional[str]] = {}
+        self._frames: dict[str, pd.DataFrame] = {}
+        self._profiles: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, rows: Optional[list[dict[str, Any]]], owner: Optional[str] = None) -> Optional[str]:
+        """store a result for owner (default the session of the current turn) and return its handle, None for no rows"""
+        if not rows:
+            return None
+        table = to_table(rows)
+        handle = f"res_{uuid.uuid4().hex[:16]}"
+        owner = owner if owner is not None else current_session_id()
+        with self._lock:
+            self._tables[handle] = table
+            self._owners[handle] = owner
+            owned = [h for h in self._tables if self._owners[h] == owner]
+            for evicted in owned[:max(len(owned) - self.max_tables, 0)]:
+                logger.warning(f"Result store dropped {evicted}, more than {self.max_tables} results in session {owner}")
+                self._drop(evicted)
+        return handle
+
+    def _drop(self, handle: str) -> None:
+        self._tables.pop(handle, None)
+        self._owners.pop(handle, None)
+        self._frames.pop(handle, None)
+        self._profiles.pop(handle, None)
+
+    def release(self, owner: Optional[str]) -> int:
+        """drop every result of a session that has ended; returns how many were dropped"""
+        with self._lock:
+            handles = [h for h, o in self._owners.items() if o == owner]
+            for handle in handles:
+                self._drop(handle)
+        return len(handles)
+
+    def table(self, handle: Optional[str]) -> Optional[pa.Table]:
+        """the stored table, None when the handle is unknown or its session was released"""
+        with self._lock:
+            table = self._tables.get(handle)
+            if table is not None:
+                self._tables.move_to_end(handle)
+            return table
+
+    def frame(self, handle: Optional[str]) -> Optional[pd.DataFrame]:
+        """an Arrow-backed DataFrame view of the table, built once per handle"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        with self._lock:
+            if handle not in self._frames:
+                #ArrowDtype columns share the table's buffers instead of copying them into NumPy
+                self._frames[handle] = table.to_pandas(types_mapper=pd.ArrowDtype)
+            return self._frames[handle]
+
+    def rows(self, handle: Optional[str]) -> Optional[list[dict[str, Any]]]:
+        """the table as SQL rows again, for consumers that need plain dicts (merges, checks, batch output)"""
+        table = self.table(handle)
+        return None if table is None else table.to_pylist()
+
+    def profile(self, handle: Optional[str]) -> Optional[dict[str, Any]]:
+        """column statistics, date coverage and trends of the table, computed once per handle"""
+        frame = self.frame(handle)
+        if frame is None:
+            return None
+        if handle not in self._profiles:
+            try:
+                self._profiles[handle] = profile_frame(frame)
+            except Exception as e:
+                logger.warning(f"Could not profile result {handle}: {e}")
+                return None
+        return self._profiles[handle]
+
+    def summary(self, handle: Optional[str]) -> Optional[dict[str, Any]]:
+        """what stands in for the rows in logs: the handle, row count and column types"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        return {
+            'result': handle,
+            'row_count': table.num_rows,
+            'columns': {field.name: str(field.type) for field in table.schema},
+        }
+
+    def to_csv(self, handle: Optional[str], max_rows: Optional[int] = None) -> Optional[str]:
+        """CSV with a header row, the first max_rows rows"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        if max_rows is not None:
+            table = table.slice(0, max_rows)
+        buffer = io.BytesIO()
+        pa_csv.write_csv(table, buffer)
+        return buffer.getvalue().decode('utf-8')
+
+    def to_markdown(self, handle: Optional[str], max_rows: Optional[int] = None) -> Optional[str]:
+        """a markdown table of the first max_rows rows"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        if max_rows is not None:
+            table = table.slice(0, max_rows)
+        names = table.column_names
+        lines = ['| ' + ' | '.join(names) + ' |', '|' + '---|' * len(names)]
+        for row in zip(*(table.column(name).to_pylist() for name in names)):
+            lines.append('| ' + ' | '.join(_cell(value) for value in row) + ' |')
+        return '\n'.join(lines)
+
+    def to_prompt(self, handle: Optional[str], token_budget: int = PYTHON_PROMPT_DATA_TOKENS) -> Optional[str]:
+        """the result for a model prompt within about token_budget tokens
+
+        a schema header, one summary line per column and the rows as CSV, or
+        evenly spaced sample rows when they do not all fit.
+        """
+        table = self.table(handle)
+        if table is None:
+            return None
+        header = [f"{table.num_rows} rows, {table.num_columns} columns:"]
+        header += [_column_summary(name, table.column(name)) for name in table.column_names]
+        header = '\n'.join(header)
+
+        budget = token_budget * CHARS_PER_TOKEN - len(header)
+        body = self.to_csv(handle)
+        if len(body) <= budget:
+            return f"{header}\nAll rows (CSV):\n{body}"
+        lines = body.splitlines()
+        #rows that fit at the average CSV line length, first and last rows included
+        fits = max(budget // max(len(body) // len(lines), 1) - 1, 2)
+        step = (len(lines) - 2) / (fits - 1)
+        sample = [lines[1 + round(i * step)] for i in range(fits)]
+        return f"{header}\nSample of {fits} evenly spaced rows (CSV):\n" + '\n'.join([lines[0]] + sample)
+
+    def to_parquet(self, handle: Optional[str], path: Optional[str] = None) -> Optional[str]:
+        """write the table to path (default <export_dir>/<handle>.parquet) and return the path"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        path = path or os.path.join(self.export_dir, f"{handle}.parquet")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pq.write_table(table, path)
+        return path
+
+    def parquet_bytes(self, handle: Optional[str]) -> Optional[bytes]:
+        """the table as parquet, e.g. for a download button"""
+        table = self.table(handle)
+        if table is None:
+            return None
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+        return buffer.getvalue()
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+
+_result_store = ResultStore()
+
+
+def get_result_store() -> ResultStore:
+    return _result_store
+
+
+def result_state(rows: Optional[list[dict[str, Any]]]) -> dict[str, Any]:
+    """state keys for a new SQL result: its handle and summary, and its profile for the critics, Python agents and UI
+
+    the rows themselves stay in the store; read them with get_result_store().rows(handle).
+    """
+    handle = _result_store.put(rows)
+    profile = _result_store.profile(handle)
+    return {
+        'latest_sql_result': handle,
+        'latest_sql_summary': _result_store.summary(handle),
+        'latest_sql_profile': profile,
+        'latest_sql_profile_prompt': render_profile(profile),
+    }
@@ -0,0 +1,578 @@
+import calendar
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Optional
+import numpy as np
+import pandas as pd
+from constants import DATA_TABLE_ID, ROLLUP_CUBE_PATH, ROLLUP_CUBE_MAX_AGE_HOURS, ROLLUP_CUBE_MAX_ROWS
+from utils.kpi_index import normalize
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+GRAINS = ('day', 'week', 'month')
+#dimension key of the per-KPI totals
+TOTAL = ''
+#indicator aggregations the stored sums and counts can answer
+CUBE_AGGREGATIONS = {'SUM', 'COUNT', 'AVG'}
+#columns of the daily aggregates the cube is built from
+RECORD_COLUMNS = ['KPI_ID', 'KPI_DATE', 'DIMENSION', 'VALUE', 'INDICATOR', 'TOTAL', 'N']
+
+#questions needing more than a sum or count of one slice go to the SQL agents
+UNSUPPORTED_WORDS = frozenset({
+    'compare', 'compared', 'comparison', 'versus', 'vs', 'rate', 'ratio', 'percentage', 'percent', 'share',
+    'average', 'avg', 'mean', 'median', 'top', 'highest', 'lowest', 'most', 'least', 'max', 'maximum', 'min',
+    'minimum', 'growth', 'change', 'difference', 'rank', 'ranking', 'why', 'forecast', 'cumulative', 'running',
+    'rolling', 'distinct', 'unique',
+})
+BREAKDOWN_WORDS = frozenset({'by', 'per', 'across', 'split'})
+GRAIN_WORDS = {'daily': 'day', 'weekly': 'week', 'monthly': 'month',
+               'day': 'day', 'days': 'day', 'week': 'week', 'weeks': 'week', 'month': 'month', 'months': 'month'}
+#a trend without a stated grain is read day by day
+TREND_WORDS = frozenset({'trend', 'plot', 'chart', 'graph', 'timeline', 'timeseries'})
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+                'nine': 9, 'ten': 10, 'twelve': 12, 'fourteen': 14, 'thirty': 30, 'ninety': 90}
+MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+
+RELATIVE_PATTERN = re.compile(
+    rf"\b(?:last|past|previous)\s+(\d+|{'|'.join(NUMBER_WORDS)})\s+(day|week|month)s?\b"
+)
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+MONTH_PATTERN = re.compile(rf"\b({'|'.join(MONTH_NAMES)})\s+(\d{{4}})\b")
+
+
+class CubeMiss(Exception):
+    """the question is not a single-slice sum or count the cube holds; the reason is reported"""
+
+
+# ---- dates ----
+
+def _to_days(values: Any) -> np.ndarray:
+    """dates -> int32 days since 1970-01-01"""
+    return np.asarray(values, dtype='datetime64[D]').astype(np.int64).astype(np.int32)
+
+
+def _from_day(day: int) -> date:
+    return date(1970, 1, 1) + timedelta(days=int(day))
+
+
+def period_start(days: np.ndarray, grain: str) -> np.ndarray:
+    """first day of the day/ISO week/month each day falls in"""
+    if grain == 'day':
+        return days
+    if grain == 'week':
+        #1970-01-01 was a Thursday, day 3 of its ISO week
+        return days - (days + 3) % 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]')
+    return months.astype('datetime64[D]').astype(np.int64).astype(np.int32)
+
+
+def _month_end(day: date) -> date:
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def _months_before(day: date, months: int) -> date:
+    return (pd.Timestamp(day) - pd.DateOffset(months=months)).date()
+
+
+def parse_date_range(question: str, today: date) -> Optional[tuple[date, date]]:
+    """the one KPI_DATE range a question names, None when it names none or several"""
+    text = question.lower()
+    ranges = set()
+    monday = today - timedelta(days=today.weekday())
+
+    for count, unit in RELATIVE_PATTERN.findall(text):
+        n = int(count) if count.isdigit() else NUMBER_WORDS[count]
+        start = {'day': today - timedelta(days=n), 'week': today - timedelta(days=7 * n),
+                 'month': _months_before(today, n)}[unit]
+        ranges.add((start, today - timedelta(days=1)))
+    if re.search(r"\byesterday\b", text):
+        ranges.add((today - timedelta(days=1), today - timedelta(days=1)))
+    if re.search(r"\btoday\b", text):
+        ranges.add((today, today))
+    if re.search(r"\b(?:last|previous)\s+week\b", text):
+        ranges.add((monday - timedelta(days=7), monday - timedelta(days=1)))
+    if re.search(r"\b(?:this\s+week|week\s+to\s+date)\b", text):
+        ranges.add((monday, today))
+    if re.search(r"\b(?:last|previous)\s+month\b", text):
+        first = today.replace(day=1)
+        ranges.add((_months_before(first, 1), first - timedelta(days=1)))
+    if re.search(r"\b(?:this\s+month|month\s+to\s+date)\b", text):
+        ranges.add((today.replace(day=1), today))
+    for name, year in MONTH_PATTERN.findall(text):
+        first = date(int(year), MONTH_NAMES[name], 1)
+        ranges.add((first, _month_end(first)))
+
+    dates = [date.fromisoformat(d) for d in ISO_DATE_PATTERN.findall(text)]
+    if len(dates) == 2:
+        ranges.add((min(dates), max(dates)))
+    elif len(dates) == 1:
+        ranges.add((dates[0], today) if re.search(r"\bsince\b", text) else (dates[0], dates[0]))
+    elif dates:
+        return None
+
+    return ranges.pop() if len(ranges) == 1 else None
+
+
+def _aligned(start: date, end: date, grain: str) -> bool:
+    """the range covers whole periods of the grain"""
+    if grain == 'day':
+        return True
+    if grain == 'week':
+        return start.weekday() == 0 and end.weekday() == 6
+    return start.day == 1 and end == _month_end(end)
+
+
+# ---- question shape ----
+
+def _find(tokens: list[str], phrase: list[str], start: int = 0) -> int:
+    for i in range(start, len(tokens) - len(phrase) + 1):
+        if tokens[i:i + len(phrase)] == phrase:
+            return i
+    return -1
+
+
+def parse_grain(tokens: list[str]) -> Optional[str]:
+    """day/week/month when the question asks for one row per period, None for a total"""
+    grains = set()
+    for i, token in enumerate(tokens):
+        if token in ('daily', 'weekly', 'monthly'):
+            grains.add(GRAIN_WORDS[token])
+        elif token in GRAIN_WORDS and i > 0 and tokens[i - 1] in BREAKDOWN_WORDS | {'each', 'every'}:
+            grains.add(GRAIN_WORDS[token])
+        elif token in GRAIN_WORDS and tokens[i + 1:i + 3] == ['on', token]:
+            grains.add(GRAIN_WORDS[token])
+    if len(grains) > 1:
+        raise CubeMiss('several grains')
+    if grains:
+        return grains.pop()
+    return 'day' if TREND_WORDS & set(tokens) else None
+
+
+def parse_breakdown(tokens: list[str], dimensions: list[str]) -> Optional[str]:
+    """the dimension a question breaks the KPI down by ('by product', 'per technology')"""
+    found = []
+    for i, token in enumerate(tokens):
+        if token not in BREAKDOWN_WORDS and not (token == 'and' and found):
+            continue
+        j = i + 1
+        while j < len(tokens) and tokens[j] in ('the', 'each', 'every', 'by'):
+            j += 1
+        best = None
+        for dimension in dimensions:
+            phrase = normalize(dimension)
+            if phrase and tokens[j:j + len(phrase)] == phrase and (best is None or len(phrase) > len(normalize(best))):
+                best = dimension
+        if best is not None and best not in found:
+            found.append(best)
+    if len(found) > 1:
+        raise CubeMiss('several breakdown dimensions')
+    return found[0] if found else None
+
+
+def _column_name(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_').upper() or 'VALUE'
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def records_from_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """daily aggregates (RECORD_COLUMNS) of mirrored rows in the local mirror's wide layout"""
+    keys = ['KPI_ID', 'KPI_DATE']
+    dimensions = [c for c in frame.columns if c.startswith('DIM:')]
+    parts = []
+    for column in (c for c in frame.columns if c.startswith('INT:')):
+        indicator = column.split(':', 1)[1]
+        for dimension in [None, *dimensions]:
+            by = keys if dimension is None else keys + [dimension]
+            grouped = frame.groupby(by, sort=False)[column].agg(['sum', 'count']).reset_index()
+            grouped = grouped[grouped['count'] > 0]
+            parts.append(pd.DataFrame({
+                'KPI_ID': grouped['KPI_ID'].to_numpy(),
+                'KPI_DATE': grouped['KPI_DATE'].to_numpy(),
+                'DIMENSION': TOTAL if dimension is None else dimension.split(':', 1)[1],
+                'VALUE': None if dimension is None else grouped[dimension].astype(str).to_numpy(),
+                'INDICATOR': indicator,
+                'TOTAL': grouped['sum'].to_numpy(dtype=float),
+                'N': grouped['count'].to_numpy(dtype=np.int64),
+            }))
+    if not parts:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+# ---- cube ----
+
+class CubeSlice:
+    """aggregates of one KPI over one dimension at one grain
+
+    rows are sorted by period then value code; sums and counts hold one column
+    per indicator of the KPI.
+    """
+
+    __slots__ = ('periods', 'codes', 'sums', 'counts')
+
+    def __init__(self, periods: np.ndarray, codes: np.ndarray, sums: np.ndarray, counts: np.ndarray):
+        self.periods = periods
+        self.codes = codes
+        self.sums = sums
+        self.counts = counts
+
+    def between(self, first: int, last: int) -> 'CubeSlice':
+        low, high = np.searchsorted(self.periods, [first, last + 1])
+        return CubeSlice(self.periods[low:high], self.codes[low:high], self.sums[low:high], self.counts[low:high])
+
+    def where(self, mask: np.ndarray) -> 'CubeSlice':
+        return CubeSlice(self.periods[mask], self.codes[mask], self.sums[mask], self.counts[mask])
+
+    def rollup(self, periods: np.ndarray, codes: np.ndarray) -> 'CubeSlice':
+        """sum rows sharing (period, code) after periods/codes were coarsened"""
+        if not len(periods):
+            return CubeSlice(periods, codes, self.sums, self.counts)
+        span = int(codes.max()) + 1
+        keys, inverse = np.unique(periods.astype(np.int64) * span + codes, return_inverse=True)
+        sums = np.zeros((len(keys), self.sums.shape[1]))
+        counts = np.zeros((len(keys), self.counts.shape[1]), dtype=np.int64)
+        np.add.at(sums, inverse, self.sums)
+        np.add.at(counts, inverse, self.counts)
+        return CubeSlice((keys // span).astype(np.int32), (keys % span).astype(np.int32), sums, counts)
+
+
+class RollupCube:
+    """SUM/COUNT aggregates of every KPI indicator by KPI_DATE day, ISO week and month,
+    in total and split by each single dimension
+
+    dimension values are dictionary encoded per (KPI, dimension); rows whose
+    dimension is missing or NULL get the code after the last value.
+    """
+
+    def __init__(self, meta: dict[str, Any], slices: dict[tuple[str, str, str], CubeSlice]):
+        self.meta = meta
+        self.slices = slices
+        self.hits = 0
+        self.misses: dict[str, int] = defaultdict(int)
+
+    # ---- build ----
+
+    @classmethod
+    def from_records(cls, records: pd.DataFrame, kpis: dict[str, dict[str, Any]], **meta) -> 'RollupCube':
+        """build from daily aggregates (RECORD_COLUMNS): TOTAL rows per KPI/day/indicator,
+        plus one row per dimension value; missing and NULL values are derived from the totals
+
+        kpis maps KPI_ID to its schema context entry (kpi_name, indicators_int).
+        """
+        cube_meta: dict[str, Any] = {**meta, 'kpis': {}}
+        slices = {}
+        records = records.assign(
+            KPI_ID=records['KPI_ID'].astype(str),
+            DAY=_to_days(records['KPI_DATE'].to_numpy(dtype='datetime64[D]')),
+        )
+        #NULL values are rebuilt from the totals below
+        records = records[(records['DIMENSION'] == TOTAL) | records['VALUE'].notna()]
+
+        for kpi_id, kpi_records in records.groupby('KPI_ID', sort=True):
+            definition = kpis.get(kpi_id, {})
+            indicators = [
+                {'name': i['name'], 'aggregation': (i.get('aggregation') or 'SUM').upper()}
+                for i in definition.get('indicators_int', [])
+            ]
+            known = {i['name'] for i in indicators}
+            for name in sorted(set(kpi_records['INDICATOR']) - known):
+                indicators.append({'name': name, 'aggregation': 'SUM'})
+            names = [i['name'] for i in indicators]
+
+            totals = kpi_records[kpi_records['DIMENSION'] == TOTAL]
+            total_index = totals.set_index(['DAY', 'INDICATOR'])[['TOTAL', 'N']].groupby(level=[0, 1]).sum()
+            dimensions = {}
+            for dimension, rows in kpi_records.groupby('DIMENSION', sort=True):
+                if dimension == TOTAL:
+                    values: list[Optional[str]] = [None]
+                    codes = np.zeros(len(rows), dtype=np.int32)
+                else:
+                    values = sorted(rows['VALUE'].astype(str).unique().tolist()) + [None]
+                    codes = pd.Categorical(rows['VALUE'].astype(str), categories=values[:-1]).codes.astype(np.int32)
+                    #whatever the named values do not add up to belongs to rows without the dimension
+                    known_sums = rows.groupby(['DAY', 'INDICATOR'])[['TOTAL', 'N']].sum()
+                    residual = total_index.sub(known_sums.reindex(total_index.index, fill_value=0))
+                    residual = residual[residual['N'] > 0].reset_index()
+                    if len(residual):
+                        rows = pd.concat([rows, residual.assign(VALUE=None)], ignore_index=True)
+                        codes = np.concatenate([codes, np.full(len(residual), len(values) - 1, dtype=np.int32)])
+                dimensions[dimension] = values
+
+                frame = pd.DataFrame({
+                    'DAY': rows['DAY'].to_numpy(), 'CODE': codes, 'INDICATOR': rows['INDICATOR'].to_numpy(),
+                    'TOTAL': rows['TOTAL'].to_numpy(dtype=float), 'N': rows['N'].to_numpy(dtype=np.int64),
+                })
+                wide = frame.pivot_table(index=['DAY', 'CODE'], columns='INDICATOR', values=['TOTAL', 'N'],
+                                         aggfunc='sum', fill_value=0)
+                sums = wide['TOTAL'].reindex(columns=names, fill_value=0).to_numpy(dtype=float)
+                counts = wide['N'].reindex(columns=names, fill_value=0).to_numpy(dtype=np.int64)
+                day = CubeSlice(
+                    wide.index.get_level_values('DAY').to_numpy(dtype=np.int32),
+                    wide.index.get_level_values('CODE').to_numpy(dtype=np.int32),
+                    np.ascontiguousarray(sums), np.ascontiguousarray(counts),
+                )
+                slices[(kpi_id, dimension, 'day')] = day
+                for grain in GRAINS[1:]:
+                    slices[(kpi_id, dimension, grain)] = day.rollup(period_start(day.periods, grain), day.codes)
+
+            cube_meta['kpis'][kpi_id] = {
+                'kpi_name': definition.get('kpi_name', kpi_id),
+                'indicators': indicators,
+                'dimensions': dimensions,
+            }
+        return cls(cube_meta, slices)
+
+    def records(self) -> pd.DataFrame:
+        """the daily aggregates the cube was built from, to fold new partitions into"""
+        frames = []
+        for (kpi_id, dimension, grain), part in self.slices.items():
+            if grain != 'day' or not len(part.periods):
+                continue
+            kpi = self.meta['kpis'][kpi_id]
+            values = np.array(kpi['dimensions'][dimension], dtype=object)
+            for j, indicator in enumerate(kpi['indicators']):
+                keep = part.counts[:, j] > 0
+                frames.append(pd.DataFrame({
+                    'KPI_ID': kpi_id,
+                    'KPI_DATE': part.periods[keep].astype('datetime64[D]'),
+                    'DIMENSION': dimension,
+                    'VALUE': values[part.codes[keep]],
+                    'INDICATOR': indicator['name'],
+                    'TOTAL': part.sums[keep, j],
+                    'N': part.counts[keep, j],
+                }))
+        if not frames:
+            return pd.DataFrame(columns=RECORD_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    # ---- storage ----
+
+    def save(self, path: str) -> None:
+        arrays, index = {}, []
+        for n, ((kpi_id, dimension, grain), part) in enumerate(self.slices.items()):
+            index.append([kpi_id, dimension, grain])
+            for field in CubeSlice.__slots__:
+                arrays[f"s{n}_{field}"] = getattr(part, field)
+        meta = {**self.meta, 'slices': index}
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'RollupCube':
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            slices = {
+                (kpi_id, dimension, grain): CubeSlice(*(data[f"s{n}_{field}"] for field in CubeSlice.__slots__))
+                for n, (kpi_id, dimension, grain) in enumerate(meta.pop('slices'))
+            }
+        return cls(meta, slices)
+
+    # ---- freshness ----
+
+    def age_hours(self) -> float:
+        built_at = datetime.fromisoformat(self.meta['built_at'])
+        return (datetime.now(timezone.utc) - built_at).total_seconds() / 3600
+
+    def freshness(self) -> dict[str, Any]:
+        return {
+            'built_at': self.meta.get('built_at'),
+            'latest_date': self.meta.get('latest_date'),
+            'age_hours': self.age_hours(),
+        }
+
+    def stats(self) -> dict[str, Any]:
+        asked = self.hits + sum(self.misses.values())
+        return {
+            'hits': self.hits,
+            'misses': dict(self.misses),
+            'hit_rate': self.hits / asked if asked else None,
+            **self.freshness(),
+        }
+
+    # ---- answering ----
+
+    def answer(self, question: str, resolution: dict[str, Any], today: Optional[date] = None) -> dict[str, Any]:
+        """rows for a 'KPI [by dimension] [per day/week/month] over a date range' question
+
+        resolution is the KPI index's resolve() output for the question. Raises
+        CubeMiss (counted by reason) when the question needs the SQL agents.
+        """
+        try:
+            result = self._answer(question, resolution, today or date.today())
+        except CubeMiss as e:
+            self.misses[str(e)] += 1
+            raise
+        self.hits += 1
+        return result
+
+    def _answer(self, question: str, resolution: dict[str, Any], today: date) -> dict[str, Any]:
+        started = time.perf_counter()
+        if self.age_hours() > ROLLUP_CUBE_MAX_AGE_HOURS:
+            raise CubeMiss('stale')
+        tokens = normalize(question)
+        if UNSUPPORTED_WORDS & set(tokens):
+            raise CubeMiss('not a sum or count')
+
+        kpi_ids = {str(k['kpi_id']) for k in resolution.get('kpis', [])}
+        if len(kpi_ids) != 1:
+            raise CubeMiss('no single KPI' if not kpi_ids else 'several KPIs')
+        kpi_id = kpi_ids.pop()
+        kpi = self.meta['kpis'].get(kpi_id)
+        if kpi is None:
+            raise CubeMiss('KPI not in cube')
+
+        dates = parse_date_range(question, today)
+        if dates is None:
+            raise CubeMiss('no single date range')
+        start, end = dates
+        if end > date.fromisoformat(self.meta['latest_date']):
+            raise CubeMiss('range ends after cube data')
+
+        grain = parse_grain(tokens)
+        dimensions = [d for d in kpi['dimensions'] if d != TOTAL]
+        breakdown = parse_breakdown(tokens, dimensions)
+
+        #indicators named in the question, else all of them
+        named = [i for i, ind in enumerate(kpi['indicators']) if _find(tokens, normalize(ind['name'])) >= 0]
+        chosen = named or [i for i, ind in enumerate(kpi['indicators']) if ind['aggregation'] in CUBE_AGGREGATIONS]
+        if not chosen or any(kpi['indicators'][i]['aggregation'] not in CUBE_AGGREGATIONS for i in chosen):
+            raise CubeMiss('indicator aggregation')
+
+        #words of the KPI, breakdown and indicator names are not filters
+        own_words = set(normalize(kpi['kpi_name'])) | set(normalize(breakdown or ''))
+        for i in chosen:
+            own_words |= set(normalize(kpi['indicators'][i]['name']))
+        filters: dict[str, set[str]] = defaultdict(set)
+        for phrase in resolution.get('filters', []):
+            matches = [m for m in phrase['matches'] if str(m['kpi_id']) == kpi_id]
+            if not matches or set(normalize(phrase['phrase'])) <= own_words:
+                continue
+            if len({m['dimension'] for m in matches}) > 1:
+                raise CubeMiss('ambiguous filter')
+            filters[matches[0]['dimension']].update(m['value'] for m in matches)
+        if len(filters) > 1 or (filters and breakdown is not None and breakdown not in filters):
+            raise CubeMiss('filters on several dimensions')
+        filter_dimension = next(iter(filters), None)
+        dimension = breakdown or filter_dimension or TOTAL
+        if dimension not in kpi['dimensions']:
+            raise CubeMiss('dimension not in cube')
+        values = kpi['dimensions'][dimension]
+
+        #whole periods come from the stored grain, anything else is rolled up from days
+        stored = grain or next((g for g in ('month', 'week') if _aligned(start, end, g)), 'day')
+        if not _aligned(start, end, stored):
+            stored = 'day'
+        part = self.slices[(kpi_id, dimension, stored)]
+        first, last = _to_days([start, end])
+        part = part.between(int(period_start(np.array([first]), stored)[0]), int(last))
+        if filter_dimension is not None:
+            wanted = [values.index(v) for v in filters[filter_dimension] if v in values]
+            part = part.where(np.isin(part.codes, wanted))
+        if not len(part.periods):
+            raise CubeMiss('no data in range')
+        periods = period_start(part.periods, grain) if grain else np.zeros_like(part.periods)
+        codes = part.codes if breakdown else np.zeros_like(part.codes)
+        part = part.rollup(periods, codes)
+        if len(part.periods) > ROLLUP_CUBE_MAX_ROWS:
+            raise CubeMiss('too many rows')
+
+        rows = []
+        for r in range(len(part.periods)):
+            row: dict[str, Any] = {}
+            if grain:
+                row['KPI_DATE'] = _from_day(part.periods[r]).isoformat()
+            if breakdown:
+                row[_column_name(breakdown)] = values[part.codes[r]]
+            for i in chosen:
+                total, n = part.sums[r, i], int(part.counts[r, i])
+                aggregation = kpi['indicators'][i]['aggregation']
+                if aggregation == 'COUNT':
+                    row[_column_name(kpi['indicators'][i]['name'])] = n
+                elif not n:
+                    row[_column_name(kpi['indicators'][i]['name'])] = None
+                elif aggregation == 'AVG':
+                    row[_column_name(kpi['indicators'][i]['name'])] = total / n
+                else:
+                    row[_column_name(kpi['indicators'][i]['name'])] = int(total) if float(total).is_integer() else total
+            rows.append(row)
+        #same order as ORDER BY on the date then the value, NULL first
+        if breakdown:
+            rows.sort(key=lambda row: (row.get('KPI_DATE', ''), row[_column_name(breakdown)] is not None,
+                                       row[_column_name(breakdown)] or ''))
+
+        return {
+            'rows': rows,
+            'sql': self._sql(kpi_id, kpi, chosen, start, end, grain, breakdown, filter_dimension,
+                             sorted(filters.get(filter_dimension, ()))),
+            'kpi_id': kpi_id,
+            'kpi_name': kpi['kpi_name'],
+            'dimension': breakdown,
+            'filters': {d: sorted(v) for d, v in filters.items()},
+            'grain': grain,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+        }
+
+    def _sql(self, kpi_id: str, kpi: dict[str, Any], chosen: list[int], start: date, end: date, grain: Optional[str],
+             breakdown: Optional[str], filter_dimension: Optional[str], filter_values: list[str]) -> str:
+        """the query the SQL agents would have run, for display and follow-up questions"""
+        where = [f"KPI_ID = {kpi_id}", f"KPI_DATE BETWEEN '{start.isoformat()}' AND '{end.isoformat()}'"]
+        if filter_dimension is not None:
+            where.append(
+                f"EXISTS (SELECT 1 FROM UNNEST(DIM) AS D WHERE D.NAME = {_sql_string(filter_dimension)} "
+                f"AND D.VALUE IN ({', '.join(map(_sql_string, filter_values))}))"
+            )
+        columns = []
+        if grain:
+            columns.append({'day': 'KPI_DATE', 'week': 'DATE_TRUNC(KPI_DATE, ISOWEEK) AS KPI_DATE',
+                            'month': 'DATE_TRUNC(KPI_DATE, MONTH) AS KPI_DATE'}[grain])
+        if breakdown:
+            columns.append(f"(SELECT VALUE FROM UNNEST(DIM) WHERE NAME = {_sql_string(breakdown)}) AS {_column_name(breakdown)}")
+        for i in chosen:
+            indicator = kpi['indicators'][i]
+            columns.append(
+                f"{indicator['aggregation']}((SELECT VALUE FROM UNNEST(INT) WHERE NAME = {_sql_string(indicator['name'])})) "
+                f"AS {_column_name(indicator['name'])}"
+            )
+        keys = int(bool(grain)) + int(bool(breakdown))
+        sql = (
+            f"WITH SUBSET AS (\n  SELECT *\n  FROM `{self.meta.get('table', DATA_TABLE_ID)}`\n  WHERE "
+            + "\n  AND   ".join(where)
+            + "\n)\nSELECT\n  " + ",\n  ".join(columns) + "\nFROM SUBSET"
+        )
+        if keys:
+            sql += "\nGROUP BY ALL\nORDER BY " + ", ".join(str(k + 1) for k in range(keys))
+        return sql
+
+
+_cube: Optional[RollupCube] = None
+_cube_mtime: Optional[float] = None
+
+
+def get_rollup_cube() -> Optional[RollupCube]:
+    """process-wide cube loaded from ROLLUP_CUBE_PATH, reloaded when the file is rebuilt; None without one"""
+    global _cube, _cube_mtime
+    try:
+        mtime = os.path.getmtime(ROLLUP_CUBE_PATH)
+    except OSError:
+        return None
+    if mtime != _cube_mtime:
+        started = time.perf_counter()
+        cube = RollupCube.load(ROLLUP_CUBE_PATH)
+        if _cube is not None:
+            #keep hit/miss counts across rebuilds
+            cube.hits, cube.misses = _cube.hits, _cube.misses
+        _cube, _cube_mtime = cube, mtime
+        logger.info(f"Loaded rollup cube: {len(cube.meta['kpis'])} KPIs, {len(cube.slices)} slices, "
+                    f"data through {cube.meta.get('latest_date')} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return _cube
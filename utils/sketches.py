@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import math
+from typing import Any, Optional
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """approximate distinct count in 2**precision bytes, mergeable across partitions
+
+    standard error is about 1.04 / sqrt(2**precision); small cardinalities use
+    linear counting and are close to exact.
+    """
+
+    def __init__(self, precision: int = 11, registers: Optional[bytearray] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"Precision must be between 4 and 16, got {precision}")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str) -> None:
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & 0xFFFFFFFFFFFFFFFF
+        #position of the first set bit in the remaining 64 - precision bits
+        rank = min(64 - rest.bit_length() + 1, 64 - self.precision + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge precision {other.precision} into {self.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return round(estimate)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'HyperLogLog':
+        return cls(data['precision'], bytearray(base64.b64decode(data['registers'])))
+
+
+class SpaceSaving:
+    """heavy hitters: the most frequent values of a stream in a fixed number of counters
+
+    counts are overestimates by at most the smallest counter; any value seen more
+    than n / capacity times is guaranteed to be kept.
+    """
+
+    def __init__(self, capacity: int = 100, counts: Optional[dict[str, int]] = None):
+        self.capacity = capacity
+        self.counts: dict[str, int] = dict(counts or {})
+
+    def add(self, value: str, weight: int = 1) -> None:
+        if value in self.counts:
+            self.counts[value] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = weight
+        else:
+            #evict the smallest counter and inherit its count as the error bound
+            smallest = min(self.counts, key=self.counts.__getitem__)
+            self.counts[value] = self.counts.pop(smallest) + weight
+
+    def merge(self, other: 'SpaceSaving') -> None:
+        merged = dict(self.counts)
+        for value, count in other.counts.items():
+            merged[value] = merged.get(value, 0) + count
+        self.counts = dict(sorted(merged.items(), key=lambda kv: -kv[1])[:self.capacity])
+
+    def top(self, k: int) -> list[tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'capacity': self.capacity, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'SpaceSaving':
+        return cls(data['capacity'], data['counts'])
@@ -0,0 +1,201 @@
+import asyncio
+from collections import namedtuple
+from typing import Any, Optional
+from constants import DATA_TABLE_ID, SQL_GUARD_DEFAULT_DAYS, SQL_GUARD_EXPLORATORY_LIMIT, SQL_GUARD_MAX_BYTES
+from utils.backends import find_backend
+from utils.bigquery_jobs import BigQueryExecutor
+from utils.local_sql import ARRAY_KINDS, TOKEN_PATTERN, WHERE_CLAUSE_ENDS, UnsupportedQuery
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#any of these makes a query an aggregation rather than a row dump
+AGGREGATING_WORDS = {'GROUP', 'DISTINCT', 'SUM', 'AVG', 'MIN', 'MAX', 'COUNT', 'COUNTIF', 'ANY_VALUE',
+                     'ARRAY_AGG', 'STRING_AGG', 'APPROX_COUNT_DISTINCT', 'APPROX_QUANTILES', 'STDDEV', 'VARIANCE'}
+
+_Token = namedtuple('_Token', 'kind value start end depth')
+
+
+def _tokens(sql: str) -> list[_Token]:
+    """non-space tokens with their parenthesis depth; identifiers upper-cased"""
+    tokens, depth, pos = [], 0, 0
+    while pos < len(sql):
+        match = TOKEN_PATTERN.match(sql, pos)
+        if match is None:
+            raise UnsupportedQuery(f"Unexpected character {sql[pos]!r}")
+        pos = match.end()
+        kind, value = match.lastgroup, match.group()
+        if kind == 'space':
+            continue
+        if value == ')':
+            depth -= 1
+        tokens.append(_Token(kind, value.upper() if kind == 'ident' else value, match.start(), match.end(), depth))
+        if value == '(':
+            depth += 1
+    return tokens
+
+
+def _clause_end(tokens: list[_Token], index: int, depth: int) -> int:
+    """index of the token ending the clause at `index` (len(tokens) when it runs to the end)"""
+    for position in range(index + 1, len(tokens)):
+        token = tokens[position]
+        if token.depth < depth or token.depth == depth and token.kind == 'ident' and token.value in WHERE_CLAUSE_ENDS:
+            return position
+    return len(tokens)
+
+
+def _table_reads(tokens: list[_Token], table_id: str) -> list[tuple[int, Optional[int], int]]:
+    """(table token, its WHERE token or None, token ending the WHERE) for each SELECT reading the table"""
+    reads = []
+    for index, token in enumerate(tokens):
+        if token.kind != 'quoted' or token.value.strip('`') != table_id:
+            continue
+        end = _clause_end(tokens, index, token.depth)
+        where = next((i for i in range(index + 1, end)
+                      if tokens[i].depth == token.depth and tokens[i].value == 'WHERE'), None)
+        reads.append((index, where, end))
+    return reads
+
+
+def _filters(tokens: list[_Token], column: str) -> bool:
+    """column appears in some WHERE clause, however it is compared"""
+    for index, token in enumerate(tokens):
+        if token.kind == 'ident' and token.value == 'WHERE':
+            end = _clause_end(tokens, index, token.depth)
+            if any(t.kind == 'ident' and t.value == column for t in tokens[index + 1:end]):
+                return True
+    return False
+
+
+def _selects_star(tokens: list[_Token]) -> bool:
+    """the outermost SELECT list has a * (or alias.*)"""
+    return any(token.depth == 0 and token.value == '*' and tokens[index - 1].value in ('SELECT', '.', ',')
+               for index, token in enumerate(tokens) if index > 0)
+
+
+def rewrite(sql: str, table_id: str = DATA_TABLE_ID, default_days: int = SQL_GUARD_DEFAULT_DAYS,
+            exploratory_limit: int = SQL_GUARD_EXPLORATORY_LIMIT) -> tuple[str, list[str]]:
+    """the query with cost guards applied, and a description of each rewrite
+
+    - reads of the KPI table get a trailing KPI_DATE window when no WHERE clause
+      names KPI_DATE, so BigQuery prunes partitions
+    - a nested SELECT * of the KPI table drops the arrays the query never uses
+    - exploratory row dumps get a LIMIT: no aggregation anywhere, and a SELECT *
+      or no KPI_ID filter. Per-KPI daily series are left whole, a result over
+      the row cap is downsampled by the executor instead of cut off
+    """
+    tokens = _tokens(sql)
+    end_of_query = len(sql.rstrip().rstrip(';').rstrip())
+    edits, rewrites = [], []  #(start, end, text), applied back to front
+
+    reads = _table_reads(tokens, table_id)
+    if reads and not _filters(tokens, 'KPI_DATE'):
+        condition = f"KPI_DATE >= DATE_SUB(CURRENT_DATE(), INTERVAL {default_days} DAY)"
+        for _, where, end in reads:
+            end_at = tokens[end].start if end < len(tokens) else end_of_query
+            if where is None:
+                edits.append((end_at, end_at, f"\nWHERE {condition}" + ("\n" if end < len(tokens) else "")))
+            else:
+                start_at = tokens[where].end
+                #the ) goes on its own line, so a trailing -- comment in the clause cannot swallow it
+                edits.append((start_at, end_at, f" {condition} AND ({sql[start_at:end_at].strip()}\n)\n"))
+        rewrites.append(f"KPI_DATE window: last {default_days} days")
+
+    used = {token.value for token in tokens if token.kind == 'ident'}
+    unused = [kind for kind in ARRAY_KINDS if kind not in used]
+    for index, _, _ in reads:
+        star = index - 2
+        if unused and star > 0 and tokens[star].depth > 0 and tokens[star].value == '*' \
+                and tokens[star - 1].value == 'SELECT' and tokens[index - 1].value == 'FROM':
+            edits.append((tokens[star].start, tokens[star].end, f"* EXCEPT ({', '.join(unused)})"))
+            rewrites.append(f"SELECT * without {', '.join(unused)}")
+
+    exploratory = _selects_star(tokens) or not _filters(tokens, 'KPI_ID')
+    if reads and exploratory and not used & AGGREGATING_WORDS and not used & {'UNION', 'INTERSECT'}:
+        limit = next((i for i, t in enumerate(tokens) if t.depth == 0 and t.value == 'LIMIT'), None)
+        if limit is None:
+            edits.append((end_of_query, end_of_query, f"\nLIMIT {exploratory_limit}"))
+            rewrites.append(f"LIMIT {exploratory_limit} on a row dump")
+        elif limit + 1 < len(tokens) and tokens[limit + 1].kind == 'number' \
+                and int(tokens[limit + 1].value) > exploratory_limit:
+            edits.append((tokens[limit + 1].start, tokens[limit + 1].end, str(exploratory_limit)))
+            rewrites.append(f"LIMIT {tokens[limit + 1].value} capped to {exploratory_limit}")
+
+    #later edits first, and of two at one position the one added last
+    for _, (start, end, text) in sorted(enumerate(edits), key=lambda edit: (edit[1][0], edit[0]), reverse=True):
+        sql = sql[:start] + text + sql[end:]
+    return sql, rewrites
+
+
+def describe_rewrites(rewrites: list[str]) -> str:
+    """what the SQL agents and the answer should know about a rewritten query; '' when it ran as written"""
+    if not rewrites:
+        return ''
+    note = f"The query was rewritten before it ran: {'; '.join(rewrites)}."
+    if any(rewrite.startswith('KPI_DATE window') for rewrite in rewrites):
+        note += " The result only covers that window; state this in the answer, or filter on KPI_DATE explicitly if the question needs another range."
+    return note
+
+
+_executor: Optional[BigQueryExecutor] = None
+
+
+def _client(project_id: Optional[str]):
+    """the installed executor's client for the project, or that of one kept here when none is installed"""
+    global _executor
+    executor = find_backend(BigQueryExecutor)
+    if executor is None:
+        if _executor is None:
+            _executor = BigQueryExecutor()
+        executor = _executor
+    return executor.client(project_id)
+
+
+def dry_run_bytes(sql: str, project_id: Optional[str]) -> int:
+    """bytes BigQuery estimates the query would process; raises on an invalid query"""
+    from google.cloud import bigquery
+
+    job = _client(project_id).query(sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    return job.total_bytes_processed
+
+
+async def guard_query(sql: str, project_id: Optional[str], dry_run: bool = True,
+                      max_bytes: int = SQL_GUARD_MAX_BYTES) -> dict[str, Any]:
+    """rewrite a query and check it against the bytes budget
+
+    returns the query to run, the rewrites applied, the dry-run estimates and
+    bytes saved by the rewrites, and a rejection message when over budget.
+    A rewrite that BigQuery rejects where the original is valid is undone.
+    """
+    record = {'query': sql, 'rewrites': [], 'bytes_processed': None, 'bytes_saved': None, 'rejected': None}
+    try:
+        record['query'], record['rewrites'] = rewrite(sql)
+    except UnsupportedQuery as e:
+        logger.debug(f"SQL guard could not tokenize the query: {e}")
+    if not dry_run:
+        return record
+
+    changed = record['query'] != sql
+    estimates = await asyncio.gather(
+        asyncio.to_thread(dry_run_bytes, record['query'], project_id),
+        *([asyncio.to_thread(dry_run_bytes, sql, project_id)] if changed else []),
+        return_exceptions=True,
+    )
+    rewritten, original = estimates[0], estimates[-1]
+    if isinstance(rewritten, Exception):
+        if not changed or isinstance(original, Exception):
+            #invalid as written, execute_sql reports the error to the SQL writer
+            return record
+        logger.warning(f"SQL guard rewrite rejected by BigQuery, running the original: {rewritten}")
+        record.update(query=sql, rewrites=[], reverted=str(rewritten))
+        rewritten = original
+
+    record['bytes_processed'] = rewritten
+    if changed and not isinstance(original, Exception) and record['query'] != sql:
+        record['bytes_saved'] = original - rewritten
+    if rewritten > max_bytes:
+        record['rejected'] = (
+            f"Query would process {rewritten / 1024 ** 3:.1f} GiB, over the {max_bytes / 1024 ** 3:.1f} GiB budget. "
+            f"Narrow the KPI_DATE range, filter on KPI_ID and avoid reading unused columns."
+        )
+    return record
@@ -0,0 +1,77 @@
+import re
+from typing import Any, Optional
+import pandas as pd
+from constants import MULTI_KPI_MAX_SUB_QUERIES
+from utils.kpi_index import get_kpi_index
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def plan_sub_queries(question: str, user_intent: Optional[str] = None,
+                     max_sub_queries: int = MULTI_KPI_MAX_SUB_QUERIES) -> list[dict[str, Any]]:
+    """the KPIs to query separately, or [] when the question is for a single KPI (or too many)
+
+    KPIs are resolved from the question, and from the starter agent's summary of
+    the user's intent for follow-ups like "now add TV sales".
+    """
+    index = get_kpi_index()
+    kpis = {kpi['kpi_id']: kpi for kpi in index.resolve(question)['kpis']}
+    if len(kpis) < 2 and user_intent:
+        for kpi in index.resolve(user_intent)['kpis']:
+            kpis.setdefault(kpi['kpi_id'], kpi)
+    if len(kpis) < 2 or len(kpis) > max_sub_queries:
+        return []
+    return list(kpis.values())
+
+
+def sub_question(question: str, kpi: dict[str, Any]) -> str:
+    """the question as asked of one KPI's SQL sequence"""
+    return (
+        f"{question}\n"
+        f"Answer this for {kpi['kpi_name']} (KPI_ID {kpi['kpi_id']}) only; the other KPIs are queried separately. "
+        f"Return one row per KPI_DATE, with KPI_DATE as a column."
+    )
+
+
+def _label(kpi: dict[str, Any]) -> str:
+    #'1. Broadband Orders' -> BROADBAND_ORDERS
+    name = re.sub(r'^\d+\.\s*', '', kpi['kpi_name'] or '') or f"KPI_{kpi['kpi_id']}"
+    return re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_').upper()
+
+
+def merge_on_kpi_date(results: list[tuple[dict[str, Any], list[dict[str, Any]]]]) -> list[dict[str, Any]]:
+    """outer join of each KPI's rows on KPI_DATE (and any other text columns every result shares)
+
+    value columns that would collide are prefixed with the KPI's name. Raises
+    ValueError when a result has no KPI_DATE column, or more than one row for a
+    merge key (e.g. a dimension the other KPIs lack), which would multiply rows.
+    """
+    frames = []
+    for kpi, rows in results:
+        frame = pd.DataFrame(rows)
+        if 'KPI_DATE' not in frame.columns:
+            raise ValueError(f"Sub-query for KPI {kpi['kpi_id']} returned no KPI_DATE column")
+        frame['KPI_DATE'] = pd.to_datetime(frame['KPI_DATE']).dt.date
+        frames.append((kpi, frame))
+
+    keys = ['KPI_DATE'] + [
+        column for column in frames[0][1].columns
+        if column != 'KPI_DATE' and all(column in f.columns and f[column].dtype == object for _, f in frames)
+    ]
+    for kpi, frame in frames:
+        repeated = frame.duplicated(keys)
+        if repeated.any():
+            raise ValueError(
+                f"Sub-query for KPI {kpi['kpi_id']} has {int(repeated.sum())} repeated rows for {', '.join(keys)}"
+            )
+    counts = pd.Series([c for _, f in frames for c in f.columns if c not in keys]).value_counts()
+
+    merged = None
+    for kpi, frame in frames:
+        frame = frame.rename(columns={c: f"{_label(kpi)}_{c}" for c in frame.columns if c not in keys and counts[c] > 1})
+        merged = frame if merged is None else merged.merge(frame, on=keys, how='outer')
+    merged = merged.sort_values(keys).reset_index(drop=True)
+    merged['KPI_DATE'] = merged['KPI_DATE'].map(lambda d: d.isoformat())
+    #back to what execute_sql returns: JSON values, NULL for dates a KPI has no row for
+    return merged.astype(object).where(merged.notna(), None).to_dict(orient='records')
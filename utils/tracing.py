@@ -0,0 +1,226 @@
+import functools
+import inspect
+import json
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Callable, Iterator, Optional
+from constants import TRACING_ENABLED, TRACES_DIR, TRACES_KEPT_IN_MEMORY
+from utils.turn_context import turn_scope
+
+
+@dataclass(slots=True)
+class Span:
+    """one timed unit of work inside a turn"""
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    status: str = 'OK'
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end is None else (self.end - self.start) * 1000
+
+
+class _NoopSpan:
+    """returned while tracing is disabled so instrumentation costs one flag check"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """collects nested spans per turn and exports each finished turn as one JSONL record"""
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, traces_dir: str = TRACES_DIR):
+        self.enabled = enabled
+        self.traces_dir = traces_dir
+        self._current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+        #spans of traces still in progress, by trace id
+        self._open_traces: dict[str, list[Span]] = {}
+        #spans started in one callback and ended in another, by caller supplied key
+        self._pending: dict[Any, Span] = {}
+        self._recent: deque = deque(maxlen=TRACES_KEPT_IN_MEMORY)
+
+    # ---- span lifecycle ----
+
+    def start_span(self, name: str, kind: str = 'internal', **attributes) -> Optional[Span]:
+        """start a span under the current one without making it current"""
+        if not self.enabled:
+            return None
+        parent = self._current.get()
+        if parent is None:
+            trace_id = uuid.uuid4().hex
+            self._open_traces[trace_id] = []
+        else:
+            trace_id = parent.trace_id
+        span = Span(
+            name=name,
+            kind=kind,
+            trace_id=trace_id,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start=time.perf_counter(),
+            attributes=attributes,
+        )
+        #a span may outlive its trace if a callback pair straddles the turn end
+        self._open_traces.setdefault(trace_id, []).append(span)
+        return span
+
+    def end_span(self, span: Optional[Span], status: str = 'OK') -> None:
+        if span is None or span.end is not None:
+            return
+        span.end = time.perf_counter()
+        span.status = status
+        if span.parent_id is None:
+            self._finish_trace(span)
+
+    @contextmanager
+    def _span_cm(self, name: str, kind: str, attributes: dict[str, Any]) -> Iterator[Span]:
+        span = self.start_span(name, kind, **attributes)
+        token = self._current.set(span)
+        status = 'OK'
+        try:
+            yield span
+        except BaseException as e:
+            status = f'ERROR: {type(e).__name__}'
+            raise
+        finally:
+            self._current.reset(token)
+            self.end_span(span, status)
+
+    def span(self, name: str, kind: str = 'internal', **attributes):
+        """context manager opening a nested span; a no-op while tracing is disabled"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return self._span_cm(name, kind, attributes)
+
+    def current_span(self) -> Optional[Span]:
+        """innermost span opened with span()/turn() in this context"""
+        return self._current.get()
+
+    @contextmanager
+    def turn(self, session_id: str, **attributes) -> Iterator[Any]:
+        """root span for one user turn, also sets the session/turn context"""
+        with turn_scope(session_id) as turn_number:
+            with self.span('turn', 'turn', session_id=session_id, turn=turn_number, **attributes) as span:
+                yield span
+
+    # ---- spans opened/closed from separate callbacks ----
+
+    def start_pending(self, key: Any, name: str, kind: str, **attributes) -> None:
+        if self.enabled:
+            self._pending[key] = self.start_span(name, kind, **attributes)
+
+    def annotate_pending(self, key: Any, **attributes) -> None:
+        span = self._pending.get(key)
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def end_pending(self, key: Any, status: str = 'OK', **attributes) -> None:
+        span = self._pending.pop(key, None)
+        if span is not None:
+            span.attributes.update(attributes)
+            self.end_span(span, status)
+
+    # ---- export ----
+
+    def _finish_trace(self, root: Span) -> None:
+        spans = self._open_traces.pop(root.trace_id, [])
+        for span in spans:
+            #callback pairs that never closed (short-circuited or errored) end with the turn
+            if span.end is None:
+                span.end = root.end
+                span.status = 'INCOMPLETE'
+        self._pending = {k: v for k, v in self._pending.items() if v.trace_id != root.trace_id}
+
+        record = {
+            'trace_id': root.trace_id,
+            'session_id': root.attributes.get('session_id'),
+            'turn': root.attributes.get('turn'),
+            'finished_at': datetime.now().isoformat(timespec='milliseconds'),
+            'duration_ms': root.duration_ms,
+            'spans': [
+                {
+                    **{k: v for k, v in asdict(span).items() if k not in ('start', 'end')},
+                    'offset_ms': (span.start - root.start) * 1000,
+                    'duration_ms': span.duration_ms,
+                }
+                for span in spans
+            ],
+        }
+        self._recent.append(record)
+        self._export(record)
+
+    def _export(self, record: dict[str, Any]) -> None:
+        os.makedirs(self.traces_dir, exist_ok=True)
+        path = os.path.join(self.traces_dir, f'trace_{datetime.now().strftime("%Y-%m-%d")}.jsonl')
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def latest_trace(self, session_id: Optional[str] = None) -> Optional[dict[str, Any]]:
+        """most recent finished turn trace, optionally for one session"""
+        for record in reversed(self._recent):
+            if session_id is None or record['session_id'] == session_id:
+                return record
+        return None
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, kind: str = 'internal', **attributes):
+    """shortcut for get_tracer().span(...)"""
+    return _tracer.span(name, kind, **attributes)
+
+
+def traced(name: Optional[str] = None, kind: str = 'internal') -> Callable:
+    """decorator wrapping a sync or async function in a span"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _tracer.enabled:
+                    return await func(*args, **kwargs)
+                with _tracer.span(span_name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+#ids of the session/turn being processed by the current task
+_session_id: ContextVar[Optional[str]] = ContextVar('session_id', default=None)
+_turn: ContextVar[Optional[int]] = ContextVar('turn', default=None)
+
+#turn counter per session, shared by every entry point in this process
+_turn_counters: dict[str, int] = {}
+
+#callables(session_id, turn) run when a turn finishes
+_turn_end_hooks: list[Callable[[str, int], None]] = []
+
+
+def register_turn_end_hook(hook: Callable[[str, int], None]) -> None:
+    """run hook(session_id, turn) whenever a turn_scope block exits"""
+    _turn_end_hooks.append(hook)
+
+
+@contextmanager
+def turn_scope(session_id: str) -> Iterator[int]:
+    """mark everything run inside the block as one turn of session_id"""
+    turn = _turn_counters.get(session_id, 0) + 1
+    _turn_counters[session_id] = turn
+
+    session_token = _session_id.set(session_id)
+    turn_token = _turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _turn.reset(turn_token)
+        _session_id.reset(session_token)
+        for hook in _turn_end_hooks:
+            hook(session_id, turn)
+
+
+def current_session_id() -> Optional[str]:
+    """session id of the turn being processed, if any"""
+    return _session_id.get()
+
+
+def current_turn() -> Optional[int]:
+    """1-based turn number within the current session, if any"""
+    return _turn.get()